@@ -2,4 +2,4 @@
 
 from httk.httkweb import serve
 
-serve("src", port=8080)
+serve("src", port=8080, threads=8, timing_log=True)
@@ -1,6 +1,21 @@
 #!/bin/bash
+#
+# Usage: status.sh [--by field] [--list] [--taskset ...] [--step ...] [--priority ...] [--status ...]
+# Run in a run directory. Uses the task status index of httk.task.taskstatus when python and httk are
+# available, otherwise counts the tasks in each ht.* directory with find.
+
+DIRNAME=$(dirname "$0")
+HTTK_DIR=$(cd "$DIRNAME/.."; pwd -P)
+
+python "$HTTK_DIR/bin/internal/task_status.py" "$@"
+RETURNCODE=$?
+if [ "$RETURNCODE" != "3" -a "$RETURNCODE" != "127" ]; then
+    exit "$RETURNCODE"
+fi
 
 for DIR in ht.*; do
-    COUNT=$(find "$DIR" -name "ht.task.*" | wc -l)
-    echo "$DIR : $COUNT"
+    if [ -d "$DIR" ]; then
+        COUNT=$(find "$DIR" -name "ht.task.*" | wc -l)
+        echo "$DIR : $COUNT"
+    fi
 done
@@ -62,7 +62,9 @@ export HT_TASKMGR_WRAP="$HT_TASKMGR_WRAP"
 export HT_TASKMGR_SET="$HT_TASKMGR_SET"
 export HT_TASKMGR_ROOTDIR="$HT_TASKMGR_ROOTDIR"
 export HT_TASKMGR_ATTEMPTS="$HT_TASKMGR_ATTEMPTS"
+export HT_TASKMGR_PACK="$HT_TASKMGR_PACK"
 BZIPLOG=1
+HTTK_TASKMGR_HTTK_DIR=$(cd "$(dirname "$0")/.."; pwd -P)
 
 # Command line argument handling
 while [ -n "$1" ]; do
@@ -86,6 +88,11 @@ while [ -n "$1" ]; do
             BZIPLOG=0
 	    shift 1
             ;;
+        -p|--pack)
+            HT_TASKMGR_PACK=$2
+	    shift 1
+	    shift 1
+            ;;
         -d|--rootdir)
             HT_TASKMGR_ROOTDIR=$2
 	    shift 1
@@ -104,7 +111,9 @@ while [ -n "$1" ]; do
         *)
 	    echo "Usage:"
 	    echo "  $0/taskmanager.sh -h : this help"
-	    echo "  $0/taskmanager.sh [-w wrap_program] [-s set]"
+	    echo "  $0/taskmanager.sh [-w wrap_program] [-s set] [-p codec]"
+	    echo ""
+	    echo "  -p codec : pack finished run directories into one archive each (codec: bz2, zlib, lzma or none)"
 	    echo ""
 	    exit 0
             ;;
@@ -317,6 +326,19 @@ function compress {
     find "$DIR" -type f -not -name \*.bz2 -exec bzip2 \{\} \;
 }
 
+# Replace a finished run directory with a packed archive (see httk.core.runarchive), or compress its files one by
+# one if that cannot be done
+function pack_run {
+    local DIR=$1
+    python "$HTTK_TASKMGR_HTTK_DIR/bin/internal/pack_run.py" --codec "$HT_TASKMGR_PACK" "$DIR"
+    if [ "$?" != "0" ]; then
+	logmsg 1 "Could not pack $DIR, compressing its files instead."
+	if [ -d "$DIR" ]; then
+	    compress "$DIR"
+	fi
+    fi
+}
+
 function copy_state {
     local FROM=$1
     local TO=$2
@@ -610,6 +632,9 @@ function start_run {
 	    ATOMIC_MV ht.taskmgr.stdout ht.tmp.atomic.taskmgr.stdout
 	    ATOMIC_END
 	    ATOMIC_EXEC
+	    if [ -n "$HT_TASKMGR_PACK" ]; then
+		pack_run "ht.run.$DATE"
+	    fi
 	)
 	if [ "$MOVEDIR" == 1 ]; then
 	    OUTDIR="${PREPREDIR}${PREDIR}ht.finished${POSTDIR}"
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of reading structures from one large multi-block cif file with
+httk.atomistic.atomisticio.cif_to_structs, in one process and on a process pool.
+
+The file is the tutorial cif files concatenated a number of times. Results are verified against
+reading the files one at a time with cif_to_struct, and the peak memory use of each run is reported.
+"""
+from __future__ import print_function
+import os, sys, glob, time, resource, tempfile, argparse, subprocess
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+src = os.path.join(top, 'src')
+cifdir = os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs')
+
+run_code = """
+import sys, time, resource
+import httk
+from httk.atomistic.atomisticio import cif_to_structs
+start = time.time()
+formulas = []
+errors = 0
+for name, struct, error in cif_to_structs(sys.argv[1], processes=int(sys.argv[2])):
+    if error is None:
+        formulas.append(struct.formula)
+    else:
+        errors += 1
+elapsed = time.time() - start
+with open(sys.argv[3], 'w') as f:
+    f.write("\\n".join(formulas))
+print('RESULT', elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(formulas), errors)
+"""
+
+
+def run(ciffile, processes, outfile):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([src] + [x for x in env.get('PYTHONPATH', '').split(os.pathsep) if x != ''])
+    out = subprocess.check_output([sys.executable, '-c', run_code, ciffile, str(processes), outfile], env=env)
+    # httk prints citation information on exit, so pick out the result line
+    line = [x for x in out.decode('utf-8').splitlines() if x.startswith('RESULT')][0]
+    elapsed, maxrss, n, errors = line.split()[1:]
+    with open(outfile) as f:
+        formulas = f.read().split("\n")
+    return float(elapsed), int(maxrss), int(n), int(errors), formulas
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark streaming multi-block cif reading")
+    ap.add_argument("--copies", help='Number of times to repeat the tutorial cif files in the large file', type=int, default=10)
+    ap.add_argument("--processes", help='Number of processes for the pool', type=int, default=4)
+    args = ap.parse_args()
+
+    import httk
+    from httk.atomistic.atomisticio import cif_to_struct
+
+    files = sorted(glob.glob(os.path.join(cifdir, '*.cif')))
+    reference = []
+    for filename in files:
+        try:
+            reference.append(cif_to_struct(filename, backends=['internal']).formula)
+        except Exception:
+            pass
+
+    tmpdir = tempfile.mkdtemp(prefix='httk_bench_cif_')
+    ciffile = os.path.join(tmpdir, 'all.cif')
+    outfile = os.path.join(tmpdir, 'formulas')
+    with open(ciffile, 'w') as out:
+        for _i in range(args.copies):
+            for filename in files:
+                with open(filename) as f:
+                    out.write(f.read()+"\n")
+    try:
+        for processes in [1, args.processes]:
+            elapsed, maxrss, n, errors, formulas = run(ciffile, processes, outfile)
+            if formulas != reference*args.copies:
+                print("Mismatch with", processes, "processes")
+                sys.exit(1)
+            print("%d blocks, %d processes: %.2f s (%.0f blocks/s), %d errors, peak memory %.0f MB" % (n+errors, processes, elapsed, (n+errors)/elapsed, errors, maxrss/1024.0))
+    finally:
+        os.remove(ciffile)
+        os.remove(outfile)
+        os.rmdir(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Parse throughput of httk.httkio.cif.read_cif and iter_cif on the cif files that Tests/structreading_data
+holds the reference results for (the all_spacegroups tutorial files), one file at a time and as one large
+multi-block file.
+
+To compare with another version of the reader, give a cif.py from that version with --reference, e.g.,
+git show <commit>:src/httk/httkio/cif.py > /tmp/cif_ref.py
+"""
+from __future__ import print_function
+import os, sys, glob, time, argparse
+
+import httk
+from httk.core.ioadapters import IoAdapterString
+from httk.httkio import cif
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+checkdir = os.path.join(top, 'Tests', 'structreading_data', 'all_spacegroups', 'cifs')
+cifdir = os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs')
+
+
+def load_module(name, filename):
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(name, filename)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except ImportError:
+        import imp
+        return imp.load_source(name, filename)
+
+
+def timed(reader, texts, repeat):
+    results = None
+    best = None
+    for _i in range(repeat):
+        start = time.time()
+        results = [reader(IoAdapterString(text)) for text in texts]
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark cif parsing")
+    ap.add_argument("--copies", help='Number of times the files are repeated in the large file', type=int, default=10)
+    ap.add_argument("--repeat", help='Number of timing runs, the best is reported', type=int, default=3)
+    ap.add_argument("--reference", help='A cif.py with another reader to compare with', default=None)
+    args = ap.parse_args()
+
+    names = [os.path.basename(x)[:-len('.check')] for x in sorted(glob.glob(os.path.join(checkdir, '*.cif.check')))]
+    texts = []
+    for name in names:
+        with open(os.path.join(cifdir, name)) as f:
+            texts.append(f.read())
+    large = "\n".join(texts*args.copies)
+    size = sum(len(x) for x in texts)/(1024.0*1024.0)
+
+    readers = [('read_cif', cif.read_cif, cif.iter_cif)]
+    if args.reference is not None:
+        ref = load_module('cif_reference', args.reference)
+        readers.append(('reference', ref.read_cif, getattr(ref, 'iter_cif', None)))
+
+    results = {}
+    for label, read_cif, iter_cif in readers:
+        elapsed, results[label] = timed(read_cif, texts, args.repeat)
+        print("%s: %d files, %.2f s (%.2f MB/s, %.0f files/s)" % (label, len(texts), elapsed, size/elapsed, len(texts)/elapsed))
+        if iter_cif is not None:
+            elapsed, blocks = timed(lambda ioa: list(iter_cif(ioa)), [large], 1)
+            print("%s: iter_cif over %d blocks, %.2f s (%.2f MB/s)" % (label, len(blocks[0]), elapsed, size*args.copies/elapsed))
+            if blocks[0] != [block for x in results[label] for block in x[0]]*args.copies:
+                print("iter_cif and read_cif differ")
+                sys.exit(1)
+    if args.reference is not None and results['reference'] != results['read_cif']:
+        print("Results differ from the reference reader")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
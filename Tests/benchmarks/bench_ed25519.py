@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of signing and verifying manifest-sized messages with httk.core.ed25519fast (one at a time and in
+batches) against the reference implementation httk.core.ed25519. Signatures and public keys are checked
+to be identical between the two.
+"""
+from __future__ import print_function
+import os, sys, time, argparse
+
+import httk
+from httk.core import ed25519, ed25519fast
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark ed25519 signatures")
+    ap.add_argument("--messages", help='Number of messages to sign and verify', type=int, default=2000)
+    ap.add_argument("--reference", help='Number of messages for the reference implementation', type=int, default=2)
+    args = ap.parse_args()
+
+    sk = os.urandom(64)
+    pk = ed25519fast.publickey(sk)
+    if pk != ed25519.publickey(sk):
+        print("Public keys differ")
+        sys.exit(1)
+    # Roughly the size of the manifest of a task with a few runs
+    messages = [("%064x task%d/ht.run.2020-01-01_00.00.00/OUTCAR.cleaned.bz2\n" % (i, i))*20 for i in range(args.messages)]
+
+    for m in messages[:args.reference]:
+        if ed25519.signature(m, sk, pk) != ed25519fast.signature(m, sk, pk):
+            print("Signatures differ")
+            sys.exit(1)
+
+    start = time.time()
+    for m in messages[:args.reference]:
+        sig = ed25519.signature(m, sk, pk)
+    t_sign_ref = (time.time() - start)/args.reference
+    start = time.time()
+    for m in messages[:args.reference]:
+        ed25519.checkvalid(sig, m, pk)
+    t_verify_ref = (time.time() - start)/args.reference
+
+    start = time.time()
+    items = [(ed25519fast.signature(m, sk, pk), m, pk) for m in messages]
+    t_sign = (time.time() - start)/len(messages)
+    start = time.time()
+    single = [ed25519fast.checkvalid(*x) for x in items]
+    t_verify = (time.time() - start)/len(messages)
+    start = time.time()
+    batch = ed25519fast.checkvalid_batch(items)
+    t_batch = (time.time() - start)/len(messages)
+    if not all(single) or not all(batch):
+        print("Verification failed")
+        sys.exit(1)
+
+    print("reference: sign %.0f ms, verify %.0f ms" % (1000*t_sign_ref, 1000*t_verify_ref))
+    print("fast: sign %.2f ms, verify %.2f ms, batch verify %.2f ms (%d signatures per minute)" % (1000*t_sign, 1000*t_verify, 1000*t_batch, 60/t_batch))
+
+
+if __name__ == "__main__":
+    main()
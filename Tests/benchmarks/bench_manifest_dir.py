@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of httk.core.crypto.manifest_dir on a generated project with many finished tasks: all manifests
+regenerated in one process, with a process pool, and again with a warm hash cache.
+
+All runs must produce byte-identical manifests (the project manifest and every ht.manifest.bz2).
+"""
+from __future__ import print_function
+import os, sys, bz2, time, shutil, random, tempfile, argparse
+
+import httk
+from httk.core.crypto import manifest_dir, generate_keys, read_keys
+
+
+def make_project(top, tasks, files, size):
+    rnd = random.Random(0)
+    keydir = os.path.join(top, 'ht.project', 'keys')
+    os.makedirs(keydir)
+    generate_keys(os.path.join(keydir, 'key1.pub'), os.path.join(keydir, 'key1.priv'))
+    # Files are dated back so that the hash cache accepts them
+    old = time.time() - 3600
+    for i in range(tasks):
+        taskdir = os.path.join(top, 'runs', 'batch%d' % (i % 10), 'ht.task.bench%d.finished' % i)
+        rundir = os.path.join(taskdir, 'ht.run.2020-01-01_00.00.00')
+        os.makedirs(rundir)
+        with open(os.path.join(taskdir, 'ht.config'), 'w') as f:
+            f.write('[main]\n')
+        for j in range(files):
+            filename = os.path.join(rundir, 'file%d' % j)
+            with open(filename, 'wb') as f:
+                f.write(os.urandom(rnd.randint(0, 2*size)))
+            os.utime(filename, (old, old))
+
+
+def run(top, workers, hash_cache):
+    keydir = os.path.join(top, 'ht.project', 'keys')
+    sk, pk = read_keys(keydir)
+    cwd = os.getcwd()
+    os.chdir(top)
+    try:
+        manifestfile = bz2.BZ2File(os.path.join('ht.project', 'ht.tmp.manifest.bz2'), 'w')
+        start = time.time()
+        manifest_dir('.', manifestfile, 'ht.project', keydir, sk, pk, force=True, workers=workers, hash_cache=hash_cache)
+        elapsed = time.time() - start
+        manifestfile.close()
+    finally:
+        os.chdir(cwd)
+    manifests = {}
+    for root, dirs, files in os.walk(top):
+        for filename in files:
+            if filename in ['ht.manifest.bz2', 'ht.tmp.manifest.bz2']:
+                with open(os.path.join(root, filename), 'rb') as f:
+                    manifests[os.path.join(root, filename)] = f.read()
+    return elapsed, manifests
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark manifest generation")
+    ap.add_argument("--tasks", help='Number of task directories', type=int, default=40)
+    ap.add_argument("--files", help='Number of files per task', type=int, default=5)
+    ap.add_argument("--size", help='Average file size in bytes', type=int, default=200000)
+    ap.add_argument("--workers", help='Number of processes for the parallel runs', type=int, default=4)
+    args = ap.parse_args()
+
+    top = tempfile.mkdtemp(prefix='httk_bench_manifest_')
+    try:
+        make_project(top, args.tasks, args.files, args.size)
+        hash_cache = os.path.join(top, 'ht.project', 'ht.tmp.manifest_hashes')
+
+        t_serial, reference = run(top, 1, None)
+        print("%d tasks, %d files: one process %.2f s" % (args.tasks, args.tasks*args.files, t_serial))
+        t_parallel, manifests = run(top, args.workers, hash_cache)
+        print("  %d workers: %.2f s, identical: %s" % (args.workers, t_parallel, manifests == reference))
+        t_cached, manifests_cached = run(top, args.workers, hash_cache)
+        print("  %d workers, cached hashes: %.2f s, identical: %s" % (args.workers, t_cached, manifests_cached == reference))
+        if manifests != reference or manifests_cached != reference:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of httk.atomistic.neighborlist: the time to build neighbor lists of n x n x n supercells of a tutorial
+structure (which should grow linearly with the number of atoms), and the throughput of finding the minimum
+interatomic distance of all the tutorial structures. Results are checked against a search over all pairs of
+sites and periodic images for the smaller cases.
+"""
+from __future__ import print_function
+import os, sys, glob, math, time, itertools, argparse
+
+import httk
+from httk.atomistic.neighborlist import neighbor_list
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+cifdir = os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs')
+
+
+def all_pairs(struct, cutoff, images=2):
+    arrays = struct.arrays
+    cart = [list(x) for x in arrays.cartesian_coords]
+    basis = [list(x) for x in arrays.basis]
+    result = []
+    for offset in itertools.product(range(-images, images+1), repeat=3):
+        shift = [sum(offset[k]*basis[k][d] for k in range(3)) for d in range(3)]
+        for i in range(len(cart)):
+            for j in range(len(cart)):
+                if i == j and offset == (0, 0, 0):
+                    continue
+                v = [cart[j][d] + shift[d] - cart[i][d] for d in range(3)]
+                dist = math.sqrt(v[0]*v[0] + v[1]*v[1] + v[2]*v[2])
+                if dist <= cutoff:
+                    result.append((i, j, offset, round(dist, 8)))
+    return sorted(result)
+
+
+def pairs(nl):
+    return sorted((int(nl.i[k]), int(nl.j[k]), tuple(int(x) for x in nl.offsets[k]), round(float(nl.distances[k]), 8)) for k in range(len(nl)))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark periodic neighbor lists")
+    ap.add_argument("--cif", help='Structure to build supercells of', default=os.path.join(cifdir, '225.cif'))
+    ap.add_argument("--cutoff", help='Cutoff distance', type=float, default=4.0)
+    ap.add_argument("--max-size", help='Largest repetition n of the n x n x n supercells', type=int, default=6)
+    ap.add_argument("--check-size", help='Largest repetition to check against all pairs', type=int, default=2)
+    args = ap.parse_args()
+
+    struct = httk.load(args.cif)
+    for n in range(1, args.max_size+1):
+        supercell = struct.transform([[n, 0, 0], [0, n, 0], [0, 0, n]])
+        supercell.arrays
+        start = time.time()
+        nl = neighbor_list(supercell, args.cutoff)
+        elapsed = time.time() - start
+        atoms = supercell.uc_nbr_atoms
+        print("%dx%dx%d: %d atoms, %d pairs, %.3f s (%.1f us/atom)" % (n, n, n, atoms, len(nl), elapsed, 1e6*elapsed/atoms))
+        if n <= args.check_size and pairs(nl) != all_pairs(supercell, args.cutoff):
+            print("Neighbor list differs from all pairs")
+            sys.exit(1)
+
+    structs = []
+    for filename in sorted(glob.glob(os.path.join(cifdir, '*.cif'))):
+        try:
+            structs.append(httk.load(filename))
+        except Exception:
+            pass
+    for s in structs:
+        s.arrays
+    start = time.time()
+    mindists = [s.neighbor_list(args.cutoff).min_distance for s in structs]
+    elapsed = time.time() - start
+    print("minimum distances of %d structures: %.2f s (%.0f structures/s)" % (len(structs), elapsed, len(structs)/elapsed))
+    for s, mindist in list(zip(structs, mindists))[:20]:
+        expected = all_pairs(s, args.cutoff)
+        expected = min(x[3] for x in expected) if len(expected) > 0 else None
+        if (mindist is None) != (expected is None) or (mindist is not None and abs(mindist - expected) > 1e-7):
+            print("Minimum distance differs from all pairs")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Scan throughput of httk.core.basic.micro_pyawk and httk.iface.vasp_if.OutcarReader on a synthetic OUTCAR of a
+long relaxation (many ionic steps with many electronic steps each), plain and bz2 compressed. The line by line
+scan that micro_pyawk used to do, trying every regex on every line, is timed for comparison.
+"""
+from __future__ import print_function
+import os, re, sys, bz2, time, shutil, tempfile, argparse
+
+from httk.core.basic import micro_pyawk, bz2open
+from httk.iface.vasp_if import read_outcar
+
+energy_regex = "^ *energy *without *entropy= *([^ ]+) *energy\\(sigma->0\\) *= *([^ ]+) *$"
+
+
+def write_outcar(f, steps, ions, scf):
+    f.write("   number of dos      NEDOS =    301   number of ions     NIONS = %6d\n" % ions)
+    for step in range(steps):
+        for i in range(scf):
+            f.write("----------------------------------------- Iteration %4d(%4d)  ---------------------------------------\n" % (step+1, i+1))
+            for name in ["POTLOK", "SETDIJ", "EDDAV", "DOS", "CHARGE", "MIXING", "LOOP"]:
+                f.write("    %-7s:  cpu time    0.0100: real time    0.0100\n" % name)
+            f.write("\n eigenvalue-minimisations  :   160\n total energy-change (2. order) :-0.1234567E-03  (-0.1234567E-06)\n")
+            f.write(" number of electron      16.0000000 magnetization\n augmentation part        1.2345678 magnetization\n\n")
+            f.write(" Free energy of the ion-electron system (eV)\n  ---------------------------------------------------\n")
+            for name in ["alpha Z        PSCENC", "Ewald energy   TEWEN", "-Hartree energ DENC", "-exchange      EXHF",
+                         "-V(xc)+E(xc)   XCENC", "PAW double counting", "entropy T*S    EENTRO", "eigenvalues    EBANDS",
+                         "atomic energy  EATOM", "Solvation  Ediel_sol"]:
+                f.write("  %-20s =       123.45678901\n" % name)
+            f.write("  ---------------------------------------------------\n")
+            f.write("  free energy    TOTEN  =      -%.8f eV\n\n" % (100.0 + i))
+            f.write("  energy without entropy =     -%.8f  energy(sigma->0) =     -%.8f\n\n" % (100.0 + i, 100.0 + i))
+        f.write("  in kB       -1.00000    -1.00000    -1.00000     0.00000     0.00000     0.00000\n\n")
+        f.write(" POSITION                                       TOTAL-FORCE (eV/Angst)\n")
+        f.write(" " + "-"*83 + "\n")
+        for i in range(ions):
+            f.write("      %.5f      0.00000      0.00000         0.010000      0.000000      0.000000\n" % (0.1*i))
+        f.write(" " + "-"*83 + "\n")
+        f.write("  FREE ENERGIE OF THE ION-ELECTRON SYSTEM (eV)\n  ---------------------------------------------------\n")
+        f.write("  free  energy   TOTEN  =      -%.8f eV\n\n" % (10.0 + step))
+        f.write("  energy  without entropy=     -%.8f  energy(sigma->0) =     -%.8f\n\n" % (10.0 + step, 10.0 + step))
+        f.write(" E-fermi :   5.1234     XC(G=0):  -8.1234     alpha+bet : -6.1234\n\n")
+        for k in range(ions//4):
+            f.write(" k-point %5d :       0.0000    0.0000    0.0000\n  band No.  band energies     occupation\n" % (k+1))
+            for band in range(ions):
+                f.write("    %4d      %9.4f      %8.5f\n" % (band+1, -5.0 + 0.1*band, 1.0))
+
+
+def line_by_line(filename, opener):
+    # What micro_pyawk did before: every regex is tried on every line
+    search = [re.compile(energy_regex), re.compile("FREE ENERGIE")]
+    results = {}
+    with opener(filename) as f:
+        for line in f:
+            for regex in search:
+                match = regex.search(line)
+                if match and regex is search[0]:
+                    results['energy'] = match.group(2)
+    return results['energy']
+
+
+def scan(filename):
+    results = {}
+
+    def read_energy(results, match):
+        results['energy'] = match.group(2)
+    micro_pyawk(filename, [[energy_regex, None, read_energy], ["FREE ENERGIE", None, lambda results, match: None]], results)
+    return results['energy']
+
+
+def timed(label, func, size):
+    start = time.time()
+    result = func()
+    elapsed = time.time() - start
+    print("%s: %.2f s (%.0f MB/s)" % (label, elapsed, size/elapsed))
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark OUTCAR scanning")
+    ap.add_argument("--steps", help='Number of ionic steps', type=int, default=300)
+    ap.add_argument("--ions", help='Number of ions', type=int, default=64)
+    ap.add_argument("--scf", help='Number of electronic steps per ionic step', type=int, default=40)
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='ht.tmp.bench_outcar_')
+    try:
+        filename = os.path.join(tmpdir, 'OUTCAR')
+        with open(filename, 'w') as f:
+            write_outcar(f, args.steps, args.ions, args.scf)
+        with open(filename, 'rb') as fin:
+            fout = bz2.BZ2File(filename+'.bz2', 'wb')
+            shutil.copyfileobj(fin, fout)
+            fout.close()
+        size = os.path.getsize(filename)/(1024.0*1024.0)
+        print("OUTCAR: %d ionic steps, %.1f MB" % (args.steps, size))
+
+        expected = timed("line by line", lambda: line_by_line(filename, open), size)
+        results = [timed("line by line, bz2", lambda: line_by_line(filename+'.bz2', lambda x: bz2open(x, 'r')), size),
+                   timed("micro_pyawk", lambda: scan(filename), size),
+                   timed("micro_pyawk, bz2", lambda: scan(filename+'.bz2'), size)]
+        outcar = timed("read_outcar (final energy)", lambda: read_outcar(filename), size)
+        results.append(outcar.final_energy)
+        steps = timed("OutcarReader.ionic_steps", lambda: outcar.ionic_steps, size)
+        if any(x != expected for x in results) or len(steps) != args.steps:
+            print("Results differ")
+            sys.exit(1)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
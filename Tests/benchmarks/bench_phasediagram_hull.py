@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the convex hull of phase diagrams (httk.core.geometry.hull_z / HullZ) on random ternary and
+quaternary systems, built all at once and by adding phases one at a time.
+
+For small systems the result is verified against the straightforward implementation that solves one linear
+program (httk.core.geometry.simplex_le_solver) per phase, with that phase left out.
+"""
+from __future__ import print_function
+import sys, time, random, argparse
+from fractions import Fraction
+
+import httk
+from httk.core.vectors import FracVector
+from httk.core.geometry import hull_z, HullZ, simplex_le_solver
+
+
+def reference_hull_distances(points, zs):
+    distances = []
+    for i in range(len(zs)):
+        others = [j for j in range(len(points)) if j != i]
+        a = FracVector.create([zs[j] for j in others])
+        b = [FracVector.create([points[j][k] for j in others]) for k in range(len(points[0]))]
+        val = simplex_le_solver(a, b, points[i])[0]
+        distances += [Fraction(zs[i]) - val.to_fraction()]
+    return distances
+
+
+def random_system(dim, n, seed):
+    rnd = random.Random(seed)
+    points = [[int(i == k) for i in range(dim)] for k in range(dim)]
+    zs = [0.0]*dim
+    for _ in range(n):
+        counts = [rnd.randint(0, 6) for _ in range(dim)]
+        if sum(counts) == 0:
+            counts[0] = 1
+        natoms = sum(counts)
+        mixing = 1.0 - sum((float(x)/natoms)**2 for x in counts)
+        points += [counts]
+        zs += [natoms*(-0.8*mixing + rnd.expovariate(8.0) - 0.05)]
+    return points, zs
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark phase diagram convex hulls")
+    ap.add_argument("--phases", help='Number of phases in the large systems', type=int, default=100000)
+    ap.add_argument("--increments", help='Number of phases to add one at a time', type=int, default=1000)
+    ap.add_argument("--skip-reference", help='Skip verification against the linear programming solution', action='store_true')
+    args = ap.parse_args()
+
+    if not args.skip_reference:
+        for dim in [2, 3, 4]:
+            points, zs = random_system(dim, 25, dim)
+            start = time.time()
+            result = hull_z(points, zs)
+            t_new = time.time() - start
+            start = time.time()
+            ref = reference_hull_distances(points, zs)
+            t_ref = time.time() - start
+            if [x.to_fraction() for x in result['hull_distances']] != ref:
+                print("Mismatch for dimension", dim)
+                sys.exit(1)
+            print("%d coordinates, %d phases: hull_z %.3f s, one linear program per phase %.2f s" % (dim, len(zs), t_new, t_ref))
+
+    for dim in [3, 4]:
+        points, zs = random_system(dim, args.phases, 0)
+        start = time.time()
+        hull = HullZ(points, zs)
+        result = hull.result()
+        print("%d coordinates, %d phases: %.2f s, %d on the hull" % (dim, len(zs), time.time() - start, len(result['hull_indices'])))
+
+        extra_points, extra_zs = random_system(dim, args.increments, 1)
+        start = time.time()
+        for point, z in zip(extra_points[dim:], extra_zs[dim:]):
+            hull.add_point(point, z)
+            hull.result()
+        print("  adding %d phases one at a time: %.2f ms per phase" % (args.increments, 1000*(time.time() - start)/args.increments))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compression of finished run directories: every file bzip2 compressed on its own (what Execution/taskmanager.sh
+did), against httk.core.runarchive.pack_run with the available codecs, in one process and with a process pool.
+Also times reading the end of a large member (random access) through cleveropen, and checks that the project
+manifest is the same before and after packing.
+"""
+from __future__ import print_function
+import os, sys, bz2, time, shutil, random, tempfile, argparse
+
+import httk
+from httk.core.crypto import manifest_dir, generate_keys, read_keys
+from httk.core.ioadapters import cleveropen
+from httk.core.runarchive import pack_run, available_codecs
+
+
+def make_project(top, runs, files, size):
+    rnd = random.Random(0)
+    keydir = os.path.join(top, 'ht.project', 'keys')
+    os.makedirs(keydir)
+    generate_keys(os.path.join(keydir, 'key1.pub'), os.path.join(keydir, 'key1.priv'))
+    rundirs = []
+    for i in range(runs):
+        taskdir = os.path.join(top, 'runs', 'ht.task.bench.%d.finished' % i)
+        rundir = os.path.join(taskdir, 'ht.run.2020-01-01_00.00.00')
+        os.makedirs(rundir)
+        with open(os.path.join(taskdir, 'ht.config'), 'w') as f:
+            f.write('[main]\n')
+        # One large output file and many small ones, text with some repetition as typical output
+        with open(os.path.join(rundir, 'OUTCAR'), 'w') as f:
+            for j in range(20*size//60):
+                f.write("  energy  without entropy=  %14.8f  energy(sigma->0) = %14.8f\n" % (rnd.uniform(-100, 0), -10.0-j))
+        for j in range(files):
+            with open(os.path.join(rundir, 'file%d' % j), 'w') as f:
+                for k in range(rnd.randint(0, 2*size)//40):
+                    f.write("%4d %12.6f %12.6f %8d\n" % (k, rnd.uniform(-1, 1), rnd.uniform(-1, 1), rnd.randint(0, 99)))
+        rundirs += [rundir]
+    return rundirs
+
+
+def manifest(top):
+    keydir = os.path.join(top, 'ht.project', 'keys')
+    sk, pk = read_keys(keydir)
+    cwd = os.getcwd()
+    os.chdir(top)
+    try:
+        manifestfile = bz2.BZ2File(os.path.join('ht.project', 'ht.tmp.manifest.bz2'), 'w')
+        manifest_dir('.', manifestfile, 'ht.project', keydir, sk, pk, force=True)
+        manifestfile.close()
+        with bz2.BZ2File(os.path.join('ht.project', 'ht.tmp.manifest.bz2'), 'r') as f:
+            return f.read()
+    finally:
+        os.chdir(cwd)
+
+
+def bzip2_each(rundir):
+    for root, dirs, files in os.walk(rundir):
+        for filename in files:
+            path = os.path.join(root, filename)
+            with open(path, 'rb') as fin:
+                fout = bz2.BZ2File(path+'.bz2', 'wb')
+                shutil.copyfileobj(fin, fout, 1 << 20)
+                fout.close()
+            os.unlink(path)
+
+
+def size_and_inodes(paths):
+    size = 0
+    inodes = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                inodes += 1 + len(files)
+                size += sum(os.path.getsize(os.path.join(root, x)) for x in files)
+        else:
+            inodes += 1
+            size += os.path.getsize(path)
+    return size/(1024.0*1024.0), inodes
+
+
+def read_tail(filename, n=65536):
+    f = cleveropen(filename, 'rb')
+    try:
+        f.seek(0, 2)
+        f.seek(max(0, f.tell() - n))
+        return f.read()
+    finally:
+        f.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark packing of run directories")
+    ap.add_argument("--runs", help='Number of run directories', type=int, default=8)
+    ap.add_argument("--files", help='Number of small files per run', type=int, default=200)
+    ap.add_argument("--size", help='Average size of the small files in bytes', type=int, default=20000)
+    ap.add_argument("--processes", help='Number of processes for the parallel runs', type=int, default=4)
+    args = ap.parse_args()
+
+    top = tempfile.mkdtemp(prefix='ht.tmp.bench_run_archive_')
+    try:
+        rundirs = make_project(top, args.runs, args.files, args.size)
+        reference = manifest(top)
+        work = os.path.join(top, 'work')
+        size, inodes = size_and_inodes(rundirs)
+        print("%d runs: %.1f MB in %d files and directories" % (args.runs, size, inodes))
+        expected_tail = read_tail(os.path.join(rundirs[0], 'OUTCAR'))
+
+        copies = [os.path.join(work, os.path.basename(os.path.dirname(x))) for x in rundirs]
+        for rundir, copy in zip(rundirs, copies):
+            shutil.copytree(rundir, copy)
+        start = time.time()
+        for copy in copies:
+            bzip2_each(copy)
+        elapsed = time.time() - start
+        csize, cinodes = size_and_inodes(copies)
+        print("bzip2 of each file: %.2f s, %.1f MB in %d files" % (elapsed, csize, cinodes))
+        start = time.time()
+        tail = read_tail(os.path.join(copies[0], 'OUTCAR'))
+        print("  end of OUTCAR: %.4f s" % (time.time() - start))
+        assert tail == expected_tail
+        shutil.rmtree(work)
+
+        for codec in available_codecs():
+            for processes in sorted(set([1, args.processes])):
+                for rundir, copy in zip(rundirs, copies):
+                    shutil.copytree(rundir, copy)
+                start = time.time()
+                archives = [pack_run(copy, codec=codec, processes=processes) for copy in copies]
+                elapsed = time.time() - start
+                csize, cinodes = size_and_inodes(archives)
+                print("pack_run %s, %d processes: %.2f s, %.1f MB in %d files" % (codec, processes, elapsed, csize, cinodes))
+                start = time.time()
+                tail = read_tail(os.path.join(copies[0], 'OUTCAR'))
+                print("  end of OUTCAR: %.4f s" % (time.time() - start))
+                assert tail == expected_tail
+                shutil.rmtree(work)
+
+        # The manifest of the project with the runs packed in place
+        for rundir in rundirs:
+            pack_run(rundir)
+        same = manifest(top) == reference
+        print("manifest after packing identical: %s" % (same,))
+        if not same:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the import time of httk.atomistic.spacegrouputils and of the first spacegroup lookups.
+
+Each measurement runs in a fresh interpreter, so that nothing is cached between them. The 'eager' numbers
+emulate the previous behavior of loading the full spacegroup pickle and hashing the symmetry operations of
+every spacegroup at import.
+"""
+from __future__ import print_function
+import os, sys, subprocess, argparse
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+src = os.path.join(top, 'src')
+
+import_code = """
+import sys, time, importlib
+import httk
+# httk itself imports spacegrouputils, so measure re-executing the module in a new module object
+del sys.modules['httk.atomistic.spacegrouputils']
+start = time.time()
+sg = importlib.import_module('httk.atomistic.spacegrouputils')
+t_import = time.time() - start
+start = time.time()
+sg.spacegroup_filter('Fm-3m')
+sg.spacegroup_filter('P 21/c')
+sg.get_symops('-P 2ac 2n')
+t_lookup = time.time() - start
+print('RESULT', t_import, t_lookup)
+"""
+
+eager_code = """
+import time, pickle
+import httk
+import httk.atomistic.spacegrouputils as sg
+start = time.time()
+with open(sg.spacegroup_pkl_path, 'rb') as f:
+    data = pickle.load(f)
+for hall in data['data']:
+    symops = [sg.symopstuple(x) for x in data['data'][hall]['symops_mtrx']]
+    hash(tuple(sorted([(hash(x[0]), hash(x[1])) for x in symops])))
+print('RESULT', time.time() - start, 0.0)
+"""
+
+
+def run(code):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([src] + [x for x in env.get('PYTHONPATH', '').split(os.pathsep) if x != ''])
+    out = subprocess.check_output([sys.executable, '-c', code], env=env)
+    # httk prints citation information on exit, so pick out the result line
+    line = [x for x in out.decode('utf-8').splitlines() if x.startswith('RESULT')][0]
+    return [float(x) for x in line.split()[1:]]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark spacegrouputils import time")
+    ap.add_argument("--repeat", help='Number of fresh interpreters to run per measurement', type=int, default=5)
+    args = ap.parse_args()
+
+    lazy = [run(import_code) for _ in range(args.repeat)]
+    eager = [run(eager_code) for _ in range(args.repeat)]
+
+    print("import spacegrouputils: %.1f ms (best of %d)" % (1000*min(x[0] for x in lazy), args.repeat))
+    print("first lookups: %.1f ms (best of %d)" % (1000*min(x[1] for x in lazy), args.repeat))
+    print("eager pickle load and rehash: %.1f ms (best of %d)" % (1000*min(x[0] for x in eager), args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the 'legacy' and 'exact' fraction encodings of SqlStore: loading the coordinates of all
+sites in a table, and whether the stored coordinates come back unchanged. Also checks that
+migrate_fraction_encoding keeps the values read with the legacy encoding.
+
+The database is filled with the structures in Tutorial/tutorial_data/all_spacegroups/cifs.
+"""
+from __future__ import print_function
+import os, sys, time, glob, shutil, tempfile, argparse
+
+import httk, httk.db
+from httk.atomistic.representativesites import RepresentativeSites
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark SqlStore fraction encodings")
+    ap.add_argument("--structures", help='Max number of structures to store', type=int, default=227)
+    ap.add_argument("--repeat", help='Number of times to load the coordinates', type=int, default=5)
+    args = ap.parse_args()
+
+    files = sorted(glob.glob(os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs', '*.cif')))[:args.structures]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        coords = {}
+        for encoding in ['legacy', 'exact']:
+            structs = [httk.load(f) for f in files]
+            store = httk.db.store.SqlStore(httk.db.backend.Sqlite(os.path.join(tmpdir, encoding+'.sqlite')), fraction_encoding=encoding)
+            start = time.time()
+            store.bulk_save(structs)
+            t_save = time.time() - start
+
+            types = RepresentativeSites.types()
+            sids = [x[0] for x in store.db.query("SELECT RepresentativeSites_id FROM RepresentativeSites", [])]
+            start = time.time()
+            for _ in range(args.repeat):
+                vals = store.get_many('RepresentativeSites', sids, types, ['reduced_coords'])
+            t_load = (time.time() - start)/args.repeat
+            natoms = sum(len(vals[sid]['reduced_coords']) for sid in sids)
+            exact = sum(1 for s in structs if vals[s.rc_sites.db.sid]['reduced_coords'] == s.rc_sites.reduced_coords)
+            print("%s: save %.2f s, load coordinates of %d sites: %.1f ms, %d of %d structures with unchanged coordinates" %
+                  (encoding, t_save, natoms, 1000*t_load, exact, len(structs)))
+            coords[encoding] = (store, sids, vals)
+
+        store, sids, vals = coords['legacy']
+        start = time.time()
+        store.migrate_fraction_encoding()
+        t_migrate = time.time() - start
+        migrated = store.get_many('RepresentativeSites', sids, RepresentativeSites.types(), ['reduced_coords'])
+        if any(migrated[sid]['reduced_coords'] != vals[sid]['reduced_coords'] for sid in sids):
+            print("Values changed in migration")
+            sys.exit(1)
+        print("migrate legacy -> exact: %.2f s" % (t_migrate,))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
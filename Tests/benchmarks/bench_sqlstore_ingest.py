@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of saving Structures into an SqlStore one at a time (SqlStore.save) vs. in an ingest session
+(SqlStore.bulk_save), and check that both give the same database content.
+
+The structures are read from Tutorial/tutorial_data/all_spacegroups/cifs and tagged, and a few of them are
+saved twice to exercise the duplicate detection.
+"""
+from __future__ import print_function
+import os, sys, time, glob, shutil, tempfile, sqlite3, argparse
+
+import httk, httk.db
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_structures(n):
+    files = sorted(glob.glob(os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs', '*.cif')))[:n]
+    structs = [httk.load(f) for f in files]
+    for i, struct in enumerate(structs):
+        struct.add_tag('index', str(i))
+    return structs + structs[:10]
+
+
+def dump(filename):
+    con = sqlite3.connect(filename)
+    out = []
+    for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"):
+        out.append((name, con.execute("SELECT * FROM "+name+" ORDER BY 1").fetchall()))
+    con.close()
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark SqlStore ingest")
+    ap.add_argument("--structures", help='Max number of structures to save', type=int, default=227)
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        results = {}
+        for mode in ['save', 'bulk_save', 'bulk_save_wal']:
+            # Fresh objects each time, so that no sids or derived data are carried over
+            structs = load_structures(args.structures)
+            filename = os.path.join(tmpdir, mode+'.sqlite')
+            backend = httk.db.backend.Sqlite(filename)
+            store = httk.db.store.SqlStore(backend)
+            start = time.time()
+            if mode == 'save':
+                for struct in structs:
+                    store.save(struct)
+                store.commit()
+            else:
+                store.bulk_save(structs, wal=(mode == 'bulk_save_wal'))
+            print("%s: %d structures in %.2f s" % (mode, len(structs), time.time() - start))
+            backend.close()
+            results[mode] = dump(filename)
+
+        if results['bulk_save'] != results['save'] or results['bulk_save_wal'] != results['save']:
+            print("Mismatch in database content")
+            sys.exit(1)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
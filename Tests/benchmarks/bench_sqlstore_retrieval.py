@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of retrieving Structures from an SqlStore, one query per field of each object
+(instantiate_from_store) vs. batched retrieval of a whole page of results (instantiate_many_from_store,
+used when iterating over a search).
+
+The database is filled with the structures in Tutorial/tutorial_data/all_spacegroups/cifs.
+"""
+from __future__ import print_function
+import os, sys, time, glob, shutil, tempfile, argparse
+
+import httk, httk.db
+from httk.atomistic import Structure
+from httk.db.filteredcollection import instantiate_from_store
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark SqlStore retrieval")
+    ap.add_argument("--structures", help='Max number of structures to store', type=int, default=227)
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        backend = httk.db.backend.Sqlite(os.path.join(tmpdir, 'bench.sqlite'))
+        store = httk.db.store.SqlStore(backend)
+        files = sorted(glob.glob(os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs', '*.cif')))
+        start = time.time()
+        for f in files[:args.structures]:
+            store.save(httk.load(f))
+        store.commit()
+        print("stored %d structures: %.2f s" % (len(files[:args.structures]), time.time() - start))
+
+        queries = [0]
+
+        def count(sql):
+            queries[0] += 1
+        backend.connection.set_trace_callback(count)
+
+        start = time.time()
+        search = store.searcher()
+        search_struct = search.variable(Structure)
+        search.output(search_struct, 'structure')
+        batched = [match[0] for match, header in search]
+        print("search iteration, batched: %.3f s, %d queries" % (time.time() - start, queries[0]))
+
+        queries[0] = 0
+        start = time.time()
+        single = [instantiate_from_store(Structure, store, s.db.sid) for s in batched]
+        print("one object at a time: %.3f s, %d queries" % (time.time() - start, queries[0]))
+        backend.connection.set_trace_callback(None)
+
+        if [s.to_tuple() for s in batched] != [s.to_tuple() for s in single]:
+            print("Mismatch between batched and single object retrieval")
+            sys.exit(1)
+        backend.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Time taken to get float cartesian coordinates and cell parameters of a supercell repeatedly, through the exact
+Structure properties and .to_floats() versus the cached Structure.arrays. The results are checked to agree.
+"""
+from __future__ import print_function
+import os, sys, time, argparse
+
+import httk
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+cifdir = os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs')
+
+
+def exact_query(struct):
+    return struct.uc_cartesian_coords.to_floats(), [float(x) for x in struct.uc_lengths_and_angles], float(struct.uc_volume)
+
+
+def arrays_query(struct):
+    arrays = struct.arrays
+    return arrays.cartesian_coords, list(arrays.lengths) + list(arrays.angles), arrays.volume
+
+
+def timed(query, struct, repeat):
+    start = time.time()
+    for _i in range(repeat):
+        result = query(struct)
+    return (time.time() - start)/repeat, result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark cached float arrays of structures")
+    ap.add_argument("--cif", help='Structure to build a supercell of', default=os.path.join(cifdir, '225.cif'))
+    ap.add_argument("--size", help='Repetitions n of the n x n x n supercell', type=int, default=6)
+    ap.add_argument("--repeat", help='Number of queries', type=int, default=20)
+    args = ap.parse_args()
+
+    n = args.size
+    struct = httk.load(args.cif).transform([[n, 0, 0], [0, n, 0], [0, 0, n]])
+
+    start = time.time()
+    struct.arrays
+    t_build = time.time() - start
+    t_exact, exact = timed(exact_query, struct, args.repeat)
+    t_arrays, arrays = timed(arrays_query, struct, args.repeat)
+
+    coords_diff = max(abs(a - b) for x, y in zip(exact[0], arrays[0]) for a, b in zip(x, y))
+    params_diff = max(abs(a - b) for a, b in zip(exact[1] + [exact[2]], arrays[1] + [arrays[2]]))
+    if coords_diff > 1e-9 or params_diff > 1e-9:
+        print("Results differ:", coords_diff, params_diff)
+        sys.exit(1)
+    print("%d atoms: exact %.4f s per query, arrays %.6f s per query (built once in %.4f s)" % (struct.uc_nbr_atoms, t_exact, t_arrays, t_build))
+
+
+if __name__ == "__main__":
+    main()
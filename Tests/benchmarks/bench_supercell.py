@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Time taken by Structure.transform to build n x n x n supercells, non-diagonal and elongated supercells of
+increasing size from a tutorial structure, to check that it scales linearly in the number of atoms of the supercell.
+
+To compare with another version, give a structureutils.py from that version with --reference, e.g.,
+git show <commit>:src/httk/atomistic/structureutils.py > /tmp/structureutils_ref.py
+The sites of the supercells are checked to be the same (in any order) as for the reference.
+"""
+from __future__ import print_function
+import os, sys, time, argparse
+
+import httk
+from httk.atomistic import structureutils
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+cifdir = os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs')
+
+
+def load_module(name, filename):
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(name, filename)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except ImportError:
+        import imp
+        return imp.load_source(name, filename)
+
+
+def sites(struct):
+    return [sorted(tuple(x) for x in group.to_fractions()) for group in struct.uc_reduced_coordgroups]
+
+
+def timed(transform, struct, transformation):
+    start = time.time()
+    result = transform(struct, transformation, max_atoms=10**9)
+    return time.time() - start, result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark supercell building")
+    ap.add_argument("--cif", help='Structure to build supercells of', default=os.path.join(cifdir, '225.cif'))
+    ap.add_argument("--max-size", help='Largest repetition n of the n x n x n supercells', type=int, default=10)
+    ap.add_argument("--reference", help='A structureutils.py with another transform to compare with', default=None)
+    ap.add_argument("--reference-max-size", help='Largest repetition to run with the reference', type=int, default=4)
+    args = ap.parse_args()
+
+    struct = httk.load(args.cif)
+    ref = None
+    if args.reference is not None:
+        ref = load_module('structureutils_reference', args.reference)
+
+    cases = [("%dx%dx%d" % (n, n, n), n, [[n, 0, 0], [0, n, 0], [0, 0, n]]) for n in range(1, args.max_size+1)]
+    cases += [("[[0,%d,%d],[%d,0,%d],[%d,%d,0]]" % ((n,)*6), n, [[0, n, n], [n, 0, n], [n, n, 0]]) for n in range(1, args.max_size//2+1)]
+    # Elongated cells, for which a search over lattice translations in order of distance has to go far out
+    cases += [("1x1x%d" % (n*n,), n, [[1, 0, 0], [0, 1, 0], [0, 0, n*n]]) for n in range(2, args.max_size+1, 2)]
+
+    for label, n, transformation in cases:
+        elapsed, result = timed(structureutils.transform, struct, transformation)
+        atoms = result.uc_nbr_atoms
+        line = "%s: %d atoms, %.3f s (%.1f us/atom)" % (label, atoms, elapsed, 1e6*elapsed/atoms)
+        if ref is not None and n <= args.reference_max_size:
+            ref_elapsed, ref_result = timed(ref.transform, struct, transformation)
+            line += ", reference %.3f s" % (ref_elapsed,)
+            if sites(ref_result) != sites(result):
+                print(line)
+                print("Sites differ from the reference")
+                sys.exit(1)
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
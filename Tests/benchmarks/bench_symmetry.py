@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Throughput of the in-process symmetry finder, httk.atomistic.symmetryfinder.find_symmetry, on the unit cells of
+the all_spacegroups tutorial cif files. The space group found is compared with the one given in each file.
+
+With --backend isotropy, the same structures are also run through the external findsym program (if it is
+configured), which is what Structure.find_symmetry() uses by default.
+"""
+from __future__ import print_function
+import os, glob, time, argparse
+
+import httk
+from httk.atomistic import spacegrouputils
+from httk.atomistic.symmetryfinder import find_symmetry
+from httk.atomistic.structureutils import structure_reduced_uc_to_representative
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+cifdir = os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs')
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark symmetry finding")
+    ap.add_argument("--symprec", help='Tolerance for find_symmetry', type=float, default=0.01)
+    ap.add_argument("--repeat", help='Number of timing runs, the best is reported', type=int, default=1)
+    ap.add_argument("--backend", help='Also time this backend of structure_reduced_uc_to_representative', default=None)
+    args = ap.parse_args()
+
+    structs = []
+    for filename in sorted(glob.glob(os.path.join(cifdir, '*.cif'))):
+        struct = httk.load(filename)
+        # Build the unit cell (and its float arrays) outside of the timing
+        struct.arrays
+        structs += [(os.path.basename(filename), struct, spacegrouputils.spacegroup_get_number(struct.rc_sites.hall_symbol))]
+    nbr_atoms = sum(len(struct.uc_reduced_coords) for _name, struct, _number in structs)
+
+    best = None
+    for _i in range(args.repeat):
+        results = []
+        times = []
+        start = time.time()
+        for name, struct, _number in structs:
+            t = time.time()
+            try:
+                results += [find_symmetry(struct, args.symprec).spacegroup_number]
+            except Exception:
+                results += [None]
+            times += [(time.time() - t, name, len(struct.uc_reduced_coords))]
+        elapsed = time.time() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, results, times)
+    elapsed, results, times = best
+
+    agree = sum(1 for (_name, _struct, number), result in zip(structs, results) if number == result)
+    failed = sum(1 for result in results if result is None)
+    print("find_symmetry: %d structures (%d sites), %.2f s (%.0f structures/s), %d agree with the cif, %d failed" %
+          (len(structs), nbr_atoms, elapsed, len(structs)/elapsed, agree, failed))
+    for t, name, n in sorted(times, reverse=True)[:3]:
+        print("  slowest: %s, %d sites, %.3f s" % (name, n, t))
+
+    if args.backend is not None:
+        start = time.time()
+        for _name, struct, _number in structs:
+            structure_reduced_uc_to_representative(struct, backends=[args.backend])
+        elapsed = time.time() - start
+        print("%s: %d structures, %.2f s (%.0f structures/s)" % (args.backend, len(structs), elapsed, len(structs)/elapsed))
+
+
+if __name__ == "__main__":
+    main()
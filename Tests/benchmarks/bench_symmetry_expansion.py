@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the symmetry expansion of representative coordinates into the unit cell
+(httk.atomistic.sitesutils.coordgroups_reduced_to_unitcell) over the all_spacegroups cifs.
+
+The result is verified against the straightforward implementation that applies one symmetry
+operation at a time and compares each new coordinate pairwise with all previous ones.
+"""
+from __future__ import print_function
+import os, sys, glob, time, fractions, argparse
+
+import httk
+from httk.atomistic import sitesutils, spacegrouputils
+
+top = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+cifdir = os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs')
+
+
+def reference_coordgroups_reduced_to_unitcell(coordgroups, hall_symbol, eps=fractions.Fraction(1, 1000)):
+    symops = spacegrouputils.get_symops(hall_symbol)
+    newcoordgroups = []
+    for coordgroup in coordgroups:
+        newcoordgroup = []
+        for symop in symops:
+            rotcoords = coordgroup*(symop[0].T())
+            for coord in rotcoords:
+                finalcoord = (coord+symop[1]).normalize()
+                if finalcoord not in newcoordgroup:
+                    for checkcoord in newcoordgroup:
+                        if (checkcoord-finalcoord).normalize_half().lengthsqr() < eps:
+                            break
+                    else:
+                        newcoordgroup += [finalcoord]
+        newcoordgroup = sorted(newcoordgroup, key=lambda x: (x[0], x[1], x[2]))
+        newcoordgroups += [newcoordgroup]
+    return newcoordgroups
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark symmetry expansion into the unit cell")
+    ap.add_argument("--skip-reference", help='Only time the new implementation', action='store_true')
+    args = ap.parse_args()
+
+    cases = []
+    for f in sorted(glob.glob(os.path.join(cifdir, '*.cif'))):
+        rc_sites = httk.load(f).rc_sites
+        cases += [(os.path.basename(f), rc_sites.reduced_coordgroups, rc_sites.hall_symbol)]
+
+    t_new = 0.0
+    t_ref = 0.0
+    for name, coordgroups, hall_symbol in cases:
+        start = time.time()
+        new = sitesutils.coordgroups_reduced_to_unitcell(coordgroups, hall_symbol)
+        t_new += time.time() - start
+
+        if args.skip_reference:
+            continue
+
+        start = time.time()
+        ref = reference_coordgroups_reduced_to_unitcell(coordgroups, hall_symbol)
+        t_ref += time.time() - start
+
+        if [[c.to_fractions() for c in group] for group in new] != [[c.to_fractions() for c in group] for group in ref]:
+            print("Mismatch for", name, hall_symbol)
+            sys.exit(1)
+
+    print("Structures:", len(cases))
+    print("coordgroups_reduced_to_unitcell: %.2f s" % (t_new,))
+    if not args.skip_reference:
+        print("reference implementation: %.2f s (speedup %.1fx)" % (t_ref, t_ref/t_new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Claim throughput of httk.task.TaskQueue on a tree with many waiting task directories, with several claiming
+processes in parallel. The way taskmanager.sh finds the next task (searching the whole tree, sorting by
+priority and name, and renaming the first one) is timed for comparison, on fewer claims.
+"""
+from __future__ import print_function
+import os, sys, time, shutil, tempfile, argparse, multiprocessing
+
+from httk.task.taskqueue import TaskQueue, parse_task_name
+
+
+def make_tasks(rootdir, count):
+    waiting = os.path.join(rootdir, 'proj', 'ht.waiting')
+    for i in range(count):
+        # Group the tasks in subdirectories, as large projects do
+        subdir = os.path.join(waiting, 'batch%03d' % (i // 1000))
+        if i % 1000 == 0:
+            os.makedirs(subdir)
+        os.mkdir(os.path.join(subdir, 'ht.task.bench.t%06d.start.0.unclaimed.%d.waitstart' % (i, 1 + i % 5)))
+
+
+def find_next_task(rootdir):
+    # What find_next_task in taskmanager.sh does: search the tree, then sort by priority and name
+    candidates = []
+    for dirpath, dirnames, _filenames in os.walk(rootdir):
+        keep = []
+        for name in dirnames:
+            fields = parse_task_name(name)
+            if fields is None:
+                keep.append(name)
+            elif fields['status'] == 'waitstart':
+                candidates.append((fields['priority'], os.path.join(dirpath, name)))
+        dirnames[:] = keep
+    if len(candidates) == 0:
+        return None
+    return min(candidates)[1]
+
+
+def baseline_claims(rootdir, claims):
+    for i in range(claims):
+        path = find_next_task(rootdir)
+        fields = parse_task_name(os.path.basename(path))
+        os.rename(path, path[:-len('unclaimed.%d.waitstart' % fields['priority'])] + 'base.%d.running' % fields['priority'])
+
+
+def queue_claims(args):
+    rootdir, owner, claims = args
+    queue = TaskQueue(rootdir)
+    count = 0
+    for i in range(claims):
+        path = queue.claim(owner)
+        if path is None:
+            break
+        queue.complete(path, 'finished')
+        count += 1
+    queue.close()
+    return count
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark task claiming")
+    ap.add_argument("--tasks", help='Number of task directories', type=int, default=100000)
+    ap.add_argument("--claims", help='Number of claims per worker', type=int, default=2000)
+    ap.add_argument("--workers", help='Number of claiming processes', type=int, default=4)
+    ap.add_argument("--baseline-claims", help='Number of claims for the comparison', type=int, default=5)
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='ht.tmp.bench_task_claim_')
+    try:
+        start = time.time()
+        make_tasks(tmpdir, args.tasks)
+        print("Created %d task directories: %.1f s" % (args.tasks, time.time() - start))
+
+        start = time.time()
+        baseline_claims(tmpdir, args.baseline_claims)
+        elapsed = time.time() - start
+        print("Search and rename (taskmanager.sh): %.3f s per claim (%.1f claims/s)" % (elapsed/args.baseline_claims, args.baseline_claims/elapsed))
+
+        queue = TaskQueue(tmpdir)
+        start = time.time()
+        found = queue.sync()
+        print("TaskQueue.sync: %d tasks in %.1f s" % (found, time.time() - start))
+        queue.close()
+
+        start = time.time()
+        pool = multiprocessing.Pool(args.workers)
+        counts = pool.map(queue_claims, [(tmpdir, 'w%d' % i, args.claims) for i in range(args.workers)])
+        pool.close()
+        pool.join()
+        elapsed = time.time() - start
+        total = sum(counts)
+        print("TaskQueue.claim + complete, %d processes: %d claims in %.2f s (%.0f claims/s)" % (args.workers, total, elapsed, total/elapsed))
+
+        queue = TaskQueue(tmpdir)
+        counts = queue.counts()
+        queue.close()
+        if counts.get('finished', 0) != total or total != args.workers*args.claims:
+            print("Unexpected task counts:", counts)
+            sys.exit(1)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
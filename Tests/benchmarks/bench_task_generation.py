@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generation of VASP relaxation tasks (the t:vasp/batch/vasp-relax-formenrg template) for many structures, one at
+a time with httk.task.create_batch_task, and in bulk with httk.task.create_batch_tasks, serially and on a pool
+of processes. The tasks are created in a directory that already holds many tasks, since that is where the
+per task duplicate check of create_batch_task is slow.
+"""
+from __future__ import print_function
+import os, sys, time, shutil, tempfile, argparse
+
+from httk.atomistic import Structure
+from httk.task import create_batch_task, create_batch_tasks
+
+
+def structures(count):
+    basis = [[0.0, 1.0, 1.0], [1.0, 0.0, 1.0], [1.0, 1.0, 0.0]]
+    for i in range(count):
+        x = 0.2 + 0.1*(i % 5)/5.0
+        yield "s%06d" % i, Structure.create(uc_basis=basis, uc_reduced_coordgroups=[[[0.0, 0.0, 0.0]], [[x, x, x]]],
+                                            assignments=['Na', 'Cl'], uc_volume=40.0 + i % 100)
+
+
+def timed(label, func, count):
+    start = time.time()
+    result = func()
+    elapsed = time.time() - start
+    print("%s: %.2f s (%.0f tasks/s)" % (label, elapsed, count/elapsed))
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark task generation")
+    ap.add_argument("--tasks", help='Number of tasks to generate', type=int, default=2000)
+    ap.add_argument("--existing", help='Number of tasks already in the directory', type=int, default=20000)
+    ap.add_argument("--processes", help='Number of processes for the parallel run', type=int, default=4)
+    args = ap.parse_args()
+
+    template = 't:vasp/batch/vasp-relax-formenrg'
+    tmpdir = tempfile.mkdtemp(prefix='ht.tmp.bench_task_generation_')
+    try:
+        structs = list(structures(args.tasks))
+        runs = {}
+        for label in ['single', 'bulk', 'parallel']:
+            runs[label] = os.path.join(tmpdir, label)
+            os.mkdir(runs[label])
+            for i in range(args.existing):
+                os.mkdir(os.path.join(runs[label], "ht.task.old.o%06d.start.0.unclaimed.3.finished" % i))
+
+        devnull = open(os.devnull, 'w')
+
+        def single():
+            # create_batch_task prints a line per task
+            stdout = sys.stdout
+            sys.stdout = devnull
+            try:
+                for name, struct in structs:
+                    create_batch_task(runs['single'], template, {'structure': struct}, name=name)
+            finally:
+                sys.stdout = stdout
+
+        timed("create_batch_task, one at a time", single, args.tasks)
+        results = timed("create_batch_tasks", lambda: list(create_batch_tasks(runs['bulk'], [(name, {'structure': struct}) for name, struct in structs], template)),
+                        args.tasks)
+        results += timed("create_batch_tasks, %d processes" % args.processes,
+                         lambda: list(create_batch_tasks(runs['parallel'], [(name, {'structure': struct}) for name, struct in structs], template,
+                                                         processes=args.processes)), args.tasks)
+        errors = [x[1] for x in results if x[1] is not None]
+        if len(errors) > 0:
+            print("Errors:", errors[:5])
+            sys.exit(1)
+        for name, struct in structs[:10]:
+            task = "ht.task.unassigned." + name + ".start.0.unclaimed.3.waitstart"
+            for label in ['bulk', 'parallel']:
+                for filename in sorted(os.listdir(os.path.join(runs['single'], task))):
+                    with open(os.path.join(runs['single'], task, filename), 'rb') as f1, open(os.path.join(runs[label], task, filename), 'rb') as f2:
+                        if f1.read() != f2.read():
+                            print("Tasks differ:", label, task, filename)
+                            sys.exit(1)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Task status queries with httk.task.TaskStatusIndex on a run directory with many tasks, most of them finished
+(each with a few files inside), compared to counting with find as Execution/status.sh used to do.
+"""
+from __future__ import print_function
+import os, sys, time, shutil, tempfile, argparse, subprocess
+
+from httk.task.taskstatus import TaskStatusIndex
+
+
+def make_tasks(rootdir, count, running):
+    for i in range(count):
+        if i < running:
+            location, owner, status = 'ht.running', 'tm1', 'running'
+        elif i < count // 10:
+            location, owner, status = 'ht.waiting', 'unclaimed', 'waitstart'
+        else:
+            location, owner, status = 'ht.finished', 'unclaimed', 'finished'
+        subdir = os.path.join(rootdir, location, 'batch%03d' % (i // 1000))
+        if not os.path.exists(subdir):
+            os.makedirs(subdir)
+        taskdir = os.path.join(subdir, 'ht.task.bench.t%06d.start.0.%s.%d.%s' % (i, owner, 1 + i % 5, status))
+        os.mkdir(taskdir)
+        for name in ['ht_steps', 'INCAR', 'OUTCAR.cleaned.bz2']:
+            open(os.path.join(taskdir, name), 'w').close()
+
+
+def find_counts(rootdir):
+    counts = {}
+    for name in sorted(os.listdir(rootdir)):
+        if name.startswith('ht.') and os.path.isdir(os.path.join(rootdir, name)):
+            out = subprocess.check_output("find '%s' -name 'ht.task.*' | wc -l" % name, shell=True, cwd=rootdir)
+            counts[name] = int(out.strip())
+    return counts
+
+
+def timed(label, func):
+    start = time.time()
+    result = func()
+    print("%s: %.3f s" % (label, time.time() - start))
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark task status queries")
+    ap.add_argument("--tasks", help='Number of task directories', type=int, default=100000)
+    ap.add_argument("--running", help='Number of running tasks', type=int, default=200)
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='ht.tmp.bench_task_status_')
+    try:
+        make_tasks(tmpdir, args.tasks, args.running)
+        expected = timed("find | wc -l per state directory", lambda: find_counts(tmpdir))
+
+        index = TaskStatusIndex(tmpdir)
+        timed("TaskStatusIndex.refresh, first", index.refresh)
+        timed("TaskStatusIndex.refresh, unchanged", index.refresh)
+        running = os.path.join(tmpdir, 'ht.running', 'batch000')
+        for name in os.listdir(running)[:10]:
+            os.rename(os.path.join(running, name), os.path.join(running, name.replace('tm1', 'unclaimed').replace('running', 'finished')))
+        timed("TaskStatusIndex.refresh, 10 tasks renamed", index.refresh)
+        counts = timed("count by location", lambda: index.count(by='location'))
+        timed("count by status, one priority", lambda: index.count(by='status', priority=3))
+        timed("list running tasks", lambda: index.tasks(status='running'))
+        index.close()
+        if counts != expected:
+            print("Counts differ:", counts, expected)
+            sys.exit(1)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
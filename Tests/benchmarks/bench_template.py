@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Rendering of templates with httk.core.template: the INCAR template of the single VASP run templates (used by
+httk.iface.vasp_if.prepare_single_run), and a larger template with python code blocks, per file through
+apply_template and on text through render_template. Interpreting the template text anew for every rendering,
+as apply_template used to do, is timed for comparison, and the outputs are checked to be identical.
+"""
+from __future__ import print_function
+import os, sys, time, shutil, tempfile, argparse
+
+import httk
+from httk.core.template import apply_template, render_template, _interpret_template
+
+code_template = """# Generated input
+SYSTEM = $name
+ENCUT = $(encut*1.3)
+KPOINTS = $(" ".join(str(k) for k in kpts))
+${
+for i, m in enumerate(magmoms):
+    print("MAGMOM_%d = %s" % (i, m))
+}
+${if spin: print("ISPIN = 2")}
+NBANDS = $nbands
+"""
+
+
+def timed(label, func, count):
+    start = time.time()
+    for i in range(count):
+        result = func(i)
+    elapsed = time.time() - start
+    print("%s: %.1f us per rendering" % (label, 1e6*elapsed/count))
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark template rendering")
+    ap.add_argument("--count", help='Number of renderings', type=int, default=2000)
+    args = ap.parse_args()
+
+    incar = os.path.join(httk.httk_root, 'Execution', 'tasks-templates', 'vasp', 'single', 'static', 'INCAR.template')
+    with open(incar) as f:
+        incar_text = f.read()
+    code_text = code_template * 10
+
+    def incar_data(i):
+        return {'VASP_MAGMOM': " ".join(["5"]*(i % 7 + 1)), 'VASP_NBANDS_SPIN': str(20 + i), 'VASP_NBANDS_NOSPIN': str(10 + i)}
+
+    def code_data(i):
+        return {'name': 'Fe%dO' % (i % 5 + 1), 'encut': 400 + i, 'kpts': [4, 4, i % 3 + 1], 'magmoms': [5.0]*(i % 4 + 1),
+                'spin': i % 2 == 0, 'nbands': 40 + i}
+
+    tmpdir = tempfile.mkdtemp(prefix='ht.tmp.bench_template_')
+    try:
+        output = os.path.join(tmpdir, 'INCAR')
+        for label, text, data in [("INCAR template", incar_text, incar_data), ("template with code blocks", code_text, code_data)]:
+            print(label + ":")
+            filename = os.path.join(tmpdir, 'template')
+            with open(filename, 'w') as f:
+                f.write(text)
+            os.utime(filename, (time.time() - 60, time.time() - 60))
+
+            def old_apply(i):
+                with open(filename) as f:
+                    result = _interpret_template(f.read(), data(i))
+                with open(output, 'w') as f:
+                    f.write(result)
+
+            timed("  interpreted, per file", old_apply, args.count)
+            timed("  apply_template", lambda i: apply_template(filename, output, data(i)), args.count)
+            timed("  interpreted", lambda i: _interpret_template(text, data(i)), args.count)
+            timed("  render_template", lambda i: render_template(text, data(i)), args.count)
+            for i in range(50):
+                if render_template(text, data(i)) != _interpret_template(text, data(i)):
+                    print("Outputs differ")
+                    sys.exit(1)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+#! /usr/bin/env python
+#
+# Packs finished run directories into archives with httk.core.runarchive.pack_run. Used by
+# Execution/taskmanager.sh, which compresses every file with bzip2 instead if this fails (exit code 3 if httk
+# cannot be imported).
+#
+import sys, os, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+try:
+    import httk
+    from httk.core.runarchive import pack_run
+except ImportError:
+    sys.exit(3)
+
+httk.dont_print_citations_at_exit()
+
+ap = argparse.ArgumentParser(description="Pack run directories into archives")
+ap.add_argument("--codec", help='Compression codec: bz2, zlib, lzma or none', default='bz2')
+ap.add_argument("--processes", help='Number of processes used for compression (default: one per cpu)', type=int, default=None)
+ap.add_argument("rundirs", nargs='+')
+args = ap.parse_args()
+
+try:
+    for rundir in args.rundirs:
+        pack_run(rundir, codec=args.codec, processes=args.processes)
+except Exception as e:
+    sys.stderr.write("pack_run.py: "+str(e)+"\n")
+    sys.exit(1)
@@ -0,0 +1,17 @@
+#! /usr/bin/env python
+#
+# Prints the status of the tasks in the run directory in the current directory, using the incrementally
+# updated index in httk.task.taskstatus. Used by Execution/status.sh, which falls back on counting with
+# find if this exits with code 3 (httk cannot be imported).
+#
+import sys, os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+try:
+    import httk
+    from httk.task.taskstatus import status_command
+except ImportError:
+    sys.exit(3)
+
+httk.dont_print_citations_at_exit()
+sys.exit(status_command(sys.argv[1:]))
@@ -20,7 +20,7 @@
 # http://onlinelibrary.wiley.com/doi/10.1002/adma.200700843/abstract
 import sys
 
-from httk.core.geometry import hull_z
+from httk.core.geometry import hull_z, HullZ
 from httk.core.httkobject import HttkPluginPlaceholder
 from httk.core import FracVector
 
@@ -37,6 +37,9 @@ class PhaseDiagram(object):
         self.energies = []
         self.ids = []
         self.other_ids = []
+        # Incrementally updated convex hull, kept over _reset() as long as no new symbol is seen
+        self._hull_engine = None
+        self._hull_engine_symbols = None
 
         self._reset()
 
@@ -70,7 +73,12 @@ class PhaseDiagram(object):
             else:
                 phase[symbol] = counts[i]
             self.seen_symbols[symbol] = True
+        if self._hull_engine is not None and list(self.seen_symbols.keys()) != self._hull_engine_symbols:
+            # A new symbol changes the coordinate system, so the hull has to be recalculated
+            self._hull_engine = None
         if energy is not None:
+            if self._hull_engine is not None:
+                self._hull_engine.add_point([phase[symbol] if symbol in phase else 0 for symbol in self._hull_engine_symbols], energy)
             self.phases += [phase]
             self.energies += [energy]
             self.ids += [id]
@@ -135,12 +143,16 @@ class PhaseDiagram(object):
 
     def _hull(self):
         if self._cache_hull is None:
-            sys.stderr.write("Warning: calculating convex hull, this may take some time.\n")
-            symbols = self.coord_system
-            phaselist = []
-            for phase in self.phases:
-                phaselist += [[phase[symbol] if symbol in phase else 0 for symbol in symbols]]
-            self._cache_hull = hull_z(phaselist, self.energies)
+            if self._hull_engine is None:
+                sys.stderr.write("Warning: calculating convex hull, this may take some time.\n")
+                symbols = list(self.coord_system)
+                phaselist = []
+                for phase in self.phases:
+                    phaselist += [[phase[symbol] if symbol in phase else 0 for symbol in symbols]]
+                self._hull_engine = HullZ(phaselist, self.energies)
+                self._hull_engine_symbols = symbols
+            # Phases added since the last call are included incrementally by the engine
+            self._cache_hull = self._hull_engine.result()
         return self._cache_hull
 
     def _overhull(self):
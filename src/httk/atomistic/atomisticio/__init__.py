@@ -16,4 +16,4 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from httk.atomistic.atomisticio import structureioplugin
-from httk.atomistic.atomisticio.structure_cif_io import cif_to_struct, struct_to_cif, cifdata_to_struct, struct_to_cifdata
+from httk.atomistic.atomisticio.structure_cif_io import cif_to_struct, cif_to_structs, struct_to_cif, cifdata_to_struct, struct_to_cifdata
@@ -15,8 +15,8 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import os, hashlib, random, string, re
-from collections import OrderedDict
+import os, hashlib, random, string, re, pickle
+from collections import OrderedDict, deque
 import httk
 import httk.httkio
 
@@ -79,6 +79,53 @@ def cif_to_struct(ioa, backends=['internal', 'cif2cell', 'ase', 'platon']):
     raise Exception("cif_to_struct: None of the requested / available backends available, tried:"+str(backends))
 
 
+def cif_to_structs(ioa, processes=1, pending=None):
+    """
+    Iterate over the structures of all data blocks in a cif file / ioadapter, which may have any number of
+    data blocks (e.g., a database export.) The file is read one data block at a time, with the internal
+    cif reader.
+
+    Yields tuples (data_block_name, structure, error), in the order of the file. If a data block could not
+    be converted, structure is None and error is the exception.
+
+    processes: with more than one, data blocks are converted on a pool of this many processes while the
+      file is read. At most pending blocks (default: 4 per process) are kept in memory at a time.
+    """
+    blocks = httk.httkio.iter_cif(ioa)
+    if processes <= 1:
+        for block in blocks:
+            yield _cifblock_to_struct(block)
+        return
+
+    import multiprocessing
+    if pending is None:
+        pending = 4*processes
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = deque()
+        for block in blocks:
+            if len(results) >= pending:
+                yield results.popleft().get()
+            results.append(pool.apply_async(_cifblock_to_struct, (block, True)))
+        while results:
+            yield results.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _cifblock_to_struct(block, pickleable_errors=False):
+    try:
+        return block[0], cifdata_to_struct([block]), None
+    except Exception as e:
+        if pickleable_errors:
+            try:
+                pickle.loads(pickle.dumps(e))
+            except Exception:
+                e = Exception(type(e).__name__+": "+str(e))
+        return block[0], None, e
+
+
 def struct_to_cif(struct, ioa, backends=['httk']):
     for backend in backends:
         if backend == 'httk':
@@ -0,0 +1,254 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Periodic neighbor lists of structures.
+
+neighbor_list(struct, cutoff) finds all pairs of sites (including periodic images) in the unit cell of a
+Structure or UnitcellStructure that are within the distance cutoff, using a cell list: the sites are sorted
+into bins (in reduced coordinates) that are at least cutoff wide in every direction, so that only sites in
+neighboring bins need to be compared. The time taken is linear in the number of sites for a fixed cutoff
+and density. Use struct.neighbor_list(cutoff) to get a neighbor list that is cached on the structure.
+
+The neighbor list works on the float arrays of the structure (struct.arrays), not on the exact coordinates.
+"""
+import math
+
+from httk.core.vectors.arraybackend import get_numpy
+
+
+class NeighborList(object):
+    """
+    All pairs of sites within cutoff of each other, in both directions (i.e., (i, j) and (j, i) both appear):
+
+      i, j: the indices of the sites (in the order of struct.arrays.reduced_coords)
+      offsets: the lattice translation (in units of the basis vectors) of the image of site j
+      distances: the distance between site i and the image of site j
+
+    i.e., distances[k] = |cart[j[k]] + offsets[k]*basis - cart[i[k]]|. The pairs are sorted on i. A site
+    is its own neighbor (with a non-zero offset) if the cutoff is longer than a lattice vector.
+    """
+
+    def __init__(self, cutoff, nbr_atoms, i, j, offsets, distances):
+        """
+        Private constructor, as per httk coding guidelines. Use neighbor_list or Structure.neighbor_list instead.
+        """
+        self.cutoff = cutoff
+        self.nbr_atoms = nbr_atoms
+        self.i = i
+        self.j = j
+        self.offsets = offsets
+        self.distances = distances
+        for arr in (self.i, self.j, self.offsets, self.distances):
+            if hasattr(arr, 'setflags'):
+                arr.setflags(write=False)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for arr in (self.i, self.j, self.offsets, self.distances):
+            if hasattr(arr, 'setflags'):
+                arr.setflags(write=False)
+
+    def __len__(self):
+        return len(self.distances)
+
+    @property
+    def min_distance(self):
+        """
+        The shortest distance between two sites, or None if there are no pairs within the cutoff.
+        """
+        if len(self.distances) == 0:
+            return None
+        return float(min(self.distances))
+
+    @property
+    def coordination_numbers(self):
+        """
+        The number of neighbors within the cutoff of each site.
+        """
+        counts = [0]*self.nbr_atoms
+        for idx in self.i:
+            counts[idx] += 1
+        return counts
+
+    def neighbors(self, site):
+        """
+        Returns a list of (j, offset, distance) of the neighbors of the site with index site.
+        """
+        return [(int(self.j[k]), tuple(int(x) for x in self.offsets[k]), float(self.distances[k])) for k in range(len(self.i)) if self.i[k] == site]
+
+    def filtered(self, cutoff):
+        """
+        Returns a new NeighborList with only the pairs within a shorter cutoff.
+        """
+        if cutoff > self.cutoff:
+            raise Exception("NeighborList.filtered: cannot extend the neighbor list to a longer cutoff.")
+        keep = [k for k in range(len(self.distances)) if self.distances[k] <= cutoff]
+        return _create(cutoff, self.nbr_atoms, [self.i[k] for k in keep], [self.j[k] for k in keep],
+                       [tuple(self.offsets[k]) for k in keep], [self.distances[k] for k in keep])
+
+    def __str__(self):
+        return "<httk NeighborList object: "+str(len(self))+" pairs within "+str(self.cutoff)+" between "+str(self.nbr_atoms)+" sites>"
+
+
+def _create(cutoff, nbr_atoms, i, j, offsets, distances):
+    numpy = get_numpy()
+    if numpy is not None:
+        i = numpy.array(i, dtype=numpy.intp)
+        j = numpy.array(j, dtype=numpy.intp)
+        offsets = numpy.array(offsets, dtype=numpy.intp).reshape((len(i), 3))
+        distances = numpy.array(distances, dtype=numpy.float64)
+    else:
+        i = tuple(int(x) for x in i)
+        j = tuple(int(x) for x in j)
+        offsets = tuple(tuple(int(y) for y in x) for x in offsets)
+        distances = tuple(float(x) for x in distances)
+    return NeighborList(cutoff, nbr_atoms, i, j, offsets, distances)
+
+
+def _tolist(arr):
+    if hasattr(arr, 'tolist'):
+        return arr.tolist()
+    return [list(x) for x in arr]
+
+
+def neighbor_list(struct, cutoff):
+    """
+    Returns a NeighborList with all pairs of sites (including periodic images) within the distance cutoff in
+    the unit cell of struct. Most code should use the cached struct.neighbor_list(cutoff) instead.
+    """
+    if not cutoff > 0:
+        raise Exception("neighbor_list: the cutoff must be positive.")
+    arrays = struct.arrays
+    basis = _tolist(arrays.basis)
+    inv_basis = _tolist(arrays.inv_basis)
+    reduced = _tolist(arrays.reduced_coords)
+    nbr_atoms = len(reduced)
+    cutoffsqr = cutoff*cutoff
+
+    # The distance between the lattice planes spanned by the other two basis vectors is 1/|column d of inv_basis|
+    # Bins that are at least cutoff wide in direction d, and how many bins out neighbors can be (more than one
+    # if the cell is narrower than the cutoff)
+    nbins = []
+    reach = []
+    for d in range(3):
+        width = 1.0/math.sqrt(inv_basis[0][d]**2 + inv_basis[1][d]**2 + inv_basis[2][d]**2)
+        n = max(1, int(width/cutoff))
+        nbins.append(n)
+        reach.append(int(math.ceil(cutoff*n/width)))
+
+    # Sites wrapped into [0,1), with the lattice translation that takes the original site there
+    wrapped_cart = []
+    wraps = []
+    bins = {}
+    for idx in range(nbr_atoms):
+        s = reduced[idx]
+        w = [int(math.floor(x)) for x in s]
+        s = [s[0]-w[0], s[1]-w[1], s[2]-w[2]]
+        for d in range(3):
+            # A tiny negative coordinate rounds up to 1.0
+            if s[d] >= 1.0:
+                s[d] = 0.0
+                w[d] += 1
+        key = tuple(min(int(s[d]*nbins[d]), nbins[d]-1) for d in range(3))
+        wraps.append(w)
+        wrapped_cart.append([s[0]*basis[0][d] + s[1]*basis[1][d] + s[2]*basis[2][d] for d in range(3)])
+        if key in bins:
+            bins[key].append(idx)
+        else:
+            bins[key] = [idx]
+
+    steps = [(a, b, c) for a in range(-reach[0], reach[0]+1) for b in range(-reach[1], reach[1]+1) for c in range(-reach[2], reach[2]+1)]
+
+    pairs = []
+    for key, centers in bins.items():
+        for step in steps:
+            extended = [key[d]+step[d] for d in range(3)]
+            image = [extended[d]//nbins[d] for d in range(3)]
+            target = (extended[0] - image[0]*nbins[0], extended[1] - image[1]*nbins[1], extended[2] - image[2]*nbins[2])
+            if target not in bins:
+                continue
+            shift = [image[0]*basis[0][d] + image[1]*basis[1][d] + image[2]*basis[2][d] for d in range(3)]
+            is_zero_image = image == [0, 0, 0]
+            for i in centers:
+                ci = wrapped_cart[i]
+                x0 = shift[0] - ci[0]
+                x1 = shift[1] - ci[1]
+                x2 = shift[2] - ci[2]
+                for j in bins[target]:
+                    cj = wrapped_cart[j]
+                    v0 = cj[0] + x0
+                    v1 = cj[1] + x1
+                    v2 = cj[2] + x2
+                    dsqr = v0*v0 + v1*v1 + v2*v2
+                    if dsqr <= cutoffsqr and not (is_zero_image and i == j):
+                        pairs.append((i, j, image, dsqr))
+
+    pairs.sort(key=lambda x: (x[0], x[3], x[1]))
+    iidx = []
+    jidx = []
+    offsets = []
+    distances = []
+    for i, j, image, dsqr in pairs:
+        wi = wraps[i]
+        wj = wraps[j]
+        iidx.append(i)
+        jidx.append(j)
+        offsets.append((image[0] - wj[0] + wi[0], image[1] - wj[1] + wi[1], image[2] - wj[2] + wi[2]))
+        distances.append(math.sqrt(dsqr))
+    return _create(cutoff, nbr_atoms, iidx, jidx, offsets, distances)
+
+
+def main():
+    from httk.core.vectors import FracVector
+    from httk.atomistic import Structure
+    import itertools
+
+    # Rock salt in a skewed primitive cell, and the same structure repeated
+    struct = Structure.create(uc_basis=FracVector.create([[0, "2.8", "2.8"], ["2.8", 0, "2.8"], ["2.8", "2.8", 0]]),
+                              uc_reduced_coordgroups=[[[0, 0, 0]], [["1/2", "1/2", "1/2"]]],
+                              assignments=['Na', 'Cl'])
+    nl = struct.neighbor_list(3.0)
+    print(nl)
+    assert nl is struct.neighbor_list(3.0)
+    assert nl.coordination_numbers == [6, 6]
+    assert abs(nl.min_distance - 2.8) < 1e-9
+
+    # Compare with all pairs over a range of images, for a cutoff longer than the lattice vectors
+    cutoff = 6.0
+    nl = struct.neighbor_list(cutoff)
+    arrays = struct.arrays
+    cart = [list(x) for x in arrays.cartesian_coords]
+    basis = [list(x) for x in arrays.basis]
+    expected = []
+    for i in range(2):
+        for j in range(2):
+            for offset in itertools.product(range(-4, 5), repeat=3):
+                if i == j and offset == (0, 0, 0):
+                    continue
+                v = [cart[j][d] - cart[i][d] + sum(offset[k]*basis[k][d] for k in range(3)) for d in range(3)]
+                dist = math.sqrt(sum(x*x for x in v))
+                if dist <= cutoff:
+                    expected.append((i, j, offset, round(dist, 9)))
+    found = [(int(nl.i[k]), int(nl.j[k]), tuple(int(x) for x in nl.offsets[k]), round(float(nl.distances[k]), 9)) for k in range(len(nl))]
+    assert sorted(found) == sorted(expected)
+    assert len(struct.neighbor_list(3.0).filtered(2.9)) == 12
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import fractions
+from math import sqrt
 
 from httk.core import FracVector, MutableFracVector
 from httk.core.basic import is_sequence
@@ -264,24 +265,111 @@ def sites_tidy(sites, backends=['platon']):
     raise Exception("structure_tidy: None of the available backends available.")
 
 
+_stacked_symops_cache = {}
+
+
+def stacked_symops(hall_symbol):
+    """
+    Returns (rotations, translations) where all symmetry operations of the spacegroup given by hall_symbol are
+    stacked so that they can be applied to a group of reduced coordinates (rows) in one operation:
+
+      coords*rotations + translations
+
+    gives for every coordinate the 3*K coordinates it is mapped onto by the K symmetry operations. (i.e., rotations
+    is the 3 x 3K matrix [R_1^T R_2^T ... R_K^T] and translations is the 3K vector [t_1 t_2 ... t_K].)
+    """
+    if hall_symbol not in _stacked_symops_cache:
+        symops = spacegrouputils.get_symops(hall_symbol)
+        if symops is None:
+            raise Exception("stacked_symops: unknown hall symbol: "+str(hall_symbol))
+        rotations = FracVector.create([[symop[0][j][i] for symop in symops for j in range(3)] for i in range(3)])
+        translations = FracVector.create([symop[1][j] for symop in symops for j in range(3)])
+        _stacked_symops_cache[hall_symbol] = (rotations, translations)
+    return _stacked_symops_cache[hall_symbol]
+
+
+def coordgroup_apply_stacked_symops(coordgroup, rotations, translations, eps=fractions.Fraction(1, 1000)):
+    """
+    Apply all stacked symmetry operations (see stacked_symops) to the reduced coordinates in coordgroup, and
+    return the sorted list of distinct resulting coordinates, normalized into [0,1).
+
+    Two coordinates are considered the same if the square of their shortest periodic distance (in reduced
+    coordinates) is < eps, in which case the first one found is kept. Coordinates are visited in the order
+    symmetry operation by symmetry operation, and within each operation in the order of coordgroup.
+
+    Rather than comparing every new coordinate with every kept one, kept coordinates are indexed on a grid
+    with cells that are at least sqrt(eps) wide, so only coordinates in neighboring cells need to be checked.
+    """
+    coordgroup = FracVector.use(coordgroup)
+    if len(coordgroup) == 0:
+        return []
+
+    rotated = coordgroup*rotations
+    expanded = (rotated + FracVector.stack_vecs([translations]*len(rotated))).normalize()
+
+    denom = expanded.denom
+    noms = expanded.noms
+    nsymops = len(translations)//3
+
+    # Compare exactly also when eps is given as a float (avoids float overflow for large denominators)
+    eps = fractions.Fraction(eps)
+    limit = eps*(4*denom*denom)
+    if eps > 0:
+        # Largest number of grid cells per unit so that 1/cells >= sqrt(eps)
+        cells = max(1, int(1/sqrt(eps)))
+        while cells > 1 and fractions.Fraction(1, cells*cells) < eps:
+            cells -= 1
+        steps = sorted(set([(cells-1) % cells, 0, 1 % cells]))
+        neighbors = [(a, b, c) for a in steps for b in steps for c in steps]
+    else:
+        cells = None
+
+    index = {}
+    kept = []
+    for k in range(nsymops):
+        for row in noms:
+            coord = row[3*k:3*k+3]
+            if cells is None:
+                if coord in index:
+                    continue
+                index[coord] = [coord]
+                kept += [coord]
+                continue
+            key = (coord[0]*cells//denom, coord[1]*cells//denom, coord[2]*cells//denom)
+            for n in neighbors:
+                neighbor_key = ((key[0]+n[0]) % cells, (key[1]+n[1]) % cells, (key[2]+n[2]) % cells)
+                if neighbor_key in index and _any_within(coord, index[neighbor_key], denom, limit):
+                    break
+            else:
+                if key in index:
+                    index[key] += [coord]
+                else:
+                    index[key] = [coord]
+                kept += [coord]
+
+    return [FracVector(coord, denom) for coord in sorted(kept)]
+
+
+def _any_within(coord, others, denom, limit):
+    # Same as (other-coord).normalize_half().lengthsqr() < eps, but on nominators over the shared denom.
+    # normalize_half puts the differences on denominator 2*denom, so limit = eps*(2*denom)^2
+    twodenom = 2*denom
+    for other in others:
+        lsqr = 0
+        for i in range(3):
+            x = 2*(other[i]-coord[i])
+            x = x - twodenom*(((x // denom) + 1) // 2)
+            lsqr += x*x
+        if lsqr < limit:
+            return True
+    return False
+
+
 def coordgroups_reduced_to_unitcell(coordgroups, hall_symbol, eps=fractions.Fraction(1,1000)):
-    # TODO: This routine is quite slow and can certainly be speed up.
-    symops = spacegrouputils.get_symops(hall_symbol)
+    rotations, translations = stacked_symops(hall_symbol)
     newcoordgroups = []
     for coordgroup in coordgroups:
-        newcoordgroup = []
-        for symop in symops:
-            rotcoords = coordgroup*(symop[0].T())
-            for coord in rotcoords:
-                finalcoord = (coord+symop[1]).normalize()
-                if finalcoord not in newcoordgroup:
-                    for checkcoord in newcoordgroup:
-                        if (checkcoord-finalcoord).normalize_half().lengthsqr() < eps:
-                            break
-                    else:
-                        newcoordgroup += [finalcoord]
-        newcoordgroup = sorted(newcoordgroup, key=lambda x: (x[0], x[1], x[2]))
-        newcoordgroups += [newcoordgroup]
+        newcoordgroups += [coordgroup_apply_stacked_symops(coordgroup, rotations, translations, eps)]
     return newcoordgroups
 
 
@@ -16,7 +16,21 @@
 #
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import sys, pickle, re
+
+"""
+Utilities for looking up and working with spacegroups.
+
+The spacegroup data (extracted from cctbx) is kept in spacegrouputils.pkl. For quick startup, it is read through
+the precompiled, read-only SQLite database spacegrouputils.sqlite, where each spacegroup record is indexed on Hall
+symbol, Hermann-Mauguin symbol, ITC number, Schoenflies symbol and a stable hash of its symmetry operations, and is
+only decoded when it is asked for. Regenerate the database after changing the pickle with::
+
+  python -c "from httk.atomistic import spacegrouputils; spacegrouputils.compile_spacegroup_db()"
+
+If the database is missing, or was not compiled from the present pickle (as told by the sha1 hash of its
+contents), an in-memory database is compiled from the pickle on first use instead.
+"""
+import os, sys, pickle, re, hashlib, sqlite3
 import subprocess
 from fractions import Fraction
 
@@ -24,15 +38,220 @@ import httk.core.citation as citation
 from httk.core.vectors import FracVector
 
 
-# Load data extracted from cctbx
 citation.add_src_citation("imported spacegroup data", "Computational Crystallography Toolbox, http://cctbx.sourceforge.net/")
-f = open(__file__.rstrip('.pyc').rstrip('.py')+".pkl",'rb')
-allspacegroupdata = pickle.load(f)
-f.close()
 
-spacegroupdata = allspacegroupdata['data']
-itcnbr_index = allspacegroupdata['itc_nbr_index']
-hm_index = allspacegroupdata['hm_index']
+_data_dir = os.path.dirname(os.path.abspath(__file__))
+spacegroup_pkl_path = os.path.join(_data_dir, "spacegrouputils.pkl")
+spacegroup_db_path = os.path.join(_data_dir, "spacegrouputils.sqlite")
+
+_db = None
+
+
+def _connect_db():
+    global _db
+    if _db is None:
+        _db = open_spacegroup_db()
+    return _db
+
+
+def open_spacegroup_db(db_path=None, pkl_path=None):
+    """
+    Open the precompiled spacegroup database read-only. If it does not exist, or was not compiled from the
+    spacegroup pickle present, compile the pickle into an in-memory database instead.
+    """
+    if db_path is None:
+        db_path = spacegroup_db_path
+    if pkl_path is None:
+        pkl_path = spacegroup_pkl_path
+
+    if os.path.exists(db_path):
+        try:
+            try:
+                db = sqlite3.connect('file:' + db_path + '?mode=ro', uri=True, check_same_thread=False)
+            except TypeError:
+                # Python 2: no uri support
+                db = sqlite3.connect(db_path, check_same_thread=False)
+            source_sha1 = db.execute("SELECT value FROM meta WHERE key='source_sha1'").fetchone()
+            if not os.path.exists(pkl_path) or (source_sha1 is not None and source_sha1[0] == _file_sha1(pkl_path)):
+                return db
+            db.close()
+        except sqlite3.Error:
+            pass
+
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    compile_spacegroup_db(pkl_path, db=db)
+    return db
+
+
+def _file_sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def compile_spacegroup_db(pkl_path=None, db_path=None, db=None):
+    """
+    Compile the spacegroup pickle into an SQLite database with one row per spacegroup (Hall symbol).
+
+    Give either the path of the database file to (re)create, db_path (by default spacegrouputils.sqlite next
+    to this file), or an open sqlite3 connection, db.
+    """
+    if pkl_path is None:
+        pkl_path = spacegroup_pkl_path
+
+    with open(pkl_path, 'rb') as f:
+        source = f.read()
+    allspacegroupdata = pickle.loads(source)
+
+    close = False
+    if db is None:
+        if db_path is None:
+            db_path = spacegroup_db_path
+        if os.path.exists(db_path):
+            os.unlink(db_path)
+        db = sqlite3.connect(db_path)
+        close = True
+
+    db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    db.execute("CREATE TABLE spacegroups (hall TEXT PRIMARY KEY, itc_nbr TEXT, setting TEXT, hm_symb TEXT, sf_symb TEXT, symops_hash TEXT, record BLOB)")
+    db.execute("CREATE TABLE hm_index (hm TEXT, hall TEXT)")
+    db.execute("CREATE TABLE itc_nbr_index (itc_nbr TEXT, hall TEXT)")
+    db.execute("CREATE INDEX spacegroups_itc_nbr ON spacegroups (itc_nbr)")
+    db.execute("CREATE INDEX spacegroups_sf_symb ON spacegroups (sf_symb)")
+    db.execute("CREATE INDEX spacegroups_symops_hash ON spacegroups (symops_hash)")
+    db.execute("CREATE INDEX hm_index_hm ON hm_index (hm)")
+    db.execute("CREATE INDEX itc_nbr_index_itc_nbr ON itc_nbr_index (itc_nbr)")
+
+    for hall, record in allspacegroupdata['data'].items():
+        record = dict(record)
+        record['symops_hash'] = symopshash(record['symops_mtrx'])
+        db.execute("INSERT INTO spacegroups VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (hall, record['itc_nbr'], record['setting'], record['hm_symb'], record['sf_symb'],
+                    record['symops_hash'], sqlite3.Binary(pickle.dumps(record, 2))))
+    for hm, halls in allspacegroupdata['hm_index'].items():
+        db.executemany("INSERT INTO hm_index VALUES (?, ?)", [(hm, hall) for hall in halls])
+    for itc_nbr, halls in allspacegroupdata['itc_nbr_index'].items():
+        db.executemany("INSERT INTO itc_nbr_index VALUES (?, ?)", [(itc_nbr, hall) for hall in halls])
+
+    db.execute("INSERT INTO meta VALUES ('source_sha1', ?)", (hashlib.sha1(source).hexdigest(),))
+    db.execute("INSERT INTO meta VALUES ('symops', ?)", (sqlite3.Binary(pickle.dumps(allspacegroupdata['symops'], 2)),))
+    db.commit()
+    if close:
+        db.close()
+
+
+class _SpacegroupRecords(object):
+    """
+    Read-only dict-like access to the spacegroup records: hall symbol -> dict of spacegroup data.
+    A record is decoded the first time it is asked for.
+    """
+
+    def __init__(self):
+        self._records = {}
+        self._halls = None
+
+    def _fetch(self, hall):
+        try:
+            return self._records[hall]
+        except KeyError:
+            pass
+        except TypeError:
+            return None
+        row = _connect_db().execute("SELECT record FROM spacegroups WHERE hall=?", (hall,)).fetchone()
+        if row is None:
+            return None
+        record = pickle.loads(bytes(row[0]))
+        self._records[hall] = record
+        return record
+
+    def __getitem__(self, hall):
+        record = self._fetch(hall)
+        if record is None:
+            raise KeyError(hall)
+        return record
+
+    def __contains__(self, hall):
+        return self._fetch(hall) is not None
+
+    def keys(self):
+        if self._halls is None:
+            self._halls = [row[0] for row in _connect_db().execute("SELECT hall FROM spacegroups ORDER BY rowid")]
+        return list(self._halls)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(hall, self[hall]) for hall in self.keys()]
+
+    def values(self):
+        return [self[hall] for hall in self.keys()]
+
+
+class _LazyDict(object):
+    """
+    Read-only dict-like object that is filled in by calling loader() the first time it is used.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._data = None
+
+    def _get(self):
+        if self._data is None:
+            self._data = self._loader()
+        return self._data
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __contains__(self, key):
+        return key in self._get()
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+    def keys(self):
+        return self._get().keys()
+
+    def items(self):
+        return self._get().items()
+
+    def values(self):
+        return self._get().values()
+
+    def get(self, key, default=None):
+        return self._get().get(key, default)
+
+
+def _load_index(table, column):
+    index = {}
+    for key, hall in _connect_db().execute("SELECT " + column + ", hall FROM " + table + " ORDER BY rowid"):
+        index.setdefault(key, []).append(hall)
+    return index
+
+
+def _load_symops_hash_index():
+    return dict(_connect_db().execute("SELECT symops_hash, hall FROM spacegroups ORDER BY rowid"))
+
+
+def _load_all_symops():
+    row = _connect_db().execute("SELECT value FROM meta WHERE key='symops'").fetchone()
+    return pickle.loads(bytes(row[0]))
+
+
+def _halls_where(condition, args):
+    return [row[0] for row in _connect_db().execute("SELECT hall FROM spacegroups WHERE " + condition + " ORDER BY rowid", args)]
+
+
+spacegroupdata = _SpacegroupRecords()
+itcnbr_index = _LazyDict(lambda: _load_index('itc_nbr_index', 'itc_nbr'))
+hm_index = _LazyDict(lambda: _load_index('hm_index', 'hm'))
 
 def val_to_tuple(val):
     frac = Fraction(val)
@@ -120,23 +339,34 @@ def symopstuple(symop, val_transform=val_to_tuple):
 
     return tuple([tuple(x) for x in transf]), tuple(transl)
 
-# symops_hash_index = allspacegroupdata['symops_hash_index']
-# Re-hash the hashes, due to hash function not being stable between version 2 and 3.
-# TODO: skip pre-generated hashes altogheter, and find a better way to do this
+def _canonical_symop(symop):
+    transf, transl = symopstuple(symop, val_transform=Fraction)
+    transf = tuple(tuple((Fraction(x).numerator, Fraction(x).denominator) for x in row) for row in transf)
+    transl = tuple((Fraction(x).numerator, Fraction(x).denominator) for x in transl)
+    return transf, transl
+
 
 def symopshash(symops):
-    data = [symopstuple(x) for x in symops]
-    hashes = tuple(sorted([(hash(x[0]), hash(x[1])) for x in data]))
-    return hash(hashes)
+    """
+    Returns a hash identifying a set of symmetry operations (given as strings, e.g., 'x,-y,z+1/2'), independent
+    of their order. The hash is stable between Python versions and runs, so it is stored in the spacegroup database.
+    """
+    data = sorted([_canonical_symop(x) for x in symops])
+    return hashlib.sha1(repr(data).encode('ascii')).hexdigest()
+
+
+symops_hash_index = _LazyDict(_load_symops_hash_index)
+all_symops = _LazyDict(_load_all_symops)
 
-symops_hash_index = {}
-for hall in spacegroupdata:
-    symops = spacegroupdata[hall]['symops_mtrx']
-    h = symopshash(symops)
-    symops_hash_index[h] = hall
-    spacegroupdata[hall]['symops_hash'] = h
+_all_symopvs = None
 
-all_symops = allspacegroupdata['symops']
+
+def _get_all_symopvs():
+    # The symmetry operations of all_symops as (symop, FracVector) pairs, created once
+    global _all_symopvs
+    if _all_symopvs is None:
+        _all_symopvs = [(symop, FracVector.create(symop)) for symop in all_symops]
+    return _all_symopvs
 
 # Valid settings, from: http://www.mx.iucr.org/iucr-top/cif/cif_core/definitions/Cdata_symmetry_cell_setting.html
 # These are really crystal systems...
@@ -247,9 +477,9 @@ def get_itcnbr_setting(itcnbr, setting):
         int(itcnbr)
     except Exception:
         return None
-    for hall in spacegroupdata:
-        if itcnbr == spacegroupdata[hall]['itc_nbr'] and setting == spacegroupdata[hall]['setting']:
-            return hall
+    halls = _halls_where("itc_nbr=? AND setting=?", (str(itcnbr), setting))
+    if len(halls) > 0:
+        return halls[0]
     return None
 
 
@@ -304,11 +534,8 @@ def filter_hm(hm, setting=None, halls=None):
 def filter_sf(sf, halls=None):
     if halls is None:
         halls = spacegroupdata.keys()
-    outhalls = []
-    for hall in halls:
-        if sf == spacegroupdata[hall]['sf_symb']:
-            outhalls.append(hall)
-    return outhalls
+    sf_halls = set(_halls_where("sf_symb=?", (sf,)))
+    return [hall for hall in halls if hall in sf_halls]
 
 
 def filter_symops(symops, halls=None):
@@ -539,11 +766,50 @@ def crystal_system_from_hall(hall_symb):
     return crystal_system_from_spacegroupnbr(numb)
 
 
-def check_symop(coordgroups, symopv):
+def _coordgroup_sets(coordgroups):
+    # The denominator and the set of nominators of the coordinates in [0,1) of each coordgroup
+    coordsets = []
     for coordgroup in coordgroups:
-        for coord in coordgroup:
-            transformed_coord = (symopv[0]*coord + symopv[1]).normalize()
-            if transformed_coord not in coordgroup:
+        coordgroup = FracVector.use(coordgroup)
+        denom = coordgroup.denom
+        coordsets += [(denom, set(tuple(coord) for coord in coordgroup.noms if all(0 <= x < denom for x in coord)))]
+    return coordsets
+
+
+def _symop_transformed_noms(symopv, denom, noms):
+    """
+    Apply symopv = (rotation, translation) to the coordinates (1/denom)*noms and normalize them into [0,1).
+    Yields the nominators over denom of each transformed coordinate, or None where it is not a multiple of 1/denom
+    (and thus cannot be equal to any of the coordinates).
+    """
+    s = symopv.denom
+    rot, trans = symopv.noms
+    # (rot*coord + trans) has nominators rot*nom + trans*denom over s*denom
+    modulus = s*denom
+    t0, t1, t2 = trans[0]*denom, trans[1]*denom, trans[2]*denom
+    (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = rot
+    for x, y, z in noms:
+        v0 = (r00*x + r01*y + r02*z + t0) % modulus
+        v1 = (r10*x + r11*y + r12*z + t1) % modulus
+        v2 = (r20*x + r21*y + r22*z + t2) % modulus
+        if v0 % s or v1 % s or v2 % s:
+            yield None
+        else:
+            yield (v0//s, v1//s, v2//s)
+
+
+def check_symop(coordgroups, symopv, coordsets=None):
+    """
+    Check if the symmetry operation symopv = (rotation, translation) maps every coordinate in coordgroups onto
+    a coordinate in the same coordgroup. The comparison is done with integer nominators, so a precomputed
+    coordsets = _coordgroup_sets(coordgroups) can be given when checking many symmetry operations.
+    """
+    if coordsets is None:
+        coordsets = _coordgroup_sets(coordgroups)
+    symopv = FracVector.use(symopv)
+    for coordgroup, (denom, coordset) in zip(coordgroups, coordsets):
+        for transformed in _symop_transformed_noms(symopv, denom, FracVector.use(coordgroup).noms):
+            if transformed is None or transformed not in coordset:
                 return False
     return True
 
@@ -580,15 +846,20 @@ def reduce_by_symops(coordgroups, symopvs, hall_symbol):
 
     reduced_coordgroups = []
     wyckoff_symbols = []
+    symopvs = [FracVector.use(symopv) for symopv in symopvs]
     for coordgroup in coordgroups:
+        coordgroup_fracs = FracVector.use(coordgroup)
+        denom = coordgroup_fracs.denom
         keep_coords = []
-        for coord in coordgroup:
+        keep_set = set()
+        for coord, nom in zip(coordgroup, coordgroup_fracs.noms):
             for symopv in symopvs:
-                transformed_coord = (symopv[0]*coord + symopv[1]).normalize()
-                if transformed_coord in keep_coords:
+                transformed = next(_symop_transformed_noms(symopv, denom, [nom]))
+                if transformed is not None and transformed in keep_set:
                     break
             else:
                 keep_coords += [coord]
+                keep_set.add(tuple(nom))
                 wyckoff_symbols += [wyckoff_symbol_matcher(wyckoffs, coord)]
         reduced_coordgroups += [keep_coords]
 
@@ -610,9 +881,9 @@ def trivial_symmetry_reduce(coordgroups):
 
     symops = []
     symopvs = []
-    for symop in all_symops:
-        symopv = FracVector.create(symop)
-        if check_symop(coordgroups, symopv):
+    coordsets = _coordgroup_sets(coordgroups)
+    for symop, symopv in _get_all_symopvs():
+        if check_symop(coordgroups, symopv, coordsets):
             symops += [all_symops[symop]]
             symopvs += [symopv]
 
@@ -631,10 +902,33 @@ def trivial_symmetry_reduce(coordgroups):
 
 
 def main():
-    print(allspacegroupdata['symops'])
+    import tempfile, shutil
+    print(dict(all_symops.items()))
     #result = spacegroup_filter('134')
     #print(result)
-    pass
+
+    # The database is only used if it was compiled from the pickle present, also when a changed pickle has
+    # the same size
+    tmpdir = tempfile.mkdtemp()
+    try:
+        pkl_path = os.path.join(tmpdir, 'spacegroups.pkl')
+        db_path = os.path.join(tmpdir, 'spacegroups.sqlite')
+        shutil.copy(spacegroup_pkl_path, pkl_path)
+        compile_spacegroup_db(pkl_path, db_path)
+        db = open_spacegroup_db(db_path, pkl_path)
+        assert db.execute("PRAGMA database_list").fetchone()[2] == db_path
+        db.close()
+        with open(pkl_path, 'rb') as f:
+            source = f.read()
+        with open(pkl_path, 'wb') as f:
+            f.write(source.replace(b'C1^1', b'C9^9'))
+        db = open_spacegroup_db(db_path, pkl_path)
+        assert db.execute("PRAGMA database_list").fetchone()[2] == ''
+        assert db.execute("SELECT sf_symb FROM spacegroups WHERE hall = 'P 1'").fetchone()[0] == 'C9^9'
+        db.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    print("Finished")
 
 
 if __name__ == "__main__":
@@ -469,6 +469,19 @@ class Structure(HttkObject):
             self._other_reps['rc'] = rc_struct
         return self._other_reps['rc']
 
+    @property
+    def arrays(self):
+        """
+        Float arrays of the unit cell, coordinates and species (a StructureArrays object), built on first use and cached.
+        """
+        return self.uc.arrays
+
+    def neighbor_list(self, cutoff):
+        """
+        All pairs of sites in the unit cell within the distance cutoff, including periodic images (a NeighborList object), cached.
+        """
+        return self.uc.neighbor_list(cutoff)
+
     def transform(self, matrix, max_search_cells=20, max_atoms=1000):
         return transform(self, matrix, max_search_cells=max_search_cells, max_atoms=max_atoms)
 
@@ -596,11 +609,11 @@ class Structure(HttkObject):
 
     @property
     def uc_cartesian_coordgroups(self):
-        return self.uc.get_cartesian_coordgroups
+        return self.uc_sites.get_cartesian_coordgroups(self.uc_cell)
 
     @property
     def uc_cartesian_coords(self):
-        return self.uc.get_cartesian_coords
+        return self.uc_sites.get_cartesian_coords(self.uc_cell)
 
     @property
     def uc_lengths_and_angles(self):
@@ -0,0 +1,149 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Floating point arrays of the unit cell of a structure, for analysis code.
+
+Structures keep the cell and coordinates as exact FracVectors, which is what is stored and hashed, but
+every geometric query then goes through exact arithmetic. Structure.arrays and UnitcellStructure.arrays
+give a StructureArrays object with the same data as float64 numpy arrays instead. It is built on first
+use and cached on the (immutable) structure object, so it never needs to be invalidated.
+
+The arrays are read-only. A StructureArrays object can be pickled to send it to other processes, and
+objects built before forking worker processes are shared with them without copying. If numpy is not
+available, the arrays are nested tuples of floats instead.
+"""
+from httk.core.vectors.arraybackend import get_numpy
+
+
+class StructureArrays(object):
+    """
+    Float arrays of the unit cell of a structure:
+
+      basis: 3x3, the basis vectors as rows
+      inv_basis: 3x3, the inverse of basis
+      reduced_coords: Nx3, the reduced coordinates of all sites, coordgroup by coordgroup
+      cartesian_coords: Nx3, the cartesian coordinates of the sites (reduced_coords*basis)
+      species: N, the index of the assignment (i.e., coordgroup) of each site
+      counts: the number of sites of each assignment
+      symbols: the symbol of each assignment
+      lengths, angles: the lengths of the basis vectors and the angles between them (in degrees)
+      volume: the volume of the cell
+    """
+
+    def __init__(self, basis, inv_basis, reduced_coords, cartesian_coords, species, counts, symbols, lengths, angles, volume):
+        """
+        Private constructor, as per httk coding guidelines. Use structure_to_arrays or Structure.arrays instead.
+        """
+        self.basis = basis
+        self.inv_basis = inv_basis
+        self.reduced_coords = reduced_coords
+        self.cartesian_coords = cartesian_coords
+        self.species = species
+        self.counts = counts
+        self.symbols = symbols
+        self.lengths = lengths
+        self.angles = angles
+        self.volume = volume
+        self._set_readonly()
+
+    def _set_readonly(self):
+        for arr in (self.basis, self.inv_basis, self.reduced_coords, self.cartesian_coords, self.species, self.lengths, self.angles):
+            if hasattr(arr, 'setflags'):
+                arr.setflags(write=False)
+
+    def __setstate__(self, state):
+        # Unpickled numpy arrays are writeable
+        self.__dict__.update(state)
+        self._set_readonly()
+
+    @property
+    def nbr_atoms(self):
+        return len(self.species)
+
+    def __str__(self):
+        return "<httk StructureArrays object: "+str(self.nbr_atoms)+" sites, symbols: "+str(self.symbols)+">"
+
+
+def _float_matrix_product(a, b):
+    return tuple(tuple(sum(row[k]*b[k][j] for k in range(len(b))) for j in range(len(b[0]))) for row in a)
+
+
+def structure_to_arrays(struct):
+    """
+    Build a StructureArrays object for the unit cell of a Structure or UnitcellStructure. Most code should use
+    the cached struct.arrays instead.
+    """
+    cell = struct.uc_cell
+    coordgroups = struct.uc_reduced_coordgroups
+    counts = [len(x) for x in coordgroups]
+    basis = cell.basis.to_floats()
+    inv_basis = cell.inv.to_floats()
+    reduced_coords = [coord for coordgroup in coordgroups for coord in coordgroup.to_floats()]
+    species = [idx for idx in range(len(counts)) for _i in range(counts[idx])]
+    symbols = list(struct.assignments.symbols)
+    lengths = [float(x) for x in cell.lengths]
+    angles = [float(x) for x in cell.angles]
+    volume = float(cell.volume)
+
+    numpy = get_numpy()
+    if numpy is not None:
+        basis = numpy.array(basis, dtype=numpy.float64)
+        inv_basis = numpy.array(inv_basis, dtype=numpy.float64)
+        reduced_coords = numpy.array(reduced_coords, dtype=numpy.float64).reshape((len(species), 3))
+        cartesian_coords = numpy.dot(reduced_coords, basis)
+        species = numpy.array(species, dtype=numpy.intp)
+        lengths = numpy.array(lengths, dtype=numpy.float64)
+        angles = numpy.array(angles, dtype=numpy.float64)
+    else:
+        basis = tuple(tuple(row) for row in basis)
+        inv_basis = tuple(tuple(row) for row in inv_basis)
+        reduced_coords = tuple(tuple(coord) for coord in reduced_coords)
+        cartesian_coords = _float_matrix_product(reduced_coords, basis)
+        species = tuple(species)
+        lengths = tuple(lengths)
+        angles = tuple(angles)
+
+    return StructureArrays(basis, inv_basis, reduced_coords, cartesian_coords, species, tuple(counts), tuple(symbols), lengths, angles, volume)
+
+
+def main():
+    from httk.core.vectors import FracVector
+    from httk.atomistic import Structure
+    import pickle
+
+    struct = Structure.create(uc_basis=FracVector.create([[2, 0, 0], [0, 2, 0], [0, 0, 3]]),
+                              uc_reduced_coordgroups=[[[0, 0, 0]], [["1/2", "1/2", "1/2"], ["1/2", 0, 0]]],
+                              assignments=['Na', 'Cl'])
+    arrays = struct.arrays
+    assert arrays is struct.arrays
+    print(arrays)
+    assert [list(x) for x in arrays.cartesian_coords] == [[0.0, 0.0, 0.0], [1.0, 1.0, 1.5], [1.0, 0.0, 0.0]]
+    assert list(arrays.species) == [0, 1, 1] and arrays.symbols == ('Na', 'Cl')
+    assert abs(arrays.volume - 12.0) < 1e-12
+    copy = pickle.loads(pickle.dumps(arrays))
+    assert [list(x) for x in copy.reduced_coords] == [list(x) for x in arrays.reduced_coords]
+    try:
+        arrays.basis[0][0] = 5.0
+        raise Exception("StructureArrays: arrays are writeable")
+    except (TypeError, ValueError):
+        pass
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
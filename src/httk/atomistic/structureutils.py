@@ -22,6 +22,7 @@ from httk.core import is_sequence, breath_first_idxs, FracVector, FracScalar, Mu
 from httk.atomistic.cell import Cell
 from httk.atomistic.unitcellsites import UnitcellSites
 from httk.atomistic import spacegrouputils
+from httk.atomistic.sitesutils import coordgroups_reduced_to_unitcell
 from math import sqrt, acos, cos, sin, pi
 from httk.atomistic.data import periodictable
 from fractions import Fraction
@@ -288,8 +289,25 @@ def structure_to_p1structure(struct, backends=['ase']):
     raise Exception("structure_to_p1structure: None of the available backends available.")
 
 
+def _internal_symmetry_structure(struct):
+    """
+    The structure in its standard setting from the in-process symmetry finder, or None (with a warning) if the
+    finder cannot determine the symmetry, so that the next backend can be tried.
+    """
+    from httk.atomistic.symmetryfinder import find_symmetry, SymmetryFinderError
+    try:
+        return find_symmetry(struct).to_structure(tags=struct.get_tags(), refs=struct.get_refs())
+    except SymmetryFinderError as e:
+        sys.stderr.write("Warning: internal symmetry finder failed: "+str(e)+"\n")
+        return None
+
+
 def structure_to_sgstructure(struct, backends=['platon']):
     for backend in backends:
+        if backend == 'internal':
+            result = _internal_symmetry_structure(struct)
+            if result is not None:
+                return result
         if backend == 'platon':
             try:
                 from httk.external import platon
@@ -525,6 +543,10 @@ def coordgroups_and_assignments_to_coords_and_occupancies(coordgroups, assignmen
 
 def structure_reduced_uc_to_representative(struct, backends=['isotropy', 'fake']):
     for backend in backends:
+        if backend == 'internal':
+            result = _internal_symmetry_structure(struct)
+            if result is not None:
+                return result
         if backend == 'isotropy':
             try:
                 from httk.external import isotropy_ext
@@ -576,23 +598,7 @@ def coordgroups_reduced_uc_to_representative(coordgroups, basis, backends=['isot
 
 
 def internal_coordgroups_reduced_rc_to_unitcellsites(coordgroups, basis, hall_symbol, eps=0.001):
-    symops = spacegrouputils.get_symops(hall_symbol)
-    newcoordgroups = []
-    for coordgroup in coordgroups:
-        newcoordgroup = []
-        for symop in symops:
-            rotcoords = coordgroup*(symop[0].T())
-            for coord in rotcoords:
-                finalcoord = (coord+symop[1]).normalize()
-                if finalcoord not in newcoordgroup:
-                    for checkcoord in newcoordgroup:
-                        if (checkcoord-finalcoord).normalize_half().lengthsqr() < eps:
-                            break
-                    else:
-                        newcoordgroup += [finalcoord]
-        newcoordgroup = sorted(newcoordgroup, key=lambda x: (x[0], x[1], x[2]))
-        newcoordgroups += [newcoordgroup]
-    return newcoordgroups, basis
+    return coordgroups_reduced_to_unitcell(coordgroups, hall_symbol, eps=eps), basis
 
 
 def coordgroups_reduced_rc_to_unitcellsites(coordgroups, basis, hall_symbol, backends=['cif2cell', 'internal', 'ase']):
@@ -695,6 +701,10 @@ def coordgroups_and_assignments_to_symbols(coordgroups, assignmentobj):
 
 def structure_tidy(struct, backends=['platon']):
     for backend in backends:
+        if backend == 'internal':
+            result = _internal_symmetry_structure(struct)
+            if result is not None:
+                return result
         if backend == 'platon':
             try:
                 from httk.external import platon_ext
@@ -946,14 +956,98 @@ def get_primitive_basis_transform(hall_symbol):
 #     # Transform to primitive cell
 #     return lattrans
 
+def _extended_gcd(a, b):
+    x0, y0, x1, y1 = 1, 0, 0, 1
+    while b != 0:
+        q = a // b
+        a, b = b, a - q*b
+        x0, x1 = x1, x0 - q*x1
+        y0, y1 = y1, y0 - q*y1
+    if a < 0:
+        return -a, -x0, -y0
+    return a, x0, y0
+
+
+def hermite_normal_form_diagonal(matrix):
+    """
+    Returns the diagonal of the lower triangular (row-style) Hermite normal form H = U*matrix of a
+    nonsingular 3x3 integer matrix, where U is unimodular. The lattice translations n with
+    0 <= n[i] < diagonal[i] are then exactly one representative of each coset of Z^3 modulo the
+    lattice spanned by the rows of matrix, i.e., the translations of a unit cell that fill the
+    supercell given by the transformation matrix.
+    """
+    m = [list(row) for row in matrix]
+    for col in range(2, -1, -1):
+        for row in range(col):
+            a = m[col][col]
+            b = m[row][col]
+            if b == 0:
+                continue
+            g, x, y = _extended_gcd(a, b)
+            pivot = [x*m[col][i] + y*m[row][i] for i in range(3)]
+            m[row] = [(a//g)*m[row][i] - (b//g)*m[col][i] for i in range(3)]
+            m[col] = pivot
+        if m[col][col] == 0:
+            raise Exception("hermite_normal_form_diagonal: singular matrix.")
+    return [abs(m[i][i]) for i in range(3)]
+
+
+def _integer_adjugate_and_det(matrix):
+    (a, b, c), (d, e, f), (g, h, i) = matrix
+    adj = [[e*i - f*h, c*h - b*i, b*f - c*e],
+           [f*g - d*i, a*i - c*g, c*d - a*f],
+           [d*h - e*g, b*g - a*h, a*e - b*d]]
+    det = a*adj[0][0] + b*adj[1][0] + c*adj[2][0]
+    return adj, det
+
+
+def _transform_integer(structure, transformation, new_cell):
+    """
+    Supercell for an integer transformation matrix. The new reduced coordinates of the image of a site r under
+    the lattice translation n are (r+n)*T^-1 modulo 1. The needed translations are given directly by the Hermite
+    normal form of T, and everything is done in integer arithmetic on the nominators, so the time taken is linear
+    in the number of atoms in the supercell.
+    """
+    matrix = transformation.noms
+    adj, det = _integer_adjugate_and_det(matrix)
+    if det == 0:
+        raise Exception("Structure.transform: singular transformation matrix.")
+    sign = 1 if det > 0 else -1
+    inv_noms = [[sign*adj[i][j] for j in range(3)] for i in range(3)]
+    diagonal = hermite_normal_form_diagonal(matrix)
+    translations = [(n0, n1, n2) for n0 in range(diagonal[0]) for n1 in range(diagonal[1]) for n2 in range(diagonal[2])]
+
+    extendedcoordgroups = []
+    for coordgroup in structure.uc_reduced_coordgroups:
+        coordgroup = FracVector.use(coordgroup)
+        denom = coordgroup.denom
+        modulus = denom*abs(det)
+        # (r + n)*T^-1 = (r_nom*adj + n*denom*adj)/(denom*det), i.e., one integer vector per site and one per translation
+        sites = [tuple(r[0]*inv_noms[0][j] + r[1]*inv_noms[1][j] + r[2]*inv_noms[2][j] for j in range(3)) for r in coordgroup.noms]
+        shifts = [tuple(denom*(n[0]*inv_noms[0][j] + n[1]*inv_noms[1][j] + n[2]*inv_noms[2][j]) for j in range(3)) for n in translations]
+        noms = tuple(((s0 + t0) % modulus, (s1 + t1) % modulus, (s2 + t2) % modulus) for t0, t1, t2 in shifts for s0, s1, s2 in sites)
+        extendedcoordgroups.append(FracVector(noms, modulus).simplify())
+
+    return structure.create(uc_reduced_coordgroups=extendedcoordgroups, uc_basis=new_cell.basis, assignments=structure.assignments)
+
+
 def transform(structure, transformation, max_search_cells=20, max_atoms=1000):
+    """
+    Returns a new structure with the cell transformation*(old basis) and all sites of the old structure inside it.
 
+    For an integer transformation matrix (i.e., a supercell) the lattice translations are enumerated from the
+    Hermite normal form of the matrix, and neither max_search_cells nor max_atoms apply. Otherwise the sites are
+    found by searching over lattice translations in order of distance, giving up after max_search_cells in each
+    direction, and raising an exception if the new cell has more than max_atoms sites (None means no limit).
+    """
     transformation = FracVector.use(transformation).simplify()
-    #if transformation.denom != 1:
-    #    raise Exception("Structure.transform requires integer transformation matrix")
 
     old_cell = structure.uc_cell
     new_cell = Cell.create(basis=transformation*old_cell.basis)
+
+    if transformation.denom == 1:
+        return _transform_integer(structure, transformation, new_cell)
+
     conversion_matrix = (old_cell.basis*new_cell.inv).simplify()
 
     volume_ratio = abs((new_cell.basis.det()/abs(old_cell.basis.det()))).simplify()
@@ -961,7 +1055,7 @@ def transform(structure, transformation, max_search_cells=20, max_atoms=1000):
     #print("HMM",(new_cell.basis.det()/old_cell.basis.det()).simplify())
     #print("SEEK_COUNTS",seek_counts, volume_ratio, structure.uc_counts, transformation)
     total_seek_counts = sum(seek_counts)
-    if total_seek_counts > max_atoms:
+    if max_atoms is not None and total_seek_counts > max_atoms:
         raise Exception("Structure.transform: more than "+str(max_atoms)+" needed. Change limit with max_atoms parameter.")
 
     #if max_search_cells != None and maxvec[0]*maxvec[1]*maxvec[2] > max_search_cells:
@@ -204,7 +204,7 @@ class StructureSupercellPlugin(HttkPlugin):
         self.struct = Structure.use(struct)
 
     def general(self, transformation, max_search_cells=20, max_atoms=1000):
-        return self.struct.transformation(transformation, max_search_cells=20, max_atoms=1000)   
+        return self.struct.transform(transformation, max_search_cells=max_search_cells, max_atoms=max_atoms)
 
     def cubic(self, tolerance=None, max_search_cells=1000):
         return build_cubic_supercell(self.struct, tolerance=tolerance, max_search_cells=max_search_cells)
@@ -0,0 +1,965 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An in-process symmetry finder.
+
+find_symmetry(struct) determines the space group of the unit cell of a Structure or UnitcellStructure and returns
+a StructureSymmetry with the Hall symbol, the conventional (standard setting) cell, and the symmetry reduced
+coordinates with their Wyckoff positions. StructureSymmetry.to_structure() gives the corresponding Structure, which
+is what the (opt-in) 'internal' backend of structure_reduced_uc_to_representative, structure_to_sgstructure and
+structure_tidy in httk.atomistic.structureutils returns. No external programs or temporary files are involved, so it
+is suitable for analyzing a large number of structures in one process.
+
+The method:
+
+  1. The cell is Delaunay reduced and the pure translations that map the structure onto itself are found. If there
+     are any, the cell is reduced to a primitive cell.
+  2. The rotations of the (Delaunay reduced) primitive lattice are the integer matrices with entries -1, 0, 1 that
+     preserve the metric. For each rotation, the translations that map one site of the least common species onto
+     the other sites of that species are candidates for a symmetry operation, which is accepted if every site is
+     mapped onto a site of the same species.
+  3. The conventional cell axes are taken from the rotation axes of the point group, with a few alternative
+     choices where the crystal system allows several settings.
+  4. The operations are transformed to each choice of conventional cell and compared with the operations of the
+     Hall settings in the spacegroup database that have the same rotations and centering. The origin shift that
+     makes the translations equal is solved for exactly by diagonalizing the integer system (R - 1) s = t' - t.
+     Standard settings are preferred.
+  5. One site of each orbit is placed on the representative coordinates of its Wyckoff position.
+
+The tolerance symprec is the largest displacement of a site from its ideal position (a cartesian distance, in
+the units of the cell), so the image of a site under a symmetry operation is matched to a site within 2*symprec.
+Sites with partial or mixed occupation are matched within the distance below which the construction of the unit
+cell merges coordinates, since the image of such a site may have been merged into a neighbor.
+
+The cell is not idealized: the conventional basis is the exact (rational) transformation of the given basis.
+Coordinates on special positions are made exact, while free parameters are taken from the given coordinates.
+"""
+import os
+import glob
+import itertools
+from fractions import Fraction
+
+from httk.core.vectors import FracVector
+from httk.atomistic import spacegrouputils
+
+# Settings preferred when several Hall settings describe the same structure (orthorhombic 'abc' is '')
+_standard_settings = ('', 'b', 'b1', '2', 'h')
+
+# Squared distance in reduced coordinates below which coordinates are merged when the unit cell is built
+# (the default of sitesutils.coordgroup_apply_stacked_symops)
+_merge_eps = Fraction(1, 1000)
+
+
+class SymmetryFinderError(Exception):
+    """
+    Raised when the symmetry of a structure cannot be determined (e.g., a degenerate cell, or operations that do
+    not match any spacegroup within the tolerance.)
+    """
+    pass
+
+
+class StructureSymmetry(object):
+    """
+    The result of find_symmetry:
+
+      hall_symbol, spacegroup_number: the space group in the setting used for the representative cell
+      transformation: the conventional basis expressed in the basis of the given unit cell,
+                      i.e., rc_basis = transformation*uc_basis
+      origin_shift: the origin of the conventional cell in reduced coordinates of the conventional cell
+      rc_basis: the conventional cell basis
+      rc_reduced_coordgroups: one site per orbit, on the representative coordinates of the Wyckoff position
+      wyckoff_symbols, multiplicities: the Wyckoff letters and multiplicities of the sites
+      assignments: the assignments of the coordgroups (the same as for the given structure)
+      nbr_operations: the number of symmetry operations of the primitive cell (the order of the point group)
+    """
+
+    def __init__(self, hall_symbol, transformation, origin_shift, rc_basis, rc_reduced_coordgroups, wyckoff_symbols,
+                 multiplicities, assignments, nbr_operations):
+        """
+        Private constructor, as per httk coding guidelines. Use find_symmetry instead.
+        """
+        self.hall_symbol = hall_symbol
+        self.transformation = transformation
+        self.origin_shift = origin_shift
+        self.rc_basis = rc_basis
+        self.rc_reduced_coordgroups = rc_reduced_coordgroups
+        self.wyckoff_symbols = wyckoff_symbols
+        self.multiplicities = multiplicities
+        self.assignments = assignments
+        self.nbr_operations = nbr_operations
+
+    @property
+    def spacegroup_number(self):
+        return spacegrouputils.spacegroup_get_number(self.hall_symbol)
+
+    def to_structure(self, tags=None, refs=None):
+        """
+        Returns a Structure with the representative (symmetry reduced) sites in the conventional cell.
+        """
+        from httk.atomistic import Structure
+        return Structure.create(assignments=self.assignments,
+                                rc_basis=self.rc_basis,
+                                rc_reduced_coordgroups=self.rc_reduced_coordgroups,
+                                hall_symbol=self.hall_symbol,
+                                wyckoff_symbols=self.wyckoff_symbols,
+                                multiplicities=self.multiplicities,
+                                tags=tags, refs=refs)
+
+    def __str__(self):
+        return "<httk StructureSymmetry object: "+self.hall_symbol+" ("+str(self.spacegroup_number)+"), "+str(len(self.wyckoff_symbols))+" representative sites>"
+
+
+def _det(m):
+    return (m[0][0]*(m[1][1]*m[2][2] - m[1][2]*m[2][1]) - m[0][1]*(m[1][0]*m[2][2] - m[1][2]*m[2][0])
+            + m[0][2]*(m[1][0]*m[2][1] - m[1][1]*m[2][0]))
+
+
+def _inverse(m):
+    # Exact inverse of an integer or Fraction matrix
+    det = Fraction(_det(m))
+    adj = [[m[1][1]*m[2][2] - m[1][2]*m[2][1], m[0][2]*m[2][1] - m[0][1]*m[2][2], m[0][1]*m[1][2] - m[0][2]*m[1][1]],
+           [m[1][2]*m[2][0] - m[1][0]*m[2][2], m[0][0]*m[2][2] - m[0][2]*m[2][0], m[0][2]*m[1][0] - m[0][0]*m[1][2]],
+           [m[1][0]*m[2][1] - m[1][1]*m[2][0], m[0][1]*m[2][0] - m[0][0]*m[2][1], m[0][0]*m[1][1] - m[0][1]*m[1][0]]]
+    return [[x/det for x in row] for row in adj]
+
+
+def _float_inverse(m):
+    det = float(_det(m))
+    return [[(m[(j+1) % 3][(i+1) % 3]*m[(j+2) % 3][(i+2) % 3] - m[(j+1) % 3][(i+2) % 3]*m[(j+2) % 3][(i+1) % 3])/det
+             for j in range(3)] for i in range(3)]
+
+
+def _matmul(a, b):
+    return [[sum(a[i][k]*b[k][j] for k in range(3)) for j in range(3)] for i in range(3)]
+
+
+def _transpose(m):
+    return [[m[j][i] for j in range(3)] for i in range(3)]
+
+
+def _matvec(m, v):
+    return [m[0][0]*v[0] + m[0][1]*v[1] + m[0][2]*v[2],
+            m[1][0]*v[0] + m[1][1]*v[1] + m[1][2]*v[2],
+            m[2][0]*v[0] + m[2][1]*v[1] + m[2][2]*v[2]]
+
+
+def _cart(u, basis):
+    # The cartesian vector of the reduced coordinates u (the basis vectors are rows)
+    return [u[0]*basis[0][d] + u[1]*basis[1][d] + u[2]*basis[2][d] for d in range(3)]
+
+
+def _dot(u, v):
+    return u[0]*v[0] + u[1]*v[1] + u[2]*v[2]
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return abs(a)
+
+
+def _delaunay_reduce(basis, eps):
+    """
+    Returns the integer matrix M such that the rows of M*basis are a Delaunay reduced basis (with positive
+    determinant) of the lattice.
+    """
+    b = [list(x) for x in basis] + [[-(basis[0][d] + basis[1][d] + basis[2][d]) for d in range(3)]]
+    c = [[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, -1, -1]]
+    for _iteration in range(1000):
+        for i, j in ((0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)):
+            if _dot(b[i], b[j]) > eps:
+                for k in range(4):
+                    if k != i and k != j:
+                        b[k] = [b[k][d] + b[i][d] for d in range(3)]
+                        c[k] = [c[k][d] + c[i][d] for d in range(3)]
+                b[i] = [-x for x in b[i]]
+                c[i] = [-x for x in c[i]]
+                break
+        else:
+            break
+    else:
+        raise SymmetryFinderError("symmetryfinder: Delaunay reduction did not converge.")
+    candidates = [(b[i], c[i]) for i in range(4)]
+    for i, j in ((0, 1), (1, 2), (2, 0)):
+        candidates += [([b[i][d] + b[j][d] for d in range(3)], [c[i][d] + c[j][d] for d in range(3)])]
+    candidates.sort(key=lambda x: _dot(x[0], x[0]))
+    for triple in itertools.combinations(range(len(candidates)), 3):
+        m = [candidates[i][1] for i in triple]
+        det = _det(m)
+        if det == 1:
+            return m
+        if det == -1:
+            return [[-x for x in row] for row in m]
+    raise SymmetryFinderError("symmetryfinder: Delaunay reduction failed.")
+
+
+def _lattice_rotations(basis, symprec):
+    """
+    Returns the rotations (acting on reduced coordinates) of the lattice with the Delaunay reduced basis.
+    The columns of a rotation are the images of the basis vectors.
+    """
+    lengths = [_dot(x, x)**0.5 for x in basis]
+    vecs = []
+    for u in itertools.product((-1, 0, 1), repeat=3):
+        if u != (0, 0, 0):
+            cart = _cart(u, basis)
+            vecs += [(u, cart, _dot(cart, cart)**0.5)]
+    cands = [[v for v in vecs if abs(v[2] - lengths[j]) < symprec] for j in range(3)]
+    metric = [[_dot(basis[i], basis[j]) for j in range(3)] for i in range(3)]
+    tols = [[symprec*(lengths[i] + lengths[j]) for j in range(3)] for i in range(3)]
+    rotations = []
+    for v0 in cands[0]:
+        for v1 in cands[1]:
+            if abs(_dot(v0[1], v1[1]) - metric[0][1]) > tols[0][1]:
+                continue
+            for v2 in cands[2]:
+                if abs(_dot(v0[1], v2[1]) - metric[0][2]) > tols[0][2] or abs(_dot(v1[1], v2[1]) - metric[1][2]) > tols[1][2]:
+                    continue
+                rot = tuple(tuple(v[0][i] for v in (v0, v1, v2)) for i in range(3))
+                if abs(_det(rot)) == 1:
+                    rotations += [rot]
+    return rotations
+
+
+class _SiteLookup(object):
+    """
+    Finds the site of a given species within the tolerance of that species (tolerances[species]) of a point,
+    using bins in reduced coordinates.
+    """
+
+    def __init__(self, basis, positions, species, tolerances):
+        self.basis = basis
+        self.positions = positions
+        self.species = species
+        self.tolerancesqr = [x*x for x in tolerances]
+        inv = _float_inverse(basis)
+        # The fractional tolerance in each direction is the tolerance divided by the distance between lattice planes
+        tolerance = max(tolerances[sp] for sp in set(species))
+        eps = [tolerance*(inv[0][d]**2 + inv[1][d]**2 + inv[2][d]**2)**0.5 for d in range(3)]
+        side = max(1, int(round(len(positions)**(1.0/3.0))))
+        self.nbins = [max(1, min(side, int(0.25/e))) if e > 0 else side for e in eps]
+        self.bins = {}
+        for idx, pos in enumerate(positions):
+            ranges = []
+            for d in range(3):
+                n = self.nbins[d]
+                lo = int((pos[d] - eps[d])*n // 1)
+                hi = int((pos[d] + eps[d])*n // 1)
+                ranges += [set(k % n for k in range(lo, hi + 1))]
+            for key in itertools.product(*ranges):
+                self.bins.setdefault((species[idx],) + key, []).append(idx)
+
+    def find(self, point, species):
+        key = (species,) + tuple(int((point[d] % 1.0)*self.nbins[d]) % self.nbins[d] for d in range(3))
+        basis = self.basis
+        for idx in self.bins.get(key, ()):
+            pos = self.positions[idx]
+            d0 = point[0] - pos[0]
+            d1 = point[1] - pos[1]
+            d2 = point[2] - pos[2]
+            d0 -= round(d0)
+            d1 -= round(d1)
+            d2 -= round(d2)
+            v = [d0*basis[0][d] + d1*basis[1][d] + d2*basis[2][d] for d in range(3)]
+            if v[0]*v[0] + v[1]*v[1] + v[2]*v[2] < self.tolerancesqr[species]:
+                return idx
+        return None
+
+
+def _map_sites(rot, trans, positions, species, lookup):
+    """
+    Returns the permutation of the sites given by the operation (rot, trans), or None if it is not a symmetry.
+    """
+    (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = rot
+    t0, t1, t2 = trans
+    perm = []
+    for idx, (x, y, z) in enumerate(positions):
+        j = lookup.find((r00*x + r01*y + r02*z + t0, r10*x + r11*y + r12*z + t1, r20*x + r21*y + r22*z + t2), species[idx])
+        if j is None:
+            return None
+        perm += [j]
+    return perm
+
+
+def _reference_sites(species):
+    # The sites of the least common species; every operation must map the first of them onto one of them
+    counts = {}
+    for sp in species:
+        counts[sp] = counts.get(sp, 0) + 1
+    rarest = min(counts, key=lambda x: (counts[x], x))
+    return [idx for idx in range(len(species)) if species[idx] == rarest]
+
+
+def _wrap(v):
+    return [x - int(x // 1) for x in v]
+
+
+def _integer_lattice_basis(vectors):
+    """
+    Returns three integer vectors that generate the same lattice as the given integer vectors (which must span 3D).
+    """
+    rows = [list(v) for v in vectors if any(v)]
+    basis = []
+    for col in range(3):
+        while True:
+            nonzero = [r for r in rows if r[col] != 0]
+            if len(nonzero) == 0:
+                raise SymmetryFinderError("symmetryfinder: the lattice vectors do not span three dimensions.")
+            pivot = min(nonzero, key=lambda r: abs(r[col]))
+            rest = []
+            done = True
+            for r in rows:
+                if r is pivot:
+                    continue
+                if r[col] != 0:
+                    q = r[col]//pivot[col]
+                    r = [r[i] - q*pivot[i] for i in range(3)]
+                    if r[col] != 0:
+                        done = False
+                if any(r):
+                    rest += [r]
+            if done:
+                basis += [pivot]
+                rows = rest
+                break
+            rows = rest + [pivot]
+    return basis
+
+
+def _primitive_transformation(positions, species, basis, tolerances):
+    """
+    Finds the pure translations of the structure. Returns the matrix P (of Fractions) such that P*basis is a
+    primitive basis (or None if the translations are inconsistent), and the list of translation permutations.
+    """
+    lookup = _SiteLookup(basis, positions, species, tolerances)
+    refs = _reference_sites(species)
+    p0 = positions[refs[0]]
+    identity = ((1, 0, 0), (0, 1, 0), (0, 0, 1))
+    translations = []
+    perms = []
+    for q in refs:
+        trans = [positions[q][d] - p0[d] for d in range(3)]
+        perm = _map_sites(identity, trans, positions, species, lookup)
+        if perm is not None:
+            translations += [trans]
+            perms += [perm]
+    n = len(translations)
+    if n == 1:
+        return [[Fraction(int(i == j)) for j in range(3)] for i in range(3)], perms
+    # The translations form a group of order n, so they are multiples of 1/n
+    vectors = [[n*int(i == j) for j in range(3)] for i in range(3)]
+    vectors += [[int(round(x*n)) % n for x in trans] for trans in translations]
+    rows = _integer_lattice_basis(vectors)
+    if abs(_det(rows)) != n*n:
+        # The translations found do not form a group
+        return None, perms
+    if _det(rows) < 0:
+        rows = [[-x for x in row] for row in rows]
+    return [[Fraction(x, n) for x in row] for row in rows], perms
+
+
+def _transform_positions(transformation, positions):
+    # Reduced coordinates in the basis transformation*basis, for a basis change given as rows
+    m = _transpose(_inverse(transformation))
+    m = [[float(x) for x in row] for row in m]
+    return [_wrap(_matvec(m, pos)) for pos in positions]
+
+
+def _find_operations(basis, positions, species, symprec, tolerances):
+    """
+    Returns the symmetry operations (rotation, translation, permutation) of the structure in a primitive,
+    Delaunay reduced cell.
+    """
+    lookup = _SiteLookup(basis, positions, species, tolerances)
+    refs = _reference_sites(species)
+    p0 = positions[refs[0]]
+    operations = []
+    for rot in _lattice_rotations(basis, symprec):
+        rp0 = _matvec(rot, p0)
+        for q in refs:
+            trans = [positions[q][d] - rp0[d] for d in range(3)]
+            perm = _map_sites(rot, trans, positions, species, lookup)
+            if perm is not None:
+                operations += [(rot, _wrap(trans), perm)]
+                break
+    return operations
+
+
+def _rotation_order(rot):
+    # The order of the proper rotation det(rot)*rot
+    trace = (rot[0][0] + rot[1][1] + rot[2][2])*_det(rot)
+    return {3: 1, -1: 2, 0: 3, 1: 4, 2: 6}[trace]
+
+
+def _proper(rot):
+    if _det(rot) == 1:
+        return rot
+    return tuple(tuple(-x for x in row) for row in rot)
+
+
+def _orbit_sum(rot, order, v):
+    total = [0, 0, 0]
+    for _i in range(order):
+        total = [total[d] + v[d] for d in range(3)]
+        v = _matvec(rot, v)
+    return total
+
+
+def _axis(rot, order):
+    # The shortest lattice vector (in reduced coordinates) along the axis of the proper rotation rot
+    for v in ([1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0], [1, 0, 1], [0, 1, 1]):
+        u = _orbit_sum(rot, order, v)
+        if any(u):
+            g = _gcd(_gcd(u[0], u[1]), u[2])
+            u = [x//g for x in u]
+            if [x for x in u if x != 0][0] < 0:
+                u = [-x for x in u]
+            return u
+    raise Exception("symmetryfinder: internal error, no rotation axis found.")
+
+
+def _perpendicular(rot, order, basis, symprec):
+    """
+    Lattice vectors perpendicular to the axis of the proper rotation rot, shortest first. Of the vectors that are
+    equally short (within symprec), the one closest to the cartesian x direction comes first.
+    """
+    vecs = []
+    for u in itertools.product(range(-3, 4), repeat=3):
+        if any(u) and not any(_orbit_sum(rot, order, list(u))):
+            cart = _cart(u, basis)
+            length = _dot(cart, cart)**0.5
+            vecs += [(length, [-x/length for x in cart], list(u))]
+    vecs.sort()
+    shortest = [x for x in vecs if x[0] < vecs[0][0] + symprec]
+    first = min(shortest, key=lambda x: x[1])
+    return [first[2]] + [x[2] for x in vecs if x is not first]
+
+
+def _length(u, basis):
+    cart = _cart(u, basis)
+    return _dot(cart, cart)**0.5
+
+
+def _conventional_candidates(operations, basis, symprec):
+    """
+    Returns a list of choices of conventional cells for the point group of the operations, as integer matrices of
+    the conventional basis vectors in terms of the primitive basis. The preferred choice comes first.
+    """
+    proper = {}
+    for rot, _trans, _perm in operations:
+        prot = _proper(rot)
+        proper.setdefault(_rotation_order(prot), []).append(prot)
+
+    def neg(u):
+        return [-x for x in u]
+
+    def righthanded(rows):
+        if _det(rows) < 0:
+            return rows[:2] + [neg(rows[2])]
+        return rows
+
+    if len(proper.get(3, [])) >= 8:
+        # Cubic: the 4-fold axes, or if there are none, the 2-fold axes, are the cube axes, which a 3-fold rotation permutes
+        rot4 = proper[4][0] if 4 in proper else proper[2][0]
+        u = _axis(rot4, 4 if 4 in proper else 2)
+        rot3 = proper[3][0]
+        rows = [u, _matvec(rot3, u), _matvec(rot3, _matvec(rot3, u))]
+        if _det(rows) < 0:
+            rows = [neg(x) for x in rows]
+        # The cube axes can be taken in any order, use the one closest to the cartesian axes
+        choices = []
+        for order in itertools.permutations(range(3)):
+            for signs in itertools.product((1, -1), repeat=3):
+                choice = [[signs[i]*x for x in rows[order[i]]] for i in range(3)]
+                if _det(choice) > 0:
+                    choices += [(-sum(_cart(choice[i], basis)[i] for i in range(3)), len(choices), choice)]
+        return [min(choices)[2]]
+    if 6 in proper or 3 in proper:
+        # Hexagonal axes: b is a rotated by 120 degrees around c. For rhombohedral centering only one of the two
+        # choices of the sign of a and b is the obverse setting
+        rot3 = _matmul(proper[6][0], proper[6][0]) if 6 in proper else proper[3][0]
+        c = _axis(rot3, 3)
+        a = _perpendicular(rot3, 3, basis, symprec)[0]
+        b = _matvec(rot3, a)
+        return [righthanded([a, b, c]), righthanded([neg(a), neg(b), c])]
+    if 4 in proper:
+        rot4 = proper[4][0]
+        c = _axis(rot4, 4)
+        a = _perpendicular(rot4, 4, basis, symprec)[0]
+        return [righthanded([a, _matvec(rot4, a), c])]
+    axes = []
+    for rot in proper.get(2, []):
+        u = _axis(rot, 2)
+        if u not in axes:
+            axes += [u]
+    if len(axes) == 3:
+        # Orthorhombic: every order of the three 2-fold axes gives a setting in the database
+        axes.sort(key=lambda u: _length(u, basis))
+        return [righthanded([axes[i], axes[j], axes[k]]) for i, j, k in itertools.permutations(range(3))]
+    if len(axes) == 1:
+        # Monoclinic: b is the 2-fold axis, and a, c are any basis of the lattice plane perpendicular to it
+        rot2 = proper[2][0]
+        b = axes[0]
+        plane = _perpendicular(rot2, 2, basis, symprec)
+        p = plane[0]
+        for q in plane[1:]:
+            if any(x != 0 for x in (p[1]*q[2] - p[2]*q[1], p[2]*q[0] - p[0]*q[2], p[0]*q[1] - p[1]*q[0])):
+                break
+        combos = [(1, 0), (0, 1), (1, 1), (1, -1), (-1, 0), (0, -1), (-1, -1), (-1, 1)]
+        candidates = []
+        for (i1, j1), (i2, j2) in itertools.product(combos, repeat=2):
+            if abs(i1*j2 - j1*i2) != 1:
+                continue
+            a = [i1*p[d] + j1*q[d] for d in range(3)]
+            c = [i2*p[d] + j2*q[d] for d in range(3)]
+            if _det([a, b, c]) > 0:
+                candidates += [(round(_length(a, basis) + _length(c, basis), 8), len(candidates), [a, b, c])]
+        candidates.sort()
+        return [x[2] for x in candidates]
+    return [[[1, 0, 0], [0, 1, 0], [0, 0, 1]]]
+
+
+def _parse_affine(spec):
+    """
+    Parses an operation or a Wyckoff position, e.g., 'x,2*x,-z+1/4', into an integer matrix and a Fraction vector.
+    """
+    mat = []
+    vec = []
+    for part in spec.replace(' ', '').split(','):
+        row = [0, 0, 0]
+        const = Fraction(0)
+        term = ''
+        for ch in part + '+':
+            if ch in '+-' and term not in ('', '+', '-'):
+                sign = -1 if term[0] == '-' else 1
+                term = term.lstrip('+-')
+                if term[-1] in 'xyz':
+                    factor = term[:-1].rstrip('*')
+                    row['xyz'.index(term[-1])] += sign*(int(factor) if factor != '' else 1)
+                else:
+                    const += sign*Fraction(term)
+                term = ''
+            term += ch
+        mat += [row]
+        vec += [const]
+    return mat, vec
+
+
+_hall_index = None
+
+
+def _get_hall_index():
+    """
+    The Hall settings in the spacegroup database indexed on their set of rotations, as lists of the Hall symbol,
+    the set of centering translations and a translation (as floats) for each rotation; and the parsed operations
+    of each setting.
+    """
+    global _hall_index
+    if _hall_index is None:
+        parsed = {}
+        index = {}
+        hall_operations = {}
+        for hall in spacegrouputils.spacegroupdata.keys():
+            operations = []
+            for symop in spacegrouputils.spacegroupdata[hall]['symops_mtrx']:
+                if symop not in parsed:
+                    rot, trans = _parse_affine(symop)
+                    parsed[symop] = (tuple(tuple(row) for row in rot), tuple(x - (x.numerator//x.denominator) for x in trans))
+                operations += [parsed[symop]]
+            translations = {}
+            centering = set()
+            for rot, trans in operations:
+                translations.setdefault(rot, tuple(float(x) for x in trans))
+                if rot == ((1, 0, 0), (0, 1, 0), (0, 0, 1)):
+                    centering.add(trans)
+            index.setdefault(frozenset(translations.keys()), []).append((hall, frozenset(centering), translations))
+            hall_operations[hall] = operations
+        _hall_index = (index, hall_operations)
+    return _hall_index
+
+
+def _solve_origin_shift(rows, rhs, tol):
+    """
+    Solves rows*s = rhs (mod 1) for s, where rows are integer 3-vectors and rhs are floats, by diagonalizing
+    the integer matrix with unimodular row and column operations. Returns the list of solutions in [0, 1)
+    (with the components that are not determined set to 0), or an empty list if there is none.
+    """
+    aug = [list(r) + [d] for r, d in zip(rows, rhs)]
+    cols = [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    m = len(aug)
+    rank = 0
+    for t in range(3):
+        while True:
+            pivot = None
+            for i in range(t, m):
+                for j in range(t, 3):
+                    if aug[i][j] != 0 and (pivot is None or abs(aug[i][j]) < abs(aug[pivot[0]][pivot[1]])):
+                        pivot = (i, j)
+            if pivot is None:
+                break
+            i, j = pivot
+            aug[t], aug[i] = aug[i], aug[t]
+            if j != t:
+                for row in aug:
+                    row[t], row[j] = row[j], row[t]
+                for row in cols:
+                    row[t], row[j] = row[j], row[t]
+            p = aug[t][t]
+            done = True
+            for i in range(t + 1, m):
+                if aug[i][t] != 0:
+                    q = aug[i][t]//p
+                    aug[i] = [aug[i][k] - q*aug[t][k] for k in range(4)]
+                    if aug[i][t] != 0:
+                        done = False
+            for j in range(t + 1, 3):
+                if aug[t][j] != 0:
+                    q = aug[t][j]//p
+                    for row in aug:
+                        row[j] -= q*row[t]
+                    for row in cols:
+                        row[j] -= q*row[t]
+                    if aug[t][j] != 0:
+                        done = False
+            if done:
+                break
+        if pivot is None:
+            break
+        rank += 1
+    for i in range(rank, m):
+        if abs(aug[i][3] - round(aug[i][3])) > tol:
+            return []
+    solutions = []
+    choices = [range(abs(aug[t][t])) for t in range(rank)] + [[0]]*(3 - rank)
+    for ks in itertools.product(*choices):
+        y = [(aug[t][3] + ks[t])/aug[t][t] if t < rank else 0.0 for t in range(3)]
+        solutions += [_wrap(_matvec(cols, y))]
+    return solutions
+
+
+def _generators(operations):
+    # Indices of operations whose rotations generate the rotations of all the operations
+    identity = ((1, 0, 0), (0, 1, 0), (0, 0, 1))
+    group = set([identity])
+    generators = []
+    for idx, (rot, _trans, _perm) in enumerate(operations):
+        if rot in group:
+            continue
+        generators += [idx]
+        new = [rot]
+        while len(new) > 0:
+            group |= set(new)
+            new = set(tuple(tuple(row) for row in _matmul(a, b)) for a in group for b in group) - group
+    return generators
+
+
+def _match_hall(operations, generators, conv, basis, symprec):
+    """
+    Compares the operations transformed to the conventional cell conv with the Hall settings in the database.
+    Yields (hall, origin shifts in conventional coordinates) for the settings that match. All the origin shifts
+    that match are given, shortest first (they differ by translations that map the space group onto itself).
+    """
+    conv_inv = _inverse(conv)
+    conv_inv_t = _transpose(conv_inv)
+    conv_t = _transpose(conv)
+    # The primitive lattice vectors in conventional coordinates give the centering translations
+    centering = set([(Fraction(0), Fraction(0), Fraction(0))])
+    for row in conv_inv:
+        for _i in range(abs(_det(conv))):
+            centering |= set(tuple((x + y) - (x + y).numerator//(x + y).denominator for x, y in zip(c, row)) for c in centering)
+    rotations = []
+    for rot, _trans, _perm in operations:
+        crot = _matmul(_matmul(conv_inv_t, [list(r) for r in rot]), conv_t)
+        if any(x.denominator != 1 for row in crot for x in row):
+            return
+        rotations += [tuple(tuple(int(x) for x in row) for row in crot)]
+    halls = _get_hall_index()[0].get(frozenset(rotations), [])
+    if len(halls) == 0:
+        return
+
+    conv_basis = _matmul([[float(x) for x in row] for row in conv], basis)
+    conv_inv_t_float = [[float(x) for x in row] for row in conv_inv_t]
+    conv_t_float = [[float(x) for x in row] for row in conv_t]
+    inv = _float_inverse(conv_basis)
+    tol = 10*symprec*max((inv[0][d]**2 + inv[1][d]**2 + inv[2][d]**2)**0.5 for d in range(3))
+    for hall, hall_centering, translations in halls:
+        if hall_centering != centering:
+            continue
+        # The differences between the translations of the setting and of the operations, in primitive coordinates
+        differences = [[h - t for h, t in zip(_matvec(conv_t_float, translations[crot]), trans)]
+                       for (_rot, trans, _perm), crot in zip(operations, rotations)]
+        rows = []
+        rhs = []
+        for idx in generators:
+            rot = operations[idx][0]
+            for i in range(3):
+                rows += [[rot[i][j] - int(i == j) for j in range(3)]]
+                rhs += [differences[idx][i]]
+        shifts = []
+        for shift in _solve_origin_shift(rows, rhs, tol):
+            # The generators give all the conditions, but check every operation in case they are not consistent
+            if any(abs(x - round(x)) > tol for (rot, _trans, _perm), diff in zip(operations, differences)
+                   for x in [sum((rot[i][j] - int(i == j))*shift[j] for j in range(3)) - diff[i] for i in range(3)]):
+                continue
+            # Of the shifts that differ by a centering translation, keep the shortest
+            cshift = _matvec(conv_inv_t_float, shift)
+            best = None
+            for c in centering:
+                s = [x + float(y) for x, y in zip(cshift, c)]
+                s = [x - round(x) for x in s]
+                cart = _cart(s, conv_basis)
+                key = (round(_dot(cart, cart), 6), [-x for x in s])
+                if best is None or key < best[0]:
+                    best = (key, s)
+            shifts += [best]
+        if len(shifts) > 0:
+            yield hall, [x[1] for x in sorted(shifts)]
+
+
+def _snap(x):
+    frac = Fraction(x).limit_denominator(48)
+    if abs(float(frac) - x) < 1e-6:
+        return frac
+    return Fraction(x).limit_denominator(10**6)
+
+
+def _fit_wyckoff(mat, vec, point, conv_basis, symprecsqr):
+    """
+    Checks if the point lies on the Wyckoff position x = mat*(x,y,z) + vec. Returns a list of
+    (row, coefficient, integer offset) for each free parameter, which gives the parameter as
+    (point[row] - vec[row] + offset)/coefficient, or None if the point is not on the position.
+    """
+    solutions = [[]]
+    used = []
+    for k in range(3):
+        if all(mat[i][k] == 0 for i in range(3)):
+            continue
+        alone = [i for i in range(3) if mat[i][k] != 0 and all(mat[i][l] == 0 for l in range(3) if l != k)]
+        if len(alone) == 0:
+            return None
+        row = min(alone, key=lambda i: abs(mat[i][k]))
+        coeff = mat[row][k]
+        used += [k]
+        solutions = [s + [(row, coeff, offset)] for s in solutions for offset in range(abs(coeff))]
+    for solution in solutions:
+        params = [0.0, 0.0, 0.0]
+        for k, (row, coeff, offset) in zip(used, solution):
+            params[k] = (point[row] - float(vec[row]) + offset)/coeff
+        diff = [point[i] - float(vec[i]) - _dot(mat[i], params) for i in range(3)]
+        diff = [x - round(x) for x in diff]
+        cart = _cart(diff, conv_basis)
+        if _dot(cart, cart) < symprecsqr:
+            return list(zip(used, solution))
+    return None
+
+
+def _wyckoff_position(hall, coord, multiplicity, conv_basis, symprec):
+    """
+    Finds the Wyckoff position with the given multiplicity of the exact coordinate coord (in the Hall setting).
+    Returns the letter and the image of coord under the symmetry operations placed on the representative
+    coordinates of the Wyckoff position, or None if there is no such position.
+    """
+    data = spacegrouputils.spacegroupdata[hall]
+    operations = _get_hall_index()[1][hall]
+    symprecsqr = symprec*symprec
+    fcoord = [float(x) for x in coord]
+    positions = [(letter, _parse_affine(spec)) for letter, mult, spec in
+                 sorted(zip(data['wyckoff_letter'], data['wyckoff_mult'], data['wyckoff_rep_spec_pos_op'])) if mult == multiplicity]
+    for rot, trans in operations:
+        image = [x + float(t) for x, t in zip(_matvec(rot, fcoord), trans)]
+        for letter, (mat, vec) in positions:
+            fit = _fit_wyckoff(mat, vec, image, conv_basis, symprecsqr)
+            if fit is None:
+                continue
+            exact = [x + t for x, t in zip(_matvec(rot, coord), trans)]
+            exact = [x - x.numerator//x.denominator for x in exact]
+            params = [Fraction(0)]*3
+            for k, (row, coeff, offset) in fit:
+                params[k] = (exact[row] - vec[row] + offset)/coeff
+            result = [vec[i] + sum(mat[i][k]*params[k] for k in range(3)) for i in range(3)]
+            return letter, [x - x.numerator//x.denominator for x in result]
+    return None
+
+
+def _find_symmetry(struct, symprec):
+    # Returns a StructureSymmetry, or None if no space group matches the operations found with this symprec
+    arrays = struct.arrays
+    basis = [list(x) for x in arrays.basis]
+    positions = [_wrap(list(x)) for x in arrays.reduced_coords]
+    species = [int(x) for x in arrays.species]
+    eps = 1e-8*max(_dot(x, x) for x in basis)
+
+    # Tolerances per species for matching a site to the image of a site, and for placing it on a Wyckoff position
+    merge_distance = float(_merge_eps)**0.5*max(_dot(x, x) for x in basis)**0.5
+    disordered = [ratio != 1 for ratio in struct.assignments.ratios]
+    tolerances = [max(2*symprec, merge_distance) if x else 2*symprec for x in disordered]
+    wyckoff_tolerances = [max(symprec, merge_distance) if x else symprec for x in disordered]
+
+    # Delaunay reduced cell of the given cell
+    m1 = _delaunay_reduce(basis, eps)
+    basis1 = _matmul(m1, basis)
+    positions1 = _transform_positions(m1, positions)
+
+    # Primitive cell, keeping one of the sites related by the pure translations
+    prim, perms = _primitive_transformation(positions1, species, basis1, tolerances)
+    if prim is None:
+        return None
+    kept = []
+    covered = set()
+    for idx in range(len(positions1)):
+        if idx not in covered:
+            kept += [idx]
+            covered |= set(perm[idx] for perm in perms)
+    basis2 = _matmul([[float(x) for x in row] for row in prim], basis1)
+    positions2 = _transform_positions(prim, [positions1[idx] for idx in kept])
+    species2 = [species[idx] for idx in kept]
+
+    # Delaunay reduced primitive cell, and the symmetry operations in it
+    m2 = _delaunay_reduce(basis2, eps)
+    basis3 = _matmul(m2, basis2)
+    positions3 = _transform_positions(m2, positions2)
+    operations = _find_operations(basis3, positions3, species2, symprec, tolerances)
+
+    generators = _generators(operations)
+    match = None
+    for conv in _conventional_candidates(operations, basis3, symprec):
+        for hall, shifts in _match_hall(operations, generators, conv, basis3, symprec):
+            if spacegrouputils.spacegroupdata[hall]['setting'] in _standard_settings:
+                match = (conv, hall, shifts)
+                break
+            if match is None:
+                match = (conv, hall, shifts)
+        else:
+            continue
+        break
+    if match is None:
+        return None
+    conv, hall, shifts = match
+
+    # The exact transformation from the given cell to the conventional cell
+    transformation = _matmul(_matmul(_matmul(conv, m2), prim), m1)
+    transformation = [[Fraction(x) for x in row] for row in transformation]
+    coordmap = _transpose(_inverse(transformation))
+    conv_basis = _matmul([[float(x) for x in row] for row in transformation], basis)
+
+    # Orbits of the sites of the primitive cell under the symmetry operations
+    orbits = []
+    seen = set()
+    for idx in range(len(positions3)):
+        if idx not in seen:
+            members = set(perm[idx] for _rot, _trans, perm in operations)
+            seen |= members
+            orbits += [(kept[idx], len(members)*abs(_det(conv)))]
+
+    # Place the sites on Wyckoff positions for each of the equivalent origins, and use the one that gives the
+    # first Wyckoff letters (and then the shortest shift), so that the result does not depend on the origin given
+    uc_coords = [coord for coordgroup in struct.uc_reduced_coordgroups for coord in coordgroup.to_fractions()]
+    best = None
+    for shift in shifts:
+        origin_shift = [_snap(x) for x in shift]
+        sites = []
+        for site, multiplicity in orbits:
+            coord = [x - s for x, s in zip(_matvec(coordmap, uc_coords[site]), origin_shift)]
+            position = _wyckoff_position(hall, coord, multiplicity, conv_basis, wyckoff_tolerances[species[site]])
+            if position is None:
+                break
+            sites += [(species[site], position[0], position[1], multiplicity)]
+        else:
+            sites.sort()
+            key = [x[:2] for x in sites]
+            if best is None or key < best[0]:
+                best = (key, origin_shift, sites)
+    if best is None:
+        return None
+    _key, origin_shift, sites = best
+
+    rc_reduced_coordgroups = [[site[2] for site in sites if site[0] == group] for group in range(len(arrays.counts))]
+    rc_basis = FracVector.create(transformation)*struct.uc_cell.basis
+    return StructureSymmetry(hall, FracVector.create(transformation), FracVector.create(origin_shift), rc_basis,
+                             [FracVector.create(x) for x in rc_reduced_coordgroups],
+                             [site[1] for site in sites], [site[3] for site in sites], struct.assignments, len(operations))
+
+
+def find_symmetry(struct, symprec=0.01):
+    """
+    Determines the space group of the unit cell of struct (a Structure or UnitcellStructure), with symprec the
+    largest distance (in the units of the cell) of a site from its ideal position. Returns a StructureSymmetry.
+
+    If the operations found with symprec are inconsistent (i.e., do not form a space group), the search is
+    repeated with a smaller symprec.
+    """
+    if struct.arrays.nbr_atoms == 0:
+        raise SymmetryFinderError("find_symmetry: the structure has no sites.")
+    for _attempt in range(4):
+        result = _find_symmetry(struct, symprec)
+        if result is not None:
+            return result
+        symprec *= 0.5
+    raise SymmetryFinderError("find_symmetry: the symmetry operations found do not match any spacegroup.")
+
+
+def main():
+    from httk.atomistic import Structure
+
+    # Rock salt in a primitive cell with a shifted origin
+    struct = Structure.create(uc_basis=FracVector.create([[0, "2.8", "2.8"], ["2.8", 0, "2.8"], ["2.8", "2.8", 0]]),
+                              uc_reduced_coordgroups=[[["1/8", "1/8", "1/8"]], [["5/8", "5/8", "5/8"]]],
+                              assignments=['Na', 'Cl'])
+    symmetry = find_symmetry(struct)
+    print(symmetry)
+    assert symmetry.hall_symbol == '-F 4 2 3' and symmetry.spacegroup_number == 225
+    assert symmetry.wyckoff_symbols == ['a', 'b'] and symmetry.multiplicities == [4, 4]
+    assert symmetry.rc_basis.to_floats() == [[5.6, 0.0, 0.0], [0.0, 5.6, 0.0], [0.0, 0.0, 5.6]]
+    assert len(symmetry.to_structure().uc_reduced_coords) == 8
+
+    # Rutile with a shifted origin, the free parameter of the 4f position is kept exactly
+    coordgroups = [[[0, 0, 0], ["1/2", "1/2", "1/2"]],
+                   [["0.305", "0.305", 0], ["0.695", "0.695", 0], ["0.805", "0.195", "1/2"], ["0.195", "0.805", "1/2"]]]
+    shift = FracVector.create(["1/10", "1/5", "3/10"])
+    struct = Structure.create(uc_basis=FracVector.create([["4.59", 0, 0], [0, "4.59", 0], [0, 0, "2.96"]]),
+                              uc_reduced_coordgroups=[[FracVector.create(x) + shift for x in group] for group in coordgroups],
+                              assignments=['Ti', 'O'])
+    symmetry = find_symmetry(struct)
+    print(symmetry)
+    assert symmetry.hall_symbol == '-P 4n 2n' and symmetry.spacegroup_number == 136
+    assert symmetry.wyckoff_symbols == ['a', 'f'] and symmetry.multiplicities == [2, 4]
+    assert symmetry.origin_shift == shift
+    assert symmetry.rc_reduced_coordgroups[1] == FracVector.create([["0.305", "0.305", 0]])
+
+    # The structures of the tutorial with one example of each spacegroup, compared with the spacegroup they are
+    # given in. These are pseudo-symmetric within the default symprec and get a higher symmetry (in 67.cif, a and b
+    # differ by 0.001 Angstrom and the coordinates are exactly those of 129).
+    overdetected = {'2.cif': 12, '26.cif': 127, '67.cif': 129}
+    top = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..')
+    cifdir = os.path.join(top, 'Tutorial', 'tutorial_data', 'all_spacegroups', 'cifs')
+    if os.path.isdir(cifdir):
+        import httk
+        mismatches = {}
+        for filename in sorted(glob.glob(os.path.join(cifdir, '*.cif'))):
+            struct = httk.load(filename)
+            expected = spacegrouputils.spacegroup_get_number(struct.rc_sites.hall_symbol)
+            found = find_symmetry(struct).spacegroup_number
+            if found != expected:
+                mismatches[os.path.basename(filename)] = found
+        print("Spacegroups of the tutorial structures that differ:", sorted(mismatches.items()))
+        assert mismatches == overdetected
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,8 @@ from httk.atomistic.unitcellsites import UnitcellSites
 from httk.atomistic.data import spacegroups
 from httk.atomistic.structureutils import *
 from httk.atomistic.spacegroup import Spacegroup
+from httk.atomistic.structurearrays import structure_to_arrays
+from httk.atomistic.neighborlist import neighbor_list
 
 
 class UnitcellStructure(HttkObject):
@@ -108,6 +110,8 @@ class UnitcellStructure(HttkObject):
         self.assignments = assignments
         self.uc_cell = uc_cell
         self.uc_sites = uc_sites
+        self._arrays = None
+        self._neighbor_lists = {}
 
     @classmethod
     def create(cls,
@@ -327,6 +331,28 @@ class UnitcellStructure(HttkObject):
     def uc_counts(self):
         return self.uc_sites.counts
 
+    @property
+    def arrays(self):
+        """
+        Float arrays of the cell, coordinates and species (a StructureArrays object), built on first use and cached.
+        """
+        if self._arrays is None:
+            self._arrays = structure_to_arrays(self)
+        return self._arrays
+
+    def neighbor_list(self, cutoff):
+        """
+        All pairs of sites within the distance cutoff, including periodic images (a NeighborList object). The
+        result is cached, and a neighbor list for a shorter cutoff is filtered from a cached longer one.
+        """
+        if cutoff not in self._neighbor_lists:
+            longer = [x for x in self._neighbor_lists if x > cutoff]
+            if len(longer) > 0:
+                self._neighbor_lists[cutoff] = self._neighbor_lists[min(longer)].filtered(cutoff)
+            else:
+                self._neighbor_lists[cutoff] = neighbor_list(self, cutoff)
+        return self._neighbor_lists[cutoff]
+
     def transform(self, matrix, max_search_cells=20, max_atoms=1000):
         return transform(self, matrix, max_search_cells=max_search_cells, max_atoms=max_atoms)
 
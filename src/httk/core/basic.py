@@ -52,6 +52,7 @@ def anonymous_symbol_to_int(symb):
 
 import re, errno, os, itertools, sys, tempfile, shutil, collections
 from httk.core.ioadapters import IoAdapterFileReader
+from httk.core.linescanner import LineScanner, required_literal
 
 
 def is_unary(e):
@@ -125,7 +126,7 @@ def mkdir_p(path):
             raise
 
 
-def micro_pyawk(ioa, search, results=None, debug=False, debugfunc=None, postdebugfunc=None):
+def micro_pyawk(ioa, search, results=None, debug=False, debugfunc=None, postdebugfunc=None, stop=None, reverse=False):
     """
     Small awk-mimicking search routine.
 
@@ -144,11 +145,16 @@ def micro_pyawk(ioa, search, results=None, debug=False, debugfunc=None, postdebu
     The default results is an empty dictionary. Passing a results object let you interact
     with it in run() and test(). Hence, in many occasions it is thus clever to use results=self.
 
+    If stop is given, stop(results) is called after each time a run function has been executed, and the
+    search ends if it returns True. With reverse=True, the lines are searched from the end of the file
+    towards the beginning, which together with stop makes it fast to find the last occurrence of something.
+
+    If every regex contains some literal text (e.g., 'TOTEN' in '^ *free *energy *TOTEN *= *([^ ]+)'), only
+    the lines that contain one of these texts are split out from the file and tested, which makes searches
+    through very large files much faster (see httk.core.linescanner.)
+
     Returns: results
     """
-    ioa = IoAdapterFileReader.use(ioa)
-    f = ioa.file
-
     if results is None:
         results = {}
 
@@ -160,25 +166,37 @@ def micro_pyawk(ioa, search, results=None, debug=False, debugfunc=None, postdebu
             except Exception as e:
                 raise Exception("Could not compile regular expression:"+entry[0]+" error: "+str(e))
 
-    for line in f:
-        if debug:
-            sys.stdout.write("\n" + line[:-1])
-        for i in range(len(search)):
-            match = search[i][0].search(line)
-            if debug and match:
-                sys.stdout.write(": MATCH")
-            if match and (search[i][1] is None or search[i][1](results, line)):
-                if debug:
-                    sys.stdout.write(": TRIGGER")
-                if debugfunc is not None:
-                    debugfunc(results, match)
-                search[i][2](results, match)
-                if postdebugfunc is not None:
-                    postdebugfunc(results, match)
+    literals = [required_literal(entry[0]) for entry in search]
+    if debug or None in literals:
+        scanner = LineScanner(ioa, None, reverse=reverse)
+    else:
+        scanner = LineScanner(ioa, literals, reverse=reverse)
+
+    try:
+        for line in scanner:
+            if debug:
+                sys.stdout.write("\n" + line[:-1])
+            for i in range(len(search)):
+                if literals[i] is not None and literals[i] not in line:
+                    continue
+                match = search[i][0].search(line)
+                if debug and match:
+                    sys.stdout.write(": MATCH")
+                if match and (search[i][1] is None or search[i][1](results, line)):
+                    if debug:
+                        sys.stdout.write(": TRIGGER")
+                    if debugfunc is not None:
+                        debugfunc(results, match)
+                    search[i][2](results, match)
+                    if postdebugfunc is not None:
+                        postdebugfunc(results, match)
+                    if stop is not None and stop(results):
+                        return results
+    finally:
+        scanner.close()
     if debug:
         sys.stdout.write("\n")
 
-    ioa.close()
     return results
 
 
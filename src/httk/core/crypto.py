@@ -17,9 +17,9 @@
 """
 Provides a few central and very helpful functions for cryptographic hashes, etc.
 """
-import hashlib, os.path, base64, re, sys, codecs
+import hashlib, os.path, base64, re, sys, codecs, io, time
 from httk.core.basic import print_, unicode_type
-from httk.core import ed25519
+from httk.core import ed25519, ed25519fast
 
 if sys.version_info[0] == 3:
     import configparser
@@ -33,17 +33,34 @@ except Exception:
 
 from httk.core.ioadapters import IoAdapterFileReader, IoAdapterFileWriter
 from httk.core.basic import nested_split
+from httk.core.runarchive import archive_suffix, get_archive
 
+# Implementation of ed25519 used for keys and signatures. They give identical results, 'reference' is the
+# original (much slower) implementation in httk.core.ed25519.
+_signature_backends = {'fast': ed25519fast, 'reference': ed25519}
+_signature_backend = ed25519fast
 
-def hexhash_str(data, prepend=None):
-    s = hashlib.sha1()
-    s.update("httk\0".encode("utf-8"))
+
+def set_signature_backend(name):
+    global _signature_backend
+    if name not in _signature_backends:
+        raise Exception("crypto.set_signature_backend: unknown backend: "+str(name))
+    _signature_backend = _signature_backends[name]
+
+
+def hexhash_bytes(data, prepend=None):
+    """
+    Returns the bytes that hexhash_str(data, prepend) is the sha1 hash of.
+    """
     if prepend is not None:
-        s.update(prepend.encode("utf-8"))
-        s.update("\0".encode("utf-8"))
-    s.update(data.encode("utf-8"))
-    s.update("\0%u\0".encode("utf-8") % len(data))
-    return s.hexdigest()
+        head = "httk\0" + prepend + "\0"
+    else:
+        head = "httk\0"
+    return head.encode("utf-8") + data.encode("utf-8") + ("\0%u\0" % len(data)).encode("utf-8")
+
+
+def hexhash_str(data, prepend=None):
+    return hashlib.sha1(hexhash_bytes(data, prepend)).hexdigest()
 
 
 def tuple_to_hexhash(t):
@@ -172,26 +189,175 @@ def read_keys(keydir):
     b64sk = f.read()
     f.close()
     sk = base64.b64decode(b64sk)
-    pk = ed25519.publickey(sk)
+    pk = _signature_backend.publickey(sk)
     return (sk, pk)
 
 
+# Size of the reads when hashing files
+_hash_block_size = 1 << 20
+# Files smaller than this in total are hashed in the calling process even if more workers are requested
+_parallel_min_bytes = 1 << 26
+
+
 def sha256file(filename):
-    def chunks(f, size=8192):
+    s = hashlib.sha256()
+    buf = bytearray(_hash_block_size)
+    view = memoryview(buf)
+    f = open(filename, 'rb')
+    try:
         while True:
-            s = f.read(size)
-            if not s:
+            n = f.readinto(buf)
+            if not n:
                 break
-            yield s
-    f = open(filename, 'rb')
-    s = hashlib.sha256()
-    for chunk in chunks(f):
-        s.update(chunk)
-    f.close()
+            s.update(view[:n])
+    finally:
+        f.close()
     return s.hexdigest()
 
 
-def manifest_dir(basedir, manifestfile, excludespath, keydir, sk, pk, debug=False, force=False):
+def _stat_key(st):
+    mtime = getattr(st, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(st.st_mtime*1000000000)
+    return "%d:%d:%d:%d" % (st.st_dev, st.st_ino, st.st_size, mtime), mtime
+
+
+class ManifestHashCache(object):
+
+    """
+    Persistent cache of sha256 sums of files, kept in an sqlite database at path. An entry is only used if the
+    inode, size and modification time of the file are unchanged since it was hashed.
+
+    Entries are written to the database on close(); new entries can also be moved between caches with
+    take_new() / update() (this is how worker processes report back.)
+    """
+
+    # Files modified this recently (in seconds) are not cached, since a later change within the resolution
+    # of the file system timestamps would go unnoticed.
+    racy_interval = 2.0
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self._new = {}
+        self._db = sqlite3.connect(path, timeout=60)
+        self._db.execute("CREATE TABLE IF NOT EXISTS sha256 (path TEXT PRIMARY KEY, stat TEXT, hash TEXT)")
+
+    def lookup(self, filename, statkey):
+        filename = os.path.abspath(filename)
+        if filename in self._new:
+            entry = self._new[filename]
+        else:
+            entry = self._db.execute("SELECT stat, hash FROM sha256 WHERE path = ?", (filename,)).fetchone()
+        if entry is not None and entry[0] == statkey:
+            return entry[1]
+        return None
+
+    def store(self, filename, statkey, mtime, hh):
+        if time.time() - mtime/1000000000.0 < self.racy_interval:
+            return
+        self._new[os.path.abspath(filename)] = (statkey, hh)
+
+    def take_new(self):
+        new = self._new
+        self._new = {}
+        return new
+
+    def update(self, entries):
+        self._new.update(entries)
+
+    def close(self):
+        if self._db is None:
+            return
+        if len(self._new) > 0:
+            self._db.executemany("INSERT OR REPLACE INTO sha256 (path, stat, hash) VALUES (?, ?, ?)",
+                                 [(k, v[0], v[1]) for k, v in self._new.items()])
+            self._db.commit()
+            self._new = {}
+        self._db.close()
+        self._db = None
+
+
+def _manifest_write(manifestfile, data):
+    if sys.version_info[0] == 3 and not isinstance(manifestfile, io.TextIOBase):
+        data = data.encode('utf-8')
+    manifestfile.write(data)
+
+
+def _generate_submanifest(basedir, fulldir, keydir, sk, pk, hash_cache):
+    submanifestfile = bz2.BZ2File(os.path.join(basedir, fulldir, 'ht.tmp.manifest.bz2'), 'w')
+    print("Generating manifest:", os.path.join(basedir, fulldir, 'ht.manifest.bz2'))
+    manifest_dir(os.path.join(basedir, fulldir), submanifestfile, os.path.join(basedir, fulldir, 'ht.config'), keydir, sk, pk,
+                 hash_cache=hash_cache)
+    submanifestfile.close()
+    os.rename(os.path.join(basedir, fulldir, 'ht.tmp.manifest.bz2'), os.path.join(basedir, fulldir, 'ht.manifest.bz2'))
+
+
+def _submanifest_job(args):
+    basedir, fulldir, keydir, sk, pk, cachepath = args
+    hash_cache = ManifestHashCache(cachepath) if cachepath is not None else None
+    try:
+        _generate_submanifest(basedir, fulldir, keydir, sk, pk, hash_cache)
+        return hash_cache.take_new() if hash_cache is not None else {}
+    finally:
+        if hash_cache is not None:
+            hash_cache.close()
+
+
+def _excluded(excludes, name, relpath):
+    for exclude in excludes:
+        if re.match(exclude, name) is not None or re.match(exclude, relpath) is not None:
+            return True
+    return False
+
+
+def _archive_entries(excludes, fulldir, archivepath):
+    # Manifest entries for the members of the packed run directory fulldir, excluded the same way as if the
+    # directory had been walked
+    entries = []
+    archive = get_archive(archivepath)
+    for name in archive.names():
+        member = archive.member(name)
+        parts = name.split('/')
+        relpath = fulldir
+        excluded = False
+        for part in parts[:-1]:
+            relpath = os.path.join(relpath, part)
+            if _excluded(excludes, part, relpath):
+                excluded = True
+                break
+        filename = os.path.join(relpath, parts[-1])
+        if excluded or 'sha256' not in member or _excluded(excludes, parts[-1], filename):
+            continue
+        entries += [(os.path.join(fulldir, *parts), None, member['sha256'])]
+    return entries
+
+
+def _walk_order(name):
+    # Sort key that puts manifest entries in the order the os.walk above (with sorted names) lists them: the files
+    # of a directory, then its task subdirectories (name ending with '/'), then the contents of its other
+    # subdirectories
+    if name.endswith('/'):
+        parts = name[:-1].split(os.sep)
+        last = (1, parts[-1])
+    else:
+        parts = name.split(os.sep)
+        last = (0, parts[-1])
+    return tuple((2, x) for x in parts[:-1]) + (last,)
+
+
+def manifest_dir(basedir, manifestfile, excludespath, keydir, sk, pk, debug=False, force=False, workers=1, hash_cache=None):
+    """
+    Write a signed manifest of the sha256 sums of all files in basedir to manifestfile. Subdirectories that are
+    tasks get their own ht.manifest.bz2 (generated if missing, or if force is set), which is entered in the manifest
+    instead of their files.
+
+    workers: number of processes used to hash files and generate the manifests of subdirectories
+      (None = one per cpu.) The manifest is the same regardless of the number of workers.
+
+    hash_cache: path to an sqlite file (or a ManifestHashCache) where sha256 sums are kept between runs,
+      so that only files that have changed are hashed again.
+    """
     message = ""
 
     excludes = []
@@ -216,7 +382,6 @@ def manifest_dir(basedir, manifestfile, excludespath, keydir, sk, pk, debug=Fals
     pubkey = f.readlines()[0].strip()
     f.close()
 
-    manifestfile.write(pubkey+"\n")
     message += pubkey+"\n"
 
     for root, unsorteddirs, unsortedfiles in os.walk(keydir, topdown=True, followlinks=False):
@@ -228,12 +393,16 @@ def manifest_dir(basedir, manifestfile, excludespath, keydir, sk, pk, debug=Fals
                 f.close()
                 pubkey = filedata[0].strip()
                 comment = filedata[1].strip()
-                manifestfile.write(pubkey+" "+str(comment)+"\n")
                 message += pubkey+" "+str(comment)+"\n"
 
-    manifestfile.write("\n")
     message += "\n"
 
+    # Collect the entries of the manifest, as (name, path of the file to hash, hash if already known), and the
+    # task subdirectories that need a new manifest. The files of a packed run directory (see
+    # httk.core.runarchive) are entered by the hashes of their content kept in the archive, so that the
+    # manifest is the same as before the directory was packed.
+    entries = []
+    submanifests = []
     for root, unsorteddirs, unsortedfiles in os.walk(basedir, topdown=True, followlinks=False):
         if root == basedir:
             root = ""
@@ -241,50 +410,95 @@ def manifest_dir(basedir, manifestfile, excludespath, keydir, sk, pk, debug=Fals
             root = os.path.relpath(root, basedir)
         files = sorted(unsortedfiles)
         dirs = sorted(unsorteddirs)
-        filenames = [os.path.join(root, x) for x in files]
-        for i, f in enumerate(files):
-            filename = filenames[i]
-            for exclude in excludes:
-                if re.match(exclude, f) is not None or re.match(exclude, filename) is not None:
-                    break
-            else:
-                truefilename = os.path.join(basedir, filename)
-                hh = sha256file(truefilename)
-                manifestfile.write(hh+" "+filename+"\n")
-                message += hh+" "+filename+"\n"
-                if debug:
-                    print("Adding:", hh+" "+filename)
+        for f in files:
+            filename = os.path.join(root, f)
+            if f.endswith(archive_suffix) and not os.path.isdir(os.path.join(basedir, filename[:-len(archive_suffix)])):
+                fulldir = filename[:-len(archive_suffix)]
+                if not _excluded(excludes, f[:-len(archive_suffix)], fulldir):
+                    entries += _archive_entries(excludes, fulldir, os.path.join(basedir, filename))
+            elif not _excluded(excludes, f, filename):
+                entries += [(filename, os.path.join(basedir, filename), None)]
         keepdirs = []
         for d in dirs:
             fulldir = os.path.join(root, d)
-            for exclude in excludes:
-                if re.match(exclude, d) is not None or re.match(exclude, fulldir) is not None:
-                    break
-            else:
+            if not _excluded(excludes, d, fulldir):
                 if d.startswith("ht.task.") or os.path.exists(os.path.join(fulldir, 'ht.config')):
                     if force or (not os.path.exists(os.path.join(fulldir, 'ht.manifest.bz2'))):
-                        submanifestfile = bz2.BZ2File(os.path.join(basedir, fulldir, 'ht.tmp.manifest.bz2'), 'w')
-                        print("Generating manifest:", os.path.join(basedir, fulldir, 'ht.manifest.bz2'))
-                        manifest_dir(os.path.join(basedir, fulldir), submanifestfile, os.path.join(basedir, fulldir, 'ht.config'), keydir, sk, pk)
-                        submanifestfile.close()
-                        os.rename(os.path.join(basedir, fulldir, 'ht.tmp.manifest.bz2'), os.path.join(basedir, fulldir, 'ht.manifest.bz2'))
-                    hh = sha256file(os.path.join(basedir, fulldir, 'ht.manifest.bz2'))
-                    manifestfile.write(hh+" "+fulldir+"/\n")
-                    message += hh+" "+fulldir+"/\n"
-                    if debug:
-                        print("Adding:", hh+" "+fulldir+"/ ")
+                        submanifests += [fulldir]
+                    entries += [(fulldir+"/", os.path.join(basedir, fulldir, 'ht.manifest.bz2'), None)]
                 else:
                     keepdirs += [d]
         unsorteddirs[:] = keepdirs
+    entries.sort(key=lambda x: _walk_order(x[0]))
+
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+
+    close_cache = False
+    if hash_cache is not None and not isinstance(hash_cache, ManifestHashCache):
+        hash_cache = ManifestHashCache(hash_cache)
+        close_cache = True
+
+    pool = None
+    try:
+        if workers > 1 and len(submanifests) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(workers)
+            cachepath = hash_cache.path if hash_cache is not None else None
+            for new in pool.map(_submanifest_job, [(basedir, fulldir, keydir, sk, pk, cachepath) for fulldir in submanifests], 1):
+                if hash_cache is not None:
+                    hash_cache.update(new)
+        else:
+            for fulldir in submanifests:
+                _generate_submanifest(basedir, fulldir, keydir, sk, pk, hash_cache)
+
+        hashes = [entry[2] for entry in entries]
+        stats = [None]*len(entries)
+        todo = []
+        for i, entry in enumerate(entries):
+            if hashes[i] is not None:
+                continue
+            if hash_cache is not None:
+                stats[i] = _stat_key(os.stat(entry[1]))
+                hashes[i] = hash_cache.lookup(entry[1], stats[i][0])
+            if hashes[i] is None:
+                todo += [i]
+
+        todo_paths = [entries[i][1] for i in todo]
+        if workers > 1 and len(todo) > 1 and sum(os.path.getsize(x) for x in todo_paths) >= _parallel_min_bytes:
+            if pool is None:
+                import multiprocessing
+                pool = multiprocessing.Pool(workers)
+            todo_hashes = pool.map(sha256file, todo_paths, max(1, len(todo)//(4*workers)))
+        else:
+            todo_hashes = [sha256file(x) for x in todo_paths]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for i, hh in zip(todo, todo_hashes):
+        hashes[i] = hh
+        if hash_cache is not None:
+            hash_cache.store(entries[i][1], stats[i][0], stats[i][1], hh)
+    if close_cache:
+        hash_cache.close()
+
+    for entry, hh in zip(entries, hashes):
+        name = entry[0]
+        message += hh+" "+name+"\n"
+        if debug:
+            print("Adding:", hh+" "+name)
 
     #print("===="+message+"====")
 
-    sig = ed25519.signature(message, sk, pk)
+    sig = _signature_backend.signature(message, sk, pk)
     b64sig = base64.b64encode(sig)
+    if not isinstance(b64sig, str):
+        b64sig = b64sig.decode('ascii')
 
-    manifestfile.write("\n")
-    manifestfile.write(b64sig)
-    manifestfile.write("\n")
+    _manifest_write(manifestfile, message+"\n"+b64sig+"\n")
 
 
 #def generate_rsa_keys(path,extraargs=[]):
@@ -343,7 +557,7 @@ def generate_keys(public_key_path, secret_key_path):
         #secret_key = sr.getrandbits(512)
     except NotImplementedError:
         raise Exception("crypto.generate_keys: Running on a system without a safe random number generator,cannot create safe cryptographic keys on this system.")
-    public_key = ed25519.publickey(secret_key)
+    public_key = _signature_backend.publickey(secret_key)
 
     b64secret_key = base64.b64encode(secret_key)
     b64public_key = base64.b64encode(public_key)
@@ -363,8 +577,8 @@ def get_crypto_signature(message, secret_key=None, keyfile=None):
         secret_key = ioa.file.read()
         ioa.close()
     secret_key = base64.b64decode(secret_key)
-    public_key = ed25519.publickey(secret_key)
-    signature = ed25519.signature(message, secret_key, public_key)
+    public_key = _signature_backend.publickey(secret_key)
+    signature = _signature_backend.signature(message, secret_key, public_key)
     b64signature = base64.b64encode(signature)
     return b64signature
 
@@ -376,7 +590,35 @@ def verify_crytpo_signature(signature, message, public_key=None, keyfile=None):
         ioa.close()
     binsignature = base64.b64decode(signature)
     binpublic_key = base64.b64decode(public_key)
-    return ed25519.checkvalid(binsignature, message, binpublic_key)
+    return _signature_backend.checkvalid(binsignature, message, binpublic_key)
+
+
+def verify_crypto_signatures(signatures, messages, public_keys):
+    """
+    Verify many base64 encoded signatures at once, returns a list of booleans. This is much faster than
+    calling verify_crytpo_signature for each of them, especially when they share public keys.
+
+    A signature or public key that cannot be decoded gives False for that entry (where verify_crytpo_signature
+    raises an exception), so one broken entry does not stop the verification of the others.
+    """
+    items = []
+    for s, m, k in zip(signatures, messages, public_keys):
+        try:
+            items.append((base64.b64decode(s), m, base64.b64decode(k)))
+        except Exception:
+            items.append(None)
+    result = [False]*len(items)
+    decoded = [i for i in range(len(items)) if items[i] is not None]
+    if hasattr(_signature_backend, 'checkvalid_batch'):
+        for i, valid in zip(decoded, _signature_backend.checkvalid_batch([items[i] for i in decoded])):
+            result[i] = valid
+        return result
+    for i in decoded:
+        try:
+            result[i] = _signature_backend.checkvalid(*items[i])
+        except Exception:
+            pass
+    return result
 
 
 def verify_crytpo_signature_old(signature, message, public_key_path):
@@ -385,7 +627,7 @@ def verify_crytpo_signature_old(signature, message, public_key_path):
     ioa.close()
     binsignature = base64.b64decode(signature)
     public_key = base64.b64decode(b64public_key)
-    return ed25519.checkvalid(binsignature, message, public_key)
+    return _signature_backend.checkvalid(binsignature, message, public_key)
 
 
 def main():
@@ -397,6 +639,9 @@ def main():
     print_("Signature is")
     print_(my_signature)
     print_("Check if signature is valid")
+    ioa = IoAdapterFileReader.use("/tmp/pub.key")
+    pubkey = ioa.file.read()
+    ioa.close()
     result = verify_crytpo_signature(my_signature, message, keyfile="/tmp/pub.key")
     print_("True message validates", result)
     assert(result == True)
@@ -404,6 +649,13 @@ def main():
     result = verify_crytpo_signature(my_signature, forged_message, keyfile="/tmp/pub.key")
     print_("Forged message validates", result)
     assert(result == False)
+    result = verify_crypto_signatures([my_signature, my_signature], [message, forged_message], [pubkey, pubkey])
+    print_("Batch validates", result)
+    assert(result == [True, False])
+    result = verify_crypto_signatures([my_signature, "not base64!", my_signature[:-8], my_signature], [message]*4,
+                                      [pubkey, pubkey, pubkey, pubkey[:-8]])
+    print_("Batch with broken entries validates", result)
+    assert(result == [True, False, False, False])
     print_("Finished")
 
 if __name__ == "__main__":
@@ -0,0 +1,384 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Faster pure Python implementation of ed25519, with the same interface and results as httk.core.ed25519
+(which is kept as the reference implementation).
+
+Points are kept in extended twisted Edwards coordinates (X:Y:Z:T) so that no modular inversions are needed
+except when encoding a point. Multiples of the base point are computed from a precomputed table of
+j*16^i*B (built on first use), other scalar multiplications use a 4-bit fixed window. checkvalid_batch
+verifies many signatures with a single random linear combination of the verification equations.
+"""
+import hashlib, binascii, random
+
+b = 256
+q = 2**255 - 19
+l = 2**252 + 27742317777372353535851937790883648493
+d = -121665 * pow(121666, q-2, q) % q
+d2 = 2*d % q
+I = pow(2, (q-1)//4, q)
+
+# The order of every point on the curve divides 8*l
+_order = 8*l
+
+_identity = (0, 1, 1, 0)
+
+_base_table = None
+
+_sysrandom = random.SystemRandom()
+
+
+def xrecover(y):
+    xx = (y*y-1) * pow(d*y*y+1, q-2, q)
+    x = pow(xx, (q+3)//8, q)
+    if (x*x - xx) % q != 0:
+        x = (x*I) % q
+    if x % 2 != 0:
+        x = q-x
+    return x
+
+
+By = 4 * pow(5, q-2, q)
+Bx = xrecover(By)
+B = [Bx % q, By % q]
+
+
+def _to_bytearray(m):
+    if isinstance(m, bytearray):
+        return m
+    try:
+        return bytearray(m, 'utf-8')
+    except TypeError:
+        return bytearray(m)
+
+
+def _int_le(s):
+    return int(binascii.hexlify(bytes(s)[::-1]), 16)
+
+
+def _bytes_le(n, length):
+    return bytearray(binascii.unhexlify('%0*x' % (2*length, n))[::-1])
+
+
+def H(m):
+    return bytearray(hashlib.sha512(bytes(m)).digest())
+
+
+def Hint(m):
+    return _int_le(H(m))
+
+
+def _add(P, Q):
+    X1, Y1, Z1, T1 = P
+    X2, Y2, Z2, T2 = Q
+    A = (Y1-X1)*(Y2-X2) % q
+    B = (Y1+X1)*(Y2+X2) % q
+    C = T1*T2 % q*d2 % q
+    D = 2*Z1*Z2 % q
+    E = B-A
+    F = D-C
+    G = D+C
+    H = B+A
+    return (E*F % q, G*H % q, F*G % q, E*H % q)
+
+
+def _madd(P, Q):
+    # Add a precomputed point Q = (y+x, y-x, 2*d*x*y)
+    X1, Y1, Z1, T1 = P
+    ypx, ymx, xy2d = Q
+    A = (Y1-X1)*ymx % q
+    B = (Y1+X1)*ypx % q
+    C = T1*xy2d % q
+    D = 2*Z1
+    E = B-A
+    F = D-C
+    G = D+C
+    H = B+A
+    return (E*F % q, G*H % q, F*G % q, E*H % q)
+
+
+def _double(P):
+    X1, Y1, Z1, _T1 = P
+    A = X1*X1 % q
+    B = Y1*Y1 % q
+    C = 2*Z1*Z1 % q
+    E = (X1+Y1)*(X1+Y1) - A - B
+    G = B-A
+    F = G-C
+    H = -A-B
+    return (E*F % q, G*H % q, F*G % q, E*H % q)
+
+
+def _negate(P):
+    return (-P[0] % q, P[1], P[2], -P[3] % q)
+
+
+def _extended(P):
+    return (P[0] % q, P[1] % q, 1, P[0]*P[1] % q)
+
+
+def _affine(P):
+    zi = pow(P[2], q-2, q)
+    return (P[0]*zi % q, P[1]*zi % q)
+
+
+def _equal(P, Q):
+    return (P[0]*Q[2] - Q[0]*P[2]) % q == 0 and (P[1]*Q[2] - Q[1]*P[2]) % q == 0
+
+
+def _is_identity(P):
+    return P[0] % q == 0 and (P[1] - P[2]) % q == 0
+
+
+def _get_base_table():
+    global _base_table
+    if _base_table is None:
+        table = []
+        P = _extended(B)
+        for _i in range(b//4):
+            row = [None, P]
+            for _j in range(2, 16):
+                row.append(_add(row[-1], P))
+            table.append([None] + _precomputed(row[1:]))
+            P = _double(_double(_double(_double(P))))
+        _base_table = table
+    return _base_table
+
+
+def _precomputed(points):
+    # Convert to (y+x, y-x, 2*d*x*y), with one modular inversion for all points
+    prods = [1]
+    for P in points:
+        prods.append(prods[-1]*P[2] % q)
+    inv = pow(prods[-1], q-2, q)
+    result = [None]*len(points)
+    for i in range(len(points)-1, -1, -1):
+        zi = inv*prods[i] % q
+        inv = inv*points[i][2] % q
+        x = points[i][0]*zi % q
+        y = points[i][1]*zi % q
+        result[i] = ((y+x) % q, (y-x) % q, d2*x*y % q)
+    return result
+
+
+def _base_mult(e):
+    table = _get_base_table()
+    e %= l
+    P = _identity
+    i = 0
+    while e:
+        nib = e & 15
+        if nib:
+            P = _madd(P, table[i][nib])
+        e >>= 4
+        i += 1
+    return P
+
+
+def _multiples(P):
+    row = [_identity, P]
+    for _j in range(2, 16):
+        row.append(_add(row[-1], P))
+    return row
+
+
+def _multi_mult(pairs):
+    # Straus' method with a 4-bit window: sum of e*P for the (e, P) in pairs
+    tables = [(e, _multiples(P)) for e, P in pairs if e != 0]
+    if len(tables) == 0:
+        return _identity
+    nibbles = (max(e for e, _ in tables).bit_length() + 3)//4
+    R = _identity
+    for i in range(nibbles-1, -1, -1):
+        if R is not _identity:
+            R = _double(_double(_double(_double(R))))
+        shift = 4*i
+        for e, row in tables:
+            nib = (e >> shift) & 15
+            if nib:
+                R = _add(R, row[nib])
+    return R
+
+
+def scalarmult(P, e):
+    return list(_affine(_multi_mult([(e % _order, _extended(P))])))
+
+
+def encodeint(y):
+    return _bytes_le(y, b//8)
+
+
+def _encode_affine(x, y):
+    return _bytes_le(y | ((x & 1) << (b-1)), b//8)
+
+
+def encodepoint(P):
+    return _encode_affine(P[0], P[1])
+
+
+def _a_from_hash(h):
+    return (_int_le(h[0:b//8]) & (2**(b-2) - 8)) | 2**(b-2)
+
+
+def publickey(sk):
+    h = H(bytearray(sk))
+    a = _a_from_hash(h)
+    return _encode_affine(*_affine(_base_mult(a)))
+
+
+def signature(m, sk, pk):
+    sk = bytearray(sk)
+    pk = bytearray(pk)
+    m = _to_bytearray(m)
+    h = H(sk)
+    a = _a_from_hash(h)
+    r = Hint(h[b//8:b//4] + m)
+    R = _encode_affine(*_affine(_base_mult(r)))
+    S = (r + Hint(R + pk + m) * a) % l
+    return R + encodeint(S)
+
+
+def isoncurve(P):
+    x = P[0]
+    y = P[1]
+    return (-x*x + y*y - 1 - d*x*x*y*y) % q == 0
+
+
+def decodeint(s):
+    return _int_le(bytearray(s)[0:b//8])
+
+
+def decodepoint(s):
+    s = bytearray(s)
+    y = _int_le(s[0:b//8]) & (2**(b-1) - 1)
+    x = xrecover(y)
+    if x & 1 != (s[b//8-1] >> 7) & 1:
+        x = q-x
+    P = [x, y]
+    if not isoncurve(P):
+        raise Exception("decoding point that is not on curve")
+    return P
+
+
+def _decode_signature(s, m, pk):
+    s = bytearray(s)
+    pk = bytearray(pk)
+    m = _to_bytearray(m)
+    if len(s) != b//4:
+        raise Exception("signature length is wrong")
+    if len(pk) != b//8:
+        raise Exception("public-key length is wrong")
+    R = decodepoint(s[0:b//8])
+    A = decodepoint(pk)
+    S = decodeint(s[b//8:b//4])
+    h = Hint(encodepoint(R) + pk + m)
+    return R, A, S, h
+
+
+def checkvalid(s, m, pk):
+    R, A, S, h = _decode_signature(s, m, pk)
+    # [S]B == R + [h]A
+    lhs = _base_mult(S)
+    rhs = _multi_mult([(1, _extended(R)), (h % _order, _extended(A))])
+    return _equal(lhs, rhs)
+
+
+def checkvalid_batch(signatures, batch_size=64):
+    """
+    Verify a list of (signature, message, public key), returns a list of booleans. Signatures are checked
+    batch_size at a time with one random linear combination of their verification equations, which is much
+    faster than checkvalid on each of them when they share public keys, as do all manifests of a project.
+    If a combination does not hold, the signatures of that batch are checked one by one.
+
+    The combined check gives the same result as checkvalid, except that (with probability < 2^-127, or
+    for signatures that do not verify only because of a small order component in the signer's own
+    public key, with probability <= 1/2) an invalid signature could pass.
+
+    A signature or public key that cannot be decoded (for which checkvalid raises an exception) gives False,
+    without affecting the other signatures.
+    """
+    result = []
+    for start in range(0, len(signatures), batch_size):
+        batch = signatures[start:start+batch_size]
+        decoded = []
+        for s, m, pk in batch:
+            try:
+                decoded.append(_decode_signature(s, m, pk))
+            except Exception:
+                decoded.append(None)
+        valid = [i for i in range(len(batch)) if decoded[i] is not None]
+        checked = [False]*len(batch)
+        if len(valid) == 0:
+            result += checked
+            continue
+        # sum z_i*([S_i]B - R_i - [h_i]A_i) == 0 for random z_i
+        sum_s = 0
+        key_scalars = {}
+        key_points = {}
+        pairs = []
+        for i in valid:
+            pk = batch[i][2]
+            R, A, S, h = decoded[i]
+            z = _sysrandom.getrandbits(128) | 1
+            sum_s += z*S
+            key = bytes(bytearray(pk))
+            key_points[key] = A
+            key_scalars[key] = (key_scalars.get(key, 0) + z*h) % _order
+            pairs.append((z, _negate(_extended(R))))
+        for key in key_scalars:
+            pairs.append((key_scalars[key], _negate(_extended(key_points[key]))))
+        if _is_identity(_add(_base_mult(sum_s), _multi_mult(pairs))):
+            for i in valid:
+                checked[i] = True
+        else:
+            for i in valid:
+                checked[i] = checkvalid(*batch[i])
+        result += checked
+    return result
+
+
+def main():
+    import os
+    from httk.core import ed25519
+
+    print("This compares the fast ed25519 implementation to the reference implementation")
+    my_secret_key = bytearray("swordfish", 'utf-8')
+    my_public_key = publickey(my_secret_key)
+    assert(my_public_key == ed25519.publickey(my_secret_key))
+    message = "This is my message."
+    my_signature = signature(message, my_secret_key, my_public_key)
+    assert(my_signature == ed25519.signature(message, my_secret_key, my_public_key))
+    assert(checkvalid(my_signature, message, my_public_key))
+    assert(not checkvalid(my_signature, "This is not my message.", my_public_key))
+
+    sk = os.urandom(64)
+    pk = publickey(sk)
+    items = [(signature(str(i), sk, pk), str(i), pk) for i in range(5)]
+    assert(checkvalid_batch(items) == [True]*5)
+    items[2] = (items[2][0], "forged", pk)
+    assert(checkvalid_batch(items) == [True, True, False, True, True])
+    # Malformed signatures and public keys only fail themselves
+    items[2] = (items[2][0][:-1], "2", pk)
+    items[3] = (items[3][0], "3", pk[:-1])
+    assert(checkvalid_batch(items) == [True, True, False, False, True])
+    assert(checkvalid_batch(items[2:4]) == [False, False])
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,8 +18,15 @@
 Basic geometry helper functions
 """
 from __future__ import division
+from fractions import Fraction
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+
 from httk.core.vectors import FracVector
 from httk.core.vectors import MutableFracVector
+from httk.core.vectors.fracmath import any_to_fraction
 
 
 def is_point_inside_cell(cell, point):
@@ -96,80 +103,647 @@ def hull_z(points, zs):
     returns data on the following format.::
 
       {
-        'hull_points': indices in points list for points that make up the convex hull,
-         'interior_points':indices for points in the interior,
-         'interior_zs':interior_zs
-         'zs_on_hull': hull z values for each point (for points on the hull, the value of the hull if this point is excluded)
-         'closest_points': list of best linear combination of other points for each point
-         'closest_weights': weights of best linear combination of other points for each point
+        'hull_indices': indices in points list for points that make up the convex hull,
+        'interior_indices': indices for points in the interior,
+        'hull_distances': z value distance to the hull for each point (for points on the hull,
+                          the distance to the hull had this point not been included)
+        'competing_indices': list of best linear combination of other points for each point
+        'competing_weights': weights of best linear combination of other points for each point
       }
 
-    where hull_points and interior_points are lists of the points on the hull and inside the hull.
-    and
+    For each point i, the hull value is the lowest z-value of any linear combination with non-negative weights of
+    the other points, such that the combination does not exceed point i in any coordinate. Hence, hull_distances[i]
+    is negative for points that are required for the hull, zero for points on the hull that can be replaced by
+    other points, and positive for interior points.
+
+    See HullZ for a version where points can be added incrementally.
+    """
+    return HullZ(points, zs).result()
+
+
+def _to_fraction(x):
+    if isinstance(x, FracVector):
+        return x.to_fraction()
+    return any_to_fraction(x)
 
-       hull_zs is a list of z-values that the hull *would have* at that point, had this point not been included.
-       interior_zs is a list of z-values that the hull has at the interior points.
 
+def _dot(a, b):
+    return sum([x*y for x, y in zip(a, b)])
+
+
+def _lcm(a, b):
+    return a*b//gcd(a, b)
+
+
+def _int_det(m):
     """
-    hull_points = []
-    non_hull_points = []
-    hull_distances = []
-    closest_points = []
-    closest_weights = []
-
-    zvalues = len(zs)
-    coeffs = len(points[0])
-    #print("zvalues",zvalues)
-    #print("coeffs",coeffs)
-    for i in range(zvalues):
-        #print("SEND IN",[zs[j] for j in range(zvalues) if j != i])
-        a = FracVector.create([zs[j] for j in range(zvalues) if j != i])
-        b = [None]*coeffs
-        c = [None]*coeffs
-        includepoints = [j for j in range(len(points)) if i != j]
-
-        for j in range(coeffs):
-            b[j] = FracVector.create([points[x][j] for x in includepoints])
-            c[j] = points[i][j]
-
-#         if i == 0:
-#             print("A",a.to_floats())
-#             print("B",[x.to_floats() for x in b])
-#             print("C",c)
-
-        solution = simplex_le_solver(a, b, c)
-        val = solution[0]
-
-#         if i == 0:
-#             print("VAL",val)
-#             print("SOL",solution[1])
-#             print("MAPPED SOL",[(solution[1][i],includepoints[i]) for i in range(len(solution[1]))])
-#
-        closest = solution[1]
-        thisclosestpoints = []
-        thisclosestweights = []
-        for j in range(len(closest)):
-            sol = closest[j]
-            if sol != 0:
-                thisclosestpoints += [includepoints[j]]
-                thisclosestweights += [sol]
-                #print("I AM",i,"I disolve into:",includepoints[j],"*",float(sol),"(",j,")")
-
-        closest_points += [thisclosestpoints]
-        closest_weights += [thisclosestweights]
-        hull_distances += [zs[i] - val]
-
-        if zs[i] <= val:
-            hull_points += [i]
-        else:
-            non_hull_points += [i]
-
-    return {'hull_indices': hull_points,
-            'interior_indices': non_hull_points,
-            'hull_distances': hull_distances,
-            'competing_indices': closest_points,
-            'competing_weights': closest_weights,
-            }
+    Exact determinant of a square matrix of integers by fraction-free (Bareiss) elimination.
+    """
+    m = [list(row) for row in m]
+    n = len(m)
+    sign = 1
+    prev = 1
+    for k in range(n-1):
+        if m[k][k] == 0:
+            for i in range(k+1, n):
+                if m[i][k] != 0:
+                    m[k], m[i] = m[i], m[k]
+                    sign = -sign
+                    break
+            else:
+                return 0
+        for i in range(k+1, n):
+            for j in range(k+1, n):
+                m[i][j] = (m[i][j]*m[k][k] - m[i][k]*m[k][j])//prev
+        prev = m[k][k]
+    if n == 0:
+        return 1
+    return sign*m[n-1][n-1]
+
+
+def _int_cofactors(m):
+    """
+    Cofactor matrix of a square matrix of integers, i.e., cof[i][j] = (-1)^(i+j) * det(m without row i and column j)
+    """
+    n = len(m)
+    if n == 1:
+        return [(1,)]
+    if n == 2:
+        return [(m[1][1], -m[1][0]), (-m[0][1], m[0][0])]
+    if n == 3:
+        (a, b, c), (d, e, f), (g, h, i) = m
+        return [(e*i - f*h, f*g - d*i, d*h - e*g),
+                (c*h - b*i, a*i - c*g, b*g - a*h),
+                (b*f - c*e, c*d - a*f, a*e - b*d)]
+    if n == 4:
+        # Expansion in the 2x2 minors of the first two and last two rows
+        (a0, a1, a2, a3), (b0, b1, b2, b3), (c0, c1, c2, c3), (d0, d1, d2, d3) = m
+        s0 = a0*b1 - b0*a1
+        s1 = a0*b2 - b0*a2
+        s2 = a0*b3 - b0*a3
+        s3 = a1*b2 - b1*a2
+        s4 = a1*b3 - b1*a3
+        s5 = a2*b3 - b2*a3
+        t0 = c0*d1 - d0*c1
+        t1 = c0*d2 - d0*c2
+        t2 = c0*d3 - d0*c3
+        t3 = c1*d2 - d1*c2
+        t4 = c1*d3 - d1*c3
+        t5 = c2*d3 - d2*c3
+        return [(b1*t5 - b2*t4 + b3*t3, -b0*t5 + b2*t2 - b3*t1, b0*t4 - b1*t2 + b3*t0, -b0*t3 + b1*t1 - b2*t0),
+                (-a1*t5 + a2*t4 - a3*t3, a0*t5 - a2*t2 + a3*t1, -a0*t4 + a1*t2 - a3*t0, a0*t3 - a1*t1 + a2*t0),
+                (d1*s5 - d2*s4 + d3*s3, -d0*s5 + d2*s2 - d3*s1, d0*s4 - d1*s2 + d3*s0, -d0*s3 + d1*s1 - d2*s0),
+                (-c1*s5 + c2*s4 - c3*s3, c0*s5 - c2*s2 + c3*s1, -c0*s4 + c1*s2 - c3*s0, c0*s3 - c1*s1 + c2*s0)]
+    cof = []
+    for i in range(n):
+        rows = m[:i] + m[i+1:]
+        cof += [tuple((-1)**(i+j)*_int_det([row[:j] + row[j+1:] for row in rows]) for j in range(n))]
+    return cof
+
+
+class _HullFacet(object):
+
+    """
+    Lower hull facet spanned by one point per coordinate.
+
+    With the points' coordinates as the rows of a matrix M, the facet stores the cofactors and determinant of M,
+    so that the weights of a point c in the facet are lambda_i = c.cofs[i]/det, and the plane of the facet, so that
+    the hull value at c is c.plane/(det*plane_denom).
+    """
+    __slots__ = ('verts', 'cofs', 'det', 'plane', 'plane_denom', 'alive', 'below', 'parked')
+
+    def __init__(self, verts, cofs, det, plane, plane_denom):
+        self.verts = verts
+        self.cofs = cofs
+        self.det = det
+        self.plane = plane
+        self.plane_denom = plane_denom
+        self.alive = True
+        # Points located in the facet that are strictly below it, and points that are not
+        self.below = []
+        self.parked = []
+
+
+class _LowerHull(object):
+
+    """
+    Incremental, exact, lower convex hull of points given as rays (c, z), c = integer coordinates and
+    z = za/zb. The coordinates are homogeneous, i.e., the hull is over the points c/sum(c) with value
+    z/sum(c) in the simplex spanned by the 'roots', which must be the unit vectors with z = 0.
+
+    Points are inserted quickhull style, i.e., at any time, each point not in the hull is assigned to the facet
+    it is located in, and the hull is extended by the point furthest below a facet until no point is below the hull.
+    Points above the hull are not moved along when the facet they are in is replaced, but are located again
+    in the final hull when flush() is called.
+    """
+
+    def __init__(self, noms, zas, zbs, roots):
+        self.noms = noms
+        self.zas = zas
+        self.zbs = zbs
+        self.facets = set()
+        self.ridges = {}
+        self.vertex_facets = {}
+        self.worklist = []
+        self.dead_parked = []
+        # The facet of each point not in the hull (updated by flush), and the points that have moved or
+        # been added to the hull since changed was last cleared
+        self.location = {}
+        self.changed = set()
+        self.last = self._make_facet(tuple(sorted(roots)))
+        self._register(self.last)
+
+    def _make_facet(self, verts):
+        noms = self.noms
+        rows = [noms[v] for v in verts]
+        cofs = _int_cofactors(rows)
+        det = _dot(rows[0], cofs[0])
+        if det == 0:
+            return None
+        if det < 0:
+            det = -det
+            cofs = [tuple([-x for x in cof]) for cof in cofs]
+        plane_denom = 1
+        for v in verts:
+            plane_denom = _lcm(plane_denom, self.zbs[v])
+        plane = [0]*len(verts)
+        for v, cof in zip(verts, cofs):
+            w = self.zas[v]*(plane_denom//self.zbs[v])
+            if w != 0:
+                plane = [x + w*y for x, y in zip(plane, cof)]
+        return _HullFacet(verts, cofs, det, plane, plane_denom)
+
+    def _register(self, facet):
+        self.facets.add(facet)
+        verts = facet.verts
+        for k in range(len(verts)):
+            ridge = verts[:k] + verts[k+1:]
+            if ridge in self.ridges:
+                self.ridges[ridge].append(facet)
+            else:
+                self.ridges[ridge] = [facet]
+            if verts[k] in self.vertex_facets:
+                self.vertex_facets[verts[k]].add(facet)
+            else:
+                self.vertex_facets[verts[k]] = set([facet])
+
+    def _unregister(self, facet):
+        facet.alive = False
+        self.facets.discard(facet)
+        verts = facet.verts
+        for k in range(len(verts)):
+            ridge = verts[:k] + verts[k+1:]
+            facets = self.ridges[ridge]
+            facets.remove(facet)
+            if len(facets) == 0:
+                del self.ridges[ridge]
+            facets = self.vertex_facets[verts[k]]
+            facets.discard(facet)
+            if len(facets) == 0:
+                del self.vertex_facets[verts[k]]
+
+    def _neighbor(self, facet, k):
+        for other in self.ridges[facet.verts[:k] + facet.verts[k+1:]]:
+            if other is not facet:
+                return other
+        return None
+
+    def height(self, p, facet):
+        """
+        A number with the sign of the z-value distance from the plane of facet to point p.
+        """
+        return self.zas[p]*facet.det*facet.plane_denom - _dot(self.noms[p], facet.plane)*self.zbs[p]
+
+    def is_below(self, p, facet):
+        """
+        True if point p is strictly below the plane of facet.
+        """
+        return self.zas[p]*facet.det*facet.plane_denom < _dot(self.noms[p], facet.plane)*self.zbs[p]
+
+    def contains(self, facet, p):
+        """
+        True if point p is located in facet (including its boundary).
+        """
+        c = self.noms[p]
+        for cof in facet.cofs:
+            if _dot(c, cof) < 0:
+                return False
+        return True
+
+    def depth(self, p, facet):
+        """
+        Float approximation of how far point p is below facet, normalized per coordinate sum.
+        """
+        c = self.noms[p]
+        zb = self.zbs[p]
+        denom = facet.det*facet.plane_denom
+        return (_dot(c, facet.plane)*zb - self.zas[p]*denom)/(denom*zb*sum(c))
+
+    def locate(self, p):
+        """
+        Returns the facet that point p is located in, by walking from the last visited facet towards the point.
+        """
+        c = self.noms[p]
+        facet = self.last
+        for _step in range(len(self.facets)+1):
+            for k, cof in enumerate(facet.cofs):
+                if _dot(c, cof) < 0:
+                    facet = self._neighbor(facet, k)
+                    break
+            else:
+                self.last = facet
+                return facet
+            if facet is None:
+                break
+        # The walk always terminates for a lower hull, so this is only reached for points outside of the simplex
+        for facet in self.facets:
+            if self.contains(facet, p):
+                return facet
+        raise Exception("_LowerHull.locate: point outside of the hull: "+str(c))
+
+    def _park(self, facet, p):
+        facet.parked.append(p)
+        self.location[p] = facet
+        self.changed.add(p)
+
+    def _find(self, facets, p):
+        for facet in facets:
+            if self.contains(facet, p):
+                return facet
+        return self.locate(p)
+
+    def park(self, points):
+        """
+        Add points that are known to not end up in the hull (i.e., that are not below the hull, or are not
+        below the hull after other points given to add() are added.)
+        """
+        for p in points:
+            self._park(self.locate(p), p)
+
+    def add(self, points):
+        """
+        Add points to the hull.
+        """
+        for p in points:
+            facet = self.locate(p)
+            if self.is_below(p, facet):
+                if len(facet.below) == 0:
+                    self.worklist.append(facet)
+                facet.below.append(p)
+            else:
+                self._park(facet, p)
+        while len(self.worklist) > 0:
+            facet = self.worklist.pop()
+            if not facet.alive or len(facet.below) == 0:
+                continue
+            p = max(facet.below, key=lambda x: self.depth(x, facet))
+            facet.below.remove(p)
+            self._insert(p, facet)
+
+    def _insert(self, q, start):
+        self.changed.add(q)
+        # Collect all facets visible from q, i.e., with q strictly below the plane, and the ridges on their
+        # boundary ('the horizon'), including ridges on the edge of the simplex.
+        visible = set([start])
+        invisible = set()
+        stack = [start]
+        horizon = []
+        while len(stack) > 0:
+            facet = stack.pop()
+            for k in range(len(facet.verts)):
+                other = self._neighbor(facet, k)
+                if other is not None:
+                    if other in visible:
+                        continue
+                    if other not in invisible:
+                        if self.is_below(q, other):
+                            visible.add(other)
+                            stack.append(other)
+                            continue
+                        invisible.add(other)
+                horizon.append(facet.verts[:k] + facet.verts[k+1:])
+
+        old_verts = set()
+        for facet in visible:
+            self._unregister(facet)
+            old_verts.update(facet.verts)
+
+        # Cone from q to the horizon. Facets of zero volume come from ridges on the edge of the simplex that q is on
+        new = []
+        for ridge in horizon:
+            facet = self._make_facet(tuple(sorted(ridge + (q,))))
+            if facet is not None:
+                self._register(facet)
+                new.append(facet)
+        self.last = new[0]
+
+        relocate = []
+        for facet in visible:
+            relocate += facet.below
+            facet.below = None
+            if len(facet.parked) > 0:
+                self.dead_parked.append(facet)
+        for p in relocate:
+            facet = self._find(new, p)
+            if self.is_below(p, facet):
+                if len(facet.below) == 0:
+                    self.worklist.append(facet)
+                facet.below.append(p)
+            else:
+                self._park(facet, p)
+        # Vertices without facets left are no longer part of the hull
+        for v in old_verts:
+            if v not in self.vertex_facets:
+                self._park(self._find(new, v), v)
+
+    def flush(self):
+        """
+        Move all points not in the hull to the facets they are located in.
+        """
+        points = []
+        for facet in self.dead_parked:
+            points += facet.parked
+            facet.parked = []
+        self.dead_parked = []
+        # Walk from point to point in an order where consecutive points tend to be close
+        noms = self.noms
+        points.sort(key=lambda p: [x/sum(noms[p]) for x in noms[p]])
+        for p in points:
+            self._park(self.locate(p), p)
+
+
+class HullZ(object):
+
+    """
+    Incremental version of hull_z: a convex half-hull over negative z-values of points with non-negative
+    coordinates, that can be extended with more points without recalculating everything.
+
+    The hull is computed exactly, in rational arithmetic, as the lower convex hull of the points normalized to
+    coordinate sum one, with a reference point of z = 0 at each unit vector (which accounts for the remainder
+    when a combination of points does not exhaust all coordinates of a point.) Adding a point only updates the
+    part of the hull it affects, and results are only recalculated for the points affected.
+    """
+
+    def __init__(self, points=None, zs=None):
+        self.dim = None
+        self._zs = []
+        self._noms = []
+        self._zas = []
+        self._zbs = []
+        self._scales = []
+        # Points that are identical to the reference point at a unit vector
+        self._references = {}
+        self._pending = []
+        self._hull = None
+        self._vertex_data = {}
+        self._recalculate_all = False
+        self._distances = []
+        self._competing_indices = []
+        self._competing_weights = []
+        self._on_hull = []
+        self._result = None
+        if points is not None:
+            self.add_points(points, zs)
+
+    @classmethod
+    def create(cls, points=None, zs=None):
+        return cls(points, zs)
+
+    def _append(self, fracs, z):
+        lcd = 1
+        for x in fracs:
+            lcd = _lcm(lcd, x.denominator)
+        z = z*lcd
+        self._noms.append(tuple([int(x*lcd) for x in fracs]))
+        self._zas.append(z.numerator)
+        self._zbs.append(z.denominator)
+        self._scales.append(lcd)
+
+    def add_point(self, point, z):
+        """
+        Add a point, returns its index.
+        """
+        fracs = [_to_fraction(x) for x in point]
+        if self.dim is None:
+            self.dim = len(fracs)
+            for i in range(self.dim):
+                self._append([Fraction(int(i == j)) for j in range(self.dim)], Fraction(0))
+        elif len(fracs) != self.dim:
+            raise Exception("HullZ.add_point: point has "+str(len(fracs))+" coordinates, expected "+str(self.dim))
+        if sum(fracs) <= 0 or min(fracs) < 0:
+            raise Exception("HullZ.add_point: coordinates must be non-negative with a positive sum")
+        z = _to_fraction(z)
+        self._zs.append(z)
+        self._append(fracs, z)
+        nonzero = [i for i in range(self.dim) if fracs[i] != 0]
+        if z == 0 and len(nonzero) == 1 and nonzero[0] not in self._references:
+            self._references[nonzero[0]] = len(self._noms)-1
+            self._vertex_data = {}
+            self._recalculate_all = True
+        self._pending.append(len(self._noms)-1)
+        self._distances.append(None)
+        self._competing_indices.append(None)
+        self._competing_weights.append(None)
+        self._on_hull.append(None)
+        self._result = None
+        return len(self._zs)-1
+
+    def add_points(self, points, zs):
+        """
+        Add a list of points with corresponding z values.
+        """
+        for point, z in zip(points, zs):
+            self.add_point(point, z)
+
+    def _update(self):
+        if len(self._pending) == 0:
+            return
+        if self._hull is None:
+            self._hull = _LowerHull(self._noms, self._zas, self._zbs, range(self.dim))
+        hull = self._hull
+        pending = self._pending
+        self._pending = []
+        # A new point only changes the hull value of a hull point if it is below the plane that gave that value,
+        # i.e., the plane of the facet below the hull point in the hull of all other points
+        changed = set()
+        for p, data in list(self._vertex_data.items()):
+            plane = data[3]
+            for q in pending:
+                if hull.is_below(q, plane):
+                    del self._vertex_data[p]
+                    changed.add(p)
+                    break
+        # Only the point lowest per coordinate sum for each direction, and with z < 0, can be in the hull
+        lowest = {}
+        park = []
+        for p in pending:
+            c = self._noms[p]
+            if self._zas[p] >= 0:
+                park.append(p)
+                continue
+            g = 0
+            for x in c:
+                g = gcd(g, x)
+            key = tuple([x//g for x in c])
+            other = lowest.get(key)
+            if other is None:
+                lowest[key] = p
+            elif self._zas[p]*self._zbs[other]*sum(self._noms[other]) < self._zas[other]*self._zbs[p]*sum(c):
+                lowest[key] = p
+                park.append(other)
+            else:
+                park.append(p)
+        hull.park(park)
+        hull.add(lowest.values())
+        hull.flush()
+        changed.update(hull.changed)
+        hull.changed = set()
+        if self._recalculate_all:
+            changed = range(self.dim, len(self._noms))
+            self._recalculate_all = False
+
+        d = self.dim
+        for p in changed:
+            if p < d:
+                continue
+            if p in hull.vertex_facets:
+                dist, indices, weights, _plane = self._vertex_result(p)
+            else:
+                self._vertex_data.pop(p, None)
+                facet = hull.location[p]
+                indices, weights = self._weights(p, facet)
+                dist = self._distance(p, facet)
+            self._distances[p-d] = FracVector(dist.numerator, dist.denominator)
+            self._competing_indices[p-d] = indices
+            self._competing_weights[p-d] = weights
+            self._on_hull[p-d] = (dist <= 0)
+
+    def _weights(self, p, facet):
+        c = self._noms[p]
+        d = self.dim
+        indices = []
+        weights = []
+        for v, cof in zip(facet.verts, facet.cofs):
+            nom = _dot(c, cof)
+            if nom == 0:
+                continue
+            w = Fraction(nom*self._scales[v], facet.det*self._scales[p])
+            if v < d:
+                # Report a point identical to the reference point, if there is one
+                v = self._references.get(v)
+                if v is None or v == p:
+                    continue
+                w /= Fraction(sum(self._noms[v]), self._scales[v])
+            indices.append(v - d)
+            weights.append(FracVector(w.numerator, w.denominator))
+        order = sorted(range(len(indices)), key=lambda i: indices[i])
+        return [indices[i] for i in order], [weights[i] for i in order]
+
+    def _distance(self, p, facet):
+        val = Fraction(_dot(self._noms[p], facet.plane), facet.det*facet.plane_denom*self._scales[p])
+        return self._zs[p - self.dim] - val
+
+    def _vertex_result(self, p):
+        data = self._vertex_data.get(p)
+        if data is not None:
+            return data
+        hull = self._hull
+        d = self.dim
+        star = hull.vertex_facets[p]
+        # Without p, the hull can only change in the region covered by the facets with p as a vertex. Start from
+        # the hull of the other vertices of these facets, and add the points inside that region.
+        local = _LowerHull(self._noms, self._zas, self._zbs, range(d))
+        neighbors = set()
+        for facet in star:
+            neighbors.update(facet.verts)
+        local.add([v for v in neighbors if v >= d and v != p])
+        # By convexity, the hull of these points is, inside a facet of the star, at most the hull z-value plus
+        # the weight of p times how much the value at p goes up. Only points below that bound need to be added.
+        facet = local.locate(p)
+        rise_nom = _dot(self._noms[p], facet.plane)*self._zbs[p] - self._zas[p]*facet.det*facet.plane_denom
+        rise_denom = facet.det*facet.plane_denom*self._zbs[p]
+        candidates = []
+        for facet in star:
+            cof = facet.cofs[facet.verts.index(p)]
+            denom = facet.det*facet.plane_denom
+            for x in facet.parked:
+                if x < d:
+                    continue
+                c = self._noms[x]
+                zb = self._zbs[x]
+                if (self._zas[x]*denom - _dot(c, facet.plane)*zb)*rise_denom < _dot(c, cof)*facet.plane_denom*zb*rise_nom:
+                    candidates.append(x)
+        local.add(candidates)
+        # If the region is not convex the facet below p may also involve other hull points.
+        # Add any of them that are below it, until there are none.
+        while True:
+            facet = local.locate(p)
+            below = self._vertices_below(p, facet)
+            if len(below) == 0:
+                break
+            local.add(below)
+        indices, weights = self._weights(p, facet)
+        data = (self._distance(p, facet), indices, weights, facet)
+        self._vertex_data[p] = data
+        return data
+
+    def _vertices_below(self, p, plane):
+        # The plane minus the hull is a concave function, which is >= 0 at p, so the region where it is >= 0
+        # is convex and contains p. Hence, all hull points below the plane are found by searching outwards from p
+        # through the hull points that are not above it.
+        hull = self._hull
+        seen = set([p])
+        stack = [p]
+        below = []
+        while len(stack) > 0:
+            v = stack.pop()
+            for facet in hull.vertex_facets[v]:
+                for x in facet.verts:
+                    if x in seen:
+                        continue
+                    seen.add(x)
+                    height = hull.height(x, plane)
+                    if height <= 0:
+                        stack.append(x)
+                        if height < 0:
+                            below.append(x)
+        return below
+
+    def result(self):
+        """
+        Returns the same data as hull_z for all points added so far.
+        """
+        if self._result is None:
+            self._update()
+            n = len(self._zs)
+            self._result = {'hull_indices': [i for i in range(n) if self._on_hull[i]],
+                            'interior_indices': [i for i in range(n) if not self._on_hull[i]],
+                            'hull_distances': list(self._distances),
+                            'competing_indices': list(self._competing_indices),
+                            'competing_weights': list(self._competing_weights),
+                            }
+        return self._result
+
+    @property
+    def hull_indices(self):
+        return self.result()['hull_indices']
+
+    @property
+    def interior_indices(self):
+        return self.result()['interior_indices']
+
+    @property
+    def hull_distances(self):
+        return self.result()['hull_distances']
+
+    @property
+    def competing_indices(self):
+        return self.result()['competing_indices']
+
+    @property
+    def competing_weights(self):
+        return self.result()['competing_weights']
+
 
 # http://en.literateprograms.org/Quickhull_(Python,_arrays)
 
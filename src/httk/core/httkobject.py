@@ -15,8 +15,8 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import inspect
-from httk.core.crypto import tuple_to_hexhash
+import inspect, hashlib
+from httk.core.crypto import tuple_to_str, hexhash_bytes
 from httk.core.basic import is_sequence
 
 
@@ -146,45 +146,59 @@ class HttkObject(object):
             raise Exception("HttkObject.use: found no way to convert:"+repr(old)+" into "+repr(cls))
 
     def to_tuple(self, use_hexhash=False):
-        self.types_resolved = {}
-        keydict = self.types()['keydict']
-        params = self.__init__.__code__.co_varnames[1:]
+        types = self.types()
+        keydict = types['keydict']
 
-        keys = [self.types()['name']]
-        for param in params:
-            if param in keydict:
-                val = getattr(self, param)
-                try:
-                    if issubclass(keydict[param], HttkObject):
-                        val = keydict[param].use(val)
-                except TypeError as e:
-                    pass
-                if use_hexhash and hasattr(val, 'hexhash'):
-                    val = val.hexhash
-                elif hasattr(val, 'to_tuple'):
-                    val = val.to_tuple()
-                elif is_sequence(val):
-                    out = []
-                    for x in val:
-                        if use_hexhash and hasattr(x, 'hexhash'):
-                            out += [x.hexhash]
-                        elif hasattr(x, 'to_tuple'):
-                            out += [x.to_tuple()]
-                        else:
-                            out += [x]
-                    val = tuple(out)
-                keys += [(param, val)]
+        keys = [types['name']]
+        for param in self.__init__.__code__.co_varnames[1:]:
+            if param not in keydict:
+                continue
+            param_type = keydict[param]
+            val = getattr(self, param)
+            try:
+                if issubclass(param_type, HttkObject):
+                    val = param_type.use(val)
+            except TypeError as e:
+                pass
+            if use_hexhash and hasattr(val, 'hexhash'):
+                val = val.hexhash
+            elif hasattr(val, 'to_tuple'):
+                val = val.to_tuple()
+            elif is_sequence(val):
+                out = []
+                for x in val:
+                    if use_hexhash and hasattr(x, 'hexhash'):
+                        out += [x.hexhash]
+                    elif hasattr(x, 'to_tuple'):
+                        out += [x.to_tuple()]
+                    else:
+                        out += [x]
+                val = tuple(out)
+            keys += [(param, val)]
 
         keys = tuple(keys)
         #print("TUPLE:",keys)
         return keys
 
+    def canonical_bytes(self):
+        """
+        Returns the canonical serialization of the object: the class name and the init parameters, where
+        HttkObjects are represented by their hexhash. hexhash is the sha1 hash of these bytes, and objects are
+        equal if they are equal.
+
+        The serialization is computed once per instance, since HttkObjects are not supposed to change.
+        Setting _hexhash = None makes both be computed again.
+        """
+        if getattr(self, '_hexhash', None) is None or getattr(self, '_canonical_bytes', None) is None:
+            data = hexhash_bytes(tuple_to_str(self.to_tuple(use_hexhash=True)))
+            self._canonical_bytes = data
+            self._hexhash = hashlib.sha1(data).hexdigest()
+        return self._canonical_bytes
+
     @httk_typed_property(str)
     def hexhash(self):
-        if not hasattr(self, '_hexhash') or self._hexhash is None:
-            t = self.to_tuple(use_hexhash=True)
-            self._hexhash = tuple_to_hexhash(t)
-
+        if getattr(self, '_hexhash', None) is None:
+            self.canonical_bytes()
         return self._hexhash
 
     def get_codependent_data(self):
@@ -193,7 +207,9 @@ class HttkObject(object):
         return []
 
     def __eq__(self, other):
-        if isinstance(other, self.__class__) and self.to_tuple() == other.to_tuple():
+        if self is other:
+            return True
+        if isinstance(other, self.__class__) and self.canonical_bytes() == other.canonical_bytes():
             return True
         else:
             return False
@@ -244,3 +260,41 @@ class HttkPluginPlaceholder(object):
             raise AttributeError("HttkPluginPlaceholder: Attempt to use plugin method on object of class:"+str(obj.__class__)+". You need to load the appropriate plugin first using an appropriate python import.")
         else:
             raise AttributeError("HttkPluginPlaceholder: Attempt to use plugin method on object of class:"+str(obj.__class__)+". You need to load the appropriate plugin first using: "+self.plugininfo)
+
+
+def main():
+    from httk.core.vectors import FracVector
+    from httk.core.crypto import tuple_to_hexhash
+    from httk.atomistic import Structure
+
+    def rocksalt(a="2.8"):
+        return Structure.create(uc_basis=FracVector.create([[0, a, a], [a, 0, a], [a, a, 0]]),
+                                uc_reduced_coordgroups=[[["1/8", "1/8", "1/8"]], [["5/8", "5/8", "5/8"]]],
+                                assignments=['Na', 'Cl'])
+
+    # hexhash is the sha1 hash of canonical_bytes, and the same as before the serialization was memoized
+    # (the hash of to_tuple with hexhashes for the HttkObjects), so that stored hexhashes stay valid
+    struct = rocksalt()
+    assert struct.hexhash == 'f6a598079d4b675e5528ee00efdda6c9677cadd2'
+    assert struct.rc_cell.hexhash == '3ddaa3cbb8394220b48c74ec3c673be23d634e9b'
+    assert hashlib.sha1(struct.canonical_bytes()).hexdigest() == struct.hexhash
+    for obj in [struct, struct.rc_cell, struct.rc_sites, struct.assignments]:
+        assert obj.hexhash == tuple_to_hexhash(obj.to_tuple(use_hexhash=True))
+
+    # Computed once, and again (with the same result) after _hexhash is reset
+    data = struct.canonical_bytes()
+    assert struct.canonical_bytes() is data
+    struct._hexhash = None
+    assert struct.canonical_bytes() == data and struct.canonical_bytes() is not data
+    assert struct.hexhash == 'f6a598079d4b675e5528ee00efdda6c9677cadd2'
+
+    # Equality is equality of the canonical serialization
+    other = rocksalt()
+    assert other == struct and other.canonical_bytes() == struct.canonical_bytes()
+    assert not (rocksalt("2.9") == struct)
+    assert not (struct.rc_cell == struct)
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
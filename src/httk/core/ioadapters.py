@@ -316,6 +316,13 @@ def zdecompressor(f, mode, *args):
 def cleveropen(filename, mode, *args):
     basename_no_ext, ext = os.path.splitext(filename)
 
+    if ext.lower() in ('.bz2', '.gz') and not os.path.exists(filename):
+        # A file in a packed run directory, see httk.core.runarchive
+        from httk.core.runarchive import open_archived
+        f = open_archived(filename, mode)
+        if f is not None:
+            return f
+
     if ext.lower() == '.bz2':
         return bz2open(filename, mode, *args)
     elif ext.lower() == '.gz':
@@ -351,6 +358,10 @@ def cleveropen(filename, mode, *args):
             return zdecompressor(filename+".Z", mode, *args)
         except (IOError, NameError):
             pass
+        from httk.core.runarchive import open_archived
+        f = open_archived(filename, mode)
+        if f is not None:
+            return f
         if not os.path.exists(filename):
             raise Exception("IOAdapters.cleveropen: file not found: "+str(filename))
         else:
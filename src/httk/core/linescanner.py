@@ -0,0 +1,448 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Fast scanning of large text files for lines containing given literal strings (used by micro_pyawk.)
+
+LineScanner(ioa, literals) iterates over the lines of a file that contain at least one of the strings in
+literals. Rather than splitting the whole file into lines, the file is searched (as bytes) for the literals,
+and only the lines where they are found are cut out and decoded. Plain files are memory mapped; bz2 and gz
+compressed files (and other io objects) are decompressed and searched in large blocks.
+
+required_literal(regex) gives a string that must be present in every line that the regular expression
+matches, if there is one, so that a set of regular expressions can be used to pick the literals.
+"""
+import sys, os, re, mmap
+
+try:
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+_blocksize = 4*1024*1024
+
+_repeats = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+
+def _literal_runs(parsed):
+    # The runs of consecutive literal characters that every match of the parsed pattern must contain
+    runs = []
+    current = []
+    for op, av in parsed:
+        if op == sre_constants.LITERAL and av != ord('\n'):
+            current.append(av)
+            continue
+        if len(current) > 0:
+            runs.append(current)
+            current = []
+        if op == sre_constants.SUBPATTERN:
+            runs += _literal_runs(av[-1])
+        elif op in _repeats and av[0] >= 1:
+            runs += _literal_runs(av[2])
+    if len(current) > 0:
+        runs.append(current)
+    return runs
+
+
+def _has_scoped_flags(parsed):
+    # Whether any group of the parsed pattern sets or clears flags for its own content, as in (?i:...)
+    for op, av in parsed:
+        if op == sre_constants.SUBPATTERN and len(av) == 4 and (av[1] or av[2]):
+            return True
+        for item in (av if isinstance(av, (tuple, list)) else [av]):
+            if isinstance(item, sre_parse.SubPattern) and _has_scoped_flags(item):
+                return True
+            if isinstance(item, (tuple, list)) and any(isinstance(x, sre_parse.SubPattern) and _has_scoped_flags(x) for x in item):
+                return True
+    return False
+
+
+def required_literal(regex):
+    """
+    Returns the longest string that is present in every string that regex (a string or compiled regular
+    expression) can match with search(), or None if there is no such string that can be determined.
+    """
+    if isinstance(regex, str):
+        pattern, flags = regex, 0
+    else:
+        pattern, flags = regex.pattern, regex.flags
+    if not isinstance(pattern, str):
+        return None
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+    if (flags | parsed.state.flags) & re.IGNORECASE or _has_scoped_flags(parsed):
+        return None
+    runs = _literal_runs(parsed)
+    if len(runs) == 0:
+        return None
+    return u''.join(chr(x) if sys.version_info[0] > 2 else unichr(x) for x in max(runs, key=len))
+
+
+def _resolve_filename(filename):
+    # The same alternatives as cleveropen tries, for a file that does not exist
+    if os.path.isfile(filename):
+        return filename
+    for ext in ['.bz2', '.BZ2', '.gz', '.GZ']:
+        if os.path.isfile(filename+ext):
+            return filename+ext
+    return None
+
+
+class LineScanner(object):
+    """
+    Iterates over the lines of ioa (a filename or any io adapter) that contain at least one of the strings in
+    literals (all lines if literals is None), as str including the line ending.
+
+    With reverse=True the lines are given from the end of the file towards the beginning. For plain files
+    this reads only as much of the file as needed; other input is read in full first.
+
+    While iterating forward, next_lines(n) returns the n lines following the last line given, regardless of
+    whether they contain a literal (e.g., for reading a block of numbers following a header), and the
+    iteration then continues after them.
+    """
+
+    def __init__(self, ioa, literals=None, reverse=False, blocksize=_blocksize):
+        self.reverse = reverse
+        self.blocksize = blocksize
+        if literals is not None:
+            literals = sorted(set(x.encode('utf-8') if not isinstance(x, bytes) else x for x in literals), key=len, reverse=True)
+            if len(literals) == 0 or any(len(x) == 0 for x in literals):
+                literals = None
+        self._literals = literals
+        self._hits = None
+
+        self._mmap = None
+        self._file = None
+        self._stream = None
+        self._close_file = False
+        self._buf = b''
+        self._pos = 0
+        self._end = 0
+        self._final = False
+
+        from httk.core.ioadapters import IoAdapterFilename, IoAdapterString, IoAdapterStringList, IoAdapterFileReader, cleveropen
+
+        filename = None
+        if isinstance(ioa, str):
+            filename = ioa
+        elif isinstance(ioa, IoAdapterFilename):
+            filename = ioa.filename
+
+        resolved = _resolve_filename(filename) if filename is not None else None
+        archived = None
+        if filename is not None and resolved is None:
+            # A file in a packed run directory, see httk.core.runarchive
+            from httk.core.runarchive import open_archived
+            archived = open_archived(filename, 'rb')
+
+        if resolved is not None:
+            filename = resolved
+            ext = os.path.splitext(filename)[1].lower()
+            if ext == '.bz2':
+                import bz2
+                self._file = bz2.BZ2File(filename, 'rb')
+            elif ext in ('.gz', '.z'):
+                import gzip
+                self._file = gzip.GzipFile(filename, 'rb')
+            else:
+                self._file = open(filename, 'rb')
+                if os.fstat(self._file.fileno()).st_size > 0:
+                    self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._close_file = True
+        elif archived is not None:
+            self._file = archived
+            self._close_file = True
+        elif isinstance(ioa, IoAdapterString):
+            self._buf = self._newlines(self._encode(ioa.string))
+        elif isinstance(ioa, IoAdapterStringList):
+            self._buf = self._newlines(self._encode("\n".join(ioa.stringlist)))
+        else:
+            if filename is not None:
+                # Let cleveropen give the error for a file that cannot be found
+                cleveropen(filename, 'r')
+            ioa = IoAdapterFileReader.use(ioa)
+            self._file = ioa.file
+            self._stream = ioa
+
+        if self._mmap is not None and self._mmap.find(b'\r') >= 0:
+            # Line endings other than \n are converted, which needs a copy of the file
+            self._buf = self._newlines(self._mmap[:])
+            self._mmap.close()
+            self._mmap = None
+            self._end = len(self._buf)
+            self._final = True
+        elif self._mmap is not None:
+            self._buf = self._mmap
+            self._end = len(self._mmap)
+            self._final = True
+        elif self._file is not None:
+            self._fill()
+        else:
+            self._end = len(self._buf)
+            self._final = True
+
+    @staticmethod
+    def _encode(data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return data
+
+    @staticmethod
+    def _newlines(data):
+        # Lines may end with \n, \r\n or \r (as with universal newlines in text mode), all are made \n
+        if b'\r' in data:
+            data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        return data
+
+    @staticmethod
+    def _decode(line):
+        if sys.version_info[0] > 2:
+            return line.decode('utf-8', 'replace')
+        return line
+
+    def _find(self, pos, end):
+        # The first occurrence of any of the literals in self._buf[pos:end], as (start, stop), or None.
+        # Each literal is searched for separately (str.find is much faster than a regex alternation) and the
+        # positions are remembered until passed, so that rare literals do not make the search quadratic.
+        # self._hits must be reset when self._buf or end changes.
+        if self._hits is None:
+            self._hits = [None]*len(self._literals)
+        best = None
+        for k, literal in enumerate(self._literals):
+            hit = self._hits[k]
+            if hit is None or 0 <= hit < pos:
+                hit = self._buf.find(literal, pos, end)
+                self._hits[k] = hit
+            if hit >= 0 and (best is None or hit < best[0]):
+                best = (hit, hit + len(literal))
+        return best
+
+    def _fill(self):
+        # Read the next block, keeping the unprocessed part of the buffer; self._end is set to the end of the
+        # last complete line
+        self._hits = None
+        while True:
+            chunk = self._encode(self._file.read(self.blocksize))
+            while chunk.endswith(b'\r'):
+                # Do not split a \r\n between blocks
+                more = self._encode(self._file.read(1))
+                if len(more) == 0:
+                    break
+                chunk += more
+            chunk = self._newlines(chunk)
+            self._buf = self._buf[self._pos:] + chunk
+            self._pos = 0
+            if len(chunk) == 0:
+                self._final = True
+                self._end = len(self._buf)
+                return
+            self._end = self._buf.rfind(b'\n') + 1
+            if self._end > 0:
+                return
+
+    def _next_line(self):
+        # The next line from self._pos, without looking for the literals, or None at the end of the input
+        while True:
+            if self._pos < self._end:
+                eol = self._buf.find(b'\n', self._pos, self._end)
+                eol = self._end if eol < 0 else eol + 1
+                line = self._buf[self._pos:eol]
+                self._pos = eol
+                return line
+            if self._final:
+                return None
+            self._fill()
+
+    def _next_candidate(self):
+        if self._literals is None:
+            return self._next_line()
+        while True:
+            m = self._find(self._pos, self._end)
+            if m is not None:
+                start = self._buf.rfind(b'\n', self._pos, m[0]) + 1
+                if start == 0:
+                    start = self._pos
+                eol = self._buf.find(b'\n', m[1], self._end)
+                eol = self._end if eol < 0 else eol + 1
+                self._pos = eol
+                return self._buf[start:eol]
+            self._pos = self._end
+            if self._final:
+                return None
+            self._fill()
+
+    def next_lines(self, n):
+        """
+        Returns a list of the (at most) n lines following the last line given.
+        """
+        if self.reverse:
+            raise Exception("LineScanner.next_lines: not available when scanning in reverse.")
+        lines = []
+        for _i in range(n):
+            line = self._next_line()
+            if line is None:
+                break
+            lines.append(self._decode(line))
+        return lines
+
+    def _block_candidates(self, start, end):
+        lines = []
+        pos = start
+        self._hits = None
+        while pos < end:
+            if self._literals is None:
+                eol = self._buf.find(b'\n', pos, end)
+                linestart = pos
+            else:
+                m = self._find(pos, end)
+                if m is None:
+                    break
+                linestart = self._buf.rfind(b'\n', pos, m[0]) + 1
+                if linestart == 0:
+                    linestart = pos
+                eol = self._buf.find(b'\n', m[1], end)
+            eol = end if eol < 0 else eol + 1
+            lines.append(self._buf[linestart:eol])
+            pos = eol
+        return lines
+
+    def _reverse_lines(self):
+        if self._mmap is None:
+            # Not randomly accessible, collect all candidates
+            lines = []
+            while True:
+                line = self._next_candidate()
+                if line is None:
+                    break
+                lines.append(line)
+            for line in reversed(lines):
+                yield line
+            return
+        # Smaller blocks than forward, since a search for the last occurrence of something usually ends early
+        blocksize = max(1, self.blocksize//16)
+        end = self._end
+        while end > 0:
+            start = max(0, end - blocksize)
+            if start > 0:
+                # Move back to the beginning of a line
+                start = self._buf.rfind(b'\n', 0, start) + 1
+            for line in reversed(self._block_candidates(start, end)):
+                yield line
+            end = start
+
+    def __iter__(self):
+        try:
+            if self.reverse:
+                for line in self._reverse_lines():
+                    yield self._decode(line)
+            else:
+                while True:
+                    line = self._next_candidate()
+                    if line is None:
+                        break
+                    yield self._decode(line)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._buf = b''
+        self._pos = 0
+        self._end = 0
+        self._final = True
+        if self._file is not None and self._close_file:
+            self._file.close()
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        self._file = None
+
+
+def main():
+    import tempfile, shutil, bz2, gzip
+    from httk.core.ioadapters import IoAdapterString
+    from httk.core.basic import micro_pyawk
+
+    assert required_literal("^ *energy *without *entropy= *([^ ]+) *energy\\(sigma->0\\) *= *([^ ]+) *$") == "energy(sigma->0)"
+    assert required_literal("(abc|xyz)q") == "q"
+    assert required_literal("a(bcd)+") == "bcd"
+    assert required_literal("[0-9]+") is None
+    assert required_literal(re.compile("abc", re.IGNORECASE)) is None
+    assert required_literal("(?i:energy)x") is None
+    assert required_literal("x(?:a|(?i:energy))+y") is None
+    assert required_literal("(?:energy)x") == "energyx"
+    results = {}
+    micro_pyawk(IoAdapterString("ENERGY x\nnothing\n"), [["(?i:energy) x", None, lambda results, match: results.setdefault('hit', []).append(match.group(0))]], results)
+    assert results == {'hit': ['ENERGY x']}
+    # Lines ending with a lone \r
+    results = {}
+    micro_pyawk(IoAdapterString("a\rfoo 1\rbar\n"), [["^foo", None, lambda results, match: results.setdefault('x', match.string.split()[1])]], results)
+    assert results == {'x': '1'}
+
+    lines = ["line %d %s\n" % (i, "match" if i % 7 == 3 else "other") for i in range(2000)] + ["last match"]
+    expected = [x for x in lines if "match" in x]
+    text = "".join(lines)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tmpdir, 'plain'), 'w') as f:
+            f.write(text)
+        f = bz2.BZ2File(os.path.join(tmpdir, 'compressed.bz2'), 'wb')
+        f.write(text.encode('utf-8'))
+        f.close()
+        f = gzip.GzipFile(os.path.join(tmpdir, 'compressed.gz'), 'wb')
+        f.write(text.encode('utf-8'))
+        f.close()
+        sources = [os.path.join(tmpdir, 'plain'), os.path.join(tmpdir, 'compressed.bz2'), os.path.join(tmpdir, 'compressed'),
+                   os.path.join(tmpdir, 'compressed.gz'), IoAdapterString(text)]
+        for source in sources:
+            # A small block size to test lines crossing block boundaries
+            for blocksize in [100, _blocksize]:
+                assert list(LineScanner(source, ["match"], blocksize=blocksize)) == expected
+                assert list(LineScanner(source, ["match"], reverse=True, blocksize=blocksize)) == expected[::-1]
+                assert list(LineScanner(source, None, blocksize=blocksize)) == lines
+                assert list(LineScanner(source, ["3 match", "10 other"], blocksize=blocksize)) == [x for x in lines if "3 match" in x or "10 other" in x]
+                scanner = LineScanner(source, ["line 1000 "], blocksize=blocksize)
+                for line in scanner:
+                    assert scanner.next_lines(2) == lines[1001:1003]
+                with open(os.path.join(tmpdir, 'plain')) as f:
+                    assert list(LineScanner(f, ["match"], blocksize=blocksize)) == expected
+        with open(os.path.join(tmpdir, 'empty'), 'w') as f:
+            pass
+        assert list(LineScanner(os.path.join(tmpdir, 'empty'), ["match"])) == []
+        # \r\n and lone \r line endings, also split between blocks
+        for newline in ['\r\n', '\r']:
+            with open(os.path.join(tmpdir, 'newlines'), 'wb') as f:
+                f.write(text.replace('\n', newline).encode('utf-8'))
+            f = bz2.BZ2File(os.path.join(tmpdir, 'newlines.bz2'), 'wb')
+            f.write(text.replace('\n', newline).encode('utf-8'))
+            f.close()
+            for source in [os.path.join(tmpdir, 'newlines'), os.path.join(tmpdir, 'newlines.bz2')]:
+                for blocksize in [99, 100, _blocksize]:
+                    assert list(LineScanner(source, None, blocksize=blocksize)) == lines
+                    assert list(LineScanner(source, ["match"], reverse=True, blocksize=blocksize)) == expected[::-1]
+    finally:
+        shutil.rmtree(tmpdir)
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
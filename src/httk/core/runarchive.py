@@ -0,0 +1,615 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Packed archives of finished run directories (ht.run.*).
+
+pack_run replaces a run directory <dir> with a single file <dir>.htpack. The files in it are split in blocks that
+are compressed independently (in parallel with processes > 1), and an index at the end of the archive gives the
+position of every block, so that any part of any member can be read without decompressing the rest.
+
+Files in a packed run are read with RunArchive, or transparently by filename: cleveropen (and thereby
+IoAdapterFilename, micro_pyawk, etc.) falls back on open_archived for a path below a directory that does not
+exist but has been packed. The index keeps the sha256 sum of every member, which the manifest tooling uses to
+list packed files by their logical content, so that manifests are the same before and after packing.
+
+Layout: a header (_magic), the compressed blocks, the index (zlib compressed json), and a trailer giving the
+position and length of the index.
+"""
+import os, io, sys, stat, json, zlib, shutil, struct, hashlib
+from collections import deque
+
+archive_suffix = '.htpack'
+
+_magic = b'HTPACK01'
+_trailer_magic = b'HTPACKIX'
+_trailer = struct.Struct('<QQ8s')
+_blocksize = 1 << 20
+# Members with these endings are already compressed and are stored as they are
+_stored_suffixes = ('.bz2', '.gz', '.xz', '.z', '.zip', '.tgz', '.htpack')
+
+
+def _codec(name):
+    # (compress(data, level), decompress(data)) for a codec name
+    if name == 'none':
+        return (lambda data, level: data), (lambda data: data)
+    elif name == 'zlib':
+        return (lambda data, level: zlib.compress(data, 6 if level is None else level)), zlib.decompress
+    elif name == 'bz2':
+        import bz2
+        return (lambda data, level: bz2.compress(data, 9 if level is None else level)), bz2.decompress
+    elif name == 'lzma':
+        try:
+            import lzma
+        except ImportError:
+            raise Exception("runarchive: codec lzma is not available in this python installation")
+        return (lambda data, level: lzma.compress(data, preset=6 if level is None else level)), lzma.decompress
+    raise Exception("runarchive: unknown codec: "+str(name))
+
+
+def available_codecs():
+    """
+    Returns a list of the codecs that can be used with pack_run in this python installation.
+    """
+    codecs = []
+    for name in ['none', 'zlib', 'bz2', 'lzma']:
+        try:
+            _codec(name)
+        except Exception:
+            continue
+        codecs += [name]
+    return codecs
+
+
+def _compress_blocks(args):
+    codec, level, blocks = args
+    compress = _codec(codec)[0]
+    return [compress(block, level) for block in blocks]
+
+
+def _run_members(rundir):
+    # The files, symlinks and directories of rundir as (relative name with '/' separators, path, lstat),
+    # with the files of every directory before its subdirectories
+    for root, dirs, files in os.walk(rundir, topdown=True, followlinks=False):
+        dirs.sort()
+        rel = os.path.relpath(root, rundir)
+        prefix = '' if rel == '.' else rel.replace(os.sep, '/')+'/'
+        for name in sorted(files) + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            path = os.path.join(root, name)
+            yield prefix+name, path, os.lstat(path)
+        for d in dirs:
+            path = os.path.join(root, d)
+            if not os.path.islink(path):
+                yield prefix+d, path, os.lstat(path)
+
+
+def pack_run(rundir, codec='bz2', level=None, processes=1, remove=True, blocksize=_blocksize, pending=None):
+    """
+    Pack the directory rundir into the archive rundir+'.htpack' and return the path of the archive.
+    The original directory is removed if remove is set (after the archive is complete.)
+
+    codec: 'bz2' (default), 'zlib', 'lzma' (if available in this python) or 'none'; level is the compression
+      level of the codec (None = its default.)
+    processes: number of processes used for compression (None = one per cpu.) The archive is the same
+      regardless of the number of processes.
+    blocksize: size of the uncompressed blocks; reading a part of a member decompresses at most this much more
+      than is asked for.
+    pending: maximum number of batches of blocks waiting to be compressed (default 4*processes.)
+    """
+    _codec(codec)
+    rundir = os.path.normpath(rundir)
+    if not os.path.isdir(rundir) or os.path.islink(rundir):
+        raise Exception("runarchive.pack_run: not a directory: "+str(rundir))
+    if processes is None:
+        import multiprocessing
+        processes = multiprocessing.cpu_count()
+    if pending is None:
+        pending = 4*processes
+
+    archivepath = rundir+archive_suffix
+    head, tail = os.path.split(rundir)
+    tmppath = os.path.join(head, 'ht.tmp.'+tail+archive_suffix)
+
+    members = []
+    dirs = []
+    pool = None
+    if processes > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+
+    out = open(tmppath, 'wb')
+    try:
+        out.write(_magic)
+        results = deque()
+
+        def write(result):
+            targets, compressed = result
+            if not isinstance(compressed, list):
+                compressed = compressed.get()
+            for member, data in zip(targets, compressed):
+                member['blocks'] += [[out.tell(), len(data)]]
+                out.write(data)
+
+        def submit(batch, codec):
+            targets = [x[0] for x in batch]
+            job = (codec, level, [x[1] for x in batch])
+            if pool is None:
+                results.append((targets, _compress_blocks(job)))
+            else:
+                if len(results) >= pending:
+                    write(results.popleft())
+                results.append((targets, pool.apply_async(_compress_blocks, (job,))))
+            while pool is None and results:
+                write(results.popleft())
+
+        # Blocks are read (and hashed) here in order, and compressed in batches of about blocksize bytes
+        batch = []
+        batchsize = 0
+        for name, path, st in _run_members(rundir):
+            if stat.S_ISDIR(st.st_mode):
+                dirs += [[name, stat.S_IMODE(st.st_mode), st.st_mtime]]
+                continue
+            member = {'name': name, 'size': 0, 'mode': stat.S_IMODE(st.st_mode), 'mtime': st.st_mtime}
+            if stat.S_ISLNK(st.st_mode):
+                member['link'] = os.readlink(path)
+                if os.path.isfile(path):
+                    member['sha256'] = _sha256file(path)
+                members += [member]
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                raise Exception("runarchive.pack_run: cannot pack special file: "+str(path))
+            member_codec = 'none' if name.lower().endswith(_stored_suffixes) else codec
+            member['codec'] = member_codec
+            member['blocks'] = []
+            members += [member]
+            if member_codec != codec and len(batch) > 0:
+                submit(batch, codec)
+                batch = []
+                batchsize = 0
+            s = hashlib.sha256()
+            f = open(path, 'rb')
+            try:
+                while True:
+                    data = f.read(blocksize)
+                    if len(data) == 0:
+                        break
+                    s.update(data)
+                    member['size'] += len(data)
+                    batch += [(member, data)]
+                    batchsize += len(data)
+                    if batchsize >= blocksize or member_codec != codec:
+                        submit(batch, member_codec)
+                        batch = []
+                        batchsize = 0
+            finally:
+                f.close()
+            member['sha256'] = s.hexdigest()
+        if len(batch) > 0:
+            submit(batch, codec)
+        while results:
+            write(results.popleft())
+
+        index = {'version': 1, 'codec': codec, 'blocksize': blocksize, 'members': members, 'dirs': dirs}
+        indexdata = zlib.compress(json.dumps(index, sort_keys=True).encode('utf-8'))
+        offset = out.tell()
+        out.write(indexdata)
+        out.write(_trailer.pack(offset, len(indexdata), _trailer_magic))
+        out.close()
+    except:
+        out.close()
+        os.unlink(tmppath)
+        raise
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    os.rename(tmppath, archivepath)
+    if remove:
+        shutil.rmtree(rundir)
+    return archivepath
+
+
+def unpack_run(archivepath, rundir=None, remove=True):
+    """
+    Restore the run directory packed in archivepath (to rundir, default: the path of the archive without
+    .htpack) and return its path. The archive is removed if remove is set.
+    """
+    archive = RunArchive(archivepath)
+    if rundir is None:
+        if not archivepath.endswith(archive_suffix):
+            raise Exception("runarchive.unpack_run: give rundir for an archive not named *"+archive_suffix)
+        rundir = archivepath[:-len(archive_suffix)]
+    archive.extract(rundir)
+    if remove:
+        os.unlink(archivepath)
+    return rundir
+
+
+def _sha256file(path):
+    s = hashlib.sha256()
+    f = open(path, 'rb')
+    try:
+        while True:
+            data = f.read(_blocksize)
+            if len(data) == 0:
+                break
+            s.update(data)
+    finally:
+        f.close()
+    return s.hexdigest()
+
+
+class _MemberReader(io.RawIOBase):
+
+    """
+    Raw binary file object for a member of an archive, decompressing one block at a time.
+    """
+
+    def __init__(self, archivepath, member, blocksize, name):
+        io.RawIOBase.__init__(self)
+        self._file = open(archivepath, 'rb')
+        self._blocks = member['blocks']
+        self._decompress = _codec(member['codec'])[1]
+        self._blocksize = blocksize
+        self._size = member['size']
+        self._pos = 0
+        self._current = None
+        self._data = b''
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            pos = offset
+        elif whence == 1:
+            pos = self._pos + offset
+        elif whence == 2:
+            pos = self._size + offset
+        else:
+            raise ValueError("invalid whence: "+str(whence))
+        if pos < 0:
+            raise ValueError("negative seek position: "+str(pos))
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        if self._pos >= self._size:
+            return 0
+        k = self._pos // self._blocksize
+        if k != self._current:
+            offset, length = self._blocks[k]
+            self._file.seek(offset)
+            self._data = self._decompress(self._file.read(length))
+            self._current = k
+        start = self._pos - k*self._blocksize
+        n = min(len(b), len(self._data) - start)
+        b[:n] = self._data[start:start+n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+            self._data = b''
+        io.RawIOBase.close(self)
+
+
+class RunArchive(object):
+
+    """
+    Read access to an archive written by pack_run. Members are named by their path relative to the run directory,
+    with '/' as separator.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            if f.read(len(_magic)) != _magic:
+                raise Exception("RunArchive: not a run archive: "+str(path))
+            f.seek(-_trailer.size, 2)
+            offset, length, magic = _trailer.unpack(f.read(_trailer.size))
+            if magic != _trailer_magic:
+                raise Exception("RunArchive: archive is incomplete: "+str(path))
+            f.seek(offset)
+            index = json.loads(zlib.decompress(f.read(length)).decode('utf-8'))
+        finally:
+            f.close()
+        self.codec = index['codec']
+        self.blocksize = index['blocksize']
+        self._members = index['members']
+        self._dirs = index['dirs']
+        self._by_name = dict((x['name'], x) for x in self._members)
+
+    def names(self):
+        """
+        Returns the names of the members (files and symlinks) in the archive.
+        """
+        return [x['name'] for x in self._members]
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def member(self, name):
+        """
+        Returns a dict with information on a member: 'name', 'size', 'mode', 'mtime', 'sha256' (sha256 sum of
+        the content, missing for a symlink to something that was not a file), and 'link' for a symlink.
+        """
+        try:
+            member = self._by_name[name]
+        except KeyError:
+            raise Exception("RunArchive: no such member: "+str(name)+" in "+str(self.path))
+        return dict((k, v) for k, v in member.items() if k != 'blocks')
+
+    def open(self, name, mode='rb'):
+        """
+        Open a member for reading, in binary ('rb') or text ('r') mode. The file object is seekable; only the
+        blocks that are read are decompressed.
+        """
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise Exception("RunArchive: archives are read-only: "+str(self.path))
+        member = self._by_name.get(name)
+        if member is None:
+            raise Exception("RunArchive: no such member: "+str(name)+" in "+str(self.path))
+        if 'link' in member:
+            target = os.path.join(self.path[:-len(archive_suffix)], *name.split('/')[:-1])
+            target = os.path.normpath(os.path.join(target, member['link']))
+            from httk.core.ioadapters import cleveropen
+            return cleveropen(target, mode)
+        raw = _MemberReader(self.path, member, self.blocksize, os.path.join(self.path, name))
+        f = io.BufferedReader(raw, 1 << 16)
+        if 'b' not in mode and sys.version_info[0] > 2:
+            return io.TextIOWrapper(f, encoding='utf-8')
+        return f
+
+    def read(self, name):
+        """
+        Returns the content of a member as bytes.
+        """
+        f = self.open(name, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def extract(self, rundir):
+        """
+        Write all members to the directory rundir, with their modes and modification times.
+        """
+        for name, mode, mtime in self._dirs:
+            path = os.path.join(rundir, *name.split('/'))
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        if not os.path.isdir(rundir):
+            os.makedirs(rundir)
+        for member in self._members:
+            path = os.path.join(rundir, *member['name'].split('/'))
+            if 'link' in member:
+                os.symlink(member['link'], path)
+                continue
+            fin = self.open(member['name'], 'rb')
+            try:
+                with open(path, 'wb') as fout:
+                    shutil.copyfileobj(fin, fout, self.blocksize)
+            finally:
+                fin.close()
+            os.chmod(path, member['mode'])
+            os.utime(path, (member['mtime'], member['mtime']))
+        for name, mode, mtime in reversed(self._dirs):
+            path = os.path.join(rundir, *name.split('/'))
+            os.chmod(path, mode)
+            os.utime(path, (mtime, mtime))
+
+
+_archive_cache = {}
+_archive_cache_size = 64
+
+
+def get_archive(path):
+    """
+    Returns a RunArchive for path, reusing the index read by an earlier call if the archive is unchanged.
+    """
+    st = os.stat(path)
+    key = (st.st_ino, st.st_size, st.st_mtime)
+    entry = _archive_cache.get(path)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+    archive = RunArchive(path)
+    if len(_archive_cache) >= _archive_cache_size:
+        _archive_cache.clear()
+    _archive_cache[path] = (key, archive)
+    return archive
+
+
+def find_archived(filename):
+    """
+    If filename is a path below a directory that has been packed (i.e., the directory does not exist but
+    an archive for it does), returns (archive path, member name), otherwise None.
+    """
+    path = os.path.abspath(filename)
+    parts = []
+    while True:
+        head, tail = os.path.split(path)
+        if head == path:
+            return None
+        parts.insert(0, tail)
+        path = head
+        if os.path.isdir(path):
+            return None
+        if os.path.isfile(path+archive_suffix):
+            return path+archive_suffix, '/'.join(parts)
+
+
+def open_archived(filename, mode='r'):
+    """
+    Open the file filename inside a packed run directory for reading, trying the same alternatives as
+    cleveropen: filename, and otherwise filename with .bz2, .BZ2, .gz or .GZ appended. Compressed members
+    are decompressed according to their extension. Returns None if there is no such member.
+    """
+    if 'w' in mode or 'a' in mode or '+' in mode:
+        return None
+    found = find_archived(filename)
+    if found is None:
+        return None
+    archivepath, name = found
+    archive = get_archive(archivepath)
+    if os.path.splitext(name)[1].lower() in ('.bz2', '.gz'):
+        candidates = [name]
+    else:
+        candidates = [name, name+'.bz2', name+'.BZ2', name+'.gz', name+'.GZ']
+    for candidate in candidates:
+        if candidate in archive:
+            break
+    else:
+        return None
+    binary = 'b' in mode or sys.version_info[0] == 2
+    f = archive.open(candidate, 'rb')
+    ext = os.path.splitext(candidate)[1].lower()
+    if ext == '.bz2':
+        import bz2
+        if sys.version_info[0] > 2:
+            f = bz2.BZ2File(f, 'rb')
+        else:
+            data = f.read()
+            f.close()
+            f = io.BytesIO(bz2.decompress(data))
+    elif ext == '.gz':
+        import gzip
+        f = gzip.GzipFile(fileobj=f, mode='rb')
+    if not binary:
+        f = io.TextIOWrapper(f, encoding='utf-8')
+    return f
+
+
+def main():
+    import tempfile, random, bz2
+    from httk.core.ioadapters import cleveropen, IoAdapterFilename, IoAdapterFileReader
+    from httk.core.basic import micro_pyawk
+
+    rnd = random.Random(0)
+    top = tempfile.mkdtemp(prefix='ht.tmp.runarchive_')
+    try:
+        rundir = os.path.join(top, 'ht.task.test.1', 'ht.run.2020-01-01_00.00.00')
+        os.makedirs(os.path.join(rundir, 'sub', 'deeper'))
+        os.makedirs(os.path.join(rundir, 'empty'))
+        contents = {
+            'OUTCAR': ''.join("  step %d energy  without entropy= %.6f\n" % (i, -10.0-i*0.01) for i in range(20000)).encode('utf-8'),
+            'empty.txt': b'',
+            'sub/data.bin': bytes(bytearray(rnd.randint(0, 255) for i in range(300000))),
+            'sub/deeper/INCAR': b'ENCUT = 520\nISMEAR = 0\n',
+            'log.bz2': bz2.compress(b'compressed log\nsecond line\n'),
+        }
+        for name, data in contents.items():
+            with open(os.path.join(rundir, *name.split('/')), 'wb') as f:
+                f.write(data)
+        os.chmod(os.path.join(rundir, 'sub', 'deeper', 'INCAR'), 0o600)
+        os.symlink('deeper/INCAR', os.path.join(rundir, 'sub', 'INCAR.link'))
+        os.utime(os.path.join(rundir, 'OUTCAR'), (1000000000, 1000000000))
+
+        for codec in available_codecs():
+            for processes in [1, 2]:
+                packdir = os.path.join(top, 'ht.task.test.1', 'ht.run.%s.%d' % (codec, processes))
+                shutil.copytree(rundir, packdir, symlinks=True)
+                archivepath = pack_run(packdir, codec=codec, processes=processes, blocksize=65536)
+                assert not os.path.exists(packdir)
+                archive = RunArchive(archivepath)
+                assert sorted(archive.names()) == sorted(list(contents.keys()) + ['sub/INCAR.link'])
+                for name, data in contents.items():
+                    assert archive.read(name) == data
+                    assert archive.member(name)['sha256'] == hashlib.sha256(data).hexdigest()
+                assert archive.read('sub/INCAR.link') == contents['sub/deeper/INCAR']
+
+                # Random access
+                f = archive.open('sub/data.bin')
+                for i in range(20):
+                    pos = rnd.randint(0, len(contents['sub/data.bin']))
+                    f.seek(pos)
+                    assert f.read(1000) == contents['sub/data.bin'][pos:pos+1000]
+                f.seek(-10, 2)
+                assert f.read() == contents['sub/data.bin'][-10:]
+                f.close()
+
+                # Reading by filename
+                f = cleveropen(os.path.join(packdir, 'sub', 'deeper', 'INCAR'), 'r')
+                assert f.read() == 'ENCUT = 520\nISMEAR = 0\n'
+                f.close()
+                f = cleveropen(os.path.join(packdir, 'log'), 'rb')
+                assert f.read() == b'compressed log\nsecond line\n'
+                f.close()
+                ioa = IoAdapterFileReader.use(IoAdapterFilename(os.path.join(packdir, 'log.bz2')))
+                assert ioa.file.readlines()[1].strip() == 'second line'
+                ioa.close()
+                results = {}
+
+                def read_energy(results, match):
+                    results['energy'] = float(match.group(1))
+                micro_pyawk(os.path.join(packdir, 'OUTCAR'), [["without entropy= *([^ ]+)", None, read_energy]], results)
+                assert results['energy'] == -10.0-19999*0.01
+                assert open_archived(os.path.join(packdir, 'missing')) is None
+                assert open_archived(os.path.join(top, 'missing', 'missing')) is None
+
+                restored = unpack_run(archivepath)
+                assert restored == packdir and not os.path.exists(archivepath)
+                for name, data in contents.items():
+                    with open(os.path.join(restored, *name.split('/')), 'rb') as f:
+                        assert f.read() == data
+                assert os.path.islink(os.path.join(restored, 'sub', 'INCAR.link'))
+                assert os.path.isdir(os.path.join(restored, 'empty'))
+                assert stat.S_IMODE(os.stat(os.path.join(restored, 'sub', 'deeper', 'INCAR')).st_mode) == 0o600
+                assert os.stat(os.path.join(restored, 'OUTCAR')).st_mtime == 1000000000
+
+        # Task readers see a packed run by the path of the run directory
+        from httk.task.reader import task_runs
+        taskdir = os.path.join(top, 'ht.task.test.2')
+        runs = [os.path.join(taskdir, 'ht.run.2020-01-01_00.00.00'), os.path.join(taskdir, 'ht.run.2021-01-01_00.00.00')]
+        shutil.copytree(rundir, runs[0], symlinks=True)
+        os.makedirs(runs[1])
+        dates = task_runs(taskdir)[1]
+        assert task_runs(taskdir)[0] == runs
+        pack_run(runs[0], remove=False)
+        assert task_runs(taskdir) == (runs, dates)
+        shutil.rmtree(runs[0])
+        assert task_runs(taskdir) == (runs, dates)
+        f = cleveropen(os.path.join(task_runs(taskdir)[0][0], 'sub', 'deeper', 'INCAR'), 'r')
+        assert f.read() == 'ENCUT = 520\nISMEAR = 0\n'
+        f.close()
+
+        # The archive does not depend on the number of processes
+        first = pack_run(rundir, codec='zlib', processes=1, remove=False, blocksize=65536)
+        with open(first, 'rb') as f:
+            data1 = f.read()
+        os.unlink(first)
+        second = pack_run(rundir, codec='zlib', processes=3, remove=False, blocksize=65536, pending=1)
+        with open(second, 'rb') as f:
+            data2 = f.read()
+        assert data1 == data2
+        print("Finished")
+    finally:
+        shutil.rmtree(top)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,7 @@
 #
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import shlex, os, sys, shutil
+import shlex, os, sys, shutil, re, time, pickle, hashlib, tempfile
 from string import Template
 from httk.core.basic import mkdir_p
 
@@ -34,8 +34,31 @@ def apply_template(template, output, envglobals=None, envlocals=None):
 
     Note: it is safe for the code inside the template
     to load the file it eventually will replace.
+
+    The template is compiled once (see CompiledTemplate) and kept in memory, and optionally on disk, for as long
+    as the file is not modified.
+    """
+    result = compile_template_file(template).render(envglobals, envlocals)
+
+    # Write output, but first remove file if it already exists, this is done explicitly
+    # to handle symlinks in a sane way; i.e., they are replaced by the instantiated template,
+    # and the file the symlink is pointing at is NOT changed.
+    if os.path.exists(output):
+        os.remove(output)
+    output_file = open(output, 'w')
+    output_file.write(result)
+    output_file.close()
+
+
+def render_template(text, envglobals=None, envlocals=None):
     """
+    Returns the template text with the replacements of apply_template done.
+    """
+    return compile_template(text).render(envglobals, envlocals)
+
 
+def _interpret_template(text, envglobals=None, envlocals=None):
+    # The template engine as it works on the text of one rendering; CompiledTemplate gives the same result.
     if envlocals is None:
         envlocals = {}
     else:
@@ -46,13 +69,11 @@ def apply_template(template, output, envglobals=None, envlocals=None):
     else:
         envglobals = envglobals.copy()
 
-    # Read template and substitute $name entries
-    template_file = open(template, 'r')
+    # Substitute $name entries
     ## shlex does not work with unicode, hence the .encode('ascii') to make sure the result is not unicode
     # Henrik added: These days it looks like we don't need the ascii encoding anymore.
-    result_step1 = Template(Template(template_file.read()).safe_substitute(
+    result_step1 = Template(Template(text).safe_substitute(
         envlocals)).safe_substitute(envglobals)#.encode('ascii')
-    template_file.close()
 
     # Substitute $(some python code) entries
     result_step2 = ''
@@ -111,14 +132,375 @@ def apply_template(template, output, envglobals=None, envlocals=None):
                 continue
             command += token
 
-    # Write output, but first remove file if it already exists, this is done explicitly
-    # to handle symlinks in a sane way; i.e., they are replaced by the instantiated template,
-    # and the file the symlink is pointing at is NOT changed.
-    if os.path.exists(output):
-        os.remove(output)
-    output_file = open(output, 'w')
-    output_file.write(result_step2)
-    output_file.close()
+    return result_step2
+
+
+def _parse_template(text):
+    # Split the text (after the $name substitutions) into ('text', ...), ('eval', ...) and ('exec', ...) parts,
+    # tokenizing exactly as _interpret_template does
+    ops = []
+    literal = ''
+    lexer = shlex.shlex(text)
+    lexer.whitespace = ''
+    eval_nesting = 0
+    exec_nesting = 0
+    for token in lexer:
+        if(eval_nesting == 0 and exec_nesting == 0):
+            if(token == '\\'):
+                token += lexer.get_token()
+            if(token == '$'):
+                token += lexer.get_token()
+            if(token == '$('):
+                eval_nesting = 1
+                command = ''
+                continue
+            if(token == '${'):
+                exec_nesting = 1
+                command = ''
+                continue
+            if(token == '\\$'):
+                token = '$'
+            literal += token
+
+        elif(exec_nesting != 0):
+            if(token == '{'):
+                exec_nesting += 1
+            if(token == '}'):
+                exec_nesting -= 1
+            if(exec_nesting == 0):
+                ops += [('text', literal), ('exec', command)]
+                literal = ''
+                continue
+            command += token
+
+        elif(eval_nesting != 0):
+            if(token == '('):
+                eval_nesting += 1
+            if(token == ')'):
+                eval_nesting -= 1
+            if(eval_nesting == 0):
+                ops += [('text', literal), ('eval', command)]
+                literal = ''
+                continue
+            command += token
+    ops += [('text', literal)]
+    return ops
+
+
+_block_codes = {}
+
+
+def _block_code(command, mode):
+    # Code blocks that contain substituted values are compiled when rendering; keep the most recent ones
+    code = _block_codes.get((command, mode))
+    if code is None:
+        try:
+            code = compile(command, '<string>', mode)
+        except SyntaxError:
+            # Let eval / exec raise it when the block is run
+            return command
+        if len(_block_codes) > 1000:
+            _block_codes.clear()
+        _block_codes[(command, mode)] = code
+    return code
+
+
+def _eval_block(code, command, envglobals, envlocals):
+    try:
+        return str(eval(code if code is not None else _block_code(command, 'eval'), envglobals, envlocals))
+    except:
+        print("Failed to eval:"+command)
+        raise
+
+
+def _exec_block(code, command, envglobals, envlocals, out):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        exec(code if code is not None else _block_code(command, 'exec'), envglobals, envlocals)
+        output = sys.stdout.getvalue()
+    except:
+        sys.stdout = stdout
+        print("Failed to execute:"+command)
+        raise
+    finally:
+        sys.stdout = stdout
+    out.append(output)
+    # A newline at the end of the output so far is removed
+    for i in range(len(out)-1, -1, -1):
+        if out[i] != '':
+            if out[i].endswith('\n'):
+                out[i] = out[i][:-1]
+            break
+
+
+# Characters in a substituted value that could change how the text around it is tokenized
+_unsafe_value = re.compile('[$\\\\\'"#(){}\n]')
+_wordchars = shlex.shlex('').wordchars
+
+
+class _TemplateVariant(object):
+    # The compiled form of a template for a given set of substituted names
+
+    def __init__(self, slots, ops, quote_follows, prefix):
+        self.slots = slots
+        self.quote_follows = quote_follows
+        self.ops = []
+        split = re.compile(re.escape(prefix) + '([0-9]+)_')
+        for kind, text in ops:
+            parts = split.split(text)
+            # Odd entries are the slot numbers
+            parts = [int(x) if i % 2 == 1 else x for i, x in enumerate(parts)]
+            self.ops += [(kind, parts)]
+        self._func = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_func'] = None
+        return state
+
+    def values(self, envglobals, envlocals):
+        # The string values of the slots, or None if any of them cannot be used with this variant
+        values = []
+        for i, (kind, name) in enumerate(self.slots):
+            value = '%s' % ((envlocals if kind == 'l' else envglobals)[name],)
+            if value == '' or _unsafe_value.search(value) is not None or (self.quote_follows[i] and value[-1] not in _wordchars):
+                return None
+            values += [value]
+        return values
+
+    def _compile(self):
+        # Generate a function that appends the parts of the output in order
+        codes = []
+        commands = []
+        lines = ["def render(_g, _l, _v, _c, _s, _eval, _exec):", "    _out = []"]
+        for kind, parts in self.ops:
+            if kind == 'text':
+                for i, part in enumerate(parts):
+                    if i % 2 == 1:
+                        lines += ["    _out.append(_v[%d])" % part]
+                    elif part != '':
+                        lines += ["    _out.append(%r)" % (part,)]
+                continue
+            if len(parts) == 1:
+                codes += [_block_code(parts[0], kind)]
+                commands += [parts[0]]
+                command = "_s[%d]" % (len(commands)-1)
+            else:
+                codes += [None]
+                command = "''.join((%s,))" % ", ".join("_v[%d]" % x if i % 2 == 1 else repr(x) for i, x in enumerate(parts))
+            if isinstance(codes[-1], str):
+                codes[-1] = None
+            if kind == 'eval':
+                lines += ["    _out.append(_eval(_c[%d], %s, _g, _l))" % (len(codes)-1, command)]
+            else:
+                lines += ["    _exec(_c[%d], %s, _g, _l, _out)" % (len(codes)-1, command)]
+        lines += ["    return ''.join(_out)"]
+        namespace = {}
+        exec(compile("\n".join(lines) + "\n", '<template>', 'exec'), namespace)
+        render = namespace['render']
+        self._func = lambda envglobals, envlocals, values: render(envglobals, envlocals, values, codes, commands, _eval_block, _exec_block)
+
+    def run(self, envglobals, envlocals, values):
+        if self._func is None:
+            self._compile()
+        return self._func(envglobals, envlocals, values)
+
+
+class CompiledTemplate(object):
+    """
+    A template (see apply_template) compiled into a Python function that emits the output. The result of render()
+    is identical to that of interpreting the template text anew.
+
+    The text is tokenized once for each combination of $name variables that are present, with placeholders in
+    place of the values; the code blocks are compiled once. When rendering, a value that could change how the
+    text around it is tokenized (e.g., one with quotes, parentheses or $ in it) makes the template be
+    interpreted the old way instead, for that rendering.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.names = set(m.group('named') or m.group('braced') for m in Template.pattern.finditer(text)
+                         if m.group('named') or m.group('braced'))
+        self.prefix = '_httkslot'
+        while self.prefix in text:
+            self.prefix += 'x'
+        self._pass1 = {}
+        self._variants = {}
+        self._disk = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_disk'] = None
+        return state
+
+    def _variant(self, envglobals, envlocals):
+        lnames = frozenset(x for x in self.names if x in envlocals)
+        pass1 = self._pass1.get(lnames)
+        if pass1 is None:
+            lslots = sorted(lnames)
+            text1 = Template(self.text).safe_substitute(dict((name, self.prefix + str(i) + '_') for i, name in enumerate(lslots)))
+            names2 = set(m.group('named') or m.group('braced') for m in Template.pattern.finditer(text1)
+                         if m.group('named') or m.group('braced'))
+            # A value right after a '$' (or in a placeholder) would be substituted again by the second pass
+            usable = re.search('\\$\\{?[_a-zA-Z0-9]*' + re.escape(self.prefix), text1) is None
+            pass1 = (text1, names2, usable)
+            self._pass1[lnames] = pass1
+        text1, names2, usable = pass1
+        gnames = frozenset(x for x in names2 if x in envglobals)
+        key = (lnames, gnames)
+        if key in self._variants:
+            return self._variants[key]
+        variant = None
+        if usable:
+            slots = [('l', name) for name in sorted(lnames)] + [('g', name) for name in sorted(gnames)]
+            text2 = Template(text1).safe_substitute(dict((name, self.prefix + str(len(lnames) + i) + '_') for i, name in enumerate(sorted(gnames))))
+            quote_follows = [False]*len(slots)
+            for m in re.finditer(re.escape(self.prefix) + '([0-9]+)_', text2):
+                # Whether a quote after a value starts a quoted string depends on the last character of the value
+                # (the rest of a line after # is skipped by the tokenizer)
+                pos = m.end()
+                while text2[pos:pos+1] == '#':
+                    pos = text2.find('\n', pos) + 1
+                    if pos == 0:
+                        pos = len(text2)
+                if text2[pos:pos+1] in ('"', "'"):
+                    quote_follows[int(m.group(1))] = True
+            try:
+                variant = _TemplateVariant(slots, _parse_template(text2), quote_follows, self.prefix)
+            except ValueError:
+                # E.g., a quotation that is not closed, which is reported when interpreting
+                variant = None
+        self._variants[key] = variant
+        if self._disk is not None:
+            _save_compiled_template(self)
+        return variant
+
+    def render(self, envglobals=None, envlocals=None):
+        if envlocals is None:
+            envlocals = {}
+        else:
+            envlocals = envlocals.copy()
+
+        if envglobals is None:
+            envglobals = {}
+        else:
+            envglobals = envglobals.copy()
+
+        variant = self._variant(envglobals, envlocals)
+        if variant is not None:
+            values = variant.values(envglobals, envlocals)
+            if values is not None:
+                return variant.run(envglobals, envlocals, values)
+        return _interpret_template(self.text, envglobals, envlocals)
+
+
+_compiled_texts = {}
+
+
+def compile_template(text):
+    """
+    Returns the CompiledTemplate of a template text, from an in-memory cache of recently used ones.
+    """
+    compiled = _compiled_texts.get(text)
+    if compiled is None:
+        compiled = CompiledTemplate(text)
+        if len(_compiled_texts) > 256:
+            _compiled_texts.clear()
+        _compiled_texts[text] = compiled
+    return compiled
+
+
+_compiled_files = {}
+_template_cache_dir = None
+_template_cache_configured = False
+
+# Files modified less than this many seconds ago are not cached, since a change within the resolution of the
+# modification time would not be noticed
+_racy_interval = 2
+
+
+def get_template_cache_dir():
+    """
+    Returns the directory where compiled templates are kept between processes, from the environment variable
+    HTTK_TEMPLATE_CACHE or template_cache in the [cache] section of the httk configuration, or None (the
+    default) if they are only kept in memory.
+    """
+    global _template_cache_dir, _template_cache_configured
+    if not _template_cache_configured:
+        path = os.environ.get('HTTK_TEMPLATE_CACHE')
+        if path is None:
+            from httk.config import config
+            path = config.get('cache', 'template_cache')
+        if path is not None and path.strip() != "":
+            _template_cache_dir = os.path.expandvars(os.path.expanduser(path.strip()))
+        _template_cache_configured = True
+    return _template_cache_dir
+
+
+def set_template_cache_dir(path):
+    """
+    Keep compiled templates in the directory path (None: only in memory) instead of the configured directory.
+    """
+    global _template_cache_dir, _template_cache_configured
+    _template_cache_dir = path
+    _template_cache_configured = True
+    _compiled_files.clear()
+
+
+def _cache_filename(cachedir, path):
+    return os.path.join(cachedir, hashlib.sha256(path.encode('utf-8')).hexdigest() + '.pickle')
+
+
+def _load_compiled_template(cachedir, path, key):
+    try:
+        with open(_cache_filename(cachedir, path), 'rb') as f:
+            entry = pickle.load(f)
+        if entry['format'] != 1 or entry['python'] != tuple(sys.version_info[:2]) or entry['path'] != path or entry['key'] != key:
+            return None
+        return entry['template']
+    except Exception:
+        return None
+
+
+def _save_compiled_template(compiled):
+    cachedir, path, key = compiled._disk
+    try:
+        mkdir_p(cachedir)
+        fd, tmpname = tempfile.mkstemp(prefix='.tmp.', dir=cachedir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({'format': 1, 'python': tuple(sys.version_info[:2]), 'path': path, 'key': key, 'template': compiled}, f, 2)
+        os.rename(tmpname, _cache_filename(cachedir, path))
+    except (IOError, OSError, pickle.PicklingError) as e:
+        sys.stderr.write("Warning: could not write compiled template to cache "+str(cachedir)+": "+str(e)+"\n")
+        compiled._disk = None
+
+
+def compile_template_file(template):
+    """
+    Returns the CompiledTemplate of the template file, cached by path and modification time.
+    """
+    path = os.path.realpath(template)
+    st = os.stat(path)
+    key = (st.st_mtime, st.st_size)
+    entry = _compiled_files.get(path)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+
+    racy = time.time() - st.st_mtime < _racy_interval
+    cachedir = get_template_cache_dir()
+    compiled = None
+    if cachedir is not None and not racy:
+        compiled = _load_compiled_template(cachedir, path, key)
+    if compiled is None:
+        template_file = open(template, 'r')
+        compiled = CompiledTemplate(template_file.read())
+        template_file.close()
+    if not racy:
+        if cachedir is not None:
+            compiled._disk = (cachedir, path, key)
+        _compiled_files[path] = (key, compiled)
+    return compiled
 
 
 def apply_templates(inputpath, outpath, template_suffixes="template", envglobals=None, envlocals=None, mkdir=True):
@@ -165,3 +547,75 @@ def apply_templates(inputpath, outpath, template_suffixes="template", envglobals
                     shutil.copy(os.path.join(root, filename), os.path.join(outpath, rp, filename))
 
     #os.chdir(main_path)
+
+
+def main():
+    import random
+
+    envglobals = {'a': 1, 'b': 'x y', 'name': 'Si', 'c': 2.5}
+    text = "SYSTEM = $name\nENCUT = $(a*400)\n${for i in range(3): print(i)}\n# comment ${name}\nCOST = \\$5 $$a\n"
+    compiled = compile_template(text)
+    expected = _interpret_template(text, envglobals)
+    assert expected == "SYSTEM = Si\nENCUT = 400\n0\n1\n2\nCOST = $5 1\n"
+    assert compiled.render(envglobals) == expected
+    assert len(compiled._variants) == 1 and list(compiled._variants.values())[0] is not None
+
+    # The output is the same as from interpreting the template, for random templates and values
+    rnd = random.Random(0)
+    pieces = ['abc', ' ', '\n', '"', "'", '#', '$', '$$', '\\', '(', ')', '{', '}', '$a', '${b}', '$name', '${name}', '$undefined',
+              '$(a+1)', '$(len("x)y"))', '${print(b)}', '${q = 7}', '$(q)', '$(c)', '.', '_', '$(', '${', 'x', '9']
+    values = ['Si', 'x y', '', 'a"b', "it's", 'p(q)', '#', '1.', 'q_', '$a', '\\n', 7, 'ab\ncd', ' ']
+    # Failing blocks are reported on stdout (which _interpret_template resets to sys.__stdout__ after exec blocks)
+    stdout, real_stdout = sys.stdout, sys.__stdout__
+    sys.__stdout__ = StringIO()
+    try:
+        for i in range(3000):
+            text = ''.join(rnd.choice(pieces) for _j in range(rnd.randint(1, 12)))
+            compiled = CompiledTemplate(text)
+            for _k in range(3):
+                envglobals = {'a': rnd.choice([1, 7]), 'b': rnd.choice(values), 'name': rnd.choice(values), 'c': 2.5}
+                envlocals = {'name': rnd.choice(values)} if rnd.random() < 0.3 else None
+                sys.stdout = StringIO()
+                try:
+                    expected = _interpret_template(text, envglobals, envlocals)
+                except Exception as e:
+                    expected = type(e)
+                sys.stdout = StringIO()
+                try:
+                    result = compiled.render(envglobals, envlocals)
+                except Exception as e:
+                    result = type(e)
+                assert result == expected, (text, envglobals, envlocals, result, expected)
+    finally:
+        sys.stdout, sys.__stdout__ = stdout, real_stdout
+
+    # Template files are compiled once, and again when modified; compiled templates can be kept on disk
+    tmpdir = tempfile.mkdtemp(prefix='ht.tmp.template_')
+    try:
+        set_template_cache_dir(os.path.join(tmpdir, 'cache'))
+        filename = os.path.join(tmpdir, 'INCAR.template')
+        output = os.path.join(tmpdir, 'INCAR')
+        with open(filename, 'w') as f:
+            f.write("ENCUT = $(encut*1.3)\n")
+        os.utime(filename, (time.time() - 60, time.time() - 60))
+        apply_template(filename, output, {'encut': 100})
+        assert compile_template_file(filename) is compile_template_file(filename)
+        with open(filename, 'w') as f:
+            f.write("ENCUT = $(encut*1.5)\n")
+        os.utime(filename, (time.time() - 30, time.time() - 30))
+        apply_template(filename, output, {'encut': 100})
+        with open(output) as f:
+            assert f.read() == "ENCUT = 150.0\n"
+        assert len(os.listdir(os.path.join(tmpdir, 'cache'))) == 1
+        _compiled_files.clear()
+        compiled = compile_template_file(filename)
+        assert len(compiled._variants) == 1
+        assert compiled.render({'encut': 200}) == "ENCUT = 300.0\n"
+    finally:
+        set_template_cache_dir(None)
+        shutil.rmtree(tmpdir)
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Optional numpy-backed bulk engine for FracVector arithmetic.
+
+A FracVector stores its nominators as nested tuples of Python integers. For large FracVectors (e.g., the
+coordinates of a cell with thousands of atoms) the per-element overhead of mapping Python lambdas over these
+tuples dominates. The functions in this module perform the same operations on arrays of nominators instead:
+
+- If all nominators (and all intermediate results, as estimated from bounds on the input) fit in a 64 bit
+  integer, the operation is done on int64 arrays.
+- Otherwise the operation is done on object arrays of Python integers, which gives exactly the same
+  results as the pure Python implementation, only with less interpreter overhead.
+
+The results are always converted back into nested tuples (or lists) of Python integers, so FracVector
+keeps its exact semantics and immutability.
+
+FracVector uses this module automatically when numpy is available and the FracVector has at least
+'threshold' elements. Use set_array_backend() to turn it off or to change the threshold.
+"""
+
+import warnings
+
+try:
+    from math import gcd as _gcd
+except ImportError:
+    from fractions import gcd as _gcd
+
+_INT64_MAX = 2**63 - 1
+# Largest integer for which every smaller integer is exactly representable as a double
+_FLOAT_EXACT_MAX = 2**53
+
+enabled = True
+threshold = 96
+
+_numpy = None
+_numpy_checked = False
+
+
+def set_array_backend(enable=None, min_elements=None):
+    """
+    Configure the array backend.
+
+    enable: True/False to turn the backend on or off (it is on by default, if numpy is available).
+    min_elements: the smallest number of nominators in a FracVector for the backend to be used.
+    """
+    global enabled, threshold
+    if enable is not None:
+        enabled = enable
+    if min_elements is not None:
+        threshold = min_elements
+
+
+def get_numpy():
+    """
+    Returns the numpy module, or None if it is not available. Importing is deferred until first use.
+    """
+    global _numpy, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            from httk.external.numpy_ext import numpy
+            _numpy = numpy
+        except Exception:
+            _numpy = None
+    return _numpy
+
+
+def active(nelements):
+    """
+    Returns True if the array backend should be used for an operation on nelements nominators.
+    """
+    return enabled and nelements >= threshold and get_numpy() is not None
+
+
+def to_array(noms, dim):
+    """
+    Convert nested nominators to an int64 array if possible, and otherwise to an object array.
+
+    dim: the expected shape (i.e., FracVector.dim). Returns None if the nominators do not form
+    an array of this shape (i.e., the FracVector is not rectangular).
+    """
+    np = _numpy
+    with warnings.catch_warnings():
+        # Old versions of numpy warn on ragged input rather than raising an exception
+        warnings.simplefilter("ignore")
+        try:
+            arr = np.array(noms)
+            if arr.dtype.kind != 'i' or arr.dtype.itemsize != 8:
+                # Avoid every lossy automatic conversion (e.g., ints in [2^63,2^64) become floats)
+                arr = np.array(noms, dtype=object)
+        except (OverflowError, ValueError):
+            try:
+                arr = np.array(noms, dtype=object)
+            except ValueError:
+                return None
+    if arr.shape != tuple(dim):
+        return None
+    return arr
+
+
+def from_array(arr, dup=tuple):
+    """
+    Convert an array of nominators back to nested sequences of Python integers.
+
+    dup: the sequence type to use, i.e., the _dup_noms of the FracVector class.
+    """
+    l = arr.tolist()
+    if dup is list or arr.ndim == 0:
+        return l
+    return _dup_nested(l, arr.ndim, dup)
+
+
+def _dup_nested(l, ndim, dup):
+    if ndim == 1:
+        return dup(l)
+    if ndim == 2:
+        return dup(map(dup, l))
+    return dup(_dup_nested(x, ndim - 1, dup) for x in l)
+
+
+def maxabs(arr):
+    """
+    Returns the largest absolute value in an array as a Python integer.
+    """
+    if arr.size == 0:
+        return 0
+    # Note: abs() on int64 is unsafe for -2^63, so take max and min separately
+    return max(int(arr.max()), -int(arr.min()))
+
+
+def _fits(arr, bound):
+    return arr.dtype != object and bound <= _INT64_MAX
+
+
+def _as_object(*arrs):
+    return [x if x.dtype == object else x.astype(object) for x in arrs]
+
+
+def matmul(A, B, dup=tuple):
+    """
+    Matrix product of two nominator arrays (matrix*matrix, matrix*vector or vector*matrix).
+    """
+    np = _numpy
+    inner = A.shape[-1]
+    if not (_fits(A, 0) and _fits(B, maxabs(A) * maxabs(B) * inner)):
+        A, B = _as_object(A, B)
+    return from_array(np.dot(A, B), dup)
+
+
+def scale(A, m, dup=tuple):
+    """
+    Multiply every nominator with the integer m.
+    """
+    if not _fits(A, maxabs(A) * abs(m)):
+        A, = _as_object(A)
+    return from_array(A * m, dup)
+
+
+def add_scaled(A, mA, B, mB, subtract=False, dup=tuple):
+    """
+    Returns the nominators A*mA + B*mB (or A*mA - B*mB if subtract is True).
+
+    Either of A and B can be a zero-dimensional array, which is then broadcast over the other.
+    """
+    if not (_fits(A, 0) and _fits(B, maxabs(A) * abs(mA) + maxabs(B) * abs(mB))):
+        A, B = _as_object(A, B)
+    if subtract:
+        return from_array(A * mA - B * mB, dup)
+    return from_array(A * mA + B * mB, dup)
+
+
+def gcd_reduce(A, initializer):
+    """
+    Returns the greatest common divisor of the absolute values of all nominators and initializer.
+    """
+    np = _numpy
+    if A.dtype == object or maxabs(A) > _INT64_MAX:
+        A, = _as_object(A)
+    gcd = np.gcd.reduce(np.abs(A).ravel()) if A.size > 0 else 0
+    return _gcd(int(gcd), abs(initializer))
+
+
+def exact_divide(A, d, dup=tuple):
+    """
+    Divide every nominator with the integer d, which must divide them exactly.
+    """
+    if not _fits(A, abs(d)):
+        A, = _as_object(A)
+    return from_array(A // d, dup)
+
+
+def normalize(A, denom, dup=tuple):
+    """
+    Returns the nominators with an integer number of denom added/removed to place each element in [0,denom).
+    """
+    if not _fits(A, 2 * (maxabs(A) + abs(denom))):
+        A, = _as_object(A)
+    return from_array(A - denom * (A // denom), dup)
+
+
+def normalize_half(A, denom, dup=tuple):
+    """
+    Returns nominators on the denominator 2*denom placing each element in [-1/2,1/2). (See FracVector.normalize_half.)
+    """
+    if not _fits(A, 4 * (maxabs(A) + abs(denom))):
+        A, = _as_object(A)
+    return from_array(2 * A - (2 * denom) * ((((2 * A) // denom) + 1) // 2), dup)
+
+
+def to_floats(A, denom):
+    """
+    Returns nested lists of floats for nom/denom, or None if this cannot be done with exactly the same
+    result as the conversion via fractions.Fraction.
+    """
+    # When both nominator and denominator are exact doubles the IEEE division is correctly rounded,
+    # i.e., identical to float(Fraction(nom, denom))
+    if A.dtype == object or maxabs(A) > _FLOAT_EXACT_MAX or abs(denom) > _FLOAT_EXACT_MAX:
+        return None
+    return (A.astype(float) / float(denom)).tolist()
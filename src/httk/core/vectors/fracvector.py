@@ -19,6 +19,7 @@ import sys, fractions, random, operator, itertools, decimal
 from functools import reduce
 from httk.core.vectors.fracmath import *
 from httk.core.vectors.vector import Vector, string_types, integer_types
+from httk.core.vectors import arraybackend
 
 try:
     from math import gcd as calc_gcd
@@ -420,6 +421,11 @@ class FracVector(Vector):
         """
         #denom = float(self.denom)
         #return nested_map_list(lambda x: float(x) / denom, self.noms)
+        arrs = self._nom_arrays()
+        if arrs is not None:
+            floats = arraybackend.to_floats(arrs[0], self.denom)
+            if floats is not None:
+                return floats
         return nested_map_list(lambda x: float(fractions.Fraction(x, self.denom)), self.noms)
 
     def to_float(self):
@@ -499,8 +505,8 @@ class FracVector(Vector):
         mA = B.denom
         mB = A.denom
 
-        Anoms = A._map_over_noms(lambda x: x * mA)
-        Bnoms = B._map_over_noms(lambda x: x * mB)
+        Anoms = A._scale_noms(mA)
+        Bnoms = B._scale_noms(mB)
 
         return cls(Anoms, denom), cls(Bnoms, denom), denom
 
@@ -602,10 +608,17 @@ class FracVector(Vector):
         denom = self.denom
 
         if self.denom != 1:
-            gcd = self._reduce_over_noms(lambda x, y: calc_gcd(x, abs(y)), initializer=self.denom)
-            if gcd != 1:
-                denom = denom // gcd
-                noms = self._map_over_noms(lambda x: int(x / gcd))
+            arrs = self._nom_arrays()
+            if arrs is not None:
+                gcd = arraybackend.gcd_reduce(arrs[0], self.denom)
+                if gcd != 1:
+                    denom = denom // gcd
+                    noms = arraybackend.exact_divide(arrs[0], gcd, self._dup_noms)
+            else:
+                gcd = self._reduce_over_noms(lambda x, y: calc_gcd(x, abs(y)), initializer=self.denom)
+                if gcd != 1:
+                    denom = denom // gcd
+                    noms = self._map_over_noms(lambda x: x // gcd)
 
         return self.__class__(noms, denom)
 
@@ -661,7 +674,11 @@ class FracVector(Vector):
         """
         Add/remove an integer +/-N to each element to place it in the range [0,1)
         """
-        noms = self._map_over_noms(lambda x: x - self.denom * (x // self.denom))
+        arrs = self._nom_arrays()
+        if arrs is not None:
+            noms = arraybackend.normalize(arrs[0], self.denom, self._dup_noms)
+        else:
+            noms = self._map_over_noms(lambda x: x - self.denom * (x // self.denom))
         return self.__class__(noms, self.denom)
 
     def normalize_half(self):
@@ -671,7 +688,11 @@ class FracVector(Vector):
         This is useful to find the shortest vector C between two points A, B in a space with periodic boundary conditions [0,1):
            C = (A-B).normalize_half()
         """
-        noms = self._map_over_noms(lambda x: 2 * x - (2 * self.denom) * ((((2 * x) // self.denom) + 1) // 2))
+        arrs = self._nom_arrays()
+        if arrs is not None:
+            noms = arraybackend.normalize_half(arrs[0], self.denom, self._dup_noms)
+        else:
+            noms = self._map_over_noms(lambda x: 2 * x - (2 * self.denom) * ((((2 * x) // self.denom) + 1) // 2))
         return self.__class__(noms, 2 * self.denom)
 
     def mul(self, other):
@@ -692,13 +713,11 @@ class FracVector(Vector):
 
         # Other is scalar
         if Bdim == ():
-            m = other.nom
-            noms = self._map_over_noms(lambda x: x * m)
+            noms = self._scale_noms(other.nom)
 
         # Self is scalar
         elif Adim == ():
-            m = self.nom
-            noms = other._map_over_noms(lambda x: x * m)
+            noms = other._scale_noms(self.nom)
 
         # Vector * Vector
         elif len(Adim) == 1 and len(Bdim) == 1:
@@ -710,20 +729,32 @@ class FracVector(Vector):
         elif len(Adim) == 2 and len(Bdim) == 1:
             if Adim[1] != Bdim[0]:
                 raise Exception("ExactVector.dot: matrix multiplication dimension mismatch," + str(Adim) + " and " + str(Bdim))
-            noms = self._dup_noms(sum([A[row][i] * B[i] for i in range(Adim[1])]) for row in range(Adim[0]))
+            arrs = self._nom_arrays(other)
+            if arrs is not None:
+                noms = arraybackend.matmul(arrs[0], arrs[1], self._dup_noms)
+            else:
+                noms = self._dup_noms(sum([A[row][i] * B[i] for i in range(Adim[1])]) for row in range(Adim[0]))
 
         # vector * Matrix
         elif len(Adim) == 1 and len(Bdim) == 2:
             if Adim[0] != Bdim[0]:
                 raise Exception("ExactVector.dot: matrix multiplication dimension mismatch," + str(Adim) + " and " + str(Bdim))
-            noms = self._dup_noms(sum([A[i] * B[i][col] for i in range(Adim[0])]) for col in range(Bdim[1]))
+            arrs = self._nom_arrays(other)
+            if arrs is not None:
+                noms = arraybackend.matmul(arrs[0], arrs[1], self._dup_noms)
+            else:
+                noms = self._dup_noms(sum([A[i] * B[i][col] for i in range(Adim[0])]) for col in range(Bdim[1]))
 
         # Matrix * Matrix
         elif len(Adim) == 2 and len(Bdim) == 2:
             if Adim[1] != Bdim[0]:
                 raise Exception("ExactVector.dot: matrix multiplication dimension mismatch," + str(Adim) + " and " + str(Bdim))
-            noms = self._dup_noms(self._dup_noms(sum([A[row][i] * B[i][col] for i in range(Adim[1])]) for col in range(Bdim[1]))
-                                  for row in range(Adim[0]))
+            arrs = self._nom_arrays(other)
+            if arrs is not None:
+                noms = arraybackend.matmul(arrs[0], arrs[1], self._dup_noms)
+            else:
+                noms = self._dup_noms(self._dup_noms(sum([A[row][i] * B[i][col] for i in range(Adim[1])]) for col in range(Bdim[1]))
+                                      for row in range(Adim[0]))
 
         else:
             raise Exception("ExactVector.dot: cannot handle tensors of order > 2, dimensions:" + str(Adim) + " and " + str(Bdim))
@@ -1131,6 +1162,40 @@ class FracVector(Vector):
 
     #### Private methods
 
+    def _nom_arrays(self, *others):
+        """
+        Decide if an operation on the nominators of self (and others) should be done by the array backend
+        (httk.core.vectors.arraybackend). If so, return a list of nominator arrays for self and others,
+        otherwise return None.
+        """
+        vecs = (self,) + others
+        for vec in vecs:
+            dim = vec.dim
+            count = 1
+            for d in dim:
+                count *= d
+            if len(dim) > 0 and arraybackend.active(count):
+                break
+        else:
+            return None
+
+        arrs = []
+        for vec in vecs:
+            arr = arraybackend.to_array(vec.noms, vec.dim)
+            if arr is None:
+                return None
+            arrs += [arr]
+        return arrs
+
+    def _scale_noms(self, m):
+        """
+        Returns the nominators multiplied by the integer m
+        """
+        arrs = self._nom_arrays()
+        if arrs is not None:
+            return arraybackend.scale(arrs[0], m, self._dup_noms)
+        return self._map_over_noms(lambda x: x * m)
+
     def _map_over_noms(self, op, *others):
         """
         Map an operation over all nominators
@@ -1148,6 +1213,14 @@ class FracVector(Vector):
         a scalar (thus pairing it with every nominator)
         """
 
+        if op in (operator.add, operator.sub) and isinstance(other, FracVector) and \
+                (self.dim == other.dim or self.dim == () or other.dim == ()):
+            arrs = self._nom_arrays(other)
+            if arrs is not None:
+                noms = arraybackend.add_scaled(arrs[0], other.denom, arrs[1], self.denom,
+                                               subtract=(op is operator.sub), dup=self._dup_noms)
+                return (noms, self.denom * other.denom)
+
         A, B, denom = self.set_common_denom(self, other)
 
         Adim = A.dim
@@ -22,7 +22,7 @@ from __future__ import print_function
 import os, sys, time
 import sqlite3 as sqlite
 import atexit
-from httk.core import FracScalar
+from httk.core import FracScalar, FracVector
 from httk.core import reraise_from
 
 sqliteconnections = set()
@@ -106,12 +106,25 @@ class Sqlite(object):
                         pass
                     debug_cursor.close()
 
+        def executemany(self, sql, values):
+            global database_debug
+            if database_debug:
+                print("DEBUG: EXECUTING SQL (MANY):"+sql+" :: "+str(len(values))+" rows", end="", file=sys.stderr)
+            try:
+                self.cursor.executemany(sql, values)
+            except Exception:
+                info = sys.exc_info()
+                reraise_from(Exception, "backend.Sqlite: Error while executing sql: "+sql+" for "+str(len(values))+" rows, the error returned was: "+str(info[1]), info)
+
         def fetchone(self):
             return self.cursor.fetchone()
 
         def fetchall(self):
             return self.cursor.fetchall()
 
+        def fetchmany(self, size):
+            return self.cursor.fetchmany(size)
+
         def close(self):
             return self.cursor.close()
 
@@ -145,6 +158,9 @@ class Sqlite(object):
                 typestr = "INTEGER"
             elif columntypes[i] == bool:
                 typestr = "INTEGER"
+            elif columntypes[i] == FracVector:
+                # Exactly encoded array of fractions
+                typestr = "BLOB"
             else:
                 raise Exception("backend.Sqlite.create_table: column of unrecognized type: "+str(columntypes[i])+" ("+str(columntypes[i].__class__)+")")
 
@@ -166,6 +182,12 @@ class Sqlite(object):
         else:
             return self.insert("INSERT INTO "+name + " DEFAULT VALUES", (), cursor=cursor)
 
+    def insert_rows(self, name, columnnames, rows, cursor):
+        """
+        Insert many rows, each a sequence of values for columnnames, in one call.
+        """
+        cursor.executemany("INSERT INTO "+name+" ("+(",".join(columnnames))+") VALUES ("+(",".join(["?"]*len(columnnames)))+" )", rows)
+
     def update_row(self, name, primkeyname, primkey, columnnames, columnvalues, cursor=None):
         if len(columnvalues) == 0:
             return
@@ -352,6 +352,23 @@ class FCMultiDict(FilteredCollection):
 def instantiate_from_store(classobj, store, id):
     types = classobj.types()
     output = store.retrieve(types['name'], types, id)
+    return _instantiate_from_output(classobj, store, id, output)
+
+
+def instantiate_many_from_store(classobj, store, ids):
+    """
+    Instantiate a list of objects from the store. Stores that provide retrieve_many get the data for all
+    objects in a few queries, rather than one query per field of each object.
+    """
+    if not hasattr(store, 'retrieve_many'):
+        return [instantiate_from_store(classobj, store, id) for id in ids]
+    types = classobj.types()
+    outputs = store.retrieve_many(types['name'], types, ids, list(types['init_keydict'].keys()))
+    return [_instantiate_from_output(classobj, store, id, output) for id, output in zip(ids, outputs)]
+
+
+def _instantiate_from_output(classobj, store, id, output):
+    types = classobj.types()
     args = types['init_keydict'].keys()
     calldict = {}
     #print("ARGS",args, output, id)
@@ -375,6 +392,9 @@ def instantiate_from_store(classobj, store, id):
 
 class FCSqlite(FilteredCollection):
 
+    # Number of result rows for which the output objects are instantiated together
+    page_size = 1000
+
     def __init__(self, sqlstore):
         super(FCSqlite, self).__init__()
         self.sqliteconnection = sqlstore.db
@@ -486,12 +506,17 @@ class FCSqlite(FilteredCollection):
             for entry in cursor:
                 yield (entry, headers)
         else:
-            for entry in cursor:
-                entry = list(entry)
+            while True:
+                page = cursor.fetchmany(self.page_size)
+                if len(page) == 0:
+                    break
+                page = [list(entry) for entry in page]
                 for replace in mustreplace:
-                    entry[replace[0]] = instantiate_from_store(replace[1], self.store, entry[replace[0]])
-                    #entry[replace[0]] = replace[1].instantiate_from_store(self.store,entry[replace[0]])
-                yield (entry, headers)
+                    objs = instantiate_many_from_store(replace[1], self.store, [entry[replace[0]] for entry in page])
+                    for entry, obj in zip(page, objs):
+                        entry[replace[0]] = obj
+                for entry in page:
+                    yield (entry, headers)
 
         cursor.close()
 
@@ -0,0 +1,166 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Exact binary encoding of arrays of fractions, used by SqlStore to keep FracVector arrays in a single BLOB column.
+
+An array is stored as its nominators on a shared denominator, flattened in row-major order:
+
+- Format 1: one byte 1, the denominator and then the nominators as little endian signed 64 bit integers.
+  Encoding and decoding is a single struct.pack/unpack call.
+- Format 2 (used when an integer does not fit in 64 bits, or some elements are None): one byte 2 followed by
+  the denominator and the nominators (or 'N' for None) as ASCII decimal integers separated by spaces.
+
+The shape is not stored, the reader gives the length of the rows.
+"""
+import struct
+
+try:
+    from math import gcd as _gcd
+except ImportError:
+    from fractions import gcd as _gcd
+
+from httk.core.vectors import FracVector, FracScalar
+from httk.core.basic import flatten
+
+_INT64_MIN = -2**63
+_INT64_MAX = 2**63 - 1
+
+try:
+    # Python 2: sqlite3 only stores buffer objects as BLOBs
+    _binary = buffer
+except NameError:
+    _binary = bytes
+
+
+def encode_fractions(val):
+    """
+    Returns the exact encoding of val (a FracVector or nested sequence of numbers, possibly with None entries).
+    """
+    if isinstance(val, FracVector):
+        fv = val
+    else:
+        flat = list(flatten(val))
+        if any(x is None for x in flat):
+            fracs = [None if x is None else FracScalar.use(x) for x in flat]
+            denom = 1
+            for x in fracs:
+                if x is not None:
+                    denom = denom*x.denom//_gcd(denom, x.denom)
+            noms = ['N' if x is None else str(x.noms*(denom//x.denom)) for x in fracs]
+            return _binary(b'\x02' + (" ".join([str(denom)] + noms)).encode('ascii'))
+        fv = FracVector.use(val)
+    denom = fv.denom
+    # (An empty array also has dim (), but its noms is an empty tuple)
+    noms = list(flatten(fv.noms)) if isinstance(fv.noms, tuple) else [fv.noms]
+    if len(noms) == 0 or (_INT64_MIN <= min(noms) and max(noms) <= _INT64_MAX and denom <= _INT64_MAX):
+        return _binary(struct.pack('<B%dq' % (len(noms)+1), 1, denom, *noms))
+    return _binary(b'\x02' + (" ".join([str(x) for x in [denom] + noms])).encode('ascii'))
+
+
+def decode_fractions(blob, width):
+    """
+    Decode an encoded array into a FracVector with rows of width elements. If the array has None entries,
+    a flat tuple of FracScalars and None is returned instead.
+    """
+    blob = bytes(blob)
+    if blob[0:1] == b'\x01':
+        n = (len(blob) - 9)//8
+        data = struct.unpack_from('<%dq' % n, blob, 9)
+        denom = struct.unpack_from('<q', blob, 1)[0]
+    elif blob[0:1] == b'\x02':
+        items = blob[1:].decode('ascii').split(" ")
+        denom = int(items[0])
+        if 'N' in items:
+            return tuple([None if x == 'N' else FracScalar.create(int(x), denom) for x in items[1:]])
+        data = [int(x) for x in items[1:]]
+    else:
+        raise Exception("fractionblob.decode_fractions: unknown encoding")
+    noms = tuple([tuple(data[i:i+width]) for i in range(0, len(data), width)])
+    return FracVector(noms, denom)
+
+
+def main():
+    import os, shutil, tempfile
+    from httk.atomistic import Structure
+    from httk.atomistic.representativesites import RepresentativeSites
+    from httk.db.backend import Sqlite
+    from httk.db.store import SqlStore
+
+    # Round trip of both formats, and of arrays with None entries
+    val = FracVector.create([["1/3", "-2/7", 0], [1, "-5/11", "1/10000019"]])
+    blob = encode_fractions(val)
+    assert blob[0:1] == b'\x01' and len(blob) == 1 + 8*7
+    assert decode_fractions(blob, 3) == val
+    val = FracVector.create([["1/3", 2**70, -2**64]])
+    blob = encode_fractions(val)
+    assert blob[0:1] == b'\x02'
+    assert decode_fractions(blob, 3) == val
+    blob = encode_fractions([["1/2", None, 3]])
+    assert decode_fractions(blob, 3) == (FracScalar.create(1, 2), None, FracScalar.create(3))
+    assert decode_fractions(encode_fractions(FracVector.create([])), 3) == FracVector.create([])
+
+    coordgroups = [[[0, 0, 0], ["1/2", "1/2", "1/2"]], [["1/3", "2/3", "1/10000019"]]]
+
+    def structure():
+        return Structure.create(uc_basis=FracVector.create([["5.6", 0, 0], [0, "5.6", 0], [0, 0, "5.6"]]),
+                                uc_reduced_coordgroups=coordgroups, assignments=['Na', 'Cl'])
+
+    types = RepresentativeSites.types()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # The coordinates come back exactly from a BLOB column, but not with the legacy encoding
+        struct = structure()
+        expected = struct.rc_sites.reduced_coords
+        backend = Sqlite(os.path.join(tmpdir, 'exact.sqlite'))
+        store = SqlStore(backend)
+        assert store.fraction_encoding == 'exact'
+        store.save(struct)
+        store.commit()
+        assert store.get('RepresentativeSites', struct.rc_sites.db.sid, types, 'reduced_coords') == expected
+        backend.close()
+
+        struct = structure()
+        backend = Sqlite(os.path.join(tmpdir, 'legacy.sqlite'))
+        store = SqlStore(backend, fraction_encoding='legacy')
+        store.save(struct)
+        store.commit()
+        sid = struct.rc_sites.db.sid
+        legacy = store.get('RepresentativeSites', sid, types, 'reduced_coords')
+        assert legacy != expected
+        backend.close()
+
+        # Migration keeps the values read with the legacy encoding, and is recorded in the database
+        backend = Sqlite(os.path.join(tmpdir, 'legacy.sqlite'))
+        store = SqlStore(backend)
+        assert store.fraction_encoding == 'legacy'
+        store.migrate_fraction_encoding()
+        assert store.fraction_encoding == 'exact'
+        assert store.get('RepresentativeSites', sid, types, 'reduced_coords') == legacy
+        backend.close()
+        backend = Sqlite(os.path.join(tmpdir, 'legacy.sqlite'))
+        store = SqlStore(backend)
+        assert store.fraction_encoding == 'exact'
+        assert store.get_many('RepresentativeSites', [sid], types, ['reduced_coords'])[sid]['reduced_coords'] == legacy
+        backend.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,12 +17,14 @@
 
 #from numpy import *
 import sys
+import sqlite3
 from httk.core import unicode_type
 from httk.core.httkobject import HttkObject
 from httk.db.filteredcollection import *
 from httk.core.basic import flatten
 from httk.core import FracVector, FracScalar
 from httk.db.storable import Storable
+from httk.db.store.fractionblob import encode_fractions, decode_fractions
 
 #def table_exist(db,table):
 #    db.execute("")
@@ -34,20 +36,71 @@ class SqlStore(object):
     Keep objects in an sql database
     """
     basics = [int, float, str, bool, FracScalar]
-
-    def __init__(self, db):
+    # Max number of sids in one 'IN (...)' clause (sqlite allows at most 999 parameters by default)
+    batch_size = 500
+    # Table that keeps information about how the data is stored
+    info_table = "httk_store_info"
+
+    def __init__(self, db, fraction_encoding=None):
+        """
+        fraction_encoding: how arrays of FracVector/FracScalar are stored:
+
+        - 'exact': each array in a single BLOB column (see httk.db.store.fractionblob), with the exact values.
+        - 'legacy': each element in a separate integer column (for variable length arrays: in a subtable)
+          as the value limited to denominator 5000000 times 10^9.
+
+        New databases use 'exact' unless told otherwise. Databases without information on the encoding were
+        created with 'legacy', and can be converted with migrate_fraction_encoding. Scalar FracScalar fields are
+        always stored as 10^9 times the value in an integer column, so they can be used in searches.
+        """
         self.db = db
         self._delay_commit = False
+        self.fraction_encoding = self._init_fraction_encoding(fraction_encoding)
+
+    def _init_fraction_encoding(self, requested):
+        if self.db.table_exists(self.info_table):
+            result = self.db.query("SELECT value FROM "+self.info_table+" WHERE key = ?", ["fraction_encoding"])
+            encoding = result[0][0] if len(result) > 0 else 'legacy'
+        elif len(self.db.query("SELECT name FROM sqlite_master WHERE type='table'", [])) > 0:
+            encoding = 'legacy'
+        else:
+            encoding = 'exact' if requested is None else requested
+            if encoding not in ('exact', 'legacy'):
+                raise Exception("SqlStore: unknown fraction_encoding: "+str(encoding))
+            self._write_info('fraction_encoding', encoding)
+            self.db.commit()
+        if requested is not None and requested != encoding:
+            raise Exception("SqlStore: the database uses fraction_encoding = "+encoding+", not "+str(requested) +
+                            " (use migrate_fraction_encoding to convert it.)")
+        return encoding
+
+    def _write_info(self, key, value, cursor=None):
+        if cursor is None:
+            cursor = self.db.cursor()
+            mycursor = True
+        else:
+            mycursor = False
+        if not self.db.table_exists(self.info_table, cursor=cursor):
+            self.db.modify_structure("CREATE TABLE "+self.info_table+" (key TEXT PRIMARY KEY, value TEXT)", (), cursor=cursor)
+        self.db.query("INSERT OR REPLACE INTO "+self.info_table+" (key, value) VALUES (?, ?)", [key, value], cursor=cursor)
+        if mycursor:
+            cursor.close()
+
+    def _is_exact_array(self, t):
+        return self.fraction_encoding == 'exact' and isinstance(t, tuple) and t[0] in (FracVector, FracScalar)
 
     class Keeper(object):
 
-        def __init__(self, store, table, types, sid):
+        def __init__(self, store, table, types, sid, prefetched=None):
             self.store = store
             self.table = table
             self.sid = sid
             self.types = types
+            self.prefetched = prefetched
 
         def __getitem__(self, name):
+            if self.prefetched is not None and name in self.prefetched:
+                return self.prefetched[name]
             return self.store.get(self.table, self.sid, self.types, name)
 
         def __setitem__(self, name, val):
@@ -69,6 +122,14 @@ class SqlStore(object):
         #    raise Exception("DictStore.retrieve: retrieve of non-existing table")
         return SqlStore.Keeper(self, table, types, sid)
 
+    def retrieve_many(self, table, types, sids, names):
+        """
+        Like retrieve, but for a list of sids, with the values of the fields in names fetched up front
+        for all of them at once (see get_many).
+        """
+        vals = self.get_many(table, sids, types, names)
+        return [SqlStore.Keeper(self, table, types, sid, vals.get(sid)) for sid in sids]
+
     def create_table(self, table, types, cursor=None):
         #self.store[table]={}
         #self.sids[table]=0
@@ -122,6 +183,12 @@ class SqlStore(object):
                 self.create_table(subtablename, {'keys': subtypes, 'index': subindex, 'derived': derivedtypes}, cursor)
                 inindex = list(filter(lambda x: x != name, inindex))
 
+            # Array of fractions stored exactly in one column
+            elif self._is_exact_array(t):
+                columns.append(name)
+                column_types.append(FracVector)
+                inindex = list(filter(lambda x: x != name, inindex))
+
             # Tuple means array
             elif isinstance(t, tuple):
                 tupletype = t[0]
@@ -197,6 +264,33 @@ class SqlStore(object):
         else:
             mycursor = False
 
+        columns, columndata, subinserts = self._encode_row(table, types, keyvals, self._store_reference)
+
+        # TODO: this logic is not finished, more elaborate updates need handling
+        if (isinstance(updatesid, int) and updatesid >= 0) or updatesid is None:
+            if updatesid is not None:
+                sid = self.db.update_row(table, table+"_id", updatesid, columns, columndata, cursor)
+            else:
+                sid = self.db.insert_row(table, columns, columndata, cursor)
+                for subinsert in subinserts:
+                    subinsert[2][table+"_sid"] = sid
+                    self.insert(subinsert[0], {'keys': subinsert[1], 'derived': subinsert[3]}, subinsert[2], cursor)
+        else:
+            sid = -updatesid
+
+        if mycursor:
+            if not self._delay_commit:
+                self.db.commit()
+            cursor.close()
+
+        return sid
+
+    def _encode_row(self, table, types, keyvals, store_reference):
+        """
+        Convert keyvals into the columns and values of a row in table, and a list of rows for subtables
+        (subtablename, subtypes, data, derived) that still lack the sid of the row. store_reference(t, val)
+        is called to get the sid of each referenced object.
+        """
         columns = []
         columndata = []
         subinserts = []
@@ -211,26 +305,12 @@ class SqlStore(object):
             if val is None:
                 continue
 
-            # Regular column, no strangeness
-            if t in self.basics:
-                #if issubclass(t,FracVector):
-                #    val = (val*1000000000).to_int()
-                if issubclass(t, FracScalar):
-                    val = FracScalar.use(val)
-                    val = int(val.limit_denominator(50000000)*1000000000)
-                #if isinstance(t,FracVector):
-                #    print("DOES THIS HAPPEN?",t,val)
-                #    val = int(val.limit_denominator(50000000))
-                else:
-                    try:
-                        val = t(val)
-                    except UnicodeEncodeError:
-                        val = unicode_type(val)
-                    except TypeError:
-                        print("HUH", val, t)
-                        raise
-                columns.append(name)
-                columndata.append(val)
+            # Regular column, no strangeness; arrays of fractions stored exactly in one column;
+            # or a numpy array with fixed number of entries, flattened and stored as _1, _2, ... columns
+            if t in self.basics or self._is_exact_array(t) or (isinstance(t, tuple) and t[1] >= 1):
+                names, vals = self._encode_columns(name, t, val)
+                columns += names
+                columndata += vals
 
             # List type means we need to establish a second table and store key values
             elif isinstance(t, list):
@@ -246,11 +326,7 @@ class SqlStore(object):
                             subtypename = t[i][0]+"_"+t[i][1].types()['name']+"_sid"
                             subtypes.append((subtypename, int,))
 
-                            if entry[i].db.sid is None:
-                                entryval = t[i][1].use(entry[i])
-                                entryval.db.store(self)
-
-                            data[subtypename] = entry[i].db.sid
+                            data[subtypename] = store_reference(t[i][1], entry[i])
                         else:
                             subtypename = t[i][0]
                             subtypes.append((subtypename, t[i][1],))
@@ -265,75 +341,89 @@ class SqlStore(object):
                     subinserts.append((subtablename, subtypes, data, ()))
                     #print("SUBINSETS",subinserts)
 
-            # Tuple means numpy array
+            # Variable length numpy array, needs subtable
             elif isinstance(t, tuple):
-                # Numpy array with fixed number of entries, just flatten and store as _1, _2, ... columns
-                tupletype = t[0]
-                #print("INSERT TUPLETYPE",tupletype,types,t)
-
-                if t[1] >= 1:
-                    #flat=val.flatten()
-                    flat = tuple(flatten(val))
-                    size = t[1]*t[2]
-                    for i in range(size):
-                        columname = name+"_"+str(i)
-                        columns.append(columname)
-                        if tupletype == FracVector:
-                            setval = (FracVector.use(flat[i]).limit_denominator(5000000)*1000000000).to_ints()
-                            columndata.append(setval)
-                        elif tupletype == FracScalar:
-                            #print("FLATI",flat[i])
-                            #columndata.append(map(lambda x:int(x*1000000000),flat[i]))
-                            if flat[i] is not None:
-                                setval = int(FracScalar.use(flat[i]).limit_denominator(5000000)*1000000000)
-                                columndata.append(setval)
-                            else:
-                                columndata.append(None)
-                        else:
-                            columndata.append(flat[i])
-
-                # Variable length numpy array, needs subtable
-                if t[1] == 0:
-                    subtablename = table+"_"+name
-                    subtablecolumnname = name
-                    subdimension = (tupletype, 1, t[2])
-
-                    for idx, entry in enumerate(val):  # loops over rows in 2d array
-                        #data = {table+"_sid":sid,name:entry}
-                        #self.insert(subtablename,data)
-                        data = {name: entry, name+"_index": idx}
-                        subtypes = [(subtablecolumnname, subdimension), (table+"_sid", int), (name+"_index", int)]
-                        subinserts.append((subtablename, subtypes, data, ()))
+                subtablename = table+"_"+name
+                subtablecolumnname = name
+                subdimension = (t[0], 1, t[2])
+
+                for idx, entry in enumerate(val):  # loops over rows in 2d array
+                    #data = {table+"_sid":sid,name:entry}
+                    #self.insert(subtablename,data)
+                    data = {name: entry, name+"_index": idx}
+                    subtypes = [(subtablecolumnname, subdimension), (table+"_sid", int), (name+"_index", int)]
+                    subinserts.append((subtablename, subtypes, data, ()))
 
             elif issubclass(t, HttkObject):
-                if val.db.sid is None:
-                    # This fixes an issue where sometimes a different class (e.g. a subclass) is sent in to be stored in a field.
-                    val = t.use(val)
-                    val.db.store(self)
                 columnname = name+"_"+t.types()['name']+"_sid"
                 columns.append(columnname)
-                columndata.append(val.db.sid)
+                columndata.append(store_reference(t, val))
             else:
                 raise Exception("Dictstore.insert: unexpected class; can only handle basic types and subclasses of Storable. Offending class:"+str(t))
 
-        # TODO: this logic is not finished, more elaborate updates need handling
-        if (isinstance(updatesid, int) and updatesid >= 0) or updatesid is None:
-            if updatesid is not None:
-                sid = self.db.update_row(table, table+"_id", updatesid, columns, columndata, cursor)
-            else:
-                sid = self.db.insert_row(table, columns, columndata, cursor)
-                for subinsert in subinserts:
-                    subinsert[2][table+"_sid"] = sid
-                    self.insert(subinsert[0], {'keys': subinsert[1], 'derived': subinsert[3]}, subinsert[2], cursor)
-        else:
-            sid = -updatesid
+        return columns, columndata, subinserts
 
-        if mycursor:
-            if not self._delay_commit:
-                self.db.commit()
-            cursor.close()
+    def _encode_columns(self, name, t, val):
+        """
+        Convert the value val of a field of a basic type or a fixed size array into the columns it is stored in and
+        their values.
+        """
+        if t in self.basics:
+            if val is None:
+                return [name], [None]
+            #if issubclass(t,FracVector):
+            #    val = (val*1000000000).to_int()
+            if issubclass(t, FracScalar):
+                val = FracScalar.use(val)
+                val = int(val.limit_denominator(50000000)*1000000000)
+            #if isinstance(t,FracVector):
+            #    print("DOES THIS HAPPEN?",t,val)
+            #    val = int(val.limit_denominator(50000000))
+            else:
+                try:
+                    val = t(val)
+                except UnicodeEncodeError:
+                    val = unicode_type(val)
+                except TypeError:
+                    print("HUH", val, t)
+                    raise
+            return [name], [val]
+
+        # Array of fractions stored exactly in one column
+        if self._is_exact_array(t):
+            return [name], [None if val is None else encode_fractions(val)]
+
+        # Numpy array with fixed number of entries, just flatten and store as _1, _2, ... columns
+        tupletype = t[0]
+        size = t[1]*t[2]
+        columns = [name+"_"+str(i) for i in range(size)]
+        if val is None:
+            return columns, [None]*size
+        #flat=val.flatten()
+        flat = tuple(flatten(val))
+        columndata = []
+        for i in range(size):
+            if tupletype == FracVector:
+                setval = (FracVector.use(flat[i]).limit_denominator(5000000)*1000000000).to_ints()
+                columndata.append(setval)
+            elif tupletype == FracScalar:
+                #print("FLATI",flat[i])
+                #columndata.append(map(lambda x:int(x*1000000000),flat[i]))
+                if flat[i] is not None:
+                    setval = int(FracScalar.use(flat[i]).limit_denominator(5000000)*1000000000)
+                    columndata.append(setval)
+                else:
+                    columndata.append(None)
+            else:
+                columndata.append(flat[i])
+        return columns, columndata
 
-        return sid
+    def _store_reference(self, t, val):
+        if val.db.sid is None:
+            # This fixes an issue where sometimes a different class (e.g. a subclass) is sent in to be stored in a field.
+            val = t.use(val)
+            val.db.store(self)
+        return val.db.sid
 
     def get(self, table, sid, types, name):
         #types=self.types[table]
@@ -348,10 +438,7 @@ class SqlStore(object):
         # Regular column, no strangeness
         if t in self.basics:
             if t == FracScalar:
-                val = self.db.get_val(table, table+"_id", sid, name)
-                if val is None:
-                    return None
-                return FracVector.create(FracScalar(int(val), 1000000000).limit_denominator(5000000))
+                return self._decode_fracscalar(self.db.get_val(table, table+"_id", sid, name))
             return self.db.get_val(table, table+"_id", sid, name)
 
         # List type means we need to establish a second table and store key values
@@ -388,10 +475,11 @@ class SqlStore(object):
             #print("TYPE0",types['keydict'][name])
             #print("TYPE",origt[0])
             #print("RESULT",result)
-            if not type(origt[0]) in (list, tuple):
-                return [x[0] for x in result]
-            else:
-                return result
+            return self._decode_list(origt, result)
+
+        # Array of fractions stored exactly in one column
+        elif self._is_exact_array(t):
+            return self._decode_exact_array(t, self.db.get_val(table, table+"_id", sid, name))
 
         # Tuple means numpy array
         elif isinstance(t, tuple):
@@ -427,23 +515,7 @@ class SqlStore(object):
                 for i in range(size):
                     columnames.append(name+"_"+str(i))
                 flat = self.db.get_row(table, table+"_id", sid, columnames)[0]
-
-                if tupletype == FracVector or tupletype == FracScalar:
-                    for x in flat:
-                        if x is None:
-                            return flat
-                    #def flatterer(l):
-                    #    if l == None:
-                    #        return None
-                    #    else:
-                    #        return Fraction(int(l),1000000000)
-                    #flat=map(flatterer,flat)
-                    flat = map(lambda l: FracScalar(int(l), 1000000000).limit_denominator(5000000), flat)
-                    reshaped = zip(*[iter(flat)]*t[1])
-                    return FracVector.create(reshaped)
-                else:
-                    map(tupletype, flat)
-                    return zip(*[iter(flat)]*t[1])
+                return self._decode_fixed_array(t, flat)
                 # TODO: ADD support for numpy
 
             # Variable length numpy array, needs subtable
@@ -452,12 +524,7 @@ class SqlStore(object):
                 columnames = []
                 for i in range(t[2]):
                     columnames.append(name+"_"+str(i))
-                if tupletype == FracVector or tupletype == FracScalar:
-                    vals = self.db.get_row(subtablename, table+"_sid", sid, columnames)
-                    vals = map(lambda l: map(lambda x: FracScalar(int(x), 1000000000), l), vals)
-                    return FracVector.create(vals).limit_denominator(5000000)
-                else:
-                    return self.db.get_row(subtablename, table+"_sid", sid, columnames)
+                return self._decode_variable_array(t, self.db.get_row(subtablename, table+"_sid", sid, columnames))
 
 #       elif issubclass(t,Storable):
         elif hasattr(t, 'types'):
@@ -468,6 +535,184 @@ class SqlStore(object):
         else:
             raise Exception("Dictstore.get: unexpected class; can only handle basic types and subclasses of Storable. Offending class:"+str(t))
 
+    def get_many(self, table, sids, types, names):
+        """
+        Batch version of get: returns a dict {sid: {name: value}} with the values of the fields in names
+        for all objects in sids. Rather than issuing one query per field of each object, all regular columns
+        are fetched in one query, and each list or array subtable in one query, per batch_size sids. Objects
+        referenced by these fields are in turn instantiated in batch.
+
+        Names that are not fields of the table, and sids without a row in the table, are left out of the result.
+        """
+        sids = list(dict.fromkeys([sid for sid in sids if sid is not None]))
+        fields = []
+        for name in names:
+            if name in types['keydict']:
+                fields.append((name, types['keydict'][name]))
+            elif name in types['derived_keydict']:
+                fields.append((name, types['derived_keydict'][name]))
+        result = {}
+        if len(sids) == 0:
+            return result
+
+        # Sort out which columns of the table and which subtables are needed
+        columns = []
+        subtables = []
+        for name, t in fields:
+            if t in self.basics:
+                columns.append(name)
+            elif isinstance(t, list):
+                if not isinstance(t[0], tuple):
+                    t = [(name, t[0])]
+                subcolumns = []
+                for i in range(len(t)):
+                    if issubclass(t[i][1], HttkObject):
+                        subcolumns.append(t[i][0]+"_"+t[i][1].types()['name']+"_sid")
+                    else:
+                        subcolumns.append(t[i][0])
+                subtables.append((name, subcolumns))
+            elif self._is_exact_array(t):
+                columns.append(name)
+            elif isinstance(t, tuple):
+                if t[1] >= 1:
+                    columns += [name+"_"+str(i) for i in range(t[1]*t[2])]
+                if t[1] == 0:
+                    subtables.append((name, [name+"_"+str(i) for i in range(t[2])]))
+            elif hasattr(t, 'types'):
+                columns.append(name+"_"+t.types()['name']+"_sid")
+            else:
+                raise Exception("SqlStore.get_many: unexpected class; can only handle basic types and subclasses of Storable. Offending class:"+str(t))
+
+        rows = {}
+        subrows = dict([(name, {}) for name, _subcolumns in subtables])
+        cursor = self.db.cursor()
+        for start in range(0, len(sids), self.batch_size):
+            chunk = sids[start:start+self.batch_size]
+            placeholders = ",".join(["?"]*len(chunk))
+            sql = "SELECT "+",".join([table+"_id"] + columns)+" FROM "+table+" WHERE "+table+"_id IN ("+placeholders+")"
+            for row in self.db.query(sql, chunk, cursor=cursor):
+                rows[row[0]] = row[1:]
+            for name, subcolumns in subtables:
+                subtablename = table+"_"+name
+                # Order as get, which retrieves the rows of one sid in the order they were inserted
+                sql = "SELECT "+",".join([table+"_sid"] + subcolumns)+" FROM "+subtablename + \
+                      " WHERE "+table+"_sid IN ("+placeholders+") ORDER BY "+table+"_sid, "+subtablename+"_id"
+                for row in self.db.query(sql, chunk, cursor=cursor):
+                    subrows[name].setdefault(row[0], []).append(row[1:])
+        cursor.close()
+        columnidx = dict([(column, i) for i, column in enumerate(columns)])
+
+        # Instantiate all referenced objects, one batch per class
+        references = {}
+        for name, t in fields:
+            if isinstance(t, list):
+                if not isinstance(t[0], tuple):
+                    t = [(name, t[0])]
+                for i in range(len(t)):
+                    if issubclass(t[i][1], HttkObject):
+                        refsids = references.setdefault(t[i][1], set())
+                        for lines in subrows[name].values():
+                            refsids.update([line[i] for line in lines])
+            elif not isinstance(t, tuple) and t not in self.basics and hasattr(t, 'types'):
+                idx = columnidx[name+"_"+t.types()['name']+"_sid"]
+                references.setdefault(t, set()).update([row[idx] for row in rows.values()])
+        objects = {}
+        for cls in references:
+            refsids = [x for x in references[cls] if x is not None]
+            objects[cls] = dict(zip(refsids, instantiate_many_from_store(cls, self, refsids)))
+
+        for sid in sids:
+            if sid not in rows:
+                continue
+            row = rows[sid]
+            vals = {}
+            for name, t in fields:
+                origt = t
+                if t in self.basics:
+                    val = row[columnidx[name]]
+                    if t == FracScalar:
+                        val = self._decode_fracscalar(val)
+                elif isinstance(t, list):
+                    if not isinstance(t[0], tuple):
+                        t = [(name, t[0])]
+                    lines = []
+                    for line in subrows[name].get(sid, []):
+                        line = list(line)
+                        for i in range(len(t)):
+                            if issubclass(t[i][1], HttkObject):
+                                line[i] = objects[t[i][1]].get(line[i])
+                        lines.append(line)
+                    val = self._decode_list(origt, lines)
+                elif self._is_exact_array(t):
+                    val = self._decode_exact_array(t, row[columnidx[name]])
+                elif isinstance(t, tuple):
+                    if t[1] >= 1:
+                        idx = columnidx[name+"_0"]
+                        val = self._decode_fixed_array(t, row[idx:idx+t[1]*t[2]])
+                    else:
+                        val = self._decode_variable_array(t, subrows[name].get(sid, []))
+                else:
+                    subsid = row[columnidx[name+"_"+t.types()['name']+"_sid"]]
+                    val = objects[t].get(subsid)
+                vals[name] = val
+            result[sid] = vals
+
+        return result
+
+    @staticmethod
+    def _decode_fracscalar(val):
+        if val is None:
+            return None
+        return FracVector.create(FracScalar(int(val), 1000000000).limit_denominator(5000000))
+
+    @staticmethod
+    def _decode_list(t, result):
+        if not type(t[0]) in (list, tuple):
+            return [x[0] for x in result]
+        else:
+            return result
+
+    @staticmethod
+    def _decode_fixed_array(t, flat):
+        tupletype = t[0]
+        if tupletype == FracVector or tupletype == FracScalar:
+            for x in flat:
+                if x is None:
+                    return flat
+            #def flatterer(l):
+            #    if l == None:
+            #        return None
+            #    else:
+            #        return Fraction(int(l),1000000000)
+            #flat=map(flatterer,flat)
+            flat = map(lambda l: FracScalar(int(l), 1000000000).limit_denominator(5000000), flat)
+            reshaped = zip(*[iter(flat)]*t[1])
+            return FracVector.create(reshaped)
+        else:
+            # A list also with python 3, since objects with the same sid may share the value (see get_many)
+            return list(zip(*[iter(flat)]*t[1]))
+
+    @staticmethod
+    def _decode_exact_array(t, blob):
+        # Same shapes as the legacy encoding, i.e., fixed size arrays in rows of t[1] elements,
+        # and variable length arrays in rows of t[2] elements.
+        if t[1] >= 1:
+            if blob is None:
+                return (None,)*(t[1]*t[2])
+            return decode_fractions(blob, t[1])
+        if blob is None:
+            return FracVector.create([])
+        return decode_fractions(blob, t[2])
+
+    @staticmethod
+    def _decode_variable_array(t, vals):
+        tupletype = t[0]
+        if tupletype == FracVector or tupletype == FracScalar:
+            vals = map(lambda l: map(lambda x: FracScalar(int(x), 1000000000), l), vals)
+            return FracVector.create(vals).limit_denominator(5000000)
+        else:
+            return vals
+
     def put(self, table, sid, types, name, val):
         raise Exception("Is this being called?")
         t = types['keydict'][name]
@@ -530,3 +775,434 @@ class SqlStore(object):
 
     def save(self, obj):
         obj.db.store(self)
+
+    def migrate_fraction_encoding(self, classes=None, strict=True):
+        """
+        Convert a database from the 'legacy' to the 'exact' fraction_encoding. Arrays get the values they are
+        read as with the legacy encoding.
+
+        classes: the HttkObject subclasses stored in the database. The default is all imported subclasses of
+        HttkObject, so the modules that define the classes must have been imported.
+        strict: if True, raise an exception, before anything is changed, if the database has tables that do not
+        belong to any of the classes; otherwise such tables are left as they are.
+        """
+        if self.fraction_encoding == 'exact':
+            return
+        if classes is None:
+            classes = _all_subclasses(HttkObject)
+
+        existing = set([x[0] for x in self.db.query("SELECT name FROM sqlite_master WHERE type='table'", [])])
+        tables = []
+        known = set([self.info_table])
+        for cls in classes:
+            try:
+                types = cls.types()
+            except Exception:
+                continue
+            if types['name'] in existing and types['name'] not in known:
+                for table, tabletypes in self._table_types(types['name'], types):
+                    known.add(table)
+                    if table in existing and tabletypes is not None:
+                        tables.append((table, tabletypes))
+        if strict and len(existing - known) > 0:
+            raise Exception("SqlStore.migrate_fraction_encoding: tables that do not belong to any of the classes: " +
+                            ", ".join(sorted(existing - known)))
+
+        cursor = self.db.cursor()
+        try:
+            for table, tabletypes in tables:
+                self._migrate_table(table, tabletypes, cursor)
+            self._write_info('fraction_encoding', 'exact', cursor)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        finally:
+            cursor.close()
+        self.fraction_encoding = 'exact'
+
+    def _table_types(self, table, types):
+        # The table and the subtables that create_table makes for it (with the legacy encoding), with their types.
+        # The subtables of variable length arrays are given with types None, since they are migrated with the table.
+        yield table, types
+        for name, t in tuple(types['keys']) + tuple(types['derived']):
+            if isinstance(t, list):
+                if not isinstance(t[0], tuple):
+                    t = [(name, t[0])]
+                subtypes = [(table+"_sid", int), (name+"_index", int)]
+                for it in t:
+                    if issubclass(it[1], HttkObject):
+                        subtypes.append((it[0]+"_"+it[1].types()['name']+"_sid", int,))
+                    else:
+                        subtypes.append((it[0], it[1],))
+                for x in self._table_types(table+"_"+name, {'keys': subtypes, 'derived': ()}):
+                    yield x
+            elif isinstance(t, tuple) and t[1] == 0:
+                if t[0] in (FracVector, FracScalar):
+                    yield table+"_"+name, None
+                else:
+                    yield table+"_"+name, {'keys': [(table+"_sid", int), (name+"_index", int), (name, (t[0], 1, t[2]))], 'derived': ()}
+
+    def _migrate_table(self, table, types, cursor):
+        for name, t in tuple(types['keys']) + tuple(types['derived']):
+            if not (isinstance(t, tuple) and t[0] in (FracVector, FracScalar)):
+                continue
+            self.db.alter("ALTER TABLE "+table+" ADD COLUMN "+name+" BLOB", (), cursor=cursor)
+            updates = []
+            if t[1] >= 1:
+                oldcolumns = [name+"_"+str(i) for i in range(t[1]*t[2])]
+                for row in self.db.query("SELECT "+",".join([table+"_id"] + oldcolumns)+" FROM "+table, [], cursor=cursor):
+                    flat = row[1:]
+                    if all(x is None for x in flat):
+                        continue
+                    val = self._decode_fixed_array(t, flat)
+                    if not isinstance(val, FracVector):
+                        val = [None if x is None else FracScalar(int(x), 1000000000).limit_denominator(5000000) for x in flat]
+                    updates.append((encode_fractions(val), row[0]))
+            else:
+                subtablename = table+"_"+name
+                oldcolumns = [name+"_"+str(i) for i in range(t[2])]
+                grouped = {}
+                for row in self.db.query("SELECT "+",".join([table+"_sid"] + oldcolumns)+" FROM "+subtablename +
+                                         " ORDER BY "+table+"_sid, "+subtablename+"_id", [], cursor=cursor):
+                    grouped.setdefault(row[0], []).append(row[1:])
+                for sid in grouped:
+                    updates.append((encode_fractions(self._decode_variable_array(t, grouped[sid])), sid))
+            cursor.executemany("UPDATE "+table+" SET "+name+" = ? WHERE "+table+"_id = ?", updates)
+            if t[1] >= 1:
+                # Dropping columns needs sqlite 3.35; with older versions they are left unused
+                if sqlite3.sqlite_version_info >= (3, 35, 0):
+                    for column in oldcolumns:
+                        try:
+                            self.db.alter("ALTER TABLE "+table+" DROP COLUMN "+column, (), cursor=cursor)
+                        except Exception:
+                            # E.g., an indexed column
+                            pass
+            else:
+                self.db.alter("DROP TABLE "+subtablename, (), cursor=cursor)
+
+    def ingest(self, wal=False):
+        """
+        Returns a SqlIngestSession for saving many objects quickly, use as::
+
+            with store.ingest() as session:
+                for obj in objects:
+                    session.save(obj)
+        """
+        return SqlIngestSession(self, wal=wal)
+
+    def bulk_save(self, objects, wal=False):
+        """
+        Save all objects in the iterable objects in one ingest session (see SqlIngestSession).
+        """
+        with self.ingest(wal=wal) as session:
+            for obj in objects:
+                session.save(obj)
+
+
+def _all_subclasses(cls):
+    result = []
+    for sub in cls.__subclasses__():
+        result += [sub] + _all_subclasses(sub)
+    return result
+
+
+class SqlIngestSession(object):
+
+    """
+    Saves objects into an SqlStore with the same result as SqlStore.save, but much faster for many objects:
+
+    - Rows are not written one at a time, but buffered per table and written with executemany.
+    - Duplicates are found in an in-memory map from hexhash (or, for classes without hexhash, the key columns)
+      to sid for each table, which is read from the database once, rather than by a search per object.
+    - Everything is committed once, at the end of the session.
+    - With wal=True, the database is switched to write-ahead logging with synchronous=NORMAL for the
+      duration of the session.
+
+    The session holds the write lock of the database (BEGIN IMMEDIATE) from start to end, so other connections
+    cannot write to it meanwhile, and the sids of new rows are the ones that follow the largest sid in each
+    table. Nothing else may write to the database through the same connection while the session is open. If the
+    session ends with an exception, everything is rolled back, and the objects saved in the session get back the
+    sids they had before.
+    """
+
+    # Number of buffered rows that triggers a write to the database
+    flush_rows = 20000
+
+    def __init__(self, store, wal=False):
+        self.store = store
+        self.db = store.db
+        self.wal = wal
+        self._next_sid = {}
+        self._dedup = {}
+        self._rows = {}
+        self._nrows = 0
+        # (db plugin, sid before the session) of the saved objects, to restore them on rollback
+        self._saved = []
+        self._saved_delay_commit = store._delay_commit
+        self._saved_pragmas = None
+        self._cursor = self.db.cursor()
+        self.db.commit()
+        if wal:
+            journal_mode = self.db.query("PRAGMA journal_mode", (), cursor=self._cursor)[0][0]
+            synchronous = self.db.query("PRAGMA synchronous", (), cursor=self._cursor)[0][0]
+            self._saved_pragmas = (journal_mode, synchronous)
+            self.db.query("PRAGMA journal_mode=WAL", (), cursor=self._cursor)
+            self._cursor.execute("PRAGMA synchronous=NORMAL")
+        self._cursor.execute("BEGIN IMMEDIATE")
+        store._delay_commit = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.close(rollback=True)
+        return False
+
+    def save(self, obj):
+        """
+        Save obj and its codependent data (e.g., tags), returns the sid of obj.
+        """
+        plugin = obj.db
+        types = plugin.storable.types
+        table = types['name']
+        self._prepare_table(table, types)
+
+        data = {}
+        for key in plugin.keydict:
+            data[key] = getattr(obj, key)
+
+        if 'hexhash' in plugin.derived_keydict and hasattr(obj, 'hexhash'):
+            dedupkey = obj.hexhash
+        else:
+            dedupkey = self._dedup_key(types, data)
+
+        sid = None if dedupkey is None else self._dedup[table].get(dedupkey)
+        if sid is None:
+            for key in plugin.derived_keydict:
+                data[key] = getattr(obj, key)
+            sid = self._insert(table, types, data)
+            if dedupkey is None:
+                # The referenced objects are saved now
+                dedupkey = self._dedup_key(types, data)
+            self._dedup[table][dedupkey] = sid
+        self._saved.append((plugin, plugin.sid))
+        plugin.sid = sid
+
+        for entry in obj.get_codependent_data():
+            self.save(entry)
+        return sid
+
+    def _store_reference(self, t, val):
+        if val.db.sid is None:
+            val = t.use(val)
+            self.save(val)
+        return val.db.sid
+
+    def _dedup_key(self, types, keyvals):
+        """
+        The values of the columns that duplicates are compared on (see _prepare_table) for a class without
+        hexhash. Referenced objects are looked up without saving them; if one is not in the database, there
+        can be no duplicate and None is returned.
+        """
+        key = []
+        for name, t in types['keys']:
+            val = keyvals.get(name)
+            if t in self.store.basics or self.store._is_exact_array(t) or (isinstance(t, tuple) and t[1] >= 1):
+                key += self.store._encode_columns(name, t, val)[1]
+            elif not isinstance(t, (list, tuple)) and issubclass(t, HttkObject):
+                if val is None:
+                    key.append(None)
+                    continue
+                sid = self._lookup_sid(t, val)
+                if sid is None:
+                    return None
+                key.append(sid)
+        return tuple(key)
+
+    def _lookup_sid(self, t, val):
+        # The sid of val if it is saved or has a duplicate in the database, otherwise None; nothing is saved
+        if val.db.sid is not None:
+            return val.db.sid
+        val = t.use(val)
+        types = val.db.storable.types
+        table = types['name']
+        self._prepare_table(table, types)
+        if 'hexhash' in types['derived_keydict'] and hasattr(val, 'hexhash'):
+            dedupkey = val.hexhash
+        else:
+            dedupkey = self._dedup_key(types, dict([(key, getattr(val, key)) for key in val.db.keydict]))
+            if dedupkey is None:
+                return None
+        return self._dedup[table].get(dedupkey)
+
+    def _prepare_table(self, table, types):
+        if table in self._dedup:
+            return
+        if not self.db.table_exists(table, cursor=self._cursor):
+            self.store.create_table(table, types, cursor=self._cursor)
+        dedup = {}
+        if 'hexhash' in types['derived_keydict']:
+            rows = self.db.query("SELECT hexhash, "+table+"_id FROM "+table, (), cursor=self._cursor)
+        else:
+            # Compare on the columns of the keys, as the search in HttkObjDbPlugin.store
+            columns = []
+            for name, t in types['keys']:
+                if t in self.store.basics or self.store._is_exact_array(t):
+                    columns.append(name)
+                elif isinstance(t, tuple) and t[1] >= 1:
+                    columns += [name+"_"+str(i) for i in range(t[1]*t[2])]
+                elif not isinstance(t, (list, tuple)) and issubclass(t, HttkObject):
+                    columns.append(name+"_"+t.types()['name']+"_sid")
+            rows = self.db.query("SELECT "+",".join(columns + [table+"_id"])+" FROM "+table, (), cursor=self._cursor)
+            rows = [(tuple(row[:-1]), row[-1]) for row in rows]
+        for key, sid in rows:
+            # As a search, use the first match
+            dedup.setdefault(key, sid)
+        self._dedup[table] = dedup
+
+    def _new_sid(self, table):
+        # The session has the write lock, so the sids after the largest one in the table are free until it ends
+        if table not in self._next_sid:
+            maxsid = self.db.query("SELECT MAX("+table+"_id) FROM "+table, (), cursor=self._cursor)[0][0]
+            self._next_sid[table] = 1 if maxsid is None else maxsid + 1
+        sid = self._next_sid[table]
+        self._next_sid[table] = sid + 1
+        return sid
+
+    def _insert(self, table, types, keyvals):
+        columns, columndata, subinserts = self.store._encode_row(table, types, keyvals, self._store_reference)
+        sid = self._new_sid(table)
+        # The sids of the subtable rows are also assigned here, to keep the rows of a list in order
+        self._rows.setdefault((table, tuple([table+"_id"] + columns)), []).append([sid] + columndata)
+        self._nrows += 1
+        for subinsert in subinserts:
+            subinsert[2][table+"_sid"] = sid
+            self._insert(subinsert[0], {'keys': subinsert[1], 'derived': subinsert[3]}, subinsert[2])
+        if self._nrows >= self.flush_rows:
+            self.flush()
+        return sid
+
+    def flush(self):
+        """
+        Write all buffered rows to the database (without committing).
+        """
+        for (table, columns), rows in self._rows.items():
+            self.db.insert_rows(table, columns, rows, cursor=self._cursor)
+        self._rows = {}
+        self._nrows = 0
+
+    def close(self, rollback=False):
+        """
+        End the session: write the buffered rows and commit, or if rollback is True, discard everything.
+        """
+        if rollback:
+            self._rows = {}
+            self._nrows = 0
+            self.db.rollback()
+            for plugin, sid in reversed(self._saved):
+                plugin.sid = sid
+            self._saved = []
+        else:
+            self.flush()
+            self.db.commit()
+        if self._saved_pragmas is not None:
+            self._cursor.execute("PRAGMA journal_mode="+str(self._saved_pragmas[0]))
+            self._cursor.execute("PRAGMA synchronous="+str(self._saved_pragmas[1]))
+        self._cursor.close()
+        self.store._delay_commit = self._saved_delay_commit
+
+
+def main():
+    import os, shutil, tempfile
+    from httk.core.vectors import FracVector
+    from httk.atomistic import Structure
+    from httk.db.backend import Sqlite
+    from httk.db.store import SqlStore
+    from httk.db.filteredcollection import instantiate_from_store, instantiate_many_from_store
+
+    def structures():
+        # Fresh objects each time, so that no sids are carried over between databases
+        structs = []
+        for i, a in enumerate(["5.6", "5.64", "4.59"]):
+            struct = Structure.create(uc_basis=FracVector.create([[a, 0, 0], [0, a, 0], [0, 0, a]]),
+                                      uc_reduced_coordgroups=[[[0, 0, 0], ["1/2", "1/2", "1/2"]], [["0.305", "0.305", 0]]],
+                                      assignments=['Na', 'Cl'])
+            struct.add_tag('index', str(i))
+            structs += [struct]
+        return structs
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        backend = Sqlite(os.path.join(tmpdir, 'store.sqlite'))
+        store = SqlStore(backend)
+        for struct in structures():
+            store.save(struct)
+        store.commit()
+
+        # Batched retrieval gives the same values and objects as one field and one object at a time
+        types = Structure.types()
+        names = list(types['init_keydict'].keys())
+        sids = [1, 2, 3]
+        vals = store.get_many(types['name'], sids + [1, 17], types, names + ['nonexisting'])
+        assert sorted(vals.keys()) == sids
+        for sid in sids:
+            assert sorted(vals[sid].keys()) == sorted(names)
+            for name in names:
+                assert vals[sid][name] == store.get(types['name'], sid, types, name), name
+        batched = instantiate_many_from_store(Structure, store, sids)
+        single = [instantiate_from_store(Structure, store, sid) for sid in sids]
+        assert [x.to_tuple() for x in batched] == [x.to_tuple() for x in single]
+        assert [x.get_tags()['index'].value for x in batched] == ['0', '1', '2']
+        backend.close()
+
+        # An ingest session gives the same database content as saving one object at a time, also for duplicates
+        def dump(backend):
+            tables = backend.query("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name", [])
+            return [(name, backend.query("SELECT * FROM "+name+" ORDER BY 1", [])) for (name,) in tables]
+        contents = []
+        for mode in ['save', 'bulk_save']:
+            backend = Sqlite(os.path.join(tmpdir, mode+'.sqlite'))
+            store = SqlStore(backend)
+            structs = structures()
+            structs += structs[:2]
+            if mode == 'save':
+                for struct in structs:
+                    store.save(struct)
+                store.commit()
+            else:
+                store.bulk_save(structs)
+            assert [x.db.sid for x in structs] == [1, 2, 3, 1, 2]
+            contents += [dump(backend)]
+            backend.close()
+        assert contents[0] == contents[1]
+
+        # A session that ends with an exception changes nothing, and the objects get back their sids
+        backend = Sqlite(os.path.join(tmpdir, 'bulk_save.sqlite'))
+        store = SqlStore(backend)
+        structs = structures()
+        store.save(structs[0])
+        store.commit()
+        before = dump(backend)
+        try:
+            with store.ingest() as session:
+                for struct in structs:
+                    session.save(struct)
+                assert [x.db.sid for x in structs] == [1, 2, 3]
+                raise ZeroDivisionError
+        except ZeroDivisionError:
+            pass
+        assert dump(backend) == before
+        assert [x.db.sid for x in structs] == [1, None, None]
+        assert [x.db.sid for x in structs[1].get_codependent_data()] == [None]
+        backend.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
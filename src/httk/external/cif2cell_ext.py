@@ -25,6 +25,7 @@ citation.add_ext_citation('cif2cell', "Torbjörn Björkman")
 
 from httk import config
 from httk.external.command import Command, find_executable
+from httk.external.extcache import cached_command
 import httk
 import httk.iface
 
@@ -58,7 +59,7 @@ def cif2cell(cwd, args, timeout=30):
     #p = subprocess.Popen([cif2cell_path]+args, stdout=subprocess.PIPE,
     #                                   stderr=subprocess.PIPE, cwd=cwd)
     #print("COMMAND CIF2CELL",args)
-    out, err, completed = Command(cif2cell_path, args, cwd=cwd).run(timeout)
+    out, err, completed = cached_command('cif2cell', cif2cell_path, args, cwd=cwd, timeout=timeout)
     #print("COMMAND CIF2CELL END",out)
     return out, err, completed
     #out, err = p.communicate()
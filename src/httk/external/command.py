@@ -176,6 +176,93 @@ class Command(object):
         return self.process.stdin
 
 
+def run_batch(func, items, workers=None):
+    """
+    Call func(item) for each item in items, in a pool of at most workers threads (by default the number of
+    cpus), and yield (index, result, error) as each call finishes, in the order they finish. index is the
+    position of the item in items. If func raises an exception, result is None and error is the exception;
+    the other calls are not affected. Otherwise error is None.
+
+    This is meant for functions that spend their time waiting for external programs (e.g., Command.run or
+    the functions in the httk.external.*_ext modules), which run concurrently since the threads only wait
+    for the subprocesses. items can be a generator; it is consumed only as workers become free, so a long
+    list of jobs is never all held in memory. Timeouts are the responsibility of func (e.g., the timeout
+    of Command.run). If the iteration is abandoned, no new calls are started.
+    """
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+    workers = max(1, workers)
+
+    jobs = queue.Queue(2*workers)
+    results = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def feeder():
+        count = 0
+        try:
+            for item in items:
+                while not stop.is_set():
+                    try:
+                        jobs.put((count, item), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    break
+                count += 1
+        except Exception as e:
+            results.put((None, None, e))
+        finally:
+            for _i in range(workers):
+                jobs.put(done)
+
+    def worker():
+        while True:
+            job = jobs.get()
+            if job is done:
+                results.put(done)
+                return
+            if stop.is_set():
+                continue
+            index, item = job
+            try:
+                result = func(item)
+            except Exception as e:
+                results.put((index, None, e))
+            else:
+                results.put((index, result, None))
+
+    threads = [threading.Thread(target=feeder)] + [threading.Thread(target=worker) for _i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        finished = 0
+        while finished < workers:
+            entry = results.get()
+            if entry is done:
+                finished += 1
+            elif entry[0] is None:
+                # The items iterator itself failed
+                raise entry[2]
+            else:
+                yield entry
+    finally:
+        stop.set()
+
+
+def run_commands(commands, timeout, workers=None):
+    """
+    Run the Command objects in commands, at most workers (by default the number of cpus) at the same time,
+    each with the given timeout (in seconds). Yields (index, (out, err, completed), error) as each command
+    finishes; see run_batch.
+    """
+    return run_batch(lambda command: command.run(timeout), commands, workers)
+
+
 def find_executable(executables, config_name):
     if not is_sequence(executables):
         executables = [executables]
@@ -206,3 +293,41 @@ def find_executable(executables, config_name):
                 return path
 
         raise Exception("find_executable: executable for "+str(config_name)+" not found. No path set in httk.cfg, and no binary '"+str(executable)+"' found in subdirectories to External/, or otherwise in the system path.")
+
+
+def main():
+    import time
+
+    # Sleeping processes run concurrently, and a command that cannot be started does not affect the others
+    commands = [Command(sys.executable, ['-c', 'import time, sys; time.sleep(0.5); sys.stdout.write("%d")' % i]) for i in range(6)]
+    commands.insert(2, Command(os.path.join(os.path.dirname(__file__), 'no_such_program'), []))
+    start = time.time()
+    results = sorted(run_commands(commands, 30, workers=3), key=lambda x: x[0])
+    elapsed = time.time() - start
+    assert [x[0] for x in results] == list(range(7))
+    assert results[2][1] is None and isinstance(results[2][2], OSError)
+    assert [x[1][0] for x in results if x[2] is None] == ["0", "1", "2", "3", "4", "5"]
+    assert elapsed < 2.5
+
+    # Timeouts are per command
+    results = list(run_commands([Command(sys.executable, ['-c', 'import time; time.sleep(10)'])], 0.5))
+    assert results[0][1][2] is None
+
+    # Items are consumed lazily, and abandoning the iteration stops new jobs from being started
+    started = []
+
+    def items():
+        for i in range(1000):
+            started.append(i)
+            yield i
+    for index, result, error in run_batch(lambda x: x*x, items(), workers=2):
+        assert result == index*index
+        if index >= 10:
+            break
+    time.sleep(0.2)
+    assert len(started) < 1000
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Persistent cache of the results of external programs (platon, isotropy findsym, cif2cell, ...).
+
+cached_command() runs an external program through httk.external.command.Command, unless the same program
+has already been run on the same input. The key of an entry is a sha256 hash of:
+
+  - the name of the tool,
+  - the version of the program, taken as the path, size and modification time of the executable,
+  - the arguments, where arguments that name input files are replaced by the contents of the files,
+  - the text given on standard input.
+
+i.e., the key is derived from exactly what the program sees. The output on stdout and stderr and the exit
+code are stored, and optionally also the files that the program writes in its working directory.
+
+The cache is an sqlite database, by default ~/.httk/extcache.sqlite. It can be configured in the [cache]
+section of the httk configuration::
+
+  [cache]
+  ext_cache=~/.httk/extcache.sqlite
+  ext_cache_max_mb=512
+  ext_cache_max_days=90
+
+Setting ext_cache to an empty value (or the environment variable HTTK_EXT_CACHE to an empty string) turns
+the cache off. Entries not used for ext_cache_max_days are removed, and the least recently used entries are
+removed when the cache grows beyond ext_cache_max_mb. The database can be shared by several processes
+(e.g., task managers running in parallel); sqlite serializes the writes.
+"""
+import os, sys, time, pickle, hashlib, sqlite3, threading
+
+from httk import config
+from httk.external.command import Command
+
+
+class ExtCache(object):
+    """
+    Persistent cache of results of external programs, kept in an sqlite database at path.
+    """
+
+    # How many entries to store between checks of the age and size limits
+    evict_interval = 50
+
+    # Entries used more recently than this (in seconds) do not get their access time updated on a hit,
+    # so that hits do not need to write to the database
+    touch_interval = 3600
+
+    def __init__(self, path, max_size=512*1024*1024, max_age=90*24*3600):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self._local = threading.local()
+        self._stores = 0
+
+    def _connect(self):
+        # sqlite connections must not be shared between threads or with forked processes
+        local = self._local
+        if getattr(local, 'db', None) is None or local.pid != os.getpid():
+            dirname = os.path.dirname(self.path)
+            if dirname != "" and not os.path.exists(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    # Created by a process running in parallel
+                    pass
+            db = sqlite3.connect(self.path, timeout=60)
+            db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, tool TEXT, created REAL, accessed REAL, size INTEGER, value BLOB)")
+            db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            db.commit()
+            local.db = db
+            local.pid = os.getpid()
+        return local.db
+
+    def lookup(self, key):
+        """
+        Returns the value stored under key, or None.
+        """
+        db = self._connect()
+        entry = db.execute("SELECT accessed, value FROM results WHERE key = ?", (key,)).fetchone()
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry[0] > self.touch_interval:
+            db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            db.commit()
+        return pickle.loads(bytes(entry[1]))
+
+    def store(self, key, tool, value):
+        db = self._connect()
+        data = pickle.dumps(value, 2)
+        now = time.time()
+        db.execute("INSERT OR REPLACE INTO results (key, tool, created, accessed, size, value) VALUES (?, ?, ?, ?, ?, ?)",
+                   (key, tool, now, now, len(data), sqlite3.Binary(data)))
+        db.commit()
+        self._stores += 1
+        if self._stores % self.evict_interval == 1:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the entries older than max_age, and then the least recently used entries until the cache is
+        smaller than max_size.
+        """
+        db = self._connect()
+        now = time.time()
+        if self.max_age is not None:
+            db.execute("DELETE FROM results WHERE accessed < ?", (now - self.max_age,))
+        if self.max_size is not None:
+            size = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if size > self.max_size:
+                remove = []
+                for key, entrysize in db.execute("SELECT key, size FROM results ORDER BY accessed"):
+                    if size <= self.max_size:
+                        break
+                    remove += [(key,)]
+                    size -= entrysize
+                db.executemany("DELETE FROM results WHERE key = ?", remove)
+        db.commit()
+
+    def clear(self):
+        db = self._connect()
+        db.execute("DELETE FROM results")
+        db.commit()
+
+    def close(self):
+        local = self._local
+        if getattr(local, 'db', None) is not None and local.pid == os.getpid():
+            local.db.close()
+        local.db = None
+
+
+_ext_cache = None
+_ext_cache_configured = False
+
+
+def get_ext_cache():
+    """
+    Returns the ExtCache set up by the httk configuration (see the module documentation), or None if the
+    cache is turned off.
+    """
+    global _ext_cache, _ext_cache_configured
+    if not _ext_cache_configured:
+        path = os.environ.get('HTTK_EXT_CACHE')
+        if path is None:
+            path = config.get('cache', 'ext_cache')
+        if path is None:
+            path = '~/.httk/extcache.sqlite'
+        if path.strip() != "":
+            max_mb = config.get('cache', 'ext_cache_max_mb')
+            max_days = config.get('cache', 'ext_cache_max_days')
+            max_size = int(float(max_mb)*1024*1024) if max_mb not in (None, "") else 512*1024*1024
+            max_age = float(max_days)*24*3600 if max_days not in (None, "") else 90*24*3600
+            _ext_cache = ExtCache(os.path.expandvars(os.path.expanduser(path.strip())), max_size, max_age)
+        _ext_cache_configured = True
+    return _ext_cache
+
+
+def set_ext_cache(cache):
+    """
+    Use cache (an ExtCache, or None to turn caching off) instead of the configured cache.
+    """
+    global _ext_cache, _ext_cache_configured
+    _ext_cache = cache
+    _ext_cache_configured = True
+
+
+def _file_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _executable_version(cmd):
+    try:
+        st = os.stat(cmd)
+        return "%s:%d:%d" % (os.path.realpath(cmd), st.st_size, int(st.st_mtime))
+    except OSError:
+        return cmd
+
+
+def _snapshot(cwd):
+    snapshot = {}
+    for name in os.listdir(cwd):
+        path = os.path.join(cwd, name)
+        if os.path.isfile(path):
+            st = os.stat(path)
+            snapshot[name] = (st.st_size, st.st_mtime)
+    return snapshot
+
+
+def ext_cache_key(tool, cmd, args, cwd=None, inputstr=None):
+    """
+    The key of a run of the executable cmd with arguments args. Arguments that name files (relative to the
+    working directory cwd) are hashed by the file contents.
+    """
+    h = hashlib.sha256()
+    h.update(("tool\0" + tool + "\0version\0" + _executable_version(cmd) + "\0").encode('utf-8'))
+    for arg in args:
+        path = os.path.join(cwd if cwd is not None else '.', arg)
+        if not arg.startswith('-') and os.path.isfile(path):
+            h.update(("file\0" + os.path.basename(arg) + "\0" + _file_hash(path) + "\0").encode('utf-8'))
+        else:
+            h.update(("arg\0" + arg + "\0").encode('utf-8'))
+    if inputstr is not None:
+        if not isinstance(inputstr, bytes):
+            inputstr = inputstr.encode('utf-8')
+        h.update(b"stdin\0" + inputstr)
+    return h.hexdigest()
+
+
+def cached_command(tool, cmd, args, cwd=None, inputstr=None, timeout=30, capture_files=False):
+    """
+    Run cmd with args (as Command(cmd, args, cwd=cwd, inputstr=inputstr).run(timeout)), or return the result
+    of an earlier run of the same program on the same input. Returns (out, err, completed).
+
+    With capture_files=True, the files that the program creates or changes in cwd are also cached, and are
+    written back into cwd on a cache hit. Only runs that complete with exit code 0 are cached.
+    """
+    cache = get_ext_cache()
+    if cache is None:
+        return Command(cmd, args, cwd=cwd, inputstr=inputstr).run(timeout)
+
+    try:
+        key = ext_cache_key(tool, cmd, args, cwd, inputstr)
+        result = cache.lookup(key)
+    except (sqlite3.Error, IOError, OSError) as e:
+        sys.stderr.write("Warning: external program cache "+str(cache.path)+" unavailable, not caching: "+str(e)+"\n")
+        set_ext_cache(None)
+        return Command(cmd, args, cwd=cwd, inputstr=inputstr).run(timeout)
+
+    if result is not None:
+        out, err, completed, files = result
+        for name, data in files.items():
+            with open(os.path.join(cwd, name), 'wb') as f:
+                f.write(data)
+        return out, err, completed
+
+    if capture_files:
+        before = _snapshot(cwd)
+    out, err, completed = Command(cmd, args, cwd=cwd, inputstr=inputstr).run(timeout)
+    if completed != 0:
+        return out, err, completed
+
+    files = {}
+    if capture_files:
+        for name, stat in _snapshot(cwd).items():
+            if before.get(name) != stat:
+                with open(os.path.join(cwd, name), 'rb') as f:
+                    files[name] = f.read()
+    try:
+        cache.store(key, tool, (out, err, completed, files))
+    except (sqlite3.Error, IOError, OSError) as e:
+        sys.stderr.write("Warning: could not write to external program cache "+str(cache.path)+": "+str(e)+"\n")
+    return out, err, completed
+
+
+def main():
+    import tempfile, shutil
+
+    tmpdir = tempfile.mkdtemp(prefix='ht.tmp.extcache_')
+    try:
+        cache = ExtCache(os.path.join(tmpdir, 'cache', 'extcache.sqlite'))
+        set_ext_cache(cache)
+        workdir = os.path.join(tmpdir, 'work')
+        os.mkdir(workdir)
+        counter = os.path.join(tmpdir, 'counter')
+        # A 'tool' that reads in.txt, writes its contents in upper case to out.txt and stdout, and counts its runs
+        script = ("import sys\n"
+                  "open(sys.argv[2][len('--counter='):], 'a').write('x')\n"
+                  "data = open(sys.argv[1]).read().upper()\n"
+                  "open('out.txt', 'w').write(data)\n"
+                  "sys.stdout.write(data + sys.stdin.read())\n")
+
+        def run(text, inputstr):
+            with open(os.path.join(workdir, 'in.txt'), 'w') as f:
+                f.write(text)
+            if os.path.exists(os.path.join(workdir, 'out.txt')):
+                os.unlink(os.path.join(workdir, 'out.txt'))
+            result = cached_command('upper', sys.executable, ['-c', script, 'in.txt', '--counter='+counter], cwd=workdir,
+                                    inputstr=inputstr, capture_files=True)
+            with open(os.path.join(workdir, 'out.txt')) as f:
+                assert f.read() == text.upper()
+            with open(counter) as f:
+                return result, len(f.read())
+
+        assert run("abc", "1") == (("ABC1", "", 0), 1)
+        assert run("abc", "1") == (("ABC1", "", 0), 1)
+        assert run("abd", "1") == (("ABD1", "", 0), 2)
+        assert run("abc", "2") == (("ABC2", "", 0), 3)
+        assert run("abd", "1") == (("ABD1", "", 0), 3)
+
+        cache.max_size = 1
+        cache.evict()
+        assert run("abc", "1") == (("ABC1", "", 0), 4)
+        cache.close()
+        print("Finished")
+    finally:
+        set_ext_cache(None)
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,7 +25,8 @@ citation.add_ext_citation('isotropy', "Harold T. Stokes, Dorian M. Hatch, and Br
 
 from httk.core.basic import int_to_anonymous_symbol
 from httk import config
-from httk.external.command import Command
+from httk.external.command import Command, run_batch
+from httk.external.extcache import cached_command
 import httk.httkio
 import httk.iface
 
@@ -49,7 +50,7 @@ def isotropy(cwd, args, inputstr, timeout=30):
     #p = subprocess.Popen([cif2cell_path]+args, stdout=subprocess.PIPE,
     #                                   stderr=subprocess.PIPE, cwd=cwd)
     #print("COMMAND CIF2CELL")
-    out, err, completed = Command(os.path.join(isotropy_path, 'findsym'), args, cwd=cwd, inputstr=inputstr).run(timeout)
+    out, err, completed = cached_command('isotropy', os.path.join(isotropy_path, 'findsym'), args, cwd=cwd, inputstr=inputstr, timeout=timeout)
     #print("COMMAND CIF2CELL END")
     return out, err, completed
     #out, err = p.communicate()
@@ -102,14 +103,14 @@ def uc_reduced_coordgroups_process_with_isotropy(coordgroup, cell, get_wyckoff=F
         raise Exception("isotropy_ext: isotropy did not complete.")
 
 
-def struct_process_with_isotropy(struct):
+def struct_process_with_isotropy(struct, timeout=30):
     tmpdir = tempfile.mkdtemp(prefix='ht.tmp.isotropy_')
 
     inputstr = httk.iface.isotropy_if.struct_to_input(struct)
     #print("== Running findsym", end="", file=sys.stderr)
     #print("==================== INPUT\n",inputstr)
     #print("====================")
-    out, err, completed = isotropy(tmpdir, [], inputstr)
+    out, err, completed = isotropy(tmpdir, [], inputstr, timeout)
 
     # Clean up
     try:
@@ -176,3 +177,12 @@ def struct_process_with_isotropy(struct):
         print("========")
 
         raise Exception("isotropy_ext: isotropy did not complete.")
+
+
+def struct_process_with_isotropy_batch(structs, workers=None, timeout=30):
+    """
+    Run struct_process_with_isotropy on the structures in structs, with at most workers (by default the number
+    of cpus) findsym processes at the same time. Yields (index, structure, error) as they finish; see
+    httk.external.command.run_batch.
+    """
+    return run_batch(lambda struct: struct_process_with_isotropy(struct, timeout), structs, workers)
@@ -21,7 +21,8 @@ citation.add_ext_citation('Platon', "A. L. Spek, Utrecht University, Padualaan 8
 import os, sys, tempfile
 
 from httk import config
-from httk.external.command import Command
+from httk.external.command import Command, run_batch
+from httk.external.extcache import cached_command
 import httk
 
 if sys.version_info[0] == 3:
@@ -49,7 +50,8 @@ def platon(cwd, args, timeout=60):
     #print("COMMAND PLATON")
     #raise Exception("PLATON")
     #print("EXECUTING PLATON",platon_path,args)
-    out, err, completed = Command(platon_path, args, cwd=cwd).run(timeout)
+    # Platon writes its results to files next to the input file, which are cached along with the output
+    out, err, completed = cached_command('platon', platon_path, args, cwd=cwd, timeout=timeout, capture_files=True)
     #print("COMMAND PLATON END", out, err, completed, cwd)
     return out, err, completed
 
@@ -66,7 +68,7 @@ def addsym(struct):
             f.close()
     if os.path.exists("/tmp/platon/atom.res"):
         os.unlink("/tmp/platon/atom.res")
-    out, err = platon("/tmp/platon", ["atom.spf"])
+    out, err, completed = platon("/tmp/platon", ["atom.spf"])
 
     f = False
     try:
@@ -85,7 +87,7 @@ def addsym(struct):
         if f:
             f.close()
 
-    out, err = platon("/tmp/platon", ["atom.res"])
+    out, err, completed = platon("/tmp/platon", ["atom.res"])
 
     f = False
     try:
@@ -111,7 +113,7 @@ def structure_addsym_and_tidy(struct):
     if os.path.exists("/tmp/platon/atom.res"):
         os.unlink("/tmp/platon/atom.res")
     #out, err = platon("/tmp/platon",["atom.spf"])
-    out, err = platon("/tmp/platon", ["-n", "atom.spf"])
+    out, err, completed = platon("/tmp/platon", ["-n", "atom.spf"])
     if err != "":
         print(err)
 
@@ -135,10 +137,10 @@ def structure_addsym_and_tidy(struct):
             f.close()
     if os.path.exists("/tmp/platon/atom.sty"):
         os.unlink("/tmp/platon/atom.sty")
-    out, err = platon("/tmp/platon", ["atom.res"])
+    out, err, completed = platon("/tmp/platon", ["atom.res"])
     if err != "":
         print(err)
-    out, err = platon("/tmp/platon", ["-Y", "atom.sty"])
+    out, err, completed = platon("/tmp/platon", ["-Y", "atom.sty"])
     if err != "":
         print(err)
 
@@ -158,7 +160,7 @@ def addsym_spacegroup(struct):
     finally:
         if f:
             f.close()
-    result, err = platon("/tmp/platon", ["atom.spf"])
+    result, err, completed = platon("/tmp/platon", ["atom.spf"])
 
     def grab(results, match):
         results[0] = match.group(1)
@@ -182,7 +184,7 @@ def structure_tidy_old(struct):
             f.close()
     if os.path.exists("/tmp/platon/atom.res"):
         os.unlink("/tmp/platon/atom.res")
-    out, err = platon("/tmp/platon", ["atom.spf"])
+    out, err, completed = platon("/tmp/platon", ["atom.spf"])
     #out, err = platon("/tmp/platon",["-n","atom.spf"])
     if err != "":
         print(err)
@@ -207,10 +209,10 @@ def structure_tidy_old(struct):
             f.close()
     if os.path.exists("/tmp/platon/atom.sty"):
         os.unlink("/tmp/platon/atom.sty")
-    out, err = platon("/tmp/platon", ["atom.res"])
+    out, err, completed = platon("/tmp/platon", ["atom.res"])
     if err != "":
         print(err)
-    out, err = platon("/tmp/platon", ["-Y", "atom.sty"])
+    out, err, completed = platon("/tmp/platon", ["-Y", "atom.sty"])
     if err != "":
         print(err)
 
@@ -235,7 +237,7 @@ def structure_to_sgstructure(struct):
             f.close()
     if os.path.exists("/tmp/platon/atom.res"):
         os.unlink("/tmp/platon/atom.res")
-    out, err = platon("/tmp/platon", ["atom.spf"])
+    out, err, completed = platon("/tmp/platon", ["atom.spf"])
     #out, err = platon("/tmp/platon",["-n","atom.spf"])
     #os.remove("/tmp/platon/atom.spf")
 
@@ -259,8 +261,8 @@ def structure_to_sgstructure(struct):
     if os.path.exists("/tmp/platon/atom.sty"):
         os.unlink("/tmp/platon/atom.sty")
 
-    out, err = platon("/tmp/platon", ["atom.res"])
-    out, err = platon("/tmp/platon", ["-Y", "atom.sty"])
+    out, err, completed = platon("/tmp/platon", ["atom.res"])
+    out, err, completed = platon("/tmp/platon", ["-Y", "atom.sty"])
 
     sgtidystruct = httk.iface.platon_if.httk.iface.platon_if.platon_styout_to_sgstruct(StringIO(out))
     sgtidystruct.refs = struct.refs
@@ -283,7 +285,7 @@ def cif_to_sgstructure(ioa):
     finally:
         if f:
             f.close()
-    out, err = platon("/tmp/platon", ["-g", "atom.cif"])
+    out, err, completed = platon("/tmp/platon", ["-g", "atom.cif"])
 
     #os.remove("/tmp/platon/atom.spf")
 
@@ -304,7 +306,7 @@ def cif_to_sgstructure(ioa):
         if f:
             f.close()
 
-    out, err = platon("/tmp/platon", ["atom.res"])
+    out, err, completed = platon("/tmp/platon", ["atom.res"])
 
     f = False
     try:
@@ -376,7 +378,7 @@ def cif_to_sgstructure(ioa):
 #     sgtidystruct.nonequiv.tags['platon_sg'] = sgtidystruct.hall_symbol
 #
 #     return sgtidystruct.to_structure()
-def structure_tidy(struct):
+def structure_tidy(struct, timeout=60):
     #TODO: use mktmpdir here
     tmpdir = tempfile.mkdtemp(prefix='ht.tmp.platon_')
     f = False
@@ -392,7 +394,7 @@ def structure_tidy(struct):
     #print("PLATON INPUT:",f.read())
     #f.close()
 
-    out, err, completed = platon(tmpdir, ["-Y", "atom.sty"])
+    out, err, completed = platon(tmpdir, ["-Y", "atom.sty"], timeout)
 
     # Clean up
     try:
@@ -418,3 +420,12 @@ def structure_tidy(struct):
     tidystruct = httk.iface.platon_if.platon_styout_to_structure(StringIO(out), based_on_struct=struct)
 
     return tidystruct
+
+
+def structure_tidy_batch(structs, workers=None, timeout=60):
+    """
+    Tidy the structures in structs with platon, running at most workers (by default the number of cpus)
+    platon processes at the same time. Yields (index, tidy structure, error) as they finish; see
+    httk.external.command.run_batch.
+    """
+    return run_batch(lambda struct: structure_tidy(struct, timeout), structs, workers)
@@ -26,4 +26,4 @@ citation.add_src_citation("httk", "Rickard Armiento")
 
 from httk.httkio.load import load
 from httk.httkio.save import save
-from httk.httkio.cif import read_cif, write_cif
+from httk.httkio.cif import read_cif, iter_cif, write_cif
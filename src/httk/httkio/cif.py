@@ -30,188 +30,302 @@ import httk
 from httk.core import *
 
 
-def _read_cif_rewind_if_needed(f, row, done_fields):
-    splitstr = row.lstrip().split(None, done_fields)
-    if len(splitstr) > 1:
-        rest = splitstr[-1]
-        if rest.strip() != "":
-            f.rewind(rest)
-            return True
-        return False
-    else:
-        return False
-
+# Precompiled expressions for _CifScanner. Whitespace means the same as for str.strip and str.split, so the
+# values come out exactly as when the file is read line by line.
+_cif_blank_regex = re.compile(r"[^\S\n]*")
+_cif_token_regex = re.compile(r"[^\S\n]*\S+")
+_cif_quote_end_regex = {"'": re.compile(r"'(?=\s)"), '"': re.compile(r'"(?=\s)')}
+_cif_pragmatic_split_regex = re.compile(r"\s+_|\s+data_|\s+loop_")
+_cif_text_end_regex = re.compile(r"^;", re.M)
+_cif_chunk_regex = re.compile(r"^(?:(;)|[^\S\n]*[dD][aA][tT][aA]_)", re.M)
+# In loops, a run of lines where no value starts with a quote, ';', '#', '_', data_ or loop_ is split on whitespace
+# all at once. Lines with quotes are split with _cif_loop_values_regex. Other lines are read one value at a time.
+_cif_loop_plain_regex = re.compile(r"(?:(?:[^\S\n]*(?![dD][aA][tT][aA]_|[lL][oO][oO][pP]_)[^\s_;#'\"]\S*(?=\s))*[^\S\n]*\n)*")
+_cif_loop_special_regex = re.compile(r"(?:^|\s)(?:[_;#]|[dD][aA][tT][aA]_|[lL][oO][oO][pP]_)")
+_cif_loop_run_size = 1 << 16
+_cif_loop_values_regex = re.compile(r"""'(.*?)'(?=\s|\Z)|"(.*?)"(?=\s|\Z)|(\S+)""")
+
+
+class _CifScanner(object):
+    """
+    Reads cif data from a string in one pass. The reading position p is the start of the current 'row',
+    which is either the start of a line, or (if noteol is True) what is left on a line after the values already read.
+    truncated is set if the text ended where more was expected (a value or the end of a text field.)
+    """
 
-def _read_cif_loop(f, pragmatic=True, use_types=False):
-    #print("Read cif loop")
-    noteol = False
-    loop_data = OrderedDict()
-    header = []
-    for row in f:
-        striprow = row.strip()
-        lowrow = striprow.lower()
-        if lowrow.startswith("_"):
-            loop_data[lowrow[1:]] = []
-            header += [lowrow[1:]]
-            noteol = _read_cif_rewind_if_needed(f, row, 1)
+    def __init__(self, text, pragmatic=True):
+        self.text = text
+        self.end = len(text)
+        self.p = 0
+        self.noteol = False
+        self.pragmatic = pragmatic
+        self.truncated = False
+
+    def row(self):
+        p = self.p
+        if p >= self.end:
+            return None
+        e = self.text.find('\n', p)
+        if e < 0:
+            return self.text[p:]
+        return self.text[p:e+1]
+
+    def next_line(self):
+        e = self.text.find('\n', self.p)
+        self.p = self.end if e < 0 else e+1
+        self.noteol = False
+
+    def rest(self, q, keep_blank=False):
+        # Continue with what is left of the line after position q, unless that is only whitespace
+        r = _cif_blank_regex.match(self.text, q).end()
+        if r < self.end and self.text[r] != '\n':
+            self.p = q if keep_blank else r
+            self.noteol = True
         else:
-            f.rewind()
-            break
-
-    while True:
-        for i in range(len(loop_data)):
-            try:
-                row = next(f)
-            except StopIteration:
-                break
-            if row.isspace():
-                continue
+            self.p = min(r+1, self.end)
+            self.noteol = False
+
+    def rest_after_token(self):
+        self.rest(_cif_token_regex.match(self.text, self.p).end())
+
+    def header(self):
+        header = []
+        row = self.row()
+        while row is not None and row.strip().startswith("#"):
+            header.append(row)
+            self.next_line()
+            row = self.row()
+        return "".join(header)
+
+    def data_blocks(self):
+        row = self.row()
+        while row is not None:
+            lowrow = row.strip().lower()
+            if lowrow.startswith("data_"):
+                data_block_name = lowrow.partition('_')[2].split()[0].strip()
+                self.rest_after_token()
+                yield data_block_name, self.data_block()
+            else:
+                self.next_line()
+            row = self.row()
+
+    def data_block(self):
+        data_items = OrderedDict()
+        loops = 0
+        row = self.row()
+        while row is not None:
             striprow = row.strip()
             lowrow = striprow.lower()
-            if not row or row.startswith("_") or lowrow.startswith("data_") or lowrow.startswith("loop_"):
-                f.rewind()
-                break
-            f.rewind()
-            val, noteol = _read_cif_data_value(f, noteol, pragmatic, use_types, inloop=True)
-            loop_data[header[i]].append(val)
-        else:
-            continue
-        break
-    return loop_data
-
-
-def _read_cif_data_value(f, noteol, pragmatic=True, use_types=False, inloop=False):
-    #print("Read cif data value")
-    data_value = None
-    for row in f:
-        #print("read_cif_data_value_row:",row)
-        striprow = row.strip()
-        if striprow == "":
-            noteol = False
-            continue
-        elif (not noteol) and row.startswith(';'):
-            folded = False
-            newline = False
-            data_value = ""
-            if row[1] == "\\" and row[2:].rstrip("\r\n") == "":
-                folded = True
-            elif row[1:].isspace():
-                if not pragmatic:
-                    data_value = row.lstrip().rstrip('\r\n')
-                    newline = True
-            else:
-                data_value = row.lstrip()[1:].rstrip('\r\n')
-                newline = True
-            stripirow = ""
-            for irow in f:
-                stripirow = irow.strip()
-                if irow.startswith(';'):
-                    break
-                if newline:
-                    data_value += '\n'
-                    newline = True
-                if folded and irow.rstrip('\r\n').endswith("\\"):
-                    data_value += irow.rstrip('\r\n').rstrip("\\")
-                    newline = False
+            if lowrow.startswith("data_"):
+                return data_items
+            elif lowrow.startswith("loop_"):
+                self.rest_after_token()
+                loopdata = self.loop()
+                data_items['loop_'+str(loops)] = list(loopdata.keys())
+                loops += 1
+                data_items.update(loopdata)
+            elif striprow.startswith(";"):
+                # Multi-line string that we've failed to tie to a name, lets just skip it, maybe we should warn
+                self.next_line()
+                row = self.row()
+                while row is not None:
+                    self.next_line()
+                    if row.rstrip() == ";":
+                        break
+                    row = self.row()
                 else:
-                    data_value += irow.rstrip('\r\n')
-                    newline = True
-            if len(stripirow) > 1:
-                f.rewind(stripirow[1:])
-                noteol = True
+                    self.truncated = True
+            elif striprow.startswith("_"):
+                data_name = lowrow.split()[0][1:]
+                self.rest_after_token()
+                data_items[data_name] = self.value(inloop=False)
             else:
-                noteol = False
-            break
-        elif striprow.startswith("'") or striprow.startswith('"'):
-            # The cif quoting rules are ... weird. Quotes are "escaped" if they are not followed by whitespace.
-            quote = striprow[0]
-            starti = 1
-            for chari in range(1, len(striprow)-1):
-                if striprow[chari] == quote and str(striprow[chari+1]).isspace():
-                    endi = chari
-                    endq = chari+1
-                    break
+                # Comments and anything else we do not understand
+                self.next_line()
+            row = self.row()
+        return data_items
+
+    def loop(self):
+        loop_data = OrderedDict()
+        header = []
+        row = self.row()
+        while row is not None:
+            striprow = row.strip()
+            if striprow.startswith("#"):
+                self.next_line()
+            elif striprow.startswith("_"):
+                loop_data[striprow.lower()[1:]] = []
+                header.append(striprow.lower()[1:])
+                self.rest_after_token()
             else:
-                if striprow[-1] != quote:
-                    starti = 0
-                    endi = len(striprow)
-                    endq = len(striprow)
-                else:
-                    endi = len(striprow)-1
-                    endq = len(striprow)
-            data_value = striprow[starti:endi]
-            if endq != len(striprow):
-                f.rewind(striprow[endq:])
-                noteol = True
+                break
+            row = self.row()
+
+        ncolumns = len(loop_data)
+        if ncolumns == 0:
+            return loop_data
+        columns = [loop_data[name] for name in header]
+        text = self.text
+        end = self.end
+        i = 0
+        while self.p < end:
+            if self.noteol:
+                row = self.row()
+                striprow = row.strip()
+                if striprow.startswith("#"):
+                    self.next_line()
+                    continue
             else:
-                noteol = False
-            break
+                p = self.p
+                values = None
+                e = _cif_loop_plain_regex.match(text, p, min(end, p + _cif_loop_run_size)).end()
+                if e > p:
+                    values = text[p:e].split()
+                else:
+                    e = text.find('\n', p)
+                    e = end if e < 0 else e+1
+                    row = text[p:e]
+                    striprow = row.strip()
+                    if striprow == "" or striprow.startswith("#"):
+                        self.p = e
+                        continue
+                    if _cif_loop_special_regex.search(row) is None:
+                        values = []
+                        for m in _cif_loop_values_regex.finditer(row):
+                            value = m.group(m.lastindex)
+                            if m.lastindex == 3 and value[0] in "'\"":
+                                # An opening quote without an end quote takes the rest of the line, let value() do that
+                                values = None
+                                break
+                            values.append(value)
+                if values is not None:
+                    for k in range(min(ncolumns, len(values))):
+                        columns[(i+k) % ncolumns].extend(values[k::ncolumns])
+                    i = (i + len(values)) % ncolumns
+                    self.p = e
+                    continue
+            lowrow = striprow.lower()
+            if row.startswith("_") or lowrow.startswith("data_") or lowrow.startswith("loop_"):
+                break
+            columns[i].append(self.value(inloop=True))
+            i += 1
+            if i == ncolumns:
+                i = 0
+        return loop_data
+
+    def value(self, inloop):
+        row = self.row()
+        while row is not None and row.strip() == "":
+            self.next_line()
+            row = self.row()
+        if row is None:
+            self.truncated = True
+            return None
+        if (not self.noteol) and row.startswith(';'):
+            return self.text_field(row)
+        striprow = row.strip()
+        start = self.p + len(row) - len(row.lstrip())
+        quote = striprow[0]
+        if quote == "'" or quote == '"':
+            # The cif quoting rules are ... weird. Quotes are "escaped" if they are not followed by whitespace.
+            m = _cif_quote_end_regex[quote].search(striprow, 1)
+            if m is not None:
+                self.rest(start+m.end(), keep_blank=True)
+                return striprow[1:m.start()]
+            self.next_line()
+            if striprow[-1] != quote:
+                return striprow
+            return striprow[1:-1]
+        if self.pragmatic and not inloop:
+            # In pragmatic mode, if we are not in a loop and there is more than one data value
+            # separated by whitespace, read all of it. This should always be ok to do, since
+            # multiple data values in this situation would be an
+            # error in the file otherwise, but if there is whitespace + underscore/data_/loop_ we parse that
+            # as a new symbol, since otherwise we COULD misread valid files (with very weird formatting...).
+            m = _cif_pragmatic_split_regex.search(striprow)
+            if m is None:
+                self.next_line()
+                return striprow
+            self.rest(start+m.end())
+            return striprow[:m.start()].strip()
+        data_value = striprow.split(None, 1)[0]
+        self.rest(start+len(data_value))
+        return data_value
+
+    def text_field(self, row):
+        folded = False
+        newline = False
+        data_value = ""
+        if row[1:2] == "\\" and row[2:].rstrip("\r\n") == "":
+            folded = True
+        elif row[1:].isspace():
+            if not self.pragmatic:
+                data_value = row.lstrip().rstrip('\r\n')
+                newline = True
         else:
-            # Unquoted string
-            if pragmatic and not inloop:
-                # In pragmatic mode, if we are not in a loop and there is more than one data value
-                # separated by whitespace, read all of it. This should always be ok to do, since
-                # multiple data values in this situation would be an
-                # error in the file otherwise, but if there is whitespace + underscore/data_/loop_ we parse that
-                # as a new symbol, since otherwise we COULD misread valid files (with very weird formatting...).
-                splitstr = re.split("\s+_|\s+data_|\s+loop_", striprow, maxsplit=1)
-            else:
-                splitstr = striprow.split(None, 1)
-            data_value = splitstr[0].strip()
-            rightside = ""
-            if len(splitstr) > 1:
-                rightside = splitstr[1].strip()
-            if rightside != "":
-                f.rewind(rightside)
-                noteol = True
+            data_value = row.lstrip()[1:].rstrip('\r\n')
+            newline = True
+        self.next_line()
+        start = self.p
+        m = _cif_text_end_regex.search(self.text, start)
+        if m is None:
+            stop = self.end
+            self.truncated = True
+        else:
+            stop = m.start()
+        lines = self.text[start:stop].split('\n')
+        if lines[-1] == "":
+            lines.pop()
+        parts = [data_value]
+        for line in lines:
+            line = line.rstrip('\r')
+            if newline:
+                parts.append('\n')
+            if folded and line.endswith("\\"):
+                parts.append(line.rstrip("\\"))
+                newline = False
             else:
-                noteol = False
-            break
-            if use_types:
-                if _cif_is_int(data_value):
-                    data_value = int(data_value.replace("(", "").replace(")", ""))
-                elif _cif_is_float(data_value):
-                    data_value = float(data_value.replace("(", "").replace(")", ""))
-
-    return data_value, noteol
+                parts.append(line)
+                newline = True
+        if m is not None:
+            self.p = stop
+            self.rest(stop+1, keep_blank=True)
+        elif len(lines) > 0 and len(lines[-1].strip()) > 1:
+            # Unterminated text field: the last line, except its first character, is read again
+            last = lines[-1]
+            last_start = stop - len(last)
+            if self.text.endswith('\n'):
+                last_start -= 1
+            self.rest(last_start + len(last) - len(last.lstrip()) + 1, keep_blank=True)
+        else:
+            self.p = self.end
+            self.noteol = False
+        return "".join(parts)
 
 
-def _read_cif_data_block(f, pragmatic=True, use_types=False):
-    #print("Read cif data block")
-    data_items = OrderedDict()
-    loops = 0
-    for row in f:
-        #print("Read data block read:",row)
-        striprow = row.strip()
-        lowrow = striprow.lower()
-        if striprow.startswith("#"):
-            continue
-        elif lowrow.startswith("data_"):
-            f.rewind()
-            return data_items
-        elif lowrow.startswith("loop_"):
-            _read_cif_rewind_if_needed(f, row, 1)
-            loopdata = _read_cif_loop(f, pragmatic, use_types)
-            data_items['loop_'+str(loops)] = list(loopdata.keys())
-            loops += 1
-            data_items.update(loopdata)
-        elif striprow.startswith(";"):
-            # Multi-line string that we've failed to tie to a name, lets just skip it, maybe we should warn
-            for irow in f:
-                if irow.rstrip() == ";":
-                    break
-        elif striprow.startswith("_"):
-            lowsplit = lowrow.split()
-            data_name = lowsplit[0][1:]
-            if len(lowsplit) > 1:
-                noteol = True
-                rightside = striprow.split(None, 1)[1].strip()
-                f.rewind(rightside)
-            else:
-                noteol = False
-            data_value, noteol = _read_cif_data_value(f, noteol, pragmatic, use_types, inloop=False)
-            data_items[data_name] = data_value
-    return data_items
+def _read_cif_chunks(f, size=1 << 16):
+    # Split a cif file into pieces of text that each start with a data block, without looking inside text fields
+    text = ""
+    start = 0
+    scanned = 0
+    intext = False
+    while True:
+        data = f.read(size)
+        text = text[start:] + data
+        scanned -= start
+        start = 0
+        last = len(text) if data == "" else max(text.rfind('\n') + 1, scanned)
+        for m in _cif_chunk_regex.finditer(text, scanned, last):
+            if m.group(1) is not None:
+                intext = not intext
+            elif not intext and m.start() > start:
+                yield text[start:m.start()]
+                start = m.start()
+        scanned = last
+        if data == "":
+            if start < len(text):
+                yield text[start:]
+            return
 
 
 def read_cif(ioa, pragmatic=True, use_types=False):
@@ -238,27 +352,43 @@ def read_cif(ioa, pragmatic=True, use_types=False):
     set use_types to True to convert things that look like floats and integers to those respective types
     """
     ioa = IoAdapterFileReader.use(ioa)
-    f = basic.rewindable_iterator(ioa.file)
-    header = ""
-    datalist = []
-    for row in f:
-        if row.strip().startswith("#"):
-            header += row
-        else:
-            f.rewind()
-            break
-
-    for row in f:
-        lowrow = row.strip().lower()
-        if lowrow.startswith("data_"):
-            data_block_name = lowrow.partition('_')[2].split()[0].strip()
-            _read_cif_rewind_if_needed(f, row, 1)
-            data_block = _read_cif_data_block(f, pragmatic, use_types)
-            datalist += [(data_block_name, data_block)]
-
+    scanner = _CifScanner(ioa.file.read(), pragmatic)
+    header = scanner.header()
+    datalist = list(scanner.data_blocks())
     ioa.close()
     return datalist, header
 
+
+def iter_cif(ioa, pragmatic=True, use_types=False):
+    """
+    Iterate over the data blocks of a cif file / ioadapter, yielding pairs of data block name and data block
+    (in the same format as the list returned by read_cif.) The file is parsed one data block at a time, so
+    memory use does not grow with the number of data blocks.
+    """
+    ioa = IoAdapterFileReader.use(ioa)
+    try:
+        start = True
+        pending = ""
+        chunks = _read_cif_chunks(ioa.file)
+        chunk = next(chunks, None)
+        while chunk is not None:
+            text = pending + chunk
+            chunk = next(chunks, None)
+            scanner = _CifScanner(text, pragmatic)
+            if start:
+                scanner.header()
+            datalist = list(scanner.data_blocks())
+            if scanner.truncated and chunk is not None:
+                # The data block did not end where the next one seemed to start, read them together
+                pending = text
+                continue
+            pending = ""
+            start = False
+            for data_block_name, data_block in datalist:
+                yield data_block_name, data_block
+    finally:
+        ioa.close()
+
 _cif_ordinary_char = "!%&()*+,-./0123456789:<=>?@ABCDEFGHIHJKLMNOPQRSTUVWXYZ\^`abcdefghijklmnopqrstuvwxyz{|}~"
 _cif_non_blank_char = _cif_ordinary_char+'"'+"#$"+"'"+"_"+";[]"
 _cif_text_lead_char = _cif_ordinary_char+'"'+"#$"+"'"+"_ \t[]"
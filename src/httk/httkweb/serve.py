@@ -17,14 +17,17 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
-import cgitb, sys, codecs, cgi, shutil, io, os
+import cgitb, sys, codecs, cgi, shutil, io, os, time, threading, socket, select
+from email.utils import formatdate, parsedate_tz, mktime_tz
 
 try:
     from urllib.parse import parse_qsl, urlsplit, urlunsplit
     from http.server import BaseHTTPRequestHandler, HTTPServer
+    import queue
 except ImportError:
     from urlparse import parse_qsl, urlsplit, urlunsplit
     from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    import Queue as queue
 
 from httk.httkweb import helpers
 from httk.httkweb.webgenerator import WebGenerator
@@ -39,6 +42,147 @@ class WebError(Exception):
         self.encoding = encoding
 
 
+_log_lock = threading.Lock()
+
+
+def _fileno(content):
+    try:
+        return content.fileno()
+    except (AttributeError, IOError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+
+class _ThreadPoolHTTPServer(HTTPServer):
+    """
+    HTTPServer that handles requests in a fixed number of worker threads. A kept-alive connection does not hold
+    a worker while it is idle: between requests it is watched by a separate thread, and handed to a worker again
+    when the next request arrives (or closed when the handler's timeout has passed.)
+    """
+
+    def __init__(self, server_address, RequestHandlerClass, threads):
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+        self._connections = queue.Queue()
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+        self._closing = False
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._workers = []
+        for _i in range(threads):
+            worker = threading.Thread(target=self._worker)
+            worker.daemon = True
+            worker.start()
+            self._workers += [worker]
+        self._watcher = threading.Thread(target=self._watch_idle)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def _new_handler(self, request, client_address):
+        # The handler is set up without running its handle(), which would serve every request on the connection
+        # in the same thread; the requests are instead handled one at a time with handle_one_request
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request = request
+        handler.client_address = client_address
+        handler.server = self
+        handler.setup()
+        return handler
+
+    def _close(self, handler, request):
+        if handler is not None:
+            try:
+                handler.finish()
+            except Exception:
+                pass
+        self.shutdown_request(request)
+
+    def _worker(self):
+        while True:
+            request, client_address, handler = self._connections.get()
+            if request is None:
+                return
+            try:
+                if handler is None:
+                    handler = self._new_handler(request, client_address)
+                handler.close_connection = True
+                handler.handle_one_request()
+                if not handler.close_connection and not self._closing:
+                    self._keep_idle(request, client_address, handler)
+                    continue
+            except Exception:
+                self.handle_error(request, client_address)
+            self._close(handler, request)
+
+    def _keep_idle(self, request, client_address, handler):
+        if _buffered_input(handler):
+            # The next request has already been read from the socket
+            self._connections.put((request, client_address, handler))
+            return
+        deadline = time.time() + handler.timeout if handler.timeout is not None else None
+        with self._idle_lock:
+            self._idle[request] = (client_address, handler, deadline)
+        self._wakeup_send.send(b'x')
+
+    def _watch_idle(self):
+        while True:
+            with self._idle_lock:
+                idle = list(self._idle.items())
+            deadlines = [x[1][2] for x in idle if x[1][2] is not None]
+            timeout = max(0, min(deadlines) - time.time()) if len(deadlines) > 0 else None
+            try:
+                readable = select.select([self._wakeup_recv] + [x[0] for x in idle], [], [], timeout)[0]
+            except (OSError, select.error, ValueError):
+                # A connection was closed while being watched; it is found and dropped below
+                readable = []
+            if self._wakeup_recv in readable:
+                self._wakeup_recv.recv(4096)
+            now = time.time()
+            ready = []
+            expired = []
+            with self._idle_lock:
+                if self._closing:
+                    expired = list(self._idle.items())
+                    self._idle = {}
+                else:
+                    for request, (client_address, handler, deadline) in idle:
+                        if request in readable:
+                            ready += [(request, client_address, handler)]
+                            del self._idle[request]
+                        elif (deadline is not None and deadline <= now) or _fileno(request) in (None, -1):
+                            expired += [(request, (client_address, handler, deadline))]
+                            del self._idle[request]
+            for connection in ready:
+                self._connections.put(connection)
+            for request, (client_address, handler, deadline) in expired:
+                self._close(handler, request)
+            if self._closing:
+                return
+
+    def process_request(self, request, client_address):
+        self._connections.put((request, client_address, None))
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self._closing = True
+        self._wakeup_send.send(b'x')
+        for _worker in self._workers:
+            self._connections.put((None, None, None))
+
+
+def _buffered_input(handler):
+    # Whether there is input for handler that has already been read from the socket into its rfile buffer
+    rfile = handler.rfile
+    if hasattr(rfile, 'peek'):
+        handler.connection.settimeout(0)
+        try:
+            return len(rfile.peek(1)) > 0
+        except (IOError, OSError):
+            # Let a worker find out what is wrong with the connection
+            return True
+        finally:
+            handler.connection.settimeout(handler.timeout)
+    buf = getattr(rfile, '_rbuf', None)
+    return buf is not None and buf.tell() > 0
+
+
 class _CallbackRequestHandler(BaseHTTPRequestHandler):
 
     get_callbacks = []
@@ -46,6 +190,9 @@ class _CallbackRequestHandler(BaseHTTPRequestHandler):
     debug = False
     netloc = 'http://localhost'
     basepath = '/'
+    timing_log = False
+    # Headers and files are sent separately, avoid delays from Nagle's algorithm on kept-alive connections
+    disable_nagle_algorithm = True
 
     def get_debug_info(self):
         parsed_path = urlsplit(self.path)
@@ -90,6 +237,82 @@ class _CallbackRequestHandler(BaseHTTPRequestHandler):
         else:
             self.wfile.write(codecs.encode(s, encoding))
 
+    def respond(self, response_code, content_type, content, encoding='utf-8', response_msg=None):
+        """
+        Send a complete response with a Content-Length header, as needed for keep-alive connections.
+        Content that is an open file is sent with sendfile when possible, with ETag and Last-Modified
+        headers, and with a 304 response if the client already has it.
+        """
+        if _fileno(content) is not None:
+            self._respond_file(response_code, content_type, content)
+            return
+        if hasattr(content, 'read'):
+            content = content.read()
+        if not isinstance(content, bytes):
+            content = codecs.encode(content, encoding)
+        self.send_response(response_code, response_msg)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        self._response_size = len(content)
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [x.strip() for x in if_none_match.split(',')]
+            return '*' in tags or etag in tags or 'W/'+etag in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            date = parsedate_tz(if_modified_since)
+            if date is not None:
+                return int(mtime) <= mktime_tz(date)
+        return False
+
+    def _respond_file(self, response_code, content_type, f):
+        try:
+            st = os.fstat(f.fileno())
+            etag = '"%x-%x"' % (int(st.st_mtime*1000000), st.st_size)
+            last_modified = formatdate(st.st_mtime, usegmt=True)
+            if response_code == 200 and self._not_modified(etag, st.st_mtime):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.end_headers()
+                self._response_size = 0
+                return
+            self.send_response(response_code)
+            self.send_header('Content-type', content_type)
+            self.send_header('Content-Length', str(st.st_size))
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            self.wfile.flush()
+            if hasattr(self.connection, 'sendfile'):
+                self.connection.sendfile(f)
+            else:
+                shutil.copyfileobj(f, self.wfile)
+            self._response_size = st.st_size
+        finally:
+            f.close()
+
+    def handle_one_request(self):
+        self._request_start = time.time()
+        self._response_code = None
+        self._response_size = '-'
+        BaseHTTPRequestHandler.handle_one_request(self)
+        if self.timing_log and self._response_code is not None:
+            line = '%s - "%s" %s %s %.1f ms\n' % (self.address_string(), self.requestline, self._response_code,
+                                                  self._response_size, 1000*(time.time() - self._request_start))
+            with _log_lock:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+    def log_request(self, code='-', size='-'):
+        self._response_code = code
+        if not self.timing_log:
+            BaseHTTPRequestHandler.log_request(self, code, size)
+
 
     def do_GET(self):
 
@@ -106,10 +329,7 @@ class _CallbackRequestHandler(BaseHTTPRequestHandler):
             basepath = basepath[1:]
 
         if not parsed_path.path.startswith(self.basepath):
-            self.send_response(404)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile_write_encoded("<html><body>Requested URL not found.</body></html>")
+            self.respond(404, 'text/html', "<html><body>Requested URL not found.</body></html>")
             return
 
         relpath = relpath[len(basepath):]
@@ -131,32 +351,20 @@ class _CallbackRequestHandler(BaseHTTPRequestHandler):
         try:
             for callback in self.get_callbacks:
                 output = callback(request)
-            self.send_response(output['response_code'])
-            self.send_header('Content-type', output['content_type'])
-            self.end_headers()
-            self.wfile_write_encoded(output['content'], output['encoding'])
+            self.respond(output['response_code'], output['content_type'], output['content'], output['encoding'])
 
         except WebError as e:
-            self.send_response(e.response_code, e.response_msg)
-            self.send_header('Content-type', e.content_type)
-            self.end_headers()
-            self.wfile_write_encoded(e.content, e.encoding)
+            self.respond(e.response_code, e.content_type, e.content, e.encoding, e.response_msg)
 
         except IOError as e:
-            self.send_response(404)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile_write_encoded("<html><body>Requested URL not found.</body></html>")
+            self.respond(404, 'text/html', "<html><body>Requested URL not found.</body></html>")
             
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
             if self.debug:
-                self.wfile_write_encoded(cgitb.html(sys.exc_info()))
+                self.respond(500, 'text/html', cgitb.html(sys.exc_info()))
                 raise
             else:
-                self.wfile_write_encoded("<html><body>An unexpected server error has occured.</body></html>")
+                self.respond(500, 'text/html', "<html><body>An unexpected server error has occured.</body></html>")
 
     def do_POST(self):
 
@@ -182,10 +390,7 @@ class _CallbackRequestHandler(BaseHTTPRequestHandler):
             basepath = basepath[1:]
 
         if not parsed_path.path.startswith(self.basepath):
-            self.send_response(404)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile_write_encoded("<html><body>Requested URL not found.</body></html>")
+            self.respond(404, 'text/html', "<html><body>Requested URL not found.</body></html>")
             return
 
         relpath = relpath[len(basepath):]
@@ -207,32 +412,31 @@ class _CallbackRequestHandler(BaseHTTPRequestHandler):
         try:
             for callback in self.post_callbacks:
                 output = callback(request)
-            self.send_response(output['response_code'])
-            self.send_header('Content-type', output['content_type'])
-            self.end_headers()
-            self.wfile_write_encoded(output['content'], output['encoding'])
+            self.respond(output['response_code'], output['content_type'], output['content'], output['encoding'])
 
         except WebError as e:
-            self.send_response(e.response_code, e.response_msg)
-            self.send_header('Content-type', e.content_type)
-            self.end_headers()
-            self.wfile_write_encoded(e.content, e.encoding)
+            self.respond(e.response_code, e.content_type, e.content, e.encoding, e.response_msg)
 
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
             if self.debug:
-                self.wfile_write_encoded(cgitb.html(sys.exc_info()))
+                self.respond(500, 'text/html', cgitb.html(sys.exc_info()))
             else:
-                self.wfile_write_encoded("<html><body>An unexpected server error has occured.</body></html>")
+                self.respond(500, 'text/html', "<html><body>An unexpected server error has occured.</body></html>")
 
     # Redirect log messages to stdout instead of stderr
     def log_message(self, format, *args):
         print(format % args)
 
 
-def startup(get_callback, post_callback=None, port=80, netloc=None, basepath='/', debug=False):
+def startup(get_callback, post_callback=None, port=80, netloc=None, basepath='/', debug=False, threads=1, keepalive_timeout=15, timing_log=False):
+    """
+    Start a web server that answers requests with get_callback / post_callback.
+
+    threads: with more than one, requests are handled by a pool of this many threads, and connections are
+      kept alive (HTTP/1.1) for up to keepalive_timeout seconds between requests. An idle connection does not
+      occupy a thread.
+    timing_log: log one line per request with the response code, size and the time it took.
+    """
 
     if post_callback is None:
         post_callback = get_callback
@@ -248,10 +452,17 @@ def startup(get_callback, post_callback=None, port=80, netloc=None, basepath='/'
     _CallbackRequestHandler.basepath = basepath
     _CallbackRequestHandler.get_callbacks += [get_callback]
     _CallbackRequestHandler.post_callbacks += [post_callback]
+    _CallbackRequestHandler.timing_log = timing_log
+    if threads > 1:
+        _CallbackRequestHandler.protocol_version = 'HTTP/1.1'
+        _CallbackRequestHandler.timeout = keepalive_timeout
 
     server = None
     try:
-        server = HTTPServer(('', port), _CallbackRequestHandler)
+        if threads > 1:
+            server = _ThreadPoolHTTPServer(('', port), _CallbackRequestHandler, threads)
+        else:
+            server = HTTPServer(('', port), _CallbackRequestHandler)
         print('Started httk webserver on port:', port)
         sys.stdout.flush()
         # Don't start serve_forever if we are inside automatic testing, etc.
@@ -263,11 +474,18 @@ def startup(get_callback, post_callback=None, port=80, netloc=None, basepath='/'
 
     finally:
         if server is not None:
-            server.socket.close()
+            server.server_close()
             print('Server shutdown complete.')
 
 
-def serve(srcdir, port=80, baseurl = None, renderers = None, template_engines = None, function_handlers = None, debug=True, config = "config", override_global_data = None):
+def serve(srcdir, port=8080, baseurl = None, renderers = None, template_engines = None, function_handlers = None, debug=True, config = "config", override_global_data = None, threads=1, timing_log=False):
+    """
+    Serve the httkweb site in srcdir.
+
+    With threads > 1, each thread has its own WebGenerator, i.e., its own page cache and its own run of the
+    init function. Hence, a database opened in init (e.g., an httk.db.backend.Sqlite kept in global_data)
+    gets one connection per thread.
+    """
     setup = helpers.setup(renderers, template_engines, function_handlers)
 
     if baseurl == None:
@@ -288,15 +506,26 @@ def serve(srcdir, port=80, baseurl = None, renderers = None, template_engines =
         global_data['_functionext'] = '.html'
     global_data['_render_mode'] = 'serve'
 
-    webgenerator = WebGenerator(srcdir, global_data, **setup)
+    if threads > 1:
+        local = threading.local()
+
+        def get_webgenerator():
+            if not hasattr(local, 'webgenerator'):
+                local.webgenerator = WebGenerator(srcdir, dict(global_data), **setup)
+            return local.webgenerator
+    else:
+        webgenerator = WebGenerator(srcdir, global_data, **setup)
+
+        def get_webgenerator():
+            return webgenerator
 
     def httk_web_callback(request):
 
         if request['relpath'] == '':
             request['relpath'] = 'index.html'
 
-        out = webgenerator.retrieve(request['relpath'],request['query'])
+        out = get_webgenerator().retrieve(request['relpath'],request['query'])
 
         return {'response_code':200, 'content_type':out['mimetype'], 'content':out['content'], 'encoding':'utf-8' }
 
-    startup(httk_web_callback, port=8080, debug=True)
+    startup(httk_web_callback, port=port, debug=debug, threads=threads, timing_log=timing_log)
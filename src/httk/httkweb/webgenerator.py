@@ -276,7 +276,7 @@ class WebGenerator(object):
         if self.static_dir != None:
             static_file = os.path.join(self.static_dir,relative_url)
             if os.path.exists(static_file):
-                mimetype = mimetypes.MimeTypes().guess_type(static_file)[0]
+                mimetype = mimetypes.guess_type(static_file)[0]
                 if mimetype is None:
                     mimetype = 'application/octet-stream'
                 #f = codecs.open(static_file, encoding='utf-8')
@@ -15,7 +15,7 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import os, shutil, math
+import os, shutil, math, re
 
 import httk
 from httk import config
@@ -24,6 +24,7 @@ from httk.atomistic.data import periodictable
 from httk.core.ioadapters import cleveropen
 from httk.core import *
 from httk.core.basic import mkdir_p, micro_pyawk
+from httk.core.linescanner import LineScanner
 from httk.atomistic import Structure
 from httk.atomistic.structureutils import cartesian_to_reduced
 
@@ -415,27 +416,147 @@ def prepare_single_run(dirpath, struct, poscarspath=None, template='t:/vasp/sing
 
 
 class OutcarReader():
+    """
+    Reads results from a VASP OUTCAR file. The final energy is read when the object is created; the data of
+    the ionic steps (energies, forces and stresses) is read when first asked for.
+
+    The OUTCAR is only read through again if ioa can be read again, i.e., it is a filename or a string, or
+    a file object that can be rewound.
+    """
+
+    _energy_re = re.compile(r"^ *energy *without *entropy= *([^ ]+) *energy\(sigma->0\) *= *([^ ]+) *$")
+    _toten_re = re.compile(r"^ *free  energy +TOTEN *= *([^ ]+) *eV")
+    _nions_re = re.compile(r"NIONS *= *([0-9]+)")
+    _float_re = re.compile(r"-?[0-9]*\.[0-9]+")
 
     def __init__(self, ioa):
         self.ioa = ioa
+        self._ionic_steps = None
         self.parse()
         pass
 
+    def _rewind(self):
+        f = getattr(self.ioa, 'file', self.ioa)
+        if hasattr(f, 'seek'):
+            f.seek(0)
+
     def parse(self):
-        results = {'final': False}
+        results = {'final': False, 'energy': False}
 
         def set_final(results, match):
             results['final'] = True
 
         def read_energy(results, match):
-            self.final_energy_with_entropy = match.group(1)
-            self.final_energy = match.group(2)
+            # The file is searched from the end, so the first energy found is the final one
+            if not results['energy']:
+                self.final_energy_with_entropy = match.group(1)
+                self.final_energy = match.group(2)
+                results['energy'] = True
         results = micro_pyawk(self.ioa, [
-                              ["^ *energy *without *entropy= *([^ ]+) *energy\(sigma->0\) *= *([^ ]+) *$", None, read_energy],
+                              [self._energy_re, None, read_energy],
                               ["FREE ENERGIE", None, set_final],
-                              ], results, debug=False)
+                              ], results, debug=False, stop=lambda results: results['final'] and results['energy'], reverse=True)
         self.parsed = True
 
+    @property
+    def ionic_steps(self):
+        """
+        A list with a dictionary for each ionic step, with the keys:
+
+          free_energy: the free energy TOTEN (eV)
+          energy: the energy without entropy (eV)
+          energy_sigma0: the energy extrapolated to sigma -> 0 (eV)
+          positions: the cartesian positions of the ions (Angstrom)
+          forces: the forces on the ions (eV/Angstrom)
+          stress: the stress XX, YY, ZZ, XY, YZ, ZX (kB)
+
+        Values not found in the OUTCAR are None.
+        """
+        if self._ionic_steps is None:
+            self._ionic_steps = self._read_ionic_steps()
+        return self._ionic_steps
+
+    @property
+    def forces(self):
+        return [step['forces'] for step in self.ionic_steps]
+
+    @property
+    def stresses(self):
+        return [step['stress'] for step in self.ionic_steps]
+
+    def _read_ionic_steps(self):
+        self._rewind()
+        steps = []
+        nions = None
+        step = {'free_energy': None, 'positions': None, 'forces': None, 'stress': None}
+        scanner = LineScanner(self.ioa, ["NIONS", "in kB", "TOTAL-FORCE", "TOTEN", "energy(sigma->0)"])
+        try:
+            for line in scanner:
+                if nions is None:
+                    match = self._nions_re.search(line)
+                    if match:
+                        nions = int(match.group(1))
+                        continue
+                if line.lstrip().startswith("in kB"):
+                    step['stress'] = [float(x) for x in self._float_re.findall(line)[:6]]
+                elif "TOTAL-FORCE" in line and nions is not None:
+                    values = [[float(x) for x in l.split()] for l in scanner.next_lines(nions+1)[1:]]
+                    step['positions'] = [x[0:3] for x in values]
+                    step['forces'] = [x[3:6] for x in values]
+                else:
+                    match = self._toten_re.search(line)
+                    if match:
+                        step['free_energy'] = float(match.group(1))
+                        continue
+                    match = self._energy_re.search(line)
+                    if match:
+                        step['energy'] = float(match.group(1))
+                        step['energy_sigma0'] = float(match.group(2))
+                        steps.append(step)
+                        step = {'free_energy': None, 'positions': None, 'forces': None, 'stress': None}
+        finally:
+            scanner.close()
+        return steps
+
 
 def read_outcar(ioa):
     return OutcarReader(ioa)
+
+
+def main():
+    from httk.core.ioadapters import IoAdapterString
+
+    step = """  in kB       %.5f    -1.00000    -1.00000     0.00000     0.00000     0.00000
+  external pressure =       -1.00 kB  Pullay stress =        0.00 kB
+
+ POSITION                                       TOTAL-FORCE (eV/Angst)
+ -----------------------------------------------------------------------------------
+      0.00000      0.00000      0.00000         %.6f      0.000000      0.000000
+      1.41000      1.41000      1.41000        -0.010000     -0.000000     -0.000000
+ -----------------------------------------------------------------------------------
+    total drift:                                0.000000      0.000000      0.000000
+
+  FREE ENERGIE OF THE ION-ELECTRON SYSTEM (eV)
+  ---------------------------------------------------
+  free  energy   TOTEN  =       %.8f eV
+
+  energy  without entropy=      %.8f  energy(sigma->0) =      %.8f
+"""
+    scf = "  free energy    TOTEN  =       -9.00000000 eV\n  energy without entropy =      -9.00000000  energy(sigma->0) =      -9.00000000\n"
+    outcar = "   number of dos      NEDOS =    301   number of ions     NIONS =      2\n"
+    for i in range(3):
+        outcar += scf + step % (-1.0 - i, 0.01*i, -10.0 - i, -10.5 - i, -10.25 - i)
+
+    reader = read_outcar(IoAdapterString(outcar))
+    assert float(reader.final_energy) == -12.25 and float(reader.final_energy_with_entropy) == -12.5
+    steps = reader.ionic_steps
+    assert len(steps) == 3
+    assert [x['free_energy'] for x in steps] == [-10.0, -11.0, -12.0]
+    assert steps[2]['positions'][1] == [1.41, 1.41, 1.41]
+    assert reader.forces[1] == [[0.01, 0.0, 0.0], [-0.01, -0.0, -0.0]]
+    assert reader.stresses[2] == [-3.0, -1.0, -1.0, 0.0, 0.0, 0.0]
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
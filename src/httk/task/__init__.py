@@ -15,5 +15,7 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from httk.task.taskmgr import create_batch_task
+from httk.task.taskmgr import create_batch_task, create_batch_tasks, TaskTemplate
 from httk.task.reader import reader, submit_reader
+from httk.task.taskqueue import TaskQueue
+from httk.task.taskstatus import TaskStatusIndex
@@ -18,6 +18,7 @@
 import glob, os, datetime, hashlib, re, base64, bz2, sys, codecs
 from httk.core.basic import print_
 from httk.core.crypto import manifest_dir, verify_crytpo_signature, read_keys
+from httk.core.runarchive import archive_suffix
 from httk.core import Computation, ComputationProject, Code, IoAdapterFileReader, Signature, SignatureKey
 
 if sys.version_info[0] == 3:
@@ -25,12 +26,33 @@ if sys.version_info[0] == 3:
 else:
     import ConfigParser as configparser
 
-def reader(projectpath, inpath, excludes=None, default_description=None, project_counter=0, force_remake_manifests=False):
+def task_runs(dirpath):
+    """
+    Returns the run directories of the task in dirpath and their dates, in order of date. A run directory that
+    has been packed (see httk.core.runarchive) is given by its path without the archive suffix, which can be
+    read through cleveropen as if it had not been packed.
+    """
+    runs = set()
+    for run in glob.glob(os.path.join(dirpath, "ht.run.*")):
+        if run.endswith(archive_suffix):
+            run = run[:-len(archive_suffix)]
+        runs.add(run)
+    runs = sorted(runs, key=lambda d: datetime.datetime.strptime(os.path.basename(d)[7:], "%Y-%m-%d_%H.%M.%S"))
+    dates = [datetime.datetime.strptime(os.path.basename(run)[7:], "%Y-%m-%d_%H.%M.%S") for run in runs]
+    return runs, dates
+
+
+def reader(projectpath, inpath, excludes=None, default_description=None, project_counter=0, force_remake_manifests=False, manifest_workers=1):
     """
     Read and yield all tasks from the project in path
+
+    manifest_workers: number of processes used to hash files when a task manifest has to be generated
+    (None = one per cpu.) The sha256 sums are cached in ht.project/ht.tmp.manifest_hashes, so that regenerating
+    manifests only hashes files that have changed.
     """
 
     keydir = os.path.join(projectpath, 'ht.project', 'keys')
+    hash_cache = os.path.join(projectpath, 'ht.project', 'ht.tmp.manifest_hashes')
     pk = None
     sk = None
 
@@ -42,12 +64,10 @@ def reader(projectpath, inpath, excludes=None, default_description=None, project
                 if dir.endswith('.finished'):
                     dirpath = os.path.join(root, dir)
                     filepath = os.path.join(dirpath, 'ht.manifest.bz2')
-                    runs = glob.glob(os.path.join(dirpath, "ht.run.*"))
-                    runs = sorted(runs, key=lambda d: datetime.datetime.strptime(os.path.basename(d)[7:], "%Y-%m-%d_%H.%M.%S"))
+                    runs, dates = task_runs(dirpath)
                     if len(runs) < 1:
                         continue
                     rundir = runs[-1]
-                    dates = [datetime.datetime.strptime(os.path.basename(run)[7:], "%Y-%m-%d_%H.%M.%S") for run in runs]
                     now = datetime.datetime.now()
                     if os.path.exists(os.path.join(dirpath, 'ht_steps')):
                         f = open(os.path.join(dirpath, 'ht_steps'))
@@ -73,7 +93,8 @@ def reader(projectpath, inpath, excludes=None, default_description=None, project
                             sk, pk = read_keys(keydir)
                         sys.stderr.write("Warning: generating manifest for "+str(dirpath)+", this takes some time.\n")
                         manifestfile = bz2.BZ2File(os.path.join(dirpath, 'ht.tmp.manifest.bz2'), 'w')
-                        manifest_dir(dirpath, manifestfile, os.path.join(dirpath, 'ht.config'), keydir, sk, pk, force=force_remake_manifests)
+                        manifest_dir(dirpath, manifestfile, os.path.join(dirpath, 'ht.config'), keydir, sk, pk, force=force_remake_manifests,
+                                     workers=manifest_workers, hash_cache=hash_cache)
                         manifestfile.close()
                         os.rename(os.path.join(dirpath, 'ht.tmp.manifest.bz2'), os.path.join(dirpath, 'ht.manifest.bz2'))
 
@@ -103,11 +124,9 @@ def submit_reader(projectpath, default_description=None, excludes=None, project=
                 if root.endswith('.finished'):
                     filepath = os.path.join(root, file)
                     dirpath = root
-                    runs = glob.glob(os.path.join(dirpath, "ht.run.*"))
-                    runs = sorted(runs, key=lambda d: datetime.datetime.strptime(os.path.basename(d)[7:], "%Y-%m-%d_%H.%M.%S"))
+                    runs, dates = task_runs(dirpath)
                     if len(runs) >= 1:
                         rundir = runs[-1]
-                        dates = [datetime.datetime.strptime(os.path.basename(run)[7:], "%Y-%m-%d_%H.%M.%S") for run in runs]
                     now = datetime.datetime.now()
                     if os.path.exists(os.path.join(dirpath, 'ht_steps')):
                         f = open(os.path.join(dirpath, 'ht_steps'))
@@ -14,12 +14,13 @@
 #
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import os, sys, tempfile, glob, shutil
+import os, sys, stat, tempfile, glob, shutil, pickle
+from collections import deque
 
 import httk
 
 from httk.core.basic import mkdir_p
-from httk.core.template import apply_templates
+from httk.core.template import apply_templates, render_template
 
 
 def create_batch_task(dirpath, template='t:vasp/batch/vasp-relax-formenrg', args=None, project='noproject', assignment='unassigned',
@@ -91,3 +92,296 @@ def create_batch_task(dirpath, template='t:vasp/batch/vasp-relax-formenrg', args
     os.rename(taskpath, finalpath)
 
     return finalpath
+
+
+class TaskTemplate(object):
+    """
+    A task template directory read into memory once, for instantiating many tasks from it (see
+    create_batch_tasks). Files ending in .template are rendered with render_template for each task, the other
+    files are copied as they are. The instantiate script (if not itself a template) is compiled once.
+    """
+
+    def __init__(self, template, instantiate_name='ht.instantiate.py', template_suffixes="template"):
+        if template.startswith('t:'):
+            template = os.path.join(httk.httk_root, 'Execution', 'tasks-templates', template[2:])
+        if not os.path.exists(template):
+            raise Exception("TaskTemplate: template does not exist: "+str(template))
+        if isinstance(template_suffixes, str):
+            template_suffixes = [template_suffixes]
+        self.template = template
+        self.instantiate_name = instantiate_name
+        self.dirs = []
+        self.files = []
+        self.instantiate_source = None
+        self._code = None
+        for root, dirs, files in os.walk(template):
+            rp = os.path.relpath(root, template)
+            if rp == '.':
+                rp = ''
+            else:
+                self.dirs += [rp]
+            for filename in sorted(files):
+                with open(os.path.join(root, filename), 'rb') as f:
+                    data = f.read()
+                mode = stat.S_IMODE(os.stat(os.path.join(root, filename)).st_mode)
+                for suffix in template_suffixes:
+                    if filename.endswith("."+suffix):
+                        self.files += [(os.path.join(rp, filename[:-len("."+suffix)]), data.decode('utf-8'), mode, True)]
+                        break
+                else:
+                    if rp == '' and filename == instantiate_name:
+                        self.instantiate_source = data.decode('utf-8')
+                    self.files += [(os.path.join(rp, filename), data, mode, False)]
+
+    def __getstate__(self):
+        # Code objects cannot be pickled; they are compiled again in each process
+        state = self.__dict__.copy()
+        state['_code'] = None
+        return state
+
+    @property
+    def instantiate_code(self):
+        if self._code is None and self.instantiate_source is not None:
+            self._code = compile(self.instantiate_source, self.instantiate_name, 'exec')
+        return self._code
+
+    def instantiate(self, taskpath, args, remove_instantiate=True):
+        """
+        Write the task files into the (existing) directory taskpath and run the instantiate script in it, with
+        args as its globals.
+        """
+        for rp in self.dirs:
+            mkdir_p(os.path.join(taskpath, rp))
+        code = self.instantiate_code
+        for rp, data, mode, is_template in self.files:
+            if code is not None and remove_instantiate and rp == self.instantiate_name:
+                continue
+            output = os.path.join(taskpath, rp)
+            if is_template:
+                with open(output, 'w') as f:
+                    f.write(render_template(data, envglobals=args))
+            else:
+                with open(output, 'wb') as f:
+                    f.write(data)
+            os.chmod(output, mode)
+
+        instantiate_path = os.path.join(taskpath, self.instantiate_name)
+        if code is None and not os.path.exists(instantiate_path):
+            return
+
+        old_path = os.getcwd()
+        old_sys_argv = sys.argv
+        try:
+            os.chdir(taskpath)
+            if code is None:
+                # The instantiate script is itself a template, so it differs between tasks
+                with open(self.instantiate_name) as f:
+                    code = compile(f.read(), self.instantiate_name, 'exec')
+            exec(code, args, {})
+            if remove_instantiate and os.path.exists(self.instantiate_name):
+                os.unlink(self.instantiate_name)
+        finally:
+            os.chdir(old_path)
+            sys.argv = old_sys_argv
+
+
+def _task_name_index(taskspath):
+    # The names of the tasks in taskspath, i.e., the <name> in ht.task.<assignment>.<name>.<step>...
+    names = set()
+    for entry in os.listdir(taskspath):
+        parts = entry.split('.')
+        if len(parts) >= 9 and parts[0] == 'ht' and parts[1] == 'task':
+            names.add('.'.join(parts[3:-5]))
+    return names
+
+
+_worker_template = None
+
+
+def _init_worker(template):
+    global _worker_template
+    _worker_template = template
+
+
+def _generate_task(taskspath, args, name, remove_instantiate, template=None, pickleable_errors=False):
+    if template is None:
+        template = _worker_template
+    taskpath = tempfile.mkdtemp(prefix='ht.tmp.', dir=taskspath)
+    try:
+        template.instantiate(taskpath, args, remove_instantiate)
+        if name is None:
+            if 'finalname' not in args:
+                name = os.path.basename(taskpath)[7:]
+            else:
+                name = args['finalname']
+        return taskpath, name, None
+    except Exception as e:
+        shutil.rmtree(taskpath, ignore_errors=True)
+        if pickleable_errors:
+            try:
+                pickle.loads(pickle.dumps(e))
+            except Exception:
+                e = Exception(type(e).__name__+": "+str(e))
+        return None, name, e
+
+
+def _generate_tasks(taskspath, chunk, remove_instantiate):
+    return [(None, name, None) if args is None else _generate_task(taskspath, args, name, remove_instantiate, None, True)
+            for args, name in chunk]
+
+
+def create_batch_tasks(dirpath, argslist, template='t:vasp/batch/vasp-relax-formenrg', assignment='unassigned',
+                       instantiate_name='ht.instantiate.py', overwrite=False, overwrite_head_dir=True, remove_instantiate=True,
+                       priority=3, processes=1, pending=None, chunksize=16):
+    """
+    Create many tasks in dirpath from the same template, as create_batch_task does for one task.
+
+    argslist: an iterable where each item is the args dictionary of a task, or a tuple (name, args) to give the
+      task name (otherwise the name is args['finalname'] if the instantiate script sets it, or a random name).
+
+    The template directory is read, and the instantiate script compiled, only once (see TaskTemplate), and
+    the names of the tasks already in dirpath are read once, instead of once per task. Each task is generated
+    in a temporary ht.tmp.* directory, and renamed into place when complete.
+
+    processes: with more than one, the task directories are generated on a pool of this many processes, which
+      are sent chunksize tasks at a time. At most pending chunks (default: 4 per process) are waiting to be
+      renamed into place at a time, so argslist can be a generator over, e.g., a database search.
+
+    Yields tuples (finalpath, error) in the order of argslist, as the tasks are created. If a task could not be
+    created (e.g., because a task with the same name exists and overwrite is False), finalpath is None and
+    error is the exception. Note that this is a generator: the tasks are created as it is iterated over.
+    """
+    if instantiate_name is None or instantiate_name == '' or not isinstance(instantiate_name, str):
+        raise Exception("taskmgr.create_batch_tasks: empty or weird instantiate_name:" + str(instantiate_name))
+
+    task_template = TaskTemplate(template, instantiate_name)
+
+    if overwrite_head_dir:
+        mkdir_p(dirpath)
+    else:
+        os.mkdir(dirpath)
+    taskspath = dirpath
+    names = _task_name_index(taskspath)
+
+    def jobs():
+        for item in argslist:
+            if isinstance(item, tuple):
+                name, args = item
+            else:
+                name, args = None, item
+            if args is None:
+                args = {}
+            if not overwrite and name is not None and name in names:
+                yield None, name
+            else:
+                yield args, name
+
+    def finish(result):
+        taskpath, name, error = result
+        if error is not None:
+            return None, error
+        if taskpath is None or (not overwrite and name in names):
+            if taskpath is not None:
+                shutil.rmtree(taskpath)
+            return None, Exception("task.taskmgr.create_batch_tasks: Task already exists:" + str(name))
+        finalpath = os.path.join(taskspath, "ht.task." + assignment + "." + name + ".start.0.unclaimed." + str(priority) + ".waitstart")
+        try:
+            os.rename(taskpath, finalpath)
+        except OSError as e:
+            shutil.rmtree(taskpath, ignore_errors=True)
+            return None, e
+        names.add(name)
+        return finalpath, None
+
+    if processes <= 1:
+        for args, name in jobs():
+            if args is None:
+                yield finish((None, name, None))
+            else:
+                yield finish(_generate_task(taskspath, args, name, remove_instantiate, task_template))
+        return
+
+    import multiprocessing
+    if pending is None:
+        pending = 4*processes
+    pool = multiprocessing.Pool(processes, _init_worker, (task_template,))
+    try:
+        results = deque()
+        chunk = []
+
+        def submit(chunk):
+            if all(args is None for args, name in chunk):
+                results.append(_Done([(None, name, None) for args, name in chunk]))
+            else:
+                results.append(pool.apply_async(_generate_tasks, (taskspath, chunk, remove_instantiate)))
+
+        for job in jobs():
+            chunk.append(job)
+            if len(chunk) >= chunksize:
+                if len(results) >= pending:
+                    for result in results.popleft().get():
+                        yield finish(result)
+                submit(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            submit(chunk)
+        while results:
+            for result in results.popleft().get():
+                yield finish(result)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class _Done(object):
+    # A result that is already available, in place of an AsyncResult
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def main():
+    tmpdir = tempfile.mkdtemp(prefix='ht.tmp.taskmgr_')
+    try:
+        template = os.path.join(tmpdir, 'template')
+        os.makedirs(os.path.join(template, 'sub'))
+        with open(os.path.join(template, 'INCAR.template'), 'w') as f:
+            f.write("SYSTEM = $system\nENCUT = $(encut*1.3)\n")
+        with open(os.path.join(template, 'sub', 'ht_steps'), 'w') as f:
+            f.write("#!/bin/bash\necho start\n")
+        os.chmod(os.path.join(template, 'sub', 'ht_steps'), 0o755)
+        with open(os.path.join(template, 'ht.instantiate.py'), 'w') as f:
+            f.write("with open('POSCAR', 'w') as f:\n    f.write(system + '\\n')\n")
+
+        runs = os.path.join(tmpdir, 'Runs')
+        single = create_batch_task(runs, template, {'system': 'Si', 'encut': 100}, name='si', assignment='test')
+        argslist = [{'system': 'Ge', 'encut': 200}, ('si', {'system': 'Si', 'encut': 100}), ('c', {'system': 'C', 'encut': 300}),
+                    ('c', {'system': 'C', 'encut': 300})]
+        for processes in [1, 2]:
+            results = list(create_batch_tasks(runs, argslist, template, assignment='test', processes=processes, chunksize=3))
+            assert [x[0] is None for x in results] == [False, True, False, True]
+            argslist[2] = ('c2', {'system': 'C', 'encut': 300})
+            path = results[0][0]
+            with open(os.path.join(path, 'INCAR')) as f:
+                assert f.read() == "SYSTEM = Ge\nENCUT = 260.0\n"
+            with open(os.path.join(path, 'POSCAR')) as f:
+                assert f.read() == "Ge\n"
+            assert os.access(os.path.join(path, 'sub', 'ht_steps'), os.X_OK)
+            assert not os.path.exists(os.path.join(path, 'ht.instantiate.py'))
+
+        # The result is the same as with create_batch_task
+        for filename in ['INCAR', 'POSCAR', 'sub/ht_steps']:
+            with open(os.path.join(single, filename)) as f1, open(os.path.join(runs, 'ht.task.test.c2.start.0.unclaimed.3.waitstart', filename)) as f2:
+                assert f1.read().replace('Si', 'C').replace('130.0', '390.0') == f2.read()
+        assert len([x for x in os.listdir(runs) if x.startswith('ht.tmp.')]) == 0
+        assert len(os.listdir(runs)) == 5
+    finally:
+        shutil.rmtree(tmpdir)
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+An sqlite index of the task directories under a root directory, for claiming tasks to run.
+
+Execution/taskmanager.sh finds tasks by searching the whole directory tree for ht.task.* directories, and
+claims one by renaming it, waiting a second and checking that the rename was not lost to another task
+manager. TaskQueue keeps an index of the task directories in an sqlite database (by default
+ht.taskqueue.sqlite in the root directory), so that finding the next task is a single query, and claims are
+serialized by the database transaction instead.
+
+The task directories are still renamed exactly as taskmanager.sh does, i.e.,
+
+  ht.task.<taskset>.<taskid>.<step>.<restarts>.<owner>.<priority>.<status>
+
+so that task managers of both kinds, and all other tools that look at the directory names, can work on the
+same tree. A rename that fails (because a task manager that does not use the index got there first) just
+means that the task is skipped.
+
+  queue = TaskQueue(rootdir)
+  queue.sync()                       # index the task directories (needed first, and after external changes)
+  path = queue.claim(owner)          # the running task directory, or None
+  queue.heartbeat(path)              # regularly, while the task runs
+  queue.complete(path, 'finished')   # or 'waitstep' with step=..., 'broken', ...
+
+A running task whose heartbeat (or directory modification time, for tasks claimed by taskmanager.sh) is
+older than stale_after seconds is considered abandoned, and is claimed again with the restart count
+increased; after more than attempts restarts, it is stopped instead.
+"""
+import os, time, sqlite3
+
+claimable_statuses = ('waitstart', 'waitstep', 'waitsubtasks')
+unfinished_statuses = ('running', 'waitstart', 'waitstep', 'waitsubtasks')
+
+# Task directories that taskmanager.sh does not search inside
+_pruned_statuses = ('finished', 'broken', 'stopped', 'running', 'waitstep', 'waitstart')
+
+_outcome_dirs = {'finished': 'ht.finished', 'broken': 'ht.broken', 'timeout': 'ht.timeout', 'stopped': 'ht.stopped'}
+
+
+def parse_task_name(name):
+    """
+    Returns a dictionary with the fields of a task directory name, or None if it is not one.
+    """
+    parts = name.split('.')
+    if len(parts) != 9 or parts[0] != 'ht' or parts[1] != 'task':
+        return None
+    try:
+        restarts = int(parts[5])
+        priority = int(parts[7])
+    except ValueError:
+        return None
+    return {'taskset': parts[2], 'taskid': parts[3], 'step': parts[4], 'restarts': restarts, 'owner': parts[6],
+            'priority': priority, 'status': parts[8]}
+
+
+def task_name(taskset, taskid, step, restarts, owner, priority, status):
+    return "ht.task.%s.%s.%s.%d.%s.%d.%s" % (taskset, taskid, step, restarts, owner, priority, status)
+
+
+def _running_dir(dirpath):
+    # The directory a claimed task is moved to, as in adopt() in taskmanager.sh: a priority subdirectory of
+    # ht.waitstart is removed, and the last ht.waiting / ht.running / ht.waitstart component is replaced by
+    # ht.running
+    parts = dirpath.split('/') if dirpath != '' else []
+    if len(parts) >= 2 and parts[0] == 'ht.waitstart' and parts[1] in ('1', '2', '3', '4', '5'):
+        parts = parts[:1] + parts[2:]
+    for i in reversed(range(len(parts))):
+        if parts[i] in ('ht.waiting', 'ht.running', 'ht.waitstart'):
+            parts[i] = 'ht.running'
+            break
+    return '/'.join(parts)
+
+
+def _outcome_dir(dirpath, status):
+    # The directory a task is moved to when it ends with status, as in start_run() in taskmanager.sh
+    if status not in _outcome_dirs:
+        return dirpath
+    parts = dirpath.split('/') if dirpath != '' else []
+    for i in reversed(range(len(parts))):
+        if parts[i] in ('ht.waiting', 'ht.running'):
+            parts[i] = _outcome_dirs[status]
+            break
+    return '/'.join(parts)
+
+
+class TaskQueue(object):
+    """
+    An sqlite index of the task directories under rootdir; see the module documentation.
+    """
+
+    def __init__(self, rootdir, dbpath=None, stale_after=15*60, attempts=10):
+        self.rootdir = os.path.realpath(rootdir)
+        if dbpath is None:
+            dbpath = os.path.join(self.rootdir, 'ht.taskqueue.sqlite')
+        self.dbpath = dbpath
+        self.stale_after = stale_after
+        self.attempts = attempts
+        self._db = sqlite3.connect(dbpath, timeout=300, isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS tasks (path TEXT PRIMARY KEY, dir TEXT, taskset TEXT, taskid TEXT, "
+                         "step TEXT, restarts INTEGER, owner TEXT, priority INTEGER, status TEXT, heartbeat REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (status, priority, path)")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _relpath(self, path):
+        if os.path.isabs(path):
+            path = os.path.relpath(os.path.realpath(path), self.rootdir)
+        return path.replace(os.sep, '/')
+
+    def _abspath(self, relpath):
+        return os.path.join(self.rootdir, *relpath.split('/'))
+
+    def _insert(self, relpath, fields, heartbeat):
+        dirpath = relpath.rpartition('/')[0]
+        self._db.execute("INSERT OR REPLACE INTO tasks (path, dir, taskset, taskid, step, restarts, owner, priority, status, heartbeat) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (relpath, dirpath, fields['taskset'], fields['taskid'], fields['step'], fields['restarts'],
+                          fields['owner'], fields['priority'], fields['status'], heartbeat))
+
+    def _walk(self, relpath):
+        # The task directories under relpath, searched as find_next_task in taskmanager.sh does
+        stack = [relpath]
+        while len(stack) > 0:
+            current = stack.pop()
+            try:
+                entries = list(os.listdir(self._abspath(current) if current != '' else self.rootdir))
+            except OSError:
+                continue
+            for name in entries:
+                if not name.startswith('ht.') or name.startswith('ht.tmp.'):
+                    if not name.startswith('ht.'):
+                        sub = current + '/' + name if current != '' else name
+                        if os.path.isdir(self._abspath(sub)):
+                            stack.append(sub)
+                    continue
+                sub = current + '/' + name if current != '' else name
+                fields = parse_task_name(name)
+                if fields is None:
+                    if os.path.isdir(self._abspath(sub)):
+                        stack.append(sub)
+                    continue
+                try:
+                    st = os.stat(self._abspath(sub))
+                except OSError:
+                    continue
+                yield sub, fields, st.st_mtime
+                if fields['status'] not in _pruned_statuses:
+                    stack.append(sub)
+
+    def sync(self, relpath=''):
+        """
+        Update the index from the task directories in the file system (under relpath, relative to the root
+        directory, if given). Returns the number of task directories found.
+        """
+        relpath = self._relpath(relpath) if relpath != '' else ''
+        found = list(self._walk(relpath))
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if relpath == '':
+                known = dict(self._db.execute("SELECT path, heartbeat FROM tasks"))
+            else:
+                known = dict(self._db.execute("SELECT path, heartbeat FROM tasks WHERE path > ? AND path < ?", (relpath + '/', relpath + '0')))
+            for sub, fields, mtime in found:
+                heartbeat = max(mtime, known.pop(sub, None) or 0)
+                self._insert(sub, fields, heartbeat)
+            self._db.executemany("DELETE FROM tasks WHERE path = ?", [(x,) for x in known])
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return len(found)
+
+    def register(self, path):
+        """
+        Add a new task directory (e.g., just created with create_batch_task) to the index.
+        """
+        relpath = self._relpath(path)
+        fields = parse_task_name(relpath.rpartition('/')[2])
+        if fields is None:
+            raise Exception("TaskQueue.register: not a task directory: "+str(path))
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert(relpath, fields, os.stat(self._abspath(relpath)).st_mtime)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def _candidates(self, now, taskset, priority):
+        # One query per status, so that each can use the (status, priority, path) index
+        conditions = {'waitstart': "", 'waitstep': "", 'running': " AND heartbeat < ?",
+                      'waitsubtasks': (" AND NOT EXISTS (SELECT 1 FROM tasks AS s WHERE s.path > t.path || '/' AND s.path < t.path || '0' "
+                                       "AND s.status IN ('running', 'waitstart', 'waitstep', 'waitsubtasks'))")}
+        candidates = []
+        for status in claimable_statuses + ('running',):
+            query = ("SELECT path, dir, taskset, taskid, step, restarts, owner, priority, status FROM tasks AS t "
+                     "WHERE status = ?" + conditions[status])
+            args = [status] + ([now - self.stale_after] if status == 'running' else [])
+            if taskset is not None and taskset != 'any':
+                query += " AND taskset = ?"
+                args.append(taskset)
+            if priority is not None:
+                query += " AND priority = ?"
+                args.append(priority)
+            query += " ORDER BY priority, path LIMIT 16"
+            candidates += self._db.execute(query, args).fetchall()
+        return sorted(candidates, key=lambda x: (x[7], x[0]))[:16]
+
+    def claim(self, owner, taskset='any', priority=None):
+        """
+        Claim the next task to run (by priority, then path) for the task manager with id owner, optionally only
+        among tasks in taskset and of a given priority. The task directory is renamed to the running state, and
+        its new path is returned. Returns None if there is no task to claim.
+        """
+        if '.' in owner or '/' in owner:
+            raise Exception("TaskQueue.claim: the owner id cannot contain '.' or '/': "+str(owner))
+        while True:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                candidates = self._candidates(now, taskset, priority)
+                if len(candidates) == 0:
+                    self._db.execute("COMMIT")
+                    return None
+                for path, dirpath, cset, taskid, step, restarts, _old_owner, prio, status in candidates:
+                    if status == 'running':
+                        # The index may be behind a runner that keeps the directory fresh (taskmanager.sh touches it)
+                        try:
+                            mtime = os.stat(self._abspath(path)).st_mtime
+                        except OSError:
+                            self._db.execute("DELETE FROM tasks WHERE path = ?", (path,))
+                            continue
+                        if mtime >= now - self.stale_after:
+                            self._db.execute("UPDATE tasks SET heartbeat = MAX(heartbeat, ?) WHERE path = ?", (mtime, path))
+                            continue
+                        restarts += 1
+                    outdir = _running_dir(dirpath)
+                    if restarts > self.attempts:
+                        newstatus = 'stopped'
+                        outdir = dirpath
+                    else:
+                        newstatus = 'running'
+                    newpath = (outdir + '/' if outdir != '' else '') + task_name(cset, taskid, step, restarts, owner, prio, newstatus)
+                    if outdir != '' and not os.path.isdir(self._abspath(outdir)):
+                        os.makedirs(self._abspath(outdir))
+                    if os.path.exists(self._abspath(newpath)):
+                        # Should never happen, leave it for the next sync
+                        self._db.execute("DELETE FROM tasks WHERE path = ?", (path,))
+                        continue
+                    try:
+                        # Must touch, since some file systems do not update the ctime on rename
+                        os.utime(self._abspath(path), None)
+                        os.rename(self._abspath(path), self._abspath(newpath))
+                    except OSError:
+                        # Lost to a task manager not using the index
+                        self._db.execute("DELETE FROM tasks WHERE path = ?", (path,))
+                        continue
+                    self._db.execute("UPDATE tasks SET path = ?, dir = ?, restarts = ?, owner = ?, status = ?, heartbeat = ? WHERE path = ?",
+                                     (newpath, outdir, restarts, owner, newstatus, now, path))
+                    if status == 'waitsubtasks':
+                        self._move_subtasks(path, newpath)
+                    if newstatus == 'stopped':
+                        with open(os.path.join(self._abspath(newpath), 'ht.reason'), 'a') as f:
+                            f.write("Too many restarts!\n")
+                        continue
+                    self._db.execute("COMMIT")
+                    return self._abspath(newpath)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _move_subtasks(self, oldpath, newpath):
+        # Update the index for tasks inside a renamed task directory
+        rows = self._db.execute("SELECT path, dir FROM tasks WHERE path > ? AND path < ?", (oldpath + '/', oldpath + '0')).fetchall()
+        for path, dirpath in rows:
+            self._db.execute("UPDATE tasks SET path = ?, dir = ? WHERE path = ?",
+                             (newpath + path[len(oldpath):], newpath + dirpath[len(oldpath):], path))
+
+    def heartbeat(self, path):
+        """
+        Mark a claimed task as alive. This also updates the modification time of the directory, which is what
+        taskmanager.sh looks at.
+        """
+        relpath = self._relpath(path)
+        os.utime(self._abspath(relpath), None)
+        self._db.execute("UPDATE tasks SET heartbeat = ? WHERE path = ?", (time.time(), relpath))
+
+    def complete(self, path, status, step=None):
+        """
+        Release a claimed task with a new status, renaming its directory as taskmanager.sh does:
+
+          finished, broken, timeout, stopped: the task is done; it is moved to ht.finished, ht.broken, etc. if it
+            is in a ht.running directory.
+          waitstep: the task is to be run again with the next step, step.
+          waitsubtasks: the task is to be run again with step when the tasks in its directory have finished.
+
+        Returns the new path of the task directory.
+        """
+        relpath = self._relpath(path)
+        dirpath, _sep, name = relpath.rpartition('/')
+        fields = parse_task_name(name)
+        if fields is None:
+            raise Exception("TaskQueue.complete: not a task directory: "+str(path))
+        if status not in ('finished', 'broken', 'timeout', 'stopped', 'waitstep', 'waitsubtasks'):
+            raise Exception("TaskQueue.complete: unknown status: "+str(status))
+        if step is None:
+            step = fields['step']
+        outdir = _outcome_dir(dirpath, status)
+        newpath = (outdir + '/' if outdir != '' else '') + task_name(fields['taskset'], fields['taskid'], step, fields['restarts'],
+                                                                      'unclaimed', fields['priority'], status)
+        if outdir != '' and not os.path.isdir(self._abspath(outdir)):
+            os.makedirs(self._abspath(outdir))
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            os.rename(self._abspath(relpath), self._abspath(newpath))
+            fields['step'] = step
+            fields['owner'] = 'unclaimed'
+            fields['status'] = status
+            self._db.execute("DELETE FROM tasks WHERE path = ?", (relpath,))
+            self._insert(newpath, fields, time.time())
+            self._move_subtasks(relpath, newpath)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return self._abspath(newpath)
+
+    def stale(self):
+        """
+        Returns the paths of the running tasks whose heartbeat is older than stale_after seconds.
+        """
+        rows = self._db.execute("SELECT path FROM tasks WHERE status = 'running' AND heartbeat < ? ORDER BY path",
+                                (time.time() - self.stale_after,))
+        return [self._abspath(x[0]) for x in rows]
+
+    def counts(self):
+        """
+        Returns a dictionary with the number of indexed tasks in each status.
+        """
+        return dict(self._db.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status"))
+
+
+def main():
+    import tempfile, shutil
+
+    tmpdir = tempfile.mkdtemp(prefix='ht.tmp.taskqueue_')
+    try:
+        os.makedirs(os.path.join(tmpdir, 'proj', 'ht.waiting'))
+        for name in ['ht.task.vasp.b.start.0.unclaimed.3.waitstart', 'ht.task.vasp.a.start.0.unclaimed.3.waitstart',
+                     'ht.task.other.c.start.0.unclaimed.1.waitstart', 'ht.task.vasp.d.start.0.unclaimed.2.finished']:
+            os.mkdir(os.path.join(tmpdir, 'proj', 'ht.waiting', name))
+        # A task with subtasks, and a task inside a temporary directory that must not be touched
+        os.makedirs(os.path.join(tmpdir, 'proj', 'ht.task.vasp.e.collect.0.unclaimed.4.waitsubtasks', 'ht.task.vasp.f.start.0.unclaimed.4.waitstart'))
+        os.makedirs(os.path.join(tmpdir, 'proj', 'ht.tmp.x', 'ht.task.vasp.g.start.0.unclaimed.1.waitstart'))
+
+        queue = TaskQueue(tmpdir, stale_after=3600, attempts=1)
+        assert queue.sync() == 6
+        assert queue.counts() == {'waitstart': 4, 'finished': 1, 'waitsubtasks': 1}
+
+        path = queue.claim('tskmgr-1', taskset='vasp')
+        assert path == os.path.join(queue.rootdir, 'proj', 'ht.running', 'ht.task.vasp.a.start.0.tskmgr-1.3.running')
+        assert os.path.isdir(path)
+        queue.heartbeat(path)
+        path = queue.complete(path, 'waitstep', step='relax2')
+        assert path == os.path.join(queue.rootdir, 'proj', 'ht.running', 'ht.task.vasp.a.relax2.0.unclaimed.3.waitstep')
+
+        # Priority first, then path
+        claimed = [queue.claim('tskmgr-2') for _i in range(4)]
+        assert [os.path.basename(x) for x in claimed] == ['ht.task.other.c.start.0.tskmgr-2.1.running', 'ht.task.vasp.a.relax2.0.tskmgr-2.3.running',
+                                                          'ht.task.vasp.b.start.0.tskmgr-2.3.running', 'ht.task.vasp.f.start.0.tskmgr-2.4.running']
+        # The task with subtasks can run when they have finished
+        assert queue.claim('tskmgr-2') is None
+        queue.complete(claimed[3], 'finished')
+        parent = queue.claim('tskmgr-2')
+        assert os.path.basename(parent) == 'ht.task.vasp.e.collect.0.tskmgr-2.4.running'
+        assert os.path.isdir(os.path.join(parent, 'ht.task.vasp.f.start.0.unclaimed.4.finished'))
+        done = queue.complete(claimed[0], 'finished')
+        assert done == os.path.join(queue.rootdir, 'proj', 'ht.finished', 'ht.task.other.c.start.0.unclaimed.1.finished')
+
+        # A running task is not claimed if its directory has been touched since the index was updated
+        queue.stale_after = 60
+        queue._db.execute("UPDATE tasks SET heartbeat = 0")
+        assert queue.claim('tskmgr-3', priority=4) is None
+        assert parent not in queue.stale()
+
+        # Stale runs are claimed again with the restart count increased, until there are too many restarts
+        queue.stale_after = -1
+        assert len(queue.stale()) == 3
+        assert os.path.basename(queue.claim('tskmgr-3', priority=3)) == 'ht.task.vasp.a.relax2.1.tskmgr-3.3.running'
+        assert os.path.basename(queue.claim('tskmgr-3', priority=3)) == 'ht.task.vasp.b.start.1.tskmgr-3.3.running'
+        assert queue.claim('tskmgr-4', priority=3) is None
+        assert queue.counts()['stopped'] == 2
+
+        # A rename by someone else is noticed by the next sync
+        queue2 = TaskQueue(tmpdir, stale_after=3600)
+        os.rename(parent, os.path.join(os.path.dirname(parent), 'ht.task.vasp.e.collect.0.unclaimed.4.waitstep'))
+        queue2.sync()
+        assert os.path.basename(queue.claim('tskmgr-5')) == 'ht.task.vasp.e.collect.0.tskmgr-5.4.running'
+        queue.close()
+        queue2.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()
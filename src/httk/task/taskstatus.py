@@ -0,0 +1,302 @@
+#
+#    The high-throughput toolkit (httk)
+#    Copyright (C) 2012-2015 Rickard Armiento
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+An incrementally updated index of the states of the task directories under a run directory.
+
+Execution/status.sh used to count the tasks with find over the whole run tree on every call. TaskStatusIndex
+keeps the directory tree in an sqlite database (by default ht.taskstatus.sqlite in the run directory), and
+refresh() only lists the directories whose modification time has changed since the last refresh. Tasks in a
+final state (finished, broken, stopped, timeout) are not looked inside again at all as long as they keep their
+name, since their contents do not change any more. Counts and lists of tasks filtered by taskset, step,
+priority, status, owner and location (the top level ht.* directory a task is in, e.g., ht.waiting) are then
+database queries.
+
+  index = TaskStatusIndex(rundir)
+  index.refresh()
+  index.count(by='status', taskset='vasp')    # {'waitstart': 1200, 'running': 14, ...}
+  index.tasks(status='broken')                # ['ht.broken/ht.task.vasp.x.start.0.unclaimed.3.broken', ...]
+
+status_command() is the command line interface used by Execution/status.sh (and thereby httk-tasks-status on
+remote computers).
+"""
+import os, sys, time, sqlite3
+
+from httk.task.taskqueue import parse_task_name
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+final_statuses = ('finished', 'broken', 'stopped', 'timeout')
+
+task_fields = ('location', 'taskset', 'taskid', 'step', 'restarts', 'owner', 'priority', 'status')
+
+
+def _subdirs(path):
+    if scandir is not None:
+        return [entry.name for entry in scandir(path) if entry.is_dir(follow_symlinks=False)]
+    return [name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)) and not os.path.islink(os.path.join(path, name))]
+
+
+class TaskStatusIndex(object):
+    """
+    An incrementally updated index of the task directories under rootdir; see the module documentation.
+    """
+
+    # Directories modified less than this many seconds before they are listed are listed again on the next
+    # refresh, since a change within the resolution of the modification time would otherwise be missed
+    racy_interval = 2
+
+    def __init__(self, rootdir, indexpath=None):
+        self.rootdir = os.path.realpath(rootdir)
+        if indexpath is None:
+            indexpath = os.path.join(self.rootdir, 'ht.taskstatus.sqlite')
+        try:
+            self._db = sqlite3.connect(indexpath, timeout=300, isolation_level=None)
+            self._setup()
+        except sqlite3.Error:
+            # E.g., a run directory we cannot write to; then the index only lives for this process
+            self._db = sqlite3.connect(':memory:', isolation_level=None)
+            self._setup()
+        self.indexpath = indexpath
+
+    def _setup(self):
+        # A journal file that is created and removed with every transaction would change the modification time
+        # of the run directory itself on every refresh
+        self._db.execute("PRAGMA journal_mode=PERSIST")
+        self._db.execute("CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime REAL, subdirs TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS tasks (path TEXT PRIMARY KEY, location TEXT, taskset TEXT, taskid TEXT, "
+                         "step TEXT, restarts INTEGER, owner TEXT, priority INTEGER, status TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, taskset)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_taskset ON tasks (taskset, status)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_location ON tasks (location, status)")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _abspath(self, relpath):
+        if relpath == '':
+            return self.rootdir
+        return os.path.join(self.rootdir, *relpath.split('/'))
+
+    def _remove(self, relpath):
+        # Remove a directory and everything under it from the index
+        for table in ('dirs', 'tasks'):
+            self._db.execute("DELETE FROM " + table + " WHERE path = ? OR (path > ? AND path < ?)", (relpath, relpath + '/', relpath + '0'))
+
+    def refresh(self):
+        """
+        Update the index from the file system. Returns the number of directories that had to be listed.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            listed = 0
+            stack = ['']
+            while len(stack) > 0:
+                relpath = stack.pop()
+                abspath = self._abspath(relpath)
+                row = self._db.execute("SELECT mtime, subdirs FROM dirs WHERE path = ?", (relpath,)).fetchone()
+                try:
+                    mtime = os.stat(abspath).st_mtime
+                    if row is not None and row[0] == mtime:
+                        names = row[1].split('/') if row[1] != '' else []
+                        added = ()
+                    else:
+                        names = _subdirs(abspath)
+                        listed += 1
+                except OSError:
+                    # Renamed or removed after its parent was listed; the parent is listed again next time
+                    continue
+                if row is None or row[0] != mtime:
+                    old = set(row[1].split('/')) if row is not None and row[1] != '' else set()
+                    added = set(names) - old
+                    for name in old - set(names):
+                        self._remove(relpath + '/' + name if relpath != '' else name)
+                    if time.time() - mtime < self.racy_interval:
+                        # It may change again within the resolution of the modification time; list it next time too
+                        mtime = -1
+                    self._db.execute("INSERT OR REPLACE INTO dirs (path, mtime, subdirs) VALUES (?, ?, ?)", (relpath, mtime, '/'.join(names)))
+                for name in names:
+                    if name.startswith('ht.tmp.'):
+                        continue
+                    sub = relpath + '/' + name if relpath != '' else name
+                    fields = parse_task_name(name)
+                    if fields is not None:
+                        if name in added:
+                            self._db.execute("INSERT OR REPLACE INTO tasks (path, location, taskset, taskid, step, restarts, owner, priority, status) "
+                                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                             (sub, sub.partition('/')[0], fields['taskset'], fields['taskid'], fields['step'], fields['restarts'],
+                                              fields['owner'], fields['priority'], fields['status']))
+                        elif fields['status'] in final_statuses:
+                            # Already indexed, and the contents of a finished task do not change
+                            continue
+                    stack.append(sub)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return listed
+
+    def _where(self, filters):
+        conditions = []
+        args = []
+        for field in sorted(filters):
+            if field not in task_fields:
+                raise Exception("TaskStatusIndex: unknown task field: "+str(field))
+            values = filters[field]
+            if values is None:
+                continue
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            conditions.append(field + " IN (" + ", ".join(["?"]*len(values)) + ")")
+            args += list(values)
+        if len(conditions) == 0:
+            return "", args
+        return " WHERE " + " AND ".join(conditions), args
+
+    def count(self, by='status', **filters):
+        """
+        Returns a dictionary with the number of tasks for each value of the field by (status, taskset, step,
+        priority, owner, location, ...), among the tasks matching filters, e.g., count(by='step', status='running').
+        The value of a filter can be a list of accepted values. With by=None, returns the total number.
+        """
+        where, args = self._where(filters)
+        if by is None:
+            return self._db.execute("SELECT COUNT(*) FROM tasks" + where, args).fetchone()[0]
+        if by not in task_fields:
+            raise Exception("TaskStatusIndex.count: unknown task field: "+str(by))
+        return dict(self._db.execute("SELECT " + by + ", COUNT(*) FROM tasks" + where + " GROUP BY " + by, args))
+
+    def tasks(self, **filters):
+        """
+        Returns the sorted paths (relative to the run directory) of the tasks matching filters; see count.
+        """
+        where, args = self._where(filters)
+        return [x[0] for x in self._db.execute("SELECT path FROM tasks" + where + " ORDER BY path", args)]
+
+
+def status_command(argv, rootdir='.', out=None):
+    """
+    The command line interface to the task status of the run directory rootdir. Without arguments, it prints
+    the number of tasks in each top level ht.* directory, as Execution/status.sh always did.
+    """
+    import argparse
+
+    if out is None:
+        out = sys.stdout
+    ap = argparse.ArgumentParser(prog='status.sh', description="Show the status of the tasks in a run directory")
+    ap.add_argument("--by", help='Count the tasks by this field (location, status, taskset, step, priority, owner)', default='location')
+    ap.add_argument("--list", help='List the matching tasks instead of counting them', action='store_true')
+    for field in ('taskset', 'step', 'priority', 'status', 'owner', 'location'):
+        ap.add_argument("--" + field, help='Only tasks with this '+field+' (comma separated list)')
+    ap.add_argument("--no-refresh", help='Answer from the index without looking at the file system', action='store_true')
+    args = ap.parse_args(argv)
+
+    filters = {}
+    for field in ('taskset', 'step', 'priority', 'status', 'owner', 'location'):
+        value = getattr(args, field)
+        if value is not None:
+            filters[field] = [int(x) for x in value.split(',')] if field == 'priority' else value.split(',')
+
+    index = TaskStatusIndex(rootdir)
+    try:
+        if not args.no_refresh:
+            index.refresh()
+        if args.list:
+            for path in index.tasks(**filters):
+                out.write(path + "\n")
+        else:
+            counts = index.count(by=args.by, **filters)
+            if args.by == 'location' and len(filters) == 0:
+                # Also show the empty state directories
+                for name in _subdirs(index.rootdir):
+                    if name.startswith('ht.') and not name.startswith('ht.tmp.') and name not in counts:
+                        counts[name] = 0
+            for key in sorted(counts, key=lambda x: (str(type(x)), x)):
+                out.write("%s : %d\n" % (key, counts[key]))
+    finally:
+        index.close()
+    return 0
+
+
+def main():
+    import tempfile, shutil
+
+    tmpdir = tempfile.mkdtemp(prefix='ht.tmp.taskstatus_')
+    try:
+        def mkdir(*path):
+            os.makedirs(os.path.join(tmpdir, *path))
+
+        for i in range(3):
+            mkdir('ht.waiting', 'batch', 'ht.task.vasp.w%d.start.0.unclaimed.%d.waitstart' % (i, i+1))
+        mkdir('ht.waiting', 'ht.task.other.o1.relax.1.unclaimed.2.waitstep')
+        mkdir('ht.finished', 'ht.task.vasp.f1.start.0.unclaimed.3.finished', 'ht.task.vasp.sub1.start.0.unclaimed.3.finished')
+        mkdir('ht.finished', 'ht.task.vasp.f1.start.0.unclaimed.3.finished', 'vasprun')
+        mkdir('ht.waiting', 'ht.tmp.submit', 'ht.task.vasp.tmp.start.0.unclaimed.1.waitstart')
+
+        def age():
+            # Move the modification times of recently changed directories out of the racy interval
+            for dirpath, _dirnames, _filenames in os.walk(tmpdir):
+                if os.stat(dirpath).st_mtime > time.time() - 30:
+                    os.utime(dirpath, (time.time() - 60, time.time() - 60))
+
+        index = TaskStatusIndex(tmpdir)
+        age()
+        assert index.refresh() > 0
+        assert index.count(by='location') == {'ht.waiting': 4, 'ht.finished': 2}
+        assert index.count(by='status', taskset='vasp') == {'waitstart': 3, 'finished': 2}
+        assert index.count(by=None, priority=[1, 2]) == 3
+        assert index.tasks(step='relax') == ['ht.waiting/ht.task.other.o1.relax.1.unclaimed.2.waitstep']
+
+        # Nothing changed, nothing listed
+        assert index.refresh() == 0
+
+        # Claiming a task renames it, which changes the mtime of the directory it is in; only that directory and the
+        # renamed task are listed again
+        os.rename(os.path.join(tmpdir, 'ht.waiting', 'batch', 'ht.task.vasp.w0.start.0.unclaimed.1.waitstart'),
+                  os.path.join(tmpdir, 'ht.waiting', 'batch', 'ht.task.vasp.w0.start.0.tm1.1.running'))
+        age()
+        assert index.refresh() == 2
+        assert index.count(owner='tm1') == {'running': 1}
+        shutil.rmtree(os.path.join(tmpdir, 'ht.finished'))
+        index.refresh()
+        assert index.count(by='location') == {'ht.waiting': 4}
+
+        # The index is kept between processes
+        index.close()
+        index = TaskStatusIndex(tmpdir)
+        assert index.count(by=None) == 4
+        index.close()
+
+        from httk.core.ioadapters import StringIO
+        out = StringIO()
+        status_command(['--by', 'status', '--taskset', 'vasp,other'], tmpdir, out)
+        assert out.getvalue() == "running : 1\nwaitstart : 2\nwaitstep : 1\n"
+        os.mkdir(os.path.join(tmpdir, 'ht.finished'))
+        out = StringIO()
+        status_command(['--no-refresh'], tmpdir, out)
+        assert out.getvalue() == "ht.finished : 0\nht.waiting : 4\n"
+    finally:
+        shutil.rmtree(tmpdir)
+    print("Finished")
+
+
+if __name__ == "__main__":
+    main()